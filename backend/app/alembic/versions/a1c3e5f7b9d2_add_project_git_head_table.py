@@ -0,0 +1,46 @@
+"""Add table for project Git branch heads
+
+Records the latest head SHA of each branch on a project's Git remote, as
+reported by GitHub push webhooks, so cached clones can skip polling.
+
+Revision ID: a1c3e5f7b9d2
+Revises: d4e5f6a7b8c9
+Create Date: 2026-10-16 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "a1c3e5f7b9d2"
+down_revision = "d4e5f6a7b8c9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "projectgithead",
+        sa.Column("project_id", sa.Uuid(), nullable=False),
+        sa.Column(
+            "branch", sqlmodel.sql.sqltypes.AutoString(), nullable=False
+        ),
+        sa.Column(
+            "sha",
+            sqlmodel.sql.sqltypes.AutoString(length=40),
+            nullable=False,
+        ),
+        sa.Column("updated", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["project.id"],
+        ),
+        sa.PrimaryKeyConstraint("project_id", "branch"),
+    )
+
+
+def downgrade():
+    op.drop_table("projectgithead")
@@ -0,0 +1,36 @@
+"""Add sha256 to shared DVC objects
+
+Lets an upload be checked against the shared object with the same MD5
+before it's discarded as a duplicate.
+
+Revision ID: a7d3e5f9b2c6
+Revises: f6b8d0a2c4e5
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "a7d3e5f9b2c6"
+down_revision = "f6b8d0a2c4e5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "dvcsharedobject",
+        sa.Column(
+            "sha256",
+            sqlmodel.sql.sqltypes.AutoString(length=64),
+            nullable=True,
+        ),
+    )
+
+
+def downgrade():
+    op.drop_column("dvcsharedobject", "sha256")
@@ -0,0 +1,50 @@
+"""Add table indexing DVC objects in each project's storage
+
+Records which DVC objects (by MD5) are in object storage for each owner and
+project, so presence checks don't need a storage round trip.
+
+Revision ID: b2d4f6a8c0e1
+Revises: a1c3e5f7b9d2
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "b2d4f6a8c0e1"
+down_revision = "a1c3e5f7b9d2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dvcobject",
+        sa.Column(
+            "owner_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "project_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "md5",
+            sqlmodel.sql.sqltypes.AutoString(length=40),
+            nullable=False,
+        ),
+        sa.Column("legacy", sa.Boolean(), nullable=False),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("owner_name", "project_name", "md5"),
+    )
+
+
+def downgrade():
+    op.drop_table("dvcobject")
@@ -0,0 +1,47 @@
+"""Add table for the per-project storage usage ledger
+
+Tracks bytes used in object storage by each project, updated by deltas on
+write and periodically reconciled, so quota checks don't list the bucket.
+
+Revision ID: c3e5a7b9d1f2
+Revises: b2d4f6a8c0e1
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "c3e5a7b9d1f2"
+down_revision = "b2d4f6a8c0e1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "storageledger",
+        sa.Column(
+            "owner_name",
+            sqlmodel.sql.sqltypes.AutoString(length=64),
+            nullable=False,
+        ),
+        sa.Column(
+            "project_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "size", sa.BigInteger(), server_default="0", nullable=False
+        ),
+        sa.Column("updated", sa.DateTime(), nullable=False),
+        sa.Column("reconciled", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("owner_name", "project_name"),
+    )
+
+
+def downgrade():
+    op.drop_table("storageledger")
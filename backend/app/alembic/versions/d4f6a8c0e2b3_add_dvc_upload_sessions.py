@@ -0,0 +1,65 @@
+"""Add table for resumable DVC upload sessions
+
+Tracks chunked uploads to the DVC remote, with the bytes received so far
+and the running MD5, so interrupted uploads can resume where they left off.
+
+Revision ID: d4f6a8c0e2b3
+Revises: c3e5a7b9d1f2
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "d4f6a8c0e2b3"
+down_revision = "c3e5a7b9d1f2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dvcuploadsession",
+        sa.Column(
+            "id", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False
+        ),
+        sa.Column(
+            "owner_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "project_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "md5", sqlmodel.sql.sqltypes.AutoString(length=40), nullable=False
+        ),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column(
+            "received", sa.BigInteger(), server_default="0", nullable=False
+        ),
+        sa.Column("md5_state", sa.LargeBinary(), nullable=True),
+        sa.Column("parts", sa.JSON(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.Column("expires", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_dvcuploadsession_expires"),
+        "dvcuploadsession",
+        ["expires"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_dvcuploadsession_expires"), table_name="dvcuploadsession"
+    )
+    op.drop_table("dvcuploadsession")
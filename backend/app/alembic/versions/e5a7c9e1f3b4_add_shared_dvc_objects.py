@@ -0,0 +1,57 @@
+"""Add shared, content-addressed DVC objects
+
+Adds a table of objects in the shared store with their reference counts,
+and marks which rows of the per-project object index are references to it.
+
+Revision ID: e5a7c9e1f3b4
+Revises: d4f6a8c0e2b3
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "e5a7c9e1f3b4"
+down_revision = "d4f6a8c0e2b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "dvcobject",
+        sa.Column(
+            "shared", sa.Boolean(), server_default="false", nullable=False
+        ),
+    )
+    op.create_table(
+        "dvcsharedobject",
+        sa.Column(
+            "md5", sqlmodel.sql.sqltypes.AutoString(length=40), nullable=False
+        ),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column(
+            "refcount", sa.Integer(), server_default="0", nullable=False
+        ),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.Column("released", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("md5"),
+    )
+    op.create_index(
+        op.f("ix_dvcsharedobject_released"),
+        "dvcsharedobject",
+        ["released"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_dvcsharedobject_released"), table_name="dvcsharedobject"
+    )
+    op.drop_table("dvcsharedobject")
+    op.drop_column("dvcobject", "shared")
@@ -0,0 +1,84 @@
+"""Add table for DVC object imports
+
+Tracks copies of DVC objects between projects' storage, with their
+progress, so any worker can report an import and resume one whose worker
+stopped.
+
+Revision ID: f6b8d0a2c4e5
+Revises: e5a7c9e1f3b4
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = "f6b8d0a2c4e5"
+down_revision = "e5a7c9e1f3b4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dvcobjectimport",
+        sa.Column(
+            "id", sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False
+        ),
+        sa.Column(
+            "owner_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "project_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "src_owner_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column(
+            "src_project_name",
+            sqlmodel.sql.sqltypes.AutoString(length=255),
+            nullable=False,
+        ),
+        sa.Column("md5s", sa.JSON(), nullable=False),
+        sa.Column("storage_limit_gb", sa.Float(), nullable=False),
+        sa.Column(
+            "status",
+            sqlmodel.sql.sqltypes.AutoString(length=16),
+            nullable=False,
+        ),
+        sa.Column("total", sa.Integer(), nullable=True),
+        sa.Column("copied", sa.Integer(), nullable=False),
+        sa.Column("referenced", sa.Integer(), nullable=False),
+        sa.Column("skipped", sa.Integer(), nullable=False),
+        sa.Column("missing", sa.Integer(), nullable=False),
+        sa.Column("failed", sa.Integer(), nullable=False),
+        sa.Column(
+            "bytes_copied", sa.BigInteger(), server_default="0", nullable=False
+        ),
+        sa.Column("error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("created", sa.DateTime(), nullable=False),
+        sa.Column("updated", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_dvcobjectimport_updated"),
+        "dvcobjectimport",
+        ["updated"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_dvcobjectimport_updated"), table_name="dvcobjectimport"
+    )
+    op.drop_table("dvcobjectimport")
@@ -1,15 +1,18 @@
 """Miscellaneous routes."""
 
+import json
 import os
 import uuid
 from typing import Literal
 
+from app import github
 from app.api.deps import (
     CurrentUser,
     CurrentUserOptional,
     SessionDep,
     get_current_active_superuser,
 )
+from app.config import settings
 from app.core import utcnow
 from app.messaging import generate_test_email, send_email
 from app.models import (
@@ -22,6 +25,7 @@ from app.models import (
     Notification,
     Org,
     Project,
+    ProjectGitHead,
     User,
     UserOrgMembership,
     UserProjectAccess,
@@ -32,6 +36,7 @@ from app.subscriptions import SubscriptionPlan, get_plans
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from pydantic.networks import EmailStr
+import sqlalchemy
 from sqlalchemy.exc import DataError
 from starlette.requests import Request
 
@@ -208,6 +213,60 @@ async def post_stripe_event(request: Request):
         print("Subscription canceled: %s", event.id)
 
 
+@router.post("/github-events", include_in_schema=False)
+async def post_github_event(request: Request, session: SessionDep) -> Message:
+    """Receive GitHub webhook events.
+
+    On ``push``, record the new head of the branch for every project backed
+    by the repo, so cached clones only refetch when the remote has actually
+    moved.
+    """
+    if not settings.GH_WEBHOOK_SECRET:
+        raise HTTPException(503, "GitHub webhooks are not configured")
+    payload = await request.body()
+    if not github.verify_webhook_signature(
+        payload,
+        signature=request.headers.get("x-hub-signature-256"),
+        secret=settings.GH_WEBHOOK_SECRET,
+    ):
+        raise HTTPException(401, "Invalid signature")
+    event_type = request.headers.get("x-github-event")
+    if event_type == "ping":
+        return Message(message="pong")
+    if event_type != "push":
+        return Message(message=f"Ignored {event_type} event")
+    data = json.loads(payload)
+    ref: str = data.get("ref", "")
+    if not ref.startswith("refs/heads/"):
+        # Tag pushes don't move any branch
+        return Message(message="Ignored non-branch ref")
+    branch = ref.removeprefix("refs/heads/")
+    repo_url = data["repository"]["html_url"].lower()
+    projects = session.exec(
+        select(Project).where(
+            sqlalchemy.func.lower(Project.git_repo_url).in_(
+                [repo_url, repo_url + ".git"]
+            )
+        )
+    ).all()
+    for project in projects:
+        head = session.get(ProjectGitHead, (project.id, branch))
+        if data.get("deleted"):
+            if head is not None:
+                session.delete(head)
+            continue
+        if head is None:
+            head = ProjectGitHead(project_id=project.id, branch=branch)
+        elif head.sha == data["after"]:
+            # Redelivery, nothing moved
+            continue
+        head.sha = data["after"]
+        head.updated = utcnow()
+        session.add(head)
+    session.commit()
+    return Message(message="Success")
+
+
 class PresignedUrlRequest(BaseModel):
     path: str
     method: Literal["get", "put"] = "get"
@@ -5,7 +5,6 @@ import uuid
 from datetime import datetime
 from typing import Literal
 
-from app.models.core import UserPublic
 import requests
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
@@ -32,7 +31,7 @@ from app.models import (
     UserSubscription,
 )
 from app.orgs import get_org_from_db
-from app.storage import get_storage_usage
+from app.storage import get_storage_usage_by_project
 from app.subscriptions import PLAN_IDS, get_monthly_price
 from app.users import get_github_token
 
@@ -408,8 +407,14 @@ def get_org_storage(
         logger.info("User is not an admin or owner of this org")
         raise HTTPException(403)
     limit = org.subscription.storage_limit
-    used = get_storage_usage(org.account.name)
-    return StorageUsage(used_gb=used, limit_gb=limit)
+    by_project = get_storage_usage_by_project(org.account.name)
+    return StorageUsage(
+        limit_gb=limit,
+        used_gb=sum(by_project.values()) / 1e9,
+        by_project_gb={
+            name: size / 1e9 for name, size in by_project.items() if name
+        },
+    )
 
 
 class OrgUserPublic(BaseModel):
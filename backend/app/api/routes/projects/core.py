@@ -42,7 +42,15 @@ from sqlmodel import Session, and_, func, not_, or_, select
 from TexSoup import TexSoup
 
 import app.projects
-from app import github, messaging, mixpanel, orgs, users
+from app import (
+    dvc_uploads,
+    github,
+    messaging,
+    mixpanel,
+    orgs,
+    shared_objects,
+    users,
+)
 from app.api.deps import (
     CurrentUser,
     CurrentUserOptional,
@@ -58,6 +66,7 @@ from app.core import (
     ryaml,
     utcnow,
 )
+from app.documents import load_yaml, read_document
 from app.dvc import (
     expand_dvc_lock_outs,
     make_mermaid_diagram,
@@ -70,13 +79,19 @@ from app.pipeline import (
     calc_overall_pipeline_status,
 )
 from app.git import (
+    COMMIT_PATCH_MAX_PAGE_BYTES,
+    COMMIT_PATCH_PAGE_BYTES,
     get_ck_info,
     get_ck_info_from_repo,
+    get_commit_detail,
+    get_commit_file_patch,
     get_commit_history,
     get_file_history,
     get_overleaf_repo,
     get_repo,
+    get_tree_index,
     get_zip_path_map_from_repo,
+    WorkingTree,
     resolve_commit_sha,
     search_refs,
 )
@@ -136,8 +151,6 @@ from app.models.projects import (
 from app.storage import (
     get_object_fs,
     get_object_url,
-    make_data_fpath,
-    remove_gcs_content_type,
 )
 
 logging.basicConfig(level=logging.INFO)
@@ -802,6 +815,9 @@ def delete_project(
     )
     session.delete(project)
     session.commit()
+    # Release the project's references to shared DVC objects, so they can
+    # be collected if nothing else references them
+    shared_objects.remove_references(owner_name, project_name)
     return Message(message="success")
 
 
@@ -817,8 +833,10 @@ def delete_project_by_id(
     # TODO: Check for collaborator access
     if project.owner != current_user:
         raise HTTPException(403)
+    owner_name, project_name = project.owner_account_name, project.name
     session.delete(project)
     session.commit()
+    shared_objects.remove_references(owner_name, project_name)
     return Message(message="success")
 
 
@@ -941,17 +959,30 @@ def get_project_history(
     ref: Optional[str] = Query(
         None, description="Branch, tag, or commit to read history from"
     ),
+    cursor: Optional[str] = Query(
+        None,
+        description=(
+            "Hash of the last commit of the previous page; returns the "
+            "commits after it"
+        ),
+    ),
 ) -> list[dict]:
     """Get paginated git commit history for a project.
 
+    Pass the last commit hash of a page as ``cursor`` to get the next one,
+    which is cheaper than a growing ``offset`` for deep history.
+
     Parameters
     ----------
     limit:
         Maximum number of commits to return.
     offset:
-        Number of commits to skip from the newest commit.
+        Number of commits to skip from the newest commit, or from
+        ``cursor`` if given.
     ref:
         Optional branch, tag, or commit to read history from.
+    cursor:
+        Optional hash of the last commit of the previous page.
     """
     project = app.projects.get_project(
         session=session,
@@ -966,7 +997,9 @@ def get_project_history(
         session=session,
         ttl=FULL_HISTORY_REPO_TTL,
     )
-    history = get_commit_history(repo, max_count=limit + offset, ref=ref)
+    history = get_commit_history(
+        repo, max_count=limit + offset, ref=ref, cursor=cursor
+    )
     return history[offset : offset + limit]
 
 
@@ -980,6 +1013,9 @@ def get_project_commit(
 ) -> dict:
     """Get details for a specific commit including changed files.
 
+    Files come with line counts but no patches; fetch a file's patch from
+    the ``patch`` endpoint.
+
     Parameters
     ----------
     commit_hash:
@@ -998,101 +1034,65 @@ def get_project_commit(
         session=session,
         ttl=FULL_HISTORY_REPO_TTL,
     )
-    try:
-        commit = repo.commit(commit_hash)
-    except Exception:
+    detail = get_commit_detail(repo, commit_hash)
+    if detail is None:
         raise HTTPException(404, "Commit not found")
-    # Cap response size so a single giant commit (e.g., a large generated
-    # file or a wide merge) can't balloon memory or the JSON payload.
-    MAX_FILES = 500
-    MAX_PATCH_BYTES = 100_000
-    changed_files: list[dict] = []
-    files_truncated = False
-    if commit.parents:
-        parent = commit.parents[0]
-        diff = parent.diff(commit, create_patch=True)
-        for d in diff:
-            if len(changed_files) >= MAX_FILES:
-                files_truncated = True
-                break
-            change_type = d.change_type  # A, D, M, R, etc.
-            patch_bytes = d.diff if d.diff else b""
-            if not isinstance(patch_bytes, bytes):
-                patch_bytes = str(patch_bytes).encode(
-                    "utf-8", errors="replace"
-                )
-            # Binary files: skip decoding the patch entirely.
-            is_binary = b"\x00" in patch_bytes[:8192]
-            patch_truncated = False
-            if is_binary:
-                patch = None
-            else:
-                if len(patch_bytes) > MAX_PATCH_BYTES:
-                    patch_bytes = patch_bytes[:MAX_PATCH_BYTES]
-                    patch_truncated = True
-                patch = patch_bytes.decode("utf-8", errors="replace")
-            if patch is None:
-                insertions = None
-                deletions = None
-            else:
-                insertions = sum(
-                    1
-                    for line in patch.splitlines()
-                    if line.startswith("+") and not line.startswith("+++")
-                )
-                deletions = sum(
-                    1
-                    for line in patch.splitlines()
-                    if line.startswith("-") and not line.startswith("---")
-                )
-            changed_files.append(
-                {
-                    "path": d.b_path or d.a_path,
-                    "old_path": d.a_path if change_type == "R" else None,
-                    "change_type": change_type,
-                    "insertions": insertions,
-                    "deletions": deletions,
-                    "patch": patch,
-                    "is_binary": is_binary,
-                    "patch_truncated": patch_truncated,
-                }
-            )
-    else:
-        # Initial commit--list all files
-        for item in commit.tree.traverse():
-            if len(changed_files) >= MAX_FILES:
-                files_truncated = True
-                break
-            if item.type == "blob":  # type: ignore[union-attr]
-                changed_files.append(
-                    {
-                        "path": item.path,  # type: ignore[union-attr]
-                        "old_path": None,
-                        "change_type": "A",
-                        "insertions": None,
-                        "deletions": None,
-                        "patch": None,
-                        "is_binary": False,
-                        "patch_truncated": False,
-                    }
-                )
-    message = (
-        commit.message
-        if isinstance(commit.message, str)
-        else bytes(commit.message).decode("utf-8", errors="replace")
-    )
-    return {
-        "hash": commit.hexsha,
-        "short_hash": commit.hexsha[:7],
-        "message": message,
-        "summary": message.split("\n")[0],
-        "author": commit.author.name,
-        "author_email": commit.author.email,
-        "timestamp": commit.committed_datetime.isoformat(),
-        "parent_hashes": [p.hexsha[:7] for p in commit.parents],
-        "changed_files": changed_files,
-        "files_truncated": files_truncated,
-    }
+    return detail
+
+
+@router.get(
+    "/projects/{owner_name}/{project_name}/git/commits/{commit_hash}/patch"
+)
+def get_project_commit_patch(
+    owner_name: str,
+    project_name: str,
+    commit_hash: str,
+    path: str,
+    session: SessionDep,
+    current_user: CurrentUserOptional,
+    offset: int = Query(
+        0, ge=0, description="Byte offset into the patch to start from"
+    ),
+    limit: int = Query(
+        COMMIT_PATCH_PAGE_BYTES,
+        gt=0,
+        le=COMMIT_PATCH_MAX_PAGE_BYTES,
+        description="Max bytes of the patch to return",
+    ),
+) -> dict:
+    """Get a page of the patch for one file changed in a commit.
+
+    Parameters
+    ----------
+    commit_hash:
+        Full or short commit hash to inspect.
+    path:
+        Path of the changed file, as listed in the commit's details.
+    offset:
+        Byte offset to start from; pass the previous page's
+        ``next_offset`` to continue.
+    limit:
+        Max bytes to return.
+    """
+    project = app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="read",
+    )
+    repo = get_repo(
+        project=project,
+        user=current_user,
+        session=session,
+        ttl=FULL_HISTORY_REPO_TTL,
+    )
+    patch = get_commit_file_patch(
+        repo, commit_hash, path=path, offset=offset, limit=limit
+    )
+    if patch is None:
+        raise HTTPException(404, "File not changed in commit")
+    return patch
 
 
 @router.get("/projects/{owner_name}/{project_name}/git/file-history")
@@ -1266,8 +1266,8 @@ def get_project_content_paths(
         p for p, obj in dvc_lock_outs.items() if obj.get("type") != "dir"
     }
     paths = set(dvc_files)
-    for f in repo.git.ls_files().split("\n"):
-        if not f or f.startswith(".dvc/"):
+    for f in get_tree_index(repo, ref).iter_paths():
+        if f.startswith(".dvc/"):
             continue
         # Prefer a DVC output's real path over its tracked ``.dvc`` pointer.
         if f.endswith(".dvc") and f[:-4] in dvc_files:
@@ -1507,7 +1507,7 @@ def _resolve_result_value(
                 if lower.endswith(".json"):
                     data = json.loads(text)
                 elif lower.endswith((".yaml", ".yml")):
-                    data = ryaml.load(text)
+                    data = load_yaml(text)
         except Exception as e:
             logger.warning(f"Failed to read result {path}: {e}")
         cache[path] = data if isinstance(data, dict) else None
@@ -1850,40 +1850,12 @@ def _build_figures(
                 figures.append({"path": path, "title": _title_from_path(path)})
                 declared_paths.add(path)
 
-    # Auto-detect figures from the repo tree
+    # Auto-detect figures from the repo tree, including those stored via
+    # standalone .dvc pointer files (tracked with `dvc add`, not via a DVC
+    # pipeline stage)
     try:
-        commit = repo.commit(ref) if ref else repo.head.commit
-        for blob in commit.tree.traverse():
-            if blob.type != "blob":  # type: ignore[union-attr]
-                continue
-            blob_path: str = blob.path  # type: ignore[union-attr]
-            _maybe_add_figure(blob_path)
-            # Also detect figures stored via standalone .dvc pointer files
-            # (tracked with `dvc add`, not via a DVC pipeline stage).
-            if blob_path.endswith(".dvc"):
-                try:
-                    dvc_data = yaml.safe_load(blob.data_stream.read())  # type: ignore[union-attr]
-                    outs = (
-                        dvc_data.get("outs")
-                        if isinstance(dvc_data, dict)
-                        else None
-                    )
-                    out = outs[0] if isinstance(outs, list) and outs else None
-                    out_path = (
-                        out.get("path") if isinstance(out, dict) else None
-                    )
-                    if isinstance(out_path, str) and out_path:
-                        actual_path = os.path.normpath(
-                            os.path.join(os.path.dirname(blob_path), out_path)
-                        )
-                    else:
-                        actual_path = blob_path[:-4]
-                    if actual_path:
-                        _maybe_add_figure(actual_path)
-                except Exception:
-                    actual_path = blob_path[:-4]
-                    if actual_path:
-                        _maybe_add_figure(actual_path)
+        for path in get_tree_index(repo, ref).iter_paths(with_dvc_outs=True):
+            _maybe_add_figure(path)
     except Exception:
         pass
     # Pre-compute calkit.yaml / dvc.lock metadata once for the tree so we
@@ -1920,11 +1892,8 @@ def _build_figures(
     dvc_lock: dict = {}
     stage_statuses = {}
     try:
-        if tree.is_file("dvc.lock"):
-            dvc_lock = ryaml.load(tree.read_bytes("dvc.lock").decode()) or {}
-        dvc_yaml: dict = {}
-        if tree.is_file("dvc.yaml"):
-            dvc_yaml = ryaml.load(tree.read_bytes("dvc.yaml").decode()) or {}
+        dvc_lock = read_document(tree, "dvc.lock", {})
+        dvc_yaml: dict = read_document(tree, "dvc.yaml", {})
         stage_statuses = compute_stage_statuses(
             dvc_yaml=dvc_yaml,
             dvc_lock=dvc_lock,
@@ -2031,11 +2000,8 @@ def _build_results(
 
     # Auto-detect results from the repo tree
     try:
-        commit = repo.commit(ref) if ref else repo.head.commit
-        for blob in commit.tree.traverse():
-            if blob.type != "blob":  # type: ignore[union-attr]
-                continue
-            _maybe_add_result(blob.path)  # type: ignore[union-attr]
+        for path in get_tree_index(repo, ref).iter_paths():
+            _maybe_add_result(path)
     except Exception:
         pass
     # Also auto-detect results from DVC lock outs (files stored with DVC)
@@ -2235,17 +2201,11 @@ def post_project_figure(
         with open(os.path.join(repo.working_dir, path + ".dvc")) as f:
             dvc_yaml = yaml.safe_load(f)
         md5 = dvc_yaml["outs"][0]["md5"]
-        fs = get_object_fs()
-        fpath = make_data_fpath(
-            owner_name=owner_name,
-            project_name=project_name,
-            idx=md5[:2],
-            md5=md5[2:],
+        # Stored like a DVC push, so it's indexed and counted toward
+        # the owner's storage
+        fpath = dvc_uploads.put_object(
+            owner_name, project_name, md5, file_data
         )
-        with fs.open(fpath, "wb") as f:
-            f.write(file_data)  # type: ignore[arg-type]
-        if settings.ENVIRONMENT != "local":
-            remove_gcs_content_type(fpath)
         url = get_object_url(fpath=fpath, fname=os.path.basename(path))
         # Finally, remove the figure from the cached repo
         os.remove(full_fig_path)
@@ -3022,11 +2982,9 @@ def get_project_dataset(
         remote=f"calkit:{owner_name}/{project_name}",
         push=False,
     )
-    dvc_lock_fpath = os.path.join(repo_dir, "dvc.lock")
-    dvc_lock = {}
-    if os.path.isfile(dvc_lock_fpath):
-        with open(dvc_lock_fpath) as f:
-            dvc_lock = yaml.safe_load(f)
+    tree = WorkingTree(repo_dir)
+    dvc_lock = read_document(tree, "dvc.lock", {})
+    if dvc_lock:
         # Expand all DVC lock outs
         fs = get_object_fs()
         dvc_lock_outs = expand_dvc_lock_outs(
@@ -3044,11 +3002,9 @@ def get_project_dataset(
     stage_name = ds.get("stage")
     if stage_name is None:
         logger.info("No stage defined for dataset")
-        dvc_fp = os.path.join(repo_dir, path + ".dvc")
-        if os.path.isfile(dvc_fp):
+        if tree.is_file(path + ".dvc"):
             logger.info(f"Repo has a .dvc file for {path}")
-            with open(dvc_fp) as f:
-                dvo = yaml.safe_load(f)["outs"][0]
+            dvo = read_document(tree, path + ".dvc")["outs"][0]
             dvc_out |= dvo
             ds["dvc_import"] = dict(outs=[dvc_out])
             ds["git_rev"] = git_rev
@@ -3066,14 +3022,11 @@ def get_project_dataset(
             raise HTTPException(404)
     else:
         logger.info(f"Looking up contents based on stage {stage_name}")
-        pipeline_fpath = os.path.join(repo_dir, "dvc.yaml")
-        if not os.path.isfile(pipeline_fpath):
+        if not tree.is_file("dvc.yaml"):
             logger.info("No dvc.yaml file")
             raise HTTPException(400, "dvc.yaml file missing")
-        with open(pipeline_fpath) as f:
-            pipeline = yaml.safe_load(f)
-        dvc_lock_fpath = os.path.join(repo_dir, "dvc.lock")
-        if not os.path.isfile(dvc_lock_fpath):
+        pipeline = read_document(tree, "dvc.yaml", {})
+        if not tree.is_file("dvc.lock"):
             logger.info("No dvc.lock file")
             raise HTTPException(400, "dvc.lock file missing")
         out = output_from_pipeline(
@@ -3276,17 +3229,9 @@ def post_project_dataset_upload(
     with open(os.path.join(repo.working_dir, path + ".dvc")) as f:
         dvc_yaml = yaml.safe_load(f)
     md5 = dvc_yaml["outs"][0]["md5"]
-    fs = get_object_fs()
-    fpath = make_data_fpath(
-        owner_name=owner_name,
-        project_name=project_name,
-        idx=md5[:2],
-        md5=md5[2:],
-    )
-    with fs.open(fpath, "wb") as f:
-        f.write(file_data)  # type: ignore[arg-type]
-    if settings.ENVIRONMENT != "local":
-        remove_gcs_content_type(fpath)
+    # Stored like a DVC push, so it's indexed and counted toward
+    # the owner's storage
+    fpath = dvc_uploads.put_object(owner_name, project_name, md5, file_data)
     url = get_object_url(fpath=fpath, fname=os.path.basename(path))
     # Finally, remove the dataset from the cached repo
     os.remove(full_ds_path)
@@ -3347,8 +3292,7 @@ def get_project_publications(
     dvc_lock: dict = {}
     stage_statuses = {}
     try:
-        if tree.is_file("dvc.lock"):
-            dvc_lock = ryaml.load(tree.read_bytes("dvc.lock").decode()) or {}
+        dvc_lock = read_document(tree, "dvc.lock", {})
         stage_statuses = compute_stage_statuses(
             dvc_yaml=pipeline,
             dvc_lock=dvc_lock,
@@ -3459,40 +3403,12 @@ def get_project_presentations(
                 presentations.append({"path": path, "title": stem})
                 declared_paths.add(path)
 
-    # Auto-detect presentations from the repo tree
+    # Auto-detect presentations from the repo tree, including those stored
+    # via standalone .dvc pointer files (tracked with `dvc add`, not via a
+    # DVC pipeline stage)
     try:
-        commit = repo.commit(ref) if ref else repo.head.commit
-        for blob in commit.tree.traverse():
-            if blob.type != "blob":  # type: ignore[union-attr]
-                continue
-            blob_path: str = blob.path  # type: ignore[union-attr]
-            _maybe_add_presentation(blob_path)
-            # Also detect presentations stored via standalone .dvc pointer
-            # files (tracked with `dvc add`, not via a DVC pipeline stage).
-            if blob_path.endswith(".dvc"):
-                try:
-                    dvc_data = yaml.safe_load(blob.data_stream.read())  # type: ignore[union-attr]
-                    outs = (
-                        dvc_data.get("outs")
-                        if isinstance(dvc_data, dict)
-                        else None
-                    )
-                    out = outs[0] if isinstance(outs, list) and outs else None
-                    out_path = (
-                        out.get("path") if isinstance(out, dict) else None
-                    )
-                    if isinstance(out_path, str) and out_path:
-                        actual_path = os.path.normpath(
-                            os.path.join(os.path.dirname(blob_path), out_path)
-                        )
-                    else:
-                        actual_path = blob_path[:-4]
-                    if actual_path:
-                        _maybe_add_presentation(actual_path)
-                except Exception:
-                    actual_path = blob_path[:-4]
-                    if actual_path:
-                        _maybe_add_presentation(actual_path)
+        for path in get_tree_index(repo, ref).iter_paths(with_dvc_outs=True):
+            _maybe_add_presentation(path)
     except Exception:
         pass
     tree = app.projects.get_repo_tree_for_ref(repo, ref)
@@ -3745,17 +3661,14 @@ def post_project_publication(
         with open(os.path.join(repo.working_dir, path + ".dvc")) as f:
             dvc_yaml = yaml.safe_load(f)
         md5 = dvc_yaml["outs"][0]["md5"]
-        fs = get_object_fs()
-        fpath = make_data_fpath(
-            owner_name=owner_name,
-            project_name=project_name,
-            idx=md5[:2],
-            md5=md5[2:],
+        # Stored like a DVC push, so it's indexed and counted toward
+        # the owner's storage
+        fpath = dvc_uploads.put_object(
+            owner_name,
+            project_name,
+            md5,
+            file_data,  # type: ignore[arg-type]
         )
-        with fs.open(fpath, "wb") as f:
-            f.write(file_data)  # type: ignore
-        if settings.ENVIRONMENT != "local":
-            remove_gcs_content_type(fpath)
         url = get_object_url(fpath=fpath, fname=os.path.basename(path))
         # Finally, remove the figure from the cached repo
         os.remove(full_fig_path)
@@ -4258,15 +4171,16 @@ def get_project_pipeline(
     if not tree.is_file("dvc.yaml"):
         return
     dvc_content = tree.read_text("dvc.yaml")
-    dvc_pipeline = ryaml.load(dvc_content)
-    # Pop off any private stages
-    for stage_name in list(dvc_pipeline.get("stages", {}).keys()):
-        if stage_name.startswith("_"):
-            dvc_pipeline["stages"].pop(stage_name)
-    if tree.is_file("params.yaml"):
-        params = ryaml.load(tree.read_text("params.yaml"))
-    else:
-        params = None
+    dvc_pipeline = read_document(tree, "dvc.yaml", {})
+    # Leave out any private stages
+    dvc_pipeline = dvc_pipeline | dict(
+        stages={
+            name: stage
+            for name, stage in (dvc_pipeline.get("stages") or {}).items()
+            if not name.startswith("_")
+        }
+    )
+    params = read_document(tree, "params.yaml")
     # Generate Mermaid diagram
     mermaid = make_mermaid_diagram(dvc_pipeline, params=params)
     logger.info(
@@ -4284,9 +4198,7 @@ def get_project_pipeline(
     stage_statuses: dict = {}
     overall_status = "unknown"
     try:
-        dvc_lock: dict = {}
-        if tree.is_file("dvc.lock"):
-            dvc_lock = ryaml.load(tree.read_bytes("dvc.lock").decode()) or {}
+        dvc_lock: dict = read_document(tree, "dvc.lock", {})
         stage_statuses = compute_stage_statuses(
             dvc_yaml=dvc_pipeline,
             dvc_lock=dvc_lock,
@@ -5013,11 +4925,7 @@ def get_project_references(
     declared_paths = {rc["path"] for rc in ref_collections}
     # Auto-detect undeclared .bib files in the repo tree
     try:
-        commit = repo.commit(ref) if ref else repo.head.commit
-        for blob in commit.tree.traverse():
-            if blob.type != "blob":  # type: ignore[union-attr]
-                continue
-            path: str = blob.path  # type: ignore[union-attr]
+        for path in get_tree_index(repo, ref).iter_paths():
             parts = path.split("/")
             if any(p.startswith(".") for p in parts):
                 continue
@@ -5337,16 +5245,14 @@ def get_project_notebooks(
     # Also detect undeclared .ipynb files not under hidden directories
     declared_paths = {nb["path"] for nb in notebooks}
     try:
-        for root, dirs, files in os.walk(repo.working_dir):
-            dirs[:] = [d for d in dirs if not d.startswith(".")]
-            for fname in files:
-                if fname.endswith(".ipynb"):
-                    rel = os.path.relpath(
-                        os.path.join(root, fname), repo.working_dir
-                    )
-                    if rel not in declared_paths:
-                        notebooks.append({"path": rel})
-                        declared_paths.add(rel)
+        for path in get_tree_index(repo, ref).iter_paths(with_dvc_outs=True):
+            if not path.endswith(".ipynb") or any(
+                p.startswith(".") for p in path.split("/")[:-1]
+            ):
+                continue
+            if path not in declared_paths:
+                notebooks.append({"path": path})
+                declared_paths.add(path)
     except Exception as e:
         logger.warning(f"Failed to scan for undeclared notebooks: {e}")
     if not notebooks:
@@ -5556,15 +5462,8 @@ def get_project_showcase(
     showcase_dvc_lock: dict = {}
     try:
         showcase_tree = app.projects.get_repo_tree_for_ref(repo, ref)
-        if showcase_tree.is_file("dvc.lock"):
-            showcase_dvc_lock = (
-                ryaml.load(showcase_tree.read_bytes("dvc.lock").decode()) or {}
-            )
-        showcase_dvc_yaml: dict = {}
-        if showcase_tree.is_file("dvc.yaml"):
-            showcase_dvc_yaml = (
-                ryaml.load(showcase_tree.read_bytes("dvc.yaml").decode()) or {}
-            )
+        showcase_dvc_lock = read_document(showcase_tree, "dvc.lock", {})
+        showcase_dvc_yaml: dict = read_document(showcase_tree, "dvc.yaml", {})
         showcase_stage_statuses = compute_stage_statuses(
             dvc_yaml=showcase_dvc_yaml,
             dvc_lock=showcase_dvc_lock,
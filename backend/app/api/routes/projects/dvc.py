@@ -1,32 +1,232 @@
 """Routes for the Calkit HTTP DVC remote."""
 
-import functools
+import asyncio
 import hashlib
 import logging
+import queue
+import re
+import secrets
+import threading
+from datetime import datetime
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 import app.projects
-from app import mixpanel
+from app import (
+    dvc_imports,
+    dvc_uploads,
+    mixpanel,
+    object_cache,
+    upload_sessions,
+)
 from app.api.deps import CurrentUserDvcScope, SessionDep
+from app.api.routes.projects.fs import (
+    PresignedChunkedAccess,
+    PresignedMultipartAccess,
+    PresignedUrlAccess,
+    make_put_access,
+)
 from app.config import settings
-from app.models import Message
+from app.models import DvcUploadSession, Message
+from app.refresh import refresh_scheduler
+from app.object_index import (
+    find_object,
+    find_objects,
+    get_indexed_objects,
+)
 from app.storage import (
+    get_backend,
     get_data_prefix,
+    get_metadata_md5,
     get_object_fs,
+    get_object_md5,
+    get_object_url,
     get_storage_usage,
-    invalidate_storage_usage_cache,
     make_data_fpath,
     remove_gcs_content_type,
 )
 
 router = APIRouter()
 
+# Max MD5s per batch existence check
+MAX_BATCH_MD5S = 10_000
+# Lifetime of presigned URLs that downloads are redirected to
+DOWNLOAD_URL_EXPIRES_SECONDS = 300
+# Request body chunks are coalesced into buffers of this size for writing
+UPLOAD_BUFFER_BYTES = 1024 * 1024
+# Max buffers per upload waiting to be written to storage
+UPLOAD_MAX_PENDING_BUFFERS = 4
+# Staged uploads up to this size whose MD5 isn't in their metadata are
+# hashed while the client waits; larger ones are hashed in the background
+UPLOAD_VERIFY_INLINE_MAX_BYTES = 16 * 1024 * 1024
+_MD5_PATTERN = re.compile(r"[0-9a-f]{32}(\.dir)?")
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _etag_matches(header: str | None, etag: str) -> bool:
+    """Check an ``If-None-Match`` header against an ETag, ignoring
+    weakness, since objects never change."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in header.split(",")
+    )
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a ``Range`` header into inclusive ``(start, end)`` offsets.
+
+    Returns None if the whole object should be sent, i.e., if the header
+    isn't a single byte range we understand, which clients must accept.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first.isdigit() or last.isdigit()):
+        return None
+    if not first:
+        # Suffix range, e.g., the last 500 bytes
+        start, end = max(size - int(last), 0), size - 1
+    elif not first.isdigit() or (last and not last.isdigit()):
+        return None
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    if start >= size or end < start:
+        raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _get_storage_limit_gb(
+    session, owner_name: str, project_name: str, current_user
+) -> float:
+    """Check write access to a project and get its owner's storage limit,
+    releasing the DB connection after, since uploads can take a while."""
+    project = app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="write",
+    )
+    owner = project.owner
+    if owner is None or owner.subscription is None:
+        raise HTTPException(400, "Project owner subscription not configured")
+    storage_limit_gb = owner.subscription.storage_limit
+    session.close()
+    return storage_limit_gb
+
+
+def _check_storage_limit(
+    owner_name: str, storage_limit_gb: float, fs, current_user
+) -> None:
+    # Create bucket if it doesn't exist -- only necessary with MinIO
+    if settings.ENVIRONMENT == "local" and not fs.exists(get_data_prefix()):
+        fs.makedir(get_data_prefix())
+    storage_used_gb = get_storage_usage(owner_name, fs=fs)
+    logger.info(
+        f"{owner_name} has used {storage_used_gb}/{storage_limit_gb} "
+        "GB of storage"
+    )
+    if storage_used_gb > storage_limit_gb:
+        logger.info("Rejecting request due to storage limit exceeded")
+        mixpanel.user_out_of_storage(user=current_user)
+        raise HTTPException(400, "Storage limit exceeded")
+
+
+class _ObjectWriter:
+    """Write an object to storage from a dedicated thread, hashing it on the
+    way, so the event loop only hands over the request body.
+
+    Chunks are coalesced into buffers of ``UPLOAD_BUFFER_BYTES``, and at most
+    ``UPLOAD_MAX_PENDING_BUFFERS`` of them are queued or being written at
+    once. Beyond that, ``write`` waits for the thread to catch up, which in
+    turn stops reading the request, so memory per upload stays bounded.
+    """
+
+    def __init__(self, fs, fpath: str, keep_bytes: int = 0, md5=None) -> None:
+        self.fs = fs
+        self.fpath = fpath
+        # Anything with ``update``, e.g., to continue a running hash
+        self.md5 = md5 if md5 is not None else hashlib.md5()
+        self.size = 0
+        # Keep the content in memory if it's no larger than this
+        self._keep_bytes = keep_bytes
+        self._kept: list[bytes] | None = [] if keep_bytes else None
+        self._buffer = bytearray()
+        self._queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(UPLOAD_MAX_PENDING_BUFFERS)
+        self._done = self._loop.create_future()
+        self._closed = False
+        threading.Thread(
+            target=self._run, name="dvc-upload-writer", daemon=True
+        ).start()
+
+    @property
+    def content(self) -> bytes | None:
+        """The object's content, if it was small enough to keep."""
+        return b"".join(self._kept) if self._kept is not None else None
+
+    async def write(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        if len(self._buffer) >= UPLOAD_BUFFER_BYTES:
+            await self._flush()
+
+    async def close(self) -> None:
+        """Write what's left and wait for the object to be stored, raising
+        any error from the thread."""
+        if not self._closed:
+            self._closed = True
+            if self._buffer and not self._done.done():
+                await self._flush()
+            self._queue.put(None)
+        await self._done
+
+    async def _flush(self) -> None:
+        await self._slots.acquire()
+        if self._done.done():
+            # The thread failed, so raise its error
+            await self._done
+        self._queue.put(bytes(self._buffer))
+        self._buffer.clear()
+
+    def _run(self) -> None:
+        try:
+            with self.fs.open(self.fpath, "wb") as f:
+                while (data := self._queue.get()) is not None:
+                    f.write(data)
+                    self.md5.update(data)
+                    self.size += len(data)
+                    if self._kept is not None:
+                        if self.size > self._keep_bytes:
+                            self._kept = None
+                        else:
+                            self._kept.append(data)
+                    self._loop.call_soon_threadsafe(self._slots.release)
+        except BaseException as e:
+            self._loop.call_soon_threadsafe(self._fail, e)
+        else:
+            self._loop.call_soon_threadsafe(self._done.set_result, None)
+
+    def _fail(self, e: BaseException) -> None:
+        self._done.set_exception(e)
+        # Wake a write waiting for a slot so it sees the error
+        for _ in range(UPLOAD_MAX_PENDING_BUFFERS):
+            self._slots.release()
+
+
 @router.post("/projects/{owner_name}/{project_name}/dvc/files/md5/{idx}/{md5}")
 async def post_project_dvc_file(
     *,
@@ -47,71 +247,72 @@ async def post_project_dvc_file(
         f"Received request from {current_user.email} to post "
         f"DVC file MD5 {idx}{md5}"
     )
-    project = app.projects.get_project(
+    # Everything that touches the database or storage runs off the event
+    # loop, so a large push doesn't stall other requests on this worker
+    storage_limit_gb = await run_in_threadpool(
+        _get_storage_limit_gb,
         session=session,
         owner_name=owner_name,
         project_name=project_name,
         current_user=current_user,
-        min_access_level="write",
     )
     logger.info(f"{current_user.email} requesting to POST data")
     # Check if user has not exceeded their storage limit
     fs = get_object_fs()
-    owner = project.owner
-    if owner is None or owner.subscription is None:
-        raise HTTPException(400, "Project owner subscription not configured")
-    storage_limit_gb = owner.subscription.storage_limit
-    session.close()
-    # Create bucket if it doesn't exist -- only necessary with MinIO
-    if settings.ENVIRONMENT == "local" and not fs.exists(get_data_prefix()):
-        fs.makedir(get_data_prefix())
-    storage_used_gb = get_storage_usage(owner_name, fs=fs)
-    logger.info(
-        f"{owner_name} has used {storage_used_gb}/{storage_limit_gb} "
-        "GB of storage"
+    await run_in_threadpool(
+        _check_storage_limit, owner_name, storage_limit_gb, fs, current_user
     )
-    if storage_used_gb > storage_limit_gb:
-        logger.info("Rejecting request due to storage limit exceeded")
-        mixpanel.user_out_of_storage(user=current_user)
-        raise HTTPException(400, "Storage limit exceeded")
     fpath = make_data_fpath(
         owner_name=owner_name, project_name=project_name, idx=idx, md5=md5
     )
     # Use a pending path during upload so we can rename after
-    sig = hashlib.md5()
     pending_fpath = fpath + ".pending"
     upload_succeeded = False
     try:
-        with fs.open(pending_fpath, "wb") as f:
+        writer = _ObjectWriter(
+            fs,
+            pending_fpath,
+            # Keep .dir manifests so they can go straight into the node's
+            # cache
+            keep_bytes=(
+                object_cache.MAX_OBJECT_BYTES if md5.endswith(".dir") else 0
+            ),
+        )
+        try:
             # See https://stackoverflow.com/q/73322065/2284865
             async for chunk in req.stream():
-                f.write(chunk)  # type: ignore
-                sig.update(chunk)
+                await writer.write(chunk)
+        finally:
+            await writer.close()
         # If using Google Cloud Storage, we need to remove the content type
         # metadata in order to set it for signed URLs
         if settings.ENVIRONMENT != "local":
-            remove_gcs_content_type(pending_fpath)
-        digest = sig.hexdigest()
+            await run_in_threadpool(remove_gcs_content_type, pending_fpath)
+        digest = writer.md5.hexdigest()
         logger.info(f"Computed MD5 from DVC post: {digest}")
         if md5.endswith(".dir"):
             digest += ".dir"
         if digest == idx + md5:
             logger.info("MD5 matches; removing pending suffix")
-            fs.mv(pending_fpath, fpath)
+            await run_in_threadpool(
+                dvc_uploads.store_upload,
+                fs,
+                owner_name,
+                project_name,
+                idx + md5,
+                writer.size,
+                pending_fpath,
+                data=writer.content,
+            )
             upload_succeeded = True
-            invalidate_storage_usage_cache(owner_name)
         else:
             logger.warning("MD5 does not match")
             raise HTTPException(400, "MD5 does not match")
     finally:
         if not upload_succeeded:
-            try:
-                if fs.exists(pending_fpath):
-                    fs.rm(pending_fpath)
-            except Exception:
-                logger.exception(
-                    "Failed to remove pending DVC upload %s", pending_fpath
-                )
+            await run_in_threadpool(
+                dvc_uploads.remove_pending, fs, pending_fpath
+            )
     return Message(message="Success")
 
 
@@ -124,14 +325,26 @@ async def get_project_dvc_file(
     md5: str,
     session: SessionDep,
     current_user: CurrentUserDvcScope,
-) -> StreamingResponse:
+    req: Request,
+    redirect: bool | None = None,
+) -> Response:
+    """Download an object.
+
+    With ``settings.DVC_DOWNLOAD_REDIRECT`` (or ``redirect=true``), the
+    response is a redirect to a presigned URL for the object, so workers
+    don't carry the bytes. Otherwise, or with ``redirect=false`` for
+    clients that don't follow redirects, the object is streamed through,
+    honoring single byte ``Range`` requests so interrupted downloads can
+    resume. Objects are addressed by MD5, which serves as their ETag.
+    """
     owner_name = owner_name.lower()
     project_name = project_name.lower()
     mixpanel.user_dvc_pulled(
         user=current_user, owner_name=owner_name, project_name=project_name
     )
     logger.info(f"{current_user.email} requesting to GET data")
-    app.projects.get_project(
+    await run_in_threadpool(
+        app.projects.get_project,
         session=session,
         owner_name=owner_name,
         project_name=project_name,
@@ -143,21 +356,735 @@ async def get_project_dvc_file(
     # open session would pin a pool connection (idle in transaction) for the
     # entire download. The POST route closes early for the same reason.
     session.close()
+    etag = f'"{idx}{md5}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+    # An object's content can't change, so a client holding this ETag
+    # already has it, and storage needn't be touched
+    if _etag_matches(req.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     # If file doesn't exist, return 404
     fs = get_object_fs()
     fpath = make_data_fpath(
         owner_name=owner_name, project_name=project_name, idx=idx, md5=md5
     )
     logger.info(f"Checking for {fpath}")
-    if not fs.exists(fpath):
-        logger.info(f"{fpath} does not exist")
-        raise HTTPException(404)
+    try:
+        size = int((await run_in_threadpool(fs.info, fpath))["size"])
+    except FileNotFoundError:
+        # The project may reference the object in the shared store
+        indexed = (
+            await run_in_threadpool(
+                get_indexed_objects, owner_name, project_name, [idx + md5]
+            )
+        ).get(idx + md5)
+        if indexed is None or not indexed.shared:
+            logger.info(f"{fpath} does not exist")
+            raise HTTPException(404)
+        fpath = indexed.path
+        try:
+            size = int((await run_in_threadpool(fs.info, fpath))["size"])
+        except FileNotFoundError:
+            logger.warning(f"Shared object {fpath} does not exist")
+            raise HTTPException(404)
+    if redirect is None:
+        redirect = settings.DVC_DOWNLOAD_REDIRECT
+    if redirect:
+        try:
+            url = await run_in_threadpool(
+                get_object_url,
+                fpath,
+                expires=DOWNLOAD_URL_EXPIRES_SECONDS,
+                fs=fs,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to sign {fpath}; proxying instead: {e}")
+        else:
+            # 307 so the client repeats the GET, with its Range header, at
+            # the new location
+            return RedirectResponse(url, status_code=307, headers=headers)
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = req.headers.get("range")
+    if_range = req.headers.get("if-range")
+    # If-Range needs a strong match, and otherwise means send everything
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
 
-    # Stream the file contents back to the user
+    # Stream the requested bytes back to the user
     def iterfile():
+        remaining = end - start + 1
         with fs.open(fpath, "rb") as f:
-            chunker = functools.partial(f.read, 4_000_000)
-            for chunk in iter(chunker, b""):
+            # Reading after a seek fetches from that offset with a ranged
+            # request on s3fs and gcsfs
+            if start:
+                f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(4_000_000, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
                 yield chunk
 
-    return StreamingResponse(iterfile())
+    return StreamingResponse(
+        iterfile(), status_code=status_code, headers=headers
+    )
+
+
+@router.head("/projects/{owner_name}/{project_name}/dvc/files/md5/{idx}/{md5}")
+def head_project_dvc_file(
+    *,
+    owner_name: str,
+    project_name: str,
+    idx: str,
+    md5: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> Response:
+    """Check whether an object exists without opening a download."""
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="read",
+    )
+    session.close()
+    stored = find_object(owner_name, project_name, idx + md5, get_object_fs())
+    # Only objects in the current layout can be downloaded from this remote
+    if stored is None or stored.legacy:
+        raise HTTPException(404)
+    headers = {"ETag": f'"{idx}{md5}"', "Accept-Ranges": "bytes"}
+    if stored.size is not None:
+        headers["Content-Length"] = str(stored.size)
+    return Response(status_code=200, headers=headers)
+
+
+class DvcObjectsExistPost(BaseModel):
+    # Full MD5s, e.g., "d41d8cd98f00b204e9800998ecf8427e" or with ".dir"
+    md5s: list[Annotated[str, Field(pattern=rf"^{_MD5_PATTERN.pattern}$")]] = (
+        Field(max_length=MAX_BATCH_MD5S)
+    )
+
+
+class DvcObjectsExist(BaseModel):
+    # Whether each object is present, in the order requested
+    exists: list[bool]
+
+
+@router.post("/projects/{owner_name}/{project_name}/dvc/objects/exist")
+def post_project_dvc_objects_exist(
+    *,
+    owner_name: str,
+    project_name: str,
+    req: DvcObjectsExistPost,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcObjectsExist:
+    """Check which of a batch of objects are in the project's storage.
+
+    Access is checked once for the whole batch, and presence comes from the
+    object index, which only probes storage, in parallel, for MD5s it
+    doesn't know.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="read",
+    )
+    session.close()
+    objects = find_objects(owner_name, project_name, req.md5s, get_object_fs())
+    exists = []
+    for md5 in req.md5s:
+        stored = objects.get(md5)
+        exists.append(stored is not None and not stored.legacy)
+    return DvcObjectsExist(exists=exists)
+
+
+def _get_staging_fpath(
+    owner_name: str, project_name: str, upload_id: str
+) -> str:
+    return (
+        f"{dvc_uploads.get_staging_prefix(owner_name, project_name)}"
+        f"/{upload_id}"
+    )
+
+
+def _parse_upload_id(upload_id: str) -> str:
+    """Get the MD5 an upload was started for from its ID."""
+    md5, _, token = upload_id.rpartition("-")
+    if not _MD5_PATTERN.fullmatch(md5) or not token.isalnum():
+        raise HTTPException(404, "Upload not found")
+    return md5
+
+
+class DvcUploadPost(BaseModel):
+    # Full MD5, e.g., "d41d8cd98f00b204e9800998ecf8427e" or with ".dir"
+    md5: str = Field(pattern=rf"^{_MD5_PATTERN.pattern}$")
+    size: int = Field(ge=0)
+
+
+class DvcUpload(BaseModel):
+    # If the project already has the object, there's nothing to upload
+    exists: bool
+    upload_id: str | None = None
+    access: (
+        Annotated[
+            PresignedUrlAccess
+            | PresignedMultipartAccess
+            | PresignedChunkedAccess,
+            Field(discriminator="kind"),
+        ]
+        | None
+    ) = None
+
+
+@router.post("/projects/{owner_name}/{project_name}/dvc/uploads")
+def post_project_dvc_upload(
+    *,
+    owner_name: str,
+    project_name: str,
+    req: DvcUploadPost,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcUpload:
+    """Start uploading an object straight to storage.
+
+    The response has presigned access for putting the object at a staging
+    key, as a single PUT, or for large objects, a multipart (S3) or
+    resumable (GCS) upload. Once it's uploaded, the client calls the
+    finalize endpoint with the upload ID, which verifies the object's MD5
+    and moves it into place. Uploads that are never finalized are deleted
+    in the background (see ``app.dvc_uploads.expire_staged_uploads``).
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    mixpanel.user_dvc_pushed(
+        user=current_user, owner_name=owner_name, project_name=project_name
+    )
+    storage_limit_gb = _get_storage_limit_gb(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+    )
+    fs = get_object_fs()
+    stored = find_object(owner_name, project_name, req.md5, fs)
+    if stored is not None and not stored.legacy:
+        return DvcUpload(exists=True)
+    _check_storage_limit(owner_name, storage_limit_gb, fs, current_user)
+    refresh_scheduler.schedule(
+        f"dvc-staging-expiry:{owner_name}/{project_name}",
+        lambda: dvc_uploads.expire_staged_uploads(
+            owner_name, project_name, fs=fs
+        ),
+    )
+    upload_id = f"{req.md5}-{secrets.token_hex(16)}"
+    access = make_put_access(
+        fs=fs,
+        backend=get_backend(),
+        full_path=_get_staging_fpath(owner_name, project_name, upload_id),
+        content_length=req.size,
+    )
+    return DvcUpload(exists=False, upload_id=upload_id, access=access)
+
+
+def _store_staged_upload(
+    fs,
+    owner_name: str,
+    project_name: str,
+    md5: str,
+    size: int,
+    staging_fpath: str,
+) -> None:
+    data = None
+    if md5.endswith(".dir") and size <= object_cache.MAX_OBJECT_BYTES:
+        with fs.open(staging_fpath, "rb") as f:
+            data = f.read()
+    dvc_uploads.store_upload(
+        fs, owner_name, project_name, md5, size, staging_fpath, data=data
+    )
+
+
+def _verify_staged_upload(
+    fs,
+    owner_name: str,
+    project_name: str,
+    upload_id: str,
+    md5: str,
+    size: int,
+) -> None:
+    """Hash a staged upload and store it if it matches. Otherwise, move it
+    aside, so the client's next finalize call reports the mismatch."""
+    staging_fpath = _get_staging_fpath(owner_name, project_name, upload_id)
+    try:
+        digest = get_object_md5(staging_fpath, fs=fs, from_metadata=False)
+        if digest == md5.removesuffix(".dir"):
+            _store_staged_upload(
+                fs, owner_name, project_name, md5, size, staging_fpath
+            )
+        else:
+            logger.warning(f"MD5 of staged upload {upload_id} does not match")
+            fs.mv(staging_fpath, staging_fpath + ".invalid")
+    except FileNotFoundError:
+        # Verified by another worker
+        pass
+
+
+@router.post(
+    "/projects/{owner_name}/{project_name}/dvc/uploads/{upload_id}/finalize",
+    responses={202: {"model": Message}},
+)
+def post_project_dvc_upload_finalize(
+    *,
+    owner_name: str,
+    project_name: str,
+    upload_id: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+    response: Response,
+) -> Message:
+    """Verify a staged upload's MD5 and move it to its content-addressed
+    path.
+
+    The MD5 comes from the object's metadata in storage when it has one, so
+    verifying usually doesn't read the object back. Otherwise, or if it
+    doesn't match (e.g., an S3 ETag that isn't an MD5), the object is
+    hashed: right away if it's small, or else in the background, and this
+    responds with 202. The client then calls it again until it responds
+    with 200 once the object is stored, or 400 if its MD5 doesn't match.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    md5 = _parse_upload_id(upload_id)
+    app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="write",
+    )
+    session.close()
+    fs = get_object_fs()
+    staging_fpath = _get_staging_fpath(owner_name, project_name, upload_id)
+    if dvc_uploads.is_verifying(fs, staging_fpath):
+        response.status_code = 202
+        return Message(message="Verifying upload")
+    try:
+        info = fs.info(staging_fpath)
+    except FileNotFoundError:
+        # Either it was verified in the background, or it was never
+        # uploaded
+        if fs.exists(staging_fpath + ".invalid"):
+            fs.rm(staging_fpath + ".invalid")
+            raise HTTPException(400, "MD5 does not match")
+        stored = find_object(owner_name, project_name, md5, fs)
+        if stored is not None and not stored.legacy:
+            return Message(message="Success")
+        raise HTTPException(404, "Upload not found")
+    size = int(info["size"])
+    expected = md5.removesuffix(".dir")
+    if get_metadata_md5(info) != expected:
+        if size > UPLOAD_VERIFY_INLINE_MAX_BYTES:
+            dvc_uploads.start_verifying(
+                fs,
+                staging_fpath,
+                lambda: _verify_staged_upload(
+                    fs, owner_name, project_name, upload_id, md5, size
+                ),
+            )
+            response.status_code = 202
+            return Message(message="Verifying upload")
+        digest = get_object_md5(staging_fpath, fs=fs, from_metadata=False)
+        if digest != expected:
+            logger.warning(f"MD5 of staged upload {upload_id} does not match")
+            fs.rm(staging_fpath)
+            raise HTTPException(400, "MD5 does not match")
+    _store_staged_upload(
+        fs, owner_name, project_name, md5, size, staging_fpath
+    )
+    return Message(message="Success")
+
+
+class DvcUploadSessionInfo(BaseModel):
+    # None if there's nothing to upload because the object is stored
+    id: str | None = None
+    # Bytes received so far, i.e., where the next chunk starts
+    offset: int
+    size: int
+    expires: datetime | None = None
+    # Whether the object is stored, either already or by this session
+    completed: bool = False
+
+
+def _session_info(upload: DvcUploadSession) -> DvcUploadSessionInfo:
+    return DvcUploadSessionInfo(
+        id=upload.id,
+        offset=upload.received,
+        size=upload.size,
+        expires=upload.expires,
+    )
+
+
+@router.post("/projects/{owner_name}/{project_name}/dvc/upload-sessions")
+def post_project_dvc_upload_session(
+    *,
+    owner_name: str,
+    project_name: str,
+    req: DvcUploadPost,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcUploadSessionInfo:
+    """Start a resumable upload of an object.
+
+    The object is then sent in chunks with ``PATCH`` requests to the
+    session, each with an ``Upload-Offset`` header giving where it starts.
+    Chunks other than the last must be at least 5 MiB. If a chunk fails,
+    ``GET`` the session for the offset to resume from. The object is
+    verified and stored when the last chunk arrives.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    mixpanel.user_dvc_pushed(
+        user=current_user, owner_name=owner_name, project_name=project_name
+    )
+    storage_limit_gb = _get_storage_limit_gb(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+    )
+    fs = get_object_fs()
+    stored = find_object(owner_name, project_name, req.md5, fs)
+    if stored is not None and not stored.legacy:
+        return DvcUploadSessionInfo(
+            offset=req.size, size=req.size, completed=True
+        )
+    _check_storage_limit(owner_name, storage_limit_gb, fs, current_user)
+    upload = upload_sessions.create_session(
+        owner_name, project_name, req.md5, req.size
+    )
+    return _session_info(upload)
+
+
+def _get_upload_session(
+    session, owner_name: str, project_name: str, session_id: str, current_user
+) -> DvcUploadSession:
+    app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="write",
+    )
+    session.close()
+    upload = upload_sessions.get_session(owner_name, project_name, session_id)
+    if upload is None:
+        raise HTTPException(404, "Upload session not found")
+    return upload
+
+
+@router.get(
+    "/projects/{owner_name}/{project_name}/dvc/upload-sessions/{session_id}"
+)
+def get_project_dvc_upload_session(
+    *,
+    owner_name: str,
+    project_name: str,
+    session_id: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcUploadSessionInfo:
+    """Get an upload session's offset, to resume it."""
+    upload = _get_upload_session(
+        session,
+        owner_name.lower(),
+        project_name.lower(),
+        session_id,
+        current_user,
+    )
+    return _session_info(upload)
+
+
+async def _receive_chunk(
+    fs,
+    upload: DvcUploadSession,
+    offset: int,
+    req: Request,
+    storage_limit_gb: float,
+    current_user,
+) -> DvcUploadSession:
+    """Store a request's body as the session's chunk at ``offset`` and
+    record it, returning the updated session."""
+    await run_in_threadpool(
+        _check_storage_limit,
+        upload.owner_name,
+        storage_limit_gb,
+        fs,
+        current_user,
+    )
+    md5 = upload_sessions.resume_md5(upload)
+    part_fpath = upload_sessions.make_part_fpath(upload, offset)
+    recorded = None
+    try:
+        writer = _ObjectWriter(fs, part_fpath, md5=md5)
+        try:
+            size = 0
+            async for chunk in req.stream():
+                size += len(chunk)
+                # Stop reading as soon as the chunk is too big
+                if offset + size > upload.size:
+                    raise HTTPException(
+                        400, "Chunk extends past the object's size"
+                    )
+                await writer.write(chunk)
+        finally:
+            await writer.close()
+        end = offset + writer.size
+        if end < upload.size and (
+            writer.size < upload_sessions.MIN_CHUNK_BYTES
+        ):
+            raise HTTPException(
+                400,
+                "Chunks other than the last must be at least "
+                f"{upload_sessions.MIN_CHUNK_BYTES} bytes",
+            )
+        if writer.size == 0:
+            raise HTTPException(400, "Chunk is empty")
+        recorded = await run_in_threadpool(
+            upload_sessions.record_chunk,
+            upload.id,
+            offset,
+            part_fpath,
+            writer.size,
+            md5.state if md5 is not None else None,
+        )
+        if recorded is None:
+            raise HTTPException(
+                409, "Another chunk was received at this offset"
+            )
+    finally:
+        if recorded is None:
+            await run_in_threadpool(dvc_uploads.remove_pending, fs, part_fpath)
+    return recorded
+
+
+@router.patch(
+    "/projects/{owner_name}/{project_name}/dvc/upload-sessions/{session_id}"
+)
+async def patch_project_dvc_upload_session(
+    *,
+    owner_name: str,
+    project_name: str,
+    session_id: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+    req: Request,
+) -> DvcUploadSessionInfo:
+    """Append a chunk, starting at the ``Upload-Offset`` header, to an
+    upload session.
+
+    Responds with 409 and the session's offset if the chunk doesn't start
+    where the last one ended. Once the last chunk is in, the object is
+    verified against the session's MD5 and stored. If that was
+    interrupted, an empty chunk at the end of the object retries it.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    try:
+        offset = int(req.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(400, "Upload-Offset header is required")
+    storage_limit_gb = await run_in_threadpool(
+        _get_storage_limit_gb,
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+    )
+    upload = await run_in_threadpool(
+        upload_sessions.get_session, owner_name, project_name, session_id
+    )
+    if upload is None:
+        raise HTTPException(404, "Upload session not found")
+    if offset != upload.received:
+        raise HTTPException(
+            409,
+            f"Upload is at offset {upload.received}",
+            headers={"Upload-Offset": str(upload.received)},
+        )
+    content_length = req.headers.get("content-length", "")
+    if content_length.isdigit() and offset + int(content_length) > upload.size:
+        raise HTTPException(400, "Chunk extends past the object's size")
+    fs = get_object_fs()
+    if offset == upload.size:
+        # Everything was received, but the session wasn't completed, e.g.,
+        # because the worker stopped
+        async for chunk in req.stream():
+            if chunk:
+                raise HTTPException(
+                    400, "Chunk extends past the object's size"
+                )
+        recorded = upload
+    else:
+        recorded = await _receive_chunk(
+            fs, upload, offset, req, storage_limit_gb, current_user
+        )
+    info = _session_info(recorded)
+    if recorded.received < recorded.size:
+        return info
+    try:
+        pending_fpath = await run_in_threadpool(
+            upload_sessions.complete_session, recorded, fs
+        )
+    except ValueError:
+        logger.warning(f"MD5 of upload session {upload.id} does not match")
+        raise HTTPException(400, "MD5 does not match")
+    except FileNotFoundError:
+        # Its chunks were merged and deleted by a concurrent retry
+        raise HTTPException(409, "Upload session is already being completed")
+    await run_in_threadpool(
+        dvc_uploads.store_upload,
+        fs,
+        owner_name,
+        project_name,
+        upload.md5,
+        upload.size,
+        pending_fpath,
+    )
+    await run_in_threadpool(upload_sessions.delete_session, recorded, fs)
+    info.completed = True
+    return info
+
+
+@router.delete(
+    "/projects/{owner_name}/{project_name}/dvc/upload-sessions/{session_id}"
+)
+def delete_project_dvc_upload_session(
+    *,
+    owner_name: str,
+    project_name: str,
+    session_id: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> Message:
+    """Abandon an upload session, deleting the chunks it has received."""
+    upload = _get_upload_session(
+        session,
+        owner_name.lower(),
+        project_name.lower(),
+        session_id,
+        current_user,
+    )
+    upload_sessions.delete_session(upload)
+    return Message(message="Success")
+
+
+class DvcImportPost(BaseModel):
+    # Project to import from, as owner/name
+    project: str = Field(pattern=r"^[^/]+/[^/]+$")
+    # MD5s of the outs to import, e.g., from the dataset's dvc_import
+    md5s: list[Annotated[str, Field(pattern=rf"^{_MD5_PATTERN.pattern}$")]] = (
+        Field(max_length=MAX_BATCH_MD5S)
+    )
+
+
+class DvcImport(BaseModel):
+    id: str
+    status: Literal["running", "completed", "failed"]
+    # Objects to import, including files listed in .dir manifests, once
+    # they've been looked up
+    total: int | None = None
+    copied: int = 0
+    # Imported by reference to the shared store
+    referenced: int = 0
+    # Already in the project
+    skipped: int = 0
+    # Not in the source project's storage
+    missing: int = 0
+    failed: int = 0
+    bytes_copied: int = 0
+    error: str | None = None
+
+
+@router.post("/projects/{owner_name}/{project_name}/dvc/imports")
+def post_project_dvc_import(
+    *,
+    owner_name: str,
+    project_name: str,
+    req: DvcImportPost,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcImport:
+    """Import objects from another project's storage, e.g., for a dataset
+    imported from it.
+
+    Objects are copied within object storage, in the background, so the
+    client needn't pull and push them. Directories' .dir manifests are
+    expanded into the files they list, and objects the project already has
+    are skipped. The import fails without copying anything if it would
+    exceed the owner's storage limit. Poll the import for its progress.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    src_owner_name, src_project_name = req.project.lower().split("/")
+    app.projects.get_project(
+        session=session,
+        owner_name=src_owner_name,
+        project_name=src_project_name,
+        current_user=current_user,
+        min_access_level="read",
+    )
+    storage_limit_gb = _get_storage_limit_gb(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+    )
+    _check_storage_limit(
+        owner_name, storage_limit_gb, get_object_fs(), current_user
+    )
+    dvc_import = dvc_imports.start_import(
+        owner_name,
+        project_name,
+        src_owner_name,
+        src_project_name,
+        req.md5s,
+        storage_limit_gb,
+    )
+    return DvcImport.model_validate(dvc_import, from_attributes=True)
+
+
+@router.get("/projects/{owner_name}/{project_name}/dvc/imports/{import_id}")
+def get_project_dvc_import(
+    *,
+    owner_name: str,
+    project_name: str,
+    import_id: str,
+    session: SessionDep,
+    current_user: CurrentUserDvcScope,
+) -> DvcImport:
+    """Get an import's progress."""
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    app.projects.get_project(
+        session=session,
+        owner_name=owner_name,
+        project_name=project_name,
+        current_user=current_user,
+        min_access_level="write",
+    )
+    dvc_import = dvc_imports.get_import(owner_name, project_name, import_id)
+    if dvc_import is None:
+        raise HTTPException(404, "Import not found")
+    return DvcImport.model_validate(dvc_import, from_attributes=True)
@@ -144,6 +144,82 @@ def _strip_data_prefix(path: str, data_prefix: str) -> str:
     return path
 
 
+def make_put_access(
+    fs,
+    backend: str,
+    full_path: str,
+    content_length: int | None,
+    content_type: str | None = None,
+) -> PresignedUrlAccess | PresignedMultipartAccess | PresignedChunkedAccess:
+    """Get presigned access for uploading an object straight to storage,
+    using a multipart (S3) or resumable (GCS) upload for large objects."""
+    # Determine if we need chunked upload for large puts
+    chunked = storage.upload_should_be_chunked(content_length)
+    if chunked:
+        # At this point, content_length is guaranteed to be not None
+        assert content_length is not None
+        try:
+            upload_info = storage.get_multipart_upload_info(
+                fs=fs,
+                fpath=full_path,
+                upload_size_bytes=content_length,
+                expires=900,
+                content_type=content_type,
+            )
+        except Exception:
+            logger.exception(
+                f"Failed to get multipart upload info for {full_path}"
+            )
+            raise HTTPException(500, "Failed to determine upload method")
+        if backend == "s3":
+            access = PresignedMultipartAccess(
+                bucket=upload_info["bucket"],
+                key=upload_info["key"],
+                upload_id=upload_info["upload_id"],
+                part_urls=upload_info["part_urls"],
+                complete_url=upload_info["complete_url"],
+                abort_url=upload_info["abort_url"],
+                part_size_bytes=upload_info["part_size_bytes"],
+                estimated_part_count=len(upload_info["part_urls"]),
+                upload_size_bytes=content_length,
+                content_type=content_type,
+            )
+        elif backend == "gcs":
+            access = PresignedChunkedAccess(
+                init_url=upload_info["init_url"],
+                http_method=upload_info["http_method"],
+                chunk_size_bytes=upload_info["chunk_size_bytes"],
+                estimated_chunk_count=upload_info["estimated_chunk_count"],
+                upload_size_bytes=content_length,
+                content_type=content_type,
+                headers={"x-goog-resumable": "start"},
+            )
+        else:
+            raise HTTPException(
+                500, f"Chunked upload not supported for {backend}"
+            )
+    # Regular presigned PUT URL for smaller files
+    else:
+        put_headers = None
+        try:
+            url = get_object_url(
+                fpath=full_path,
+                fname=None,
+                expires=900,
+                fs=fs,
+                method="put",
+            )
+        except RuntimeError:
+            logger.exception(f"Failed to get presigned URL for {full_path}")
+            raise HTTPException(500, "Failed to get presigned URL")
+        access = PresignedUrlAccess(
+            url=url,
+            http_method="PUT",
+            headers=put_headers,
+        )
+    return access
+
+
 @router.post("/projects/{owner_name}/{project_name}/fs/ops")
 def post_project_fs_op(
     owner_name: str,
@@ -313,69 +389,23 @@ def post_project_fs_op(
         )
     # We are doing a PUT if we've made it this far
     assert operation == "put"
-    # Determine if we need chunked upload for large puts
-    chunked = storage.upload_should_be_chunked(content_length)
-    if chunked:
-        # At this point, content_length is guaranteed to be not None
-        assert content_length is not None
-        try:
-            upload_info = storage.get_multipart_upload_info(
-                fs=fs,
-                fpath=full_path,
-                upload_size_bytes=content_length,
-                expires=900,
-                content_type=content_type,
-            )
-        except Exception:
-            logger.exception(
-                f"Failed to get multipart upload info for {full_path}"
-            )
-            raise HTTPException(500, "Failed to determine upload method")
-        if backend == "s3":
-            access = PresignedMultipartAccess(
-                bucket=upload_info["bucket"],
-                key=upload_info["key"],
-                upload_id=upload_info["upload_id"],
-                part_urls=upload_info["part_urls"],
-                complete_url=upload_info["complete_url"],
-                abort_url=upload_info["abort_url"],
-                part_size_bytes=upload_info["part_size_bytes"],
-                estimated_part_count=len(upload_info["part_urls"]),
-                upload_size_bytes=content_length,
-                content_type=content_type,
-            )
-        elif backend == "gcs":
-            access = PresignedChunkedAccess(
-                init_url=upload_info["init_url"],
-                http_method=upload_info["http_method"],
-                chunk_size_bytes=upload_info["chunk_size_bytes"],
-                estimated_chunk_count=upload_info["estimated_chunk_count"],
-                upload_size_bytes=content_length,
-                content_type=content_type,
-                headers={"x-goog-resumable": "start"},
-            )
-        else:
-            raise HTTPException(
-                500, f"Chunked upload not supported for {backend}"
-            )
-    # Regular presigned PUT URL for smaller files
-    else:
-        put_headers = None
+    access = make_put_access(
+        fs=fs,
+        backend=backend,
+        full_path=full_path,
+        content_length=content_length,
+        content_type=content_type,
+    )
+    if content_length is not None:
+        # The upload bypasses the API, so it's charged when issued rather
+        # than waiting for the next reconciliation, which corrects it if it
+        # never happens
         try:
-            url = get_object_url(
-                fpath=full_path,
-                fname=None,
-                expires=900,
-                fs=fs,
-                method="put",
-            )
-        except RuntimeError:
-            logger.exception(f"Failed to get presigned URL for {full_path}")
-            raise HTTPException(500, "Failed to get presigned URL")
-        access = PresignedUrlAccess(
-            url=url,
-            http_method="PUT",
-            headers=put_headers,
+            previous_size = int(fs.size(full_path) or 0)
+        except FileNotFoundError:
+            previous_size = 0
+        storage.record_storage_usage(
+            owner_name, project_name, content_length - previous_size
         )
     if current_user is not None:
         mixpanel.user_performed_fs_op(
@@ -38,6 +38,7 @@ from app import messaging, mixpanel, users
 from app.api.deps import CurrentUser, CurrentUserOptional, SessionDep
 from app.config import settings
 from app.core import ryaml, utcnow
+from app.documents import read_document
 from app.git import get_repo, get_repo_tree_for_ref, resolve_commit_sha
 from app.models import (
     ContentsItem,
@@ -126,15 +127,11 @@ def _get_pipeline_output_staleness(
         return result
     try:
         tree = get_repo_tree_for_ref(repo, git_rev)
-        dvc_lock: dict[str, Any] = {}
-        if tree.is_file("dvc.lock"):
-            dvc_lock = ryaml.load(tree.read_bytes("dvc.lock").decode()) or {}
+        dvc_lock: dict[str, Any] = read_document(tree, "dvc.lock", {})
         stage = find_stage_for_path(path, dvc_lock)
         if stage is None:
             return result
-        dvc_yaml: dict[str, Any] = {}
-        if tree.is_file("dvc.yaml"):
-            dvc_yaml = ryaml.load(tree.read_bytes("dvc.yaml").decode()) or {}
+        dvc_yaml: dict[str, Any] = read_document(tree, "dvc.yaml", {})
         statuses = compute_stage_statuses(
             dvc_yaml=dvc_yaml,
             dvc_lock=dvc_lock,
@@ -362,7 +359,7 @@ def _store_internal_release_copy(
     ).dvc_lock_outs
     dvc_out = dvc_lock_outs.get(path)
     if dvc_out is None and tree.is_file(path + ".dvc"):
-        dvc_out = ryaml.load(tree.read_text(path + ".dvc"))["outs"][0]
+        dvc_out = read_document(tree, path + ".dvc")["outs"][0]
     # Only single files are stored in the cloud; directories (incl. whole
     # project) are zipped, which is a CLI feature for now.
     if dvc_out is not None and str(dvc_out.get("md5", "")).endswith(".dir"):
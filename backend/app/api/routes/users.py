@@ -47,7 +47,7 @@ from app.security import (
     get_password_hash,
     verify_password,
 )
-from app.storage import get_storage_usage
+from app.storage import get_storage_usage_by_project
 from app.subscriptions import PLAN_IDS, get_monthly_price
 from app.zenodo import AUTH_URL as ZENODO_AUTH_URL
 
@@ -778,8 +778,16 @@ def get_user_storage(
     session: SessionDep,
     current_user: CurrentUser,
 ) -> StorageUsage:
-    used = get_storage_usage(owner_name=current_user.account.name)
+    by_project = get_storage_usage_by_project(
+        owner_name=current_user.account.name
+    )
     if current_user.subscription is None:
         raise HTTPException(404, "User does not have a subscription")
     limit = current_user.subscription.storage_limit
-    return StorageUsage(limit_gb=limit, used_gb=used)
+    return StorageUsage(
+        limit_gb=limit,
+        used_gb=sum(by_project.values()) / 1e9,
+        by_project_gb={
+            name: size / 1e9 for name, size in by_project.items() if name
+        },
+    )
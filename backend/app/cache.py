@@ -0,0 +1,442 @@
+"""Cache tier shared by all API and DVC workers.
+
+Data derived from project content (expanded DVC lock outs, stage statuses,
+file histories, etc.) is expensive to compute and identical for every
+worker, so rather than each process building and holding its own copy,
+caches go through a ``Namespace`` here, which stores values in a backend
+chosen by ``settings.SHARED_CACHE_URL``:
+
+- ``memory://``: a dict in this process (the default, and what tests use),
+  which shares nothing between workers, so deployments with more than one
+  should use one of the others
+- ``sqlite:///path/to/cache.db``: a database file on local disk, shared by
+  every worker on the host
+- ``redis://host:port/db``: a Redis-protocol server (Redis, Valkey, etc.),
+  shared across hosts; needs the ``redis`` package
+
+Keys are hashed into ``calkit:{namespace}:{version}:{digest}``, so callers
+should build them from content hashes (blob, tree or commit SHAs) wherever
+possible, which makes entries valid for every worker and clone. Values are
+pickled, compressed when large, and signed with an HMAC keyed by
+``settings.SHARED_CACHE_SECRET`` (``SECRET_KEY`` if unset), so anything
+else able to write to the backend can't get a worker to unpickle its data.
+Don't store secrets here: entries are signed, not encrypted. Each namespace
+also keeps recently used values deserialized in-process, for as long as
+``local_ttl`` allows.
+
+``check_backend`` builds the backend at startup, so a misconfigured
+``SHARED_CACHE_URL`` fails there rather than as cache misses.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
+from urllib.parse import urlparse
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "calkit"
+# Values over this many bytes are compressed
+COMPRESS_MIN_BYTES = 1024
+# Max entries per namespace held by the memory and SQLite backends, so a
+# busy namespace can't evict the others
+MAX_ENTRIES = 10_000
+
+_PICKLED = b"p"
+_COMPRESSED = b"z"
+# Length of the signature prefixed to each value
+SIGNATURE_BYTES = hashlib.sha256().digest_size
+
+
+def get_key_namespace(key: str) -> str:
+    """Get the ``calkit:{namespace}:{version}:`` prefix of a backend key,
+    which backends bound separately."""
+    return key[: key.rfind(":") + 1]
+
+
+def _sign(data: bytes) -> bytes:
+    secret = settings.SHARED_CACHE_SECRET or settings.SECRET_KEY
+    return hmac.new(secret.encode(), data, hashlib.sha256).digest()
+
+
+def dumps(value: Any) -> bytes:
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) >= COMPRESS_MIN_BYTES:
+        data = _COMPRESSED + zlib.compress(data, 1)
+    else:
+        data = _PICKLED + data
+    return _sign(data) + data
+
+
+def loads(data: bytes) -> Any:
+    signature, data = data[:SIGNATURE_BYTES], data[SIGNATURE_BYTES:]
+    if not hmac.compare_digest(signature, _sign(data)):
+        raise ValueError("Invalid signature")
+    if data[:1] == _COMPRESSED:
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class Backend(ABC):
+    """Byte store for cache entries."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None) -> None: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str) -> None: ...
+
+    def ping(self) -> None:
+        """Raise if the backend isn't reachable."""
+
+
+class MemoryBackend(Backend):
+    """Entries in a dict per namespace in this process, evicting each
+    namespace's least recently used."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._data: dict[
+            str, OrderedDict[str, tuple[float | None, bytes]]
+        ] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entries = self._data.get(get_key_namespace(key))
+            entry = entries.get(key) if entries is not None else None
+            if entries is None or entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float | None) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            entries = self._data.setdefault(
+                get_key_namespace(key), OrderedDict()
+            )
+            entries[key] = (expires_at, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entries = self._data.get(get_key_namespace(key))
+            if entries is not None:
+                entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for entries in self._data.values():
+                for key in [k for k in entries if k.startswith(prefix)]:
+                    del entries[key]
+
+
+class SqliteBackend(Backend):
+    """Entries in a SQLite database on local disk.
+
+    Every worker on the host opens the same file. WAL mode lets readers
+    proceed while another process writes. Each namespace written to is
+    pruned to ``max_entries`` separately.
+    """
+
+    # Prune expired and excess entries after this many writes
+    PRUNE_EVERY = 500
+
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        # Namespaces written to since the last prune
+        self._written: set[str] = set()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "expires_at REAL, stored_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections can't be shared across threads or forks
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and time.time() >= expires_at:
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float | None) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+        self._written.add(get_key_namespace(key))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+
+    def ping(self) -> None:
+        self._connect().execute("SELECT 1 FROM cache LIMIT 1")
+
+    def prune(self) -> None:
+        """Delete expired entries, then the oldest beyond the max in each
+        namespace written to since the last prune."""
+        namespaces, self._written = self._written, set()
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM cache WHERE expires_at < ?", (time.time(),)
+            )
+            for namespace in namespaces:
+                # A key range rather than a LIKE, so it uses the index
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    "WHERE key >= ? AND key < ? "
+                    "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (
+                        namespace,
+                        namespace[:-1] + chr(ord(namespace[-1]) + 1),
+                        self.max_entries,
+                    ),
+                )
+
+
+class RedisBackend(Backend):
+    """Entries on a Redis-protocol server, which handles expiry and
+    eviction (configure it with a ``maxmemory`` policy)."""
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    def ping(self) -> None:
+        self._redis.ping()
+
+    def get(self, key: str) -> bytes | None:
+        return self._redis.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float | None) -> None:
+        px = max(int(ttl * 1000), 1) if ttl is not None else None
+        self._redis.set(key, value, px=px)
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        keys = list(self._redis.scan_iter(match=f"{prefix}*", count=1000))
+        for start in range(0, len(keys), 1000):
+            self._redis.delete(*keys[start : start + 1000])
+
+
+def make_backend(url: str) -> Backend:
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        return SqliteBackend(parsed.path)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+_backend: Backend | None = None
+_backend_pid: int | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Backend:
+    """Return this process's backend, creating it on first use (and again
+    after a fork, since clients can't be shared across processes)."""
+    global _backend, _backend_pid
+    with _backend_lock:
+        if _backend is None or _backend_pid != os.getpid():
+            _backend = make_backend(settings.SHARED_CACHE_URL)
+            _backend_pid = os.getpid()
+        return _backend
+
+
+def check_backend() -> None:
+    """Build this process's backend and make sure it's reachable, raising if
+    not."""
+    backend = get_backend()
+    backend.ping()
+    if isinstance(backend, MemoryBackend):
+        if settings.ENVIRONMENT != "local":
+            logger.warning(
+                "SHARED_CACHE_URL is memory://, so caches aren't shared "
+                "between workers"
+            )
+    elif not (
+        settings.SHARED_CACHE_SECRET
+        or "SECRET_KEY" in settings.model_fields_set
+    ):
+        # The default SECRET_KEY is random per process, so no worker could
+        # read another's entries
+        raise ValueError(
+            "Set SHARED_CACHE_SECRET or SECRET_KEY to share caches between "
+            "workers"
+        )
+
+
+def set_backend(backend: Backend | None) -> None:
+    """Replace the backend, e.g., with a fresh ``MemoryBackend`` in tests."""
+    global _backend, _backend_pid
+    with _backend_lock:
+        _backend = backend
+        _backend_pid = os.getpid() if backend is not None else None
+
+
+class Namespace:
+    """A named group of cache entries.
+
+    ``ttl`` is how long entries live in the shared backend, and
+    ``local_ttl`` how long a value read from it is reused in this process
+    without checking the backend again. Leave ``local_ttl`` at 0 for
+    entries that get invalidated, since other workers can't clear copies
+    held in this process. Bump ``version`` when the value format changes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float | None = None,
+        local_ttl: float = 0,
+        local_max: int = 64,
+        version: int = 1,
+    ) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_max = local_max
+        self.prefix = f"{KEY_PREFIX}:{name}:{version}:"
+        self._local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, key: Any) -> str:
+        """Hash a key, e.g., a SHA or a tuple of them, into a backend key."""
+        if not isinstance(key, str):
+            key = repr(key)
+        return self.prefix + hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        full_key = self.make_key(key)
+        if self.local_ttl > 0:
+            with self._lock:
+                entry = self._local.get(full_key)
+                if entry is not None:
+                    if time.monotonic() < entry[0]:
+                        self._local.move_to_end(full_key)
+                        return entry[1]
+                    del self._local[full_key]
+        try:
+            data = get_backend().get(full_key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {self.name}: {e}")
+            return default
+        if data is None:
+            return default
+        try:
+            value = loads(data)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable {self.name} entry: {e}")
+            return default
+        self._put_local(full_key, value)
+        return value
+
+    def set(self, key: Any, value: Any, ttl: float | None = None) -> None:
+        full_key = self.make_key(key)
+        ttl = ttl if ttl is not None else self.ttl
+        self._put_local(full_key, value, ttl)
+        try:
+            get_backend().set(full_key, dumps(value), ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {self.name}: {e}")
+
+    def delete(self, key: Any) -> None:
+        full_key = self.make_key(key)
+        with self._lock:
+            self._local.pop(full_key, None)
+        try:
+            get_backend().delete(full_key)
+        except Exception as e:
+            logger.warning(f"Shared cache delete failed for {self.name}: {e}")
+
+    def clear(self) -> None:
+        """Delete every entry in this namespace."""
+        with self._lock:
+            self._local.clear()
+        try:
+            get_backend().delete_prefix(self.prefix)
+        except Exception as e:
+            logger.warning(f"Shared cache clear failed for {self.name}: {e}")
+
+    def _put_local(
+        self, full_key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        local_ttl = min(self.local_ttl, ttl) if ttl else self.local_ttl
+        if local_ttl <= 0:
+            return
+        with self._lock:
+            self._local[full_key] = (time.monotonic() + local_ttl, value)
+            self._local.move_to_end(full_key)
+            while len(self._local) > self.local_max:
+                self._local.popitem(last=False)
@@ -0,0 +1,275 @@
+"""Long-lived ``git cat-file`` workers for reading objects from repos.
+
+Spawning ``git cat-file`` per call, or walking trees through GitPython
+objects, costs a process or a pile of Python objects per read. Instead,
+each repo gets a small pool of persistent ``git cat-file --batch`` (content)
+and ``--batch-check`` (type and size) processes. Requests are pipelined:
+all object names in a call are written before the responses are read, so
+reading every ``.dvc`` pointer in a directory is one round trip per object
+on an already-running process.
+
+Workers that sit idle are closed after ``IDLE_TIMEOUT`` seconds, and a
+worker that dies mid-request is restarted and the request retried once.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Literal
+
+logger = logging.getLogger(__name__)
+
+Mode = Literal["batch", "batch-check"]
+
+# Close workers unused for this long
+IDLE_TIMEOUT = 60
+# Max concurrent workers per repo and mode
+MAX_WORKERS_PER_REPO = 2
+# Max workers overall; the least recently used idle ones are closed first
+MAX_WORKERS = 64
+# Write object names in chunks of at most this many bytes, then read their
+# responses, so neither side can block forever on a full pipe
+_CHUNK_BYTES = 16 * 1024
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    oid: str
+    type: str  # "blob", "tree", "commit" or "tag"
+    size: int
+
+
+class CatFileError(Exception):
+    pass
+
+
+class _Worker:
+    """One ``git cat-file`` process; callers must hold ``lock``."""
+
+    def __init__(self, git_dir: str, mode: Mode, env: dict[str, str]):
+        self.git_dir = git_dir
+        self.mode = mode
+        self.env = env
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._proc: subprocess.Popen | None = None
+
+    def _start(self) -> subprocess.Popen:
+        self._proc = subprocess.Popen(
+            ["git", "cat-file", f"--{self.mode}"],
+            cwd=self.git_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, **self.env},
+        )
+        return self._proc
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            assert proc.stdin is not None
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+            proc.wait()
+
+    def request(
+        self, names: list[str]
+    ) -> list[tuple[ObjectInfo, bytes | None] | None]:
+        try:
+            return self._request(names)
+        except (OSError, ValueError, CatFileError) as e:
+            # The process died or got out of sync; start over once
+            logger.warning(
+                f"git cat-file --{self.mode} in {self.git_dir} failed "
+                f"({e}); restarting"
+            )
+            self.close()
+            return self._request(names)
+
+    def _request(
+        self, names: list[str]
+    ) -> list[tuple[ObjectInfo, bytes | None] | None]:
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            proc = self._start()
+        assert proc.stdin is not None and proc.stdout is not None
+        self.last_used = time.monotonic()
+        results: list[tuple[ObjectInfo, bytes | None] | None] = []
+        start = 0
+        while start < len(names):
+            # Pipeline a chunk of names, then collect its responses
+            end, nbytes = start, 0
+            while end < len(names) and (
+                end == start or nbytes + len(names[end]) < _CHUNK_BYTES
+            ):
+                nbytes += len(names[end]) + 1
+                end += 1
+            proc.stdin.write(
+                "".join(n + "\n" for n in names[start:end]).encode()
+            )
+            proc.stdin.flush()
+            for name in names[start:end]:
+                results.append(self._read_response(proc, name))
+            start = end
+        self.last_used = time.monotonic()
+        return results
+
+    def _read_response(
+        self, proc: subprocess.Popen, name: str
+    ) -> tuple[ObjectInfo, bytes | None] | None:
+        assert proc.stdout is not None
+        header = proc.stdout.readline()
+        if not header:
+            raise CatFileError("unexpected end of output")
+        line = header.decode("utf-8", errors="replace").rstrip("\n")
+        # "<name> missing" or "<name> ambiguous"; the name may have spaces
+        if line == f"{name} missing" or line == f"{name} ambiguous":
+            return None
+        parts = line.split(" ")
+        if len(parts) != 3:
+            raise CatFileError(f"unexpected header {line!r}")
+        try:
+            info = ObjectInfo(oid=parts[0], type=parts[1], size=int(parts[2]))
+        except ValueError:
+            raise CatFileError(f"unexpected header {line!r}")
+        if self.mode == "batch-check":
+            return info, None
+        content = proc.stdout.read(info.size + 1)
+        if len(content) != info.size + 1:
+            raise CatFileError("truncated object content")
+        return info, content[:-1]
+
+
+class CatFilePool:
+    """Persistent ``git cat-file`` workers, keyed by repo, mode and env."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._workers: OrderedDict[tuple, list[_Worker]] = OrderedDict()
+        self._reaper: threading.Thread | None = None
+
+    def request(
+        self,
+        git_dir: str,
+        names: list[str],
+        mode: Mode = "batch",
+        env: dict[str, str] | None = None,
+    ) -> list[tuple[ObjectInfo, bytes | None] | None]:
+        """Look up ``names`` (anything ``git rev-parse`` accepts, e.g.
+        ``<rev>:<path>`` or an object ID) in one pipelined round trip.
+
+        Returns, in order, ``(info, content)`` for each name, or None if it
+        doesn't exist. ``content`` is None in ``batch-check`` mode.
+        """
+        if not names:
+            return []
+        if any("\n" in name for name in names):
+            raise ValueError("Object names can't contain newlines")
+        worker = self._acquire(git_dir, mode, env or {})
+        try:
+            return worker.request(names)
+        finally:
+            worker.lock.release()
+
+    def read(
+        self, git_dir: str, name: str, env: dict[str, str] | None = None
+    ) -> tuple[ObjectInfo, bytes] | None:
+        """Read a single object's info and content."""
+        result = self.request(git_dir, [name], env=env)[0]
+        if result is None:
+            return None
+        info, content = result
+        assert content is not None
+        return info, content
+
+    def close(self, git_dir: str | None = None) -> None:
+        """Close all idle workers, or just those for ``git_dir``."""
+        with self._lock:
+            for key in list(self._workers):
+                if git_dir is not None and key[0] != git_dir:
+                    continue
+                self._close_idle(key, max_idle=0)
+
+    def _acquire(
+        self, git_dir: str, mode: Mode, env: dict[str, str]
+    ) -> _Worker:
+        key = (git_dir, mode, tuple(sorted(env.items())))
+        while True:
+            with self._lock:
+                workers = self._workers.setdefault(key, [])
+                self._workers.move_to_end(key)
+                for worker in workers:
+                    if worker.lock.acquire(blocking=False):
+                        return worker
+                if len(workers) < MAX_WORKERS_PER_REPO:
+                    worker = _Worker(git_dir, mode, env)
+                    worker.lock.acquire()
+                    workers.append(worker)
+                    self._enforce_limit()
+                    self._start_reaper()
+                    return worker
+                # All busy; queue behind the one used least recently
+                worker = min(workers, key=lambda w: w.last_used)
+            worker.lock.acquire()
+            with self._lock:
+                # It may have been closed and dropped from the pool while
+                # we waited, in which case using it would start a process
+                # nothing reaps
+                if worker in self._workers.get(key, []):
+                    return worker
+            worker.lock.release()
+
+    def _close_idle(self, key: tuple, max_idle: float) -> None:
+        """Close a key's workers idle for over ``max_idle`` seconds. Must be
+        called with ``_lock`` held."""
+        now = time.monotonic()
+        keep = []
+        for worker in self._workers.get(key, []):
+            if now - worker.last_used >= max_idle and worker.lock.acquire(
+                blocking=False
+            ):
+                worker.close()
+                worker.lock.release()
+            else:
+                keep.append(worker)
+        if keep:
+            self._workers[key] = keep
+        else:
+            self._workers.pop(key, None)
+
+    def _enforce_limit(self) -> None:
+        n_workers = sum(len(ws) for ws in self._workers.values())
+        for key in list(self._workers):
+            if n_workers <= MAX_WORKERS:
+                break
+            before = len(self._workers[key])
+            self._close_idle(key, max_idle=0)
+            n_workers -= before - len(self._workers.get(key, []))
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None:
+            self._reaper = threading.Thread(
+                target=self._reap_forever, name="cat-file-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap_forever(self) -> None:
+        while True:
+            time.sleep(IDLE_TIMEOUT / 2)
+            with self._lock:
+                for key in list(self._workers):
+                    self._close_idle(key, max_idle=IDLE_TIMEOUT)
+
+
+pool = CatFilePool()
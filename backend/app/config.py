@@ -122,6 +122,35 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER_PASSWORD: str
     FIRST_SUPERUSER_GITHUB_USERNAME: str
 
+    # Disk budget for cached Git clones and mirrors. Once exceeded, the least
+    # recently used ones are evicted. Set to 0 to disable eviction.
+    REPO_CACHE_MAX_GB: float = 20
+    # Disk budget for small, immutable DVC objects (e.g., .dir manifests)
+    # cached on each node. See app.object_cache.
+    DVC_OBJECT_CACHE_MAX_MB: float = 1024
+    # Answer DVC remote downloads with a redirect to a short-lived presigned
+    # URL, so bytes go straight from object storage to the client instead of
+    # through API workers. Clients that don't follow redirects can pass
+    # ?redirect=false to have the file proxied.
+    DVC_DOWNLOAD_REDIRECT: bool = False
+    # Store objects pushed to the DVC remote once, in a content-addressed
+    # store shared by all projects, with each project holding a reference.
+    # Objects already stored elsewhere stay where they are. See
+    # app.shared_objects.
+    DVC_SHARED_OBJECTS: bool = False
+    # Clone project mirrors without file contents (--filter=blob:none), so
+    # git fetches blobs on demand as they're read. Cuts cold-start time and
+    # disk use for repos with large committed data histories. Only applies
+    # to mirrors created after it's turned on.
+    GIT_PARTIAL_CLONE: bool = False
+    # Where caches of project-derived data are shared between workers:
+    # memory:// (per process), sqlite:///path/to/cache.db (per host), or a
+    # redis:// URL (across hosts). See app.cache.
+    SHARED_CACHE_URL: str = "memory://"
+    # Key for signing shared cache entries, which must be the same for every
+    # worker sharing them; defaults to SECRET_KEY
+    SHARED_CACHE_SECRET: str | None = None
+
     # GitHub
     GH_CLIENT_ID: str
     GH_CLIENT_SECRET: str
@@ -130,6 +159,10 @@ class Settings(BaseSettings):
     # as a GitHub Actions secret. Optional: without it, GitHub-less users can
     # only read public projects.
     GH_APP_PRIVATE_KEY: str | None = None
+    # Secret for verifying GitHub push webhook signatures. Optional: without
+    # it, the webhook endpoint is disabled and cached clones fall back to
+    # TTL-based polling of the remote.
+    GH_WEBHOOK_SECRET: str | None = None
     # Stripe
     STRIPE_SECRET_KEY: str
     STRIPE_PUBLISHABLE_KEY: str
@@ -0,0 +1,150 @@
+"""Parse-once cache for YAML and JSON documents read from repos.
+
+Files like ``dvc.lock``, ``dvc.yaml``, ``calkit.yaml`` and ``params.yaml``
+are read by most project endpoints, often several times per request, and
+parsing a large lockfile costs far more than reading it. Parsed documents
+are cached here keyed by the file's Git blob SHA, so each revision of a
+file is parsed once per process no matter which route, ref or clone it's
+read through.
+
+Documents are parsed with libyaml's C loader and returned as immutable
+views, since the same object is shared by every caller. Callers that need
+to modify one should take a ``copy.deepcopy``, which returns plain dicts
+and lists. Code that writes a document back (preserving comments and
+quoting) should keep using the round-trip loader ``app.core.ryaml``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Literal
+
+import yaml
+
+if TYPE_CHECKING:
+    from app.git import RepoTree
+
+Format = Literal["yaml", "json"]
+
+# Max parsed documents held in memory per process
+CACHE_MAX = 256
+
+_cache: OrderedDict[tuple[str, str], Any] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is immutable; copy it first")
+
+
+class FrozenDict(dict):
+    """A ``dict`` that can't be modified in place."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self) -> dict:
+        return dict(self)
+
+    def __deepcopy__(self, memo: dict) -> dict:
+        return thaw(self)
+
+    def __reduce__(self):
+        # Stay frozen through the shared cache (see app.cache)
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """A ``list`` that can't be modified in place."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = _immutable
+    reverse = sort = _immutable
+
+    def __copy__(self) -> list:
+        return list(self)
+
+    def __deepcopy__(self, memo: dict) -> list:
+        return thaw(self)
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(obj: Any) -> Any:
+    """Return an immutable copy of parsed YAML or JSON data."""
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj: Any) -> Any:
+    """Return a mutable copy of data returned by ``freeze``."""
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+def load_yaml(data: bytes | str) -> Any:
+    """Parse YAML with libyaml's C loader.
+
+    It's ~10x faster than the pure-Python loaders on large lockfiles. The
+    Dockerfile asserts ``yaml.__with_libyaml__``, so it's always present
+    where we deploy.
+    """
+    return yaml.load(data, Loader=yaml.CSafeLoader)
+
+
+def get_blob_sha(data: bytes) -> str:
+    """Return the SHA Git would give ``data`` as a blob."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def parse_blob(
+    blob_sha: str, read_bytes: Callable[[], bytes], fmt: Format = "yaml"
+) -> Any:
+    """Return the parsed, immutable contents of a blob.
+
+    ``read_bytes`` is only called on a cache miss. Parse errors propagate
+    and aren't cached.
+    """
+    key = (fmt, blob_sha)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = read_bytes()
+    doc = freeze(load_yaml(data) if fmt == "yaml" else json.loads(data))
+    with _cache_lock:
+        _cache[key] = doc
+        while len(_cache) > CACHE_MAX:
+            _cache.popitem(last=False)
+    return doc
+
+
+def read_document(
+    tree: RepoTree, path: str, default: Any = None, fmt: Format = "yaml"
+) -> Any:
+    """Return the parsed, immutable contents of the file at ``path`` in
+    ``tree``, or ``default`` if it isn't a file or is empty.
+    """
+    if not tree.is_file(path):
+        return default
+    doc = parse_blob(
+        tree.get_blob_sha(path), lambda: tree.read_bytes(path), fmt=fmt
+    )
+    return default if doc is None else doc
+
+
+def clear() -> None:
+    with _cache_lock:
+        _cache.clear()
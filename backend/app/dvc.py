@@ -6,12 +6,13 @@ import json
 import logging
 import os
 import tempfile
-from functools import lru_cache
 
 import ruamel.yaml
 from dvc.commands import dag
 from dvc.repo import Repo
 
+from app import cache, object_cache, object_index
+from app.documents import thaw
 from app.storage import get_object_fs, make_data_fpath
 
 logging.basicConfig(level=logging.INFO)
@@ -20,18 +21,48 @@ logger = logging.getLogger(__name__)
 yaml = ruamel.yaml.YAML()
 
 
-@lru_cache(maxsize=512)
-def _read_dvc_dir_cached(dvc_dir_path: str) -> list[dict] | None:
+# Parsed DVC .dir manifests, keyed by object path. The path includes the
+# md5, so contents never change, but a missing one may be uploaded later, so
+# misses are only remembered briefly. Raw manifests are also kept on local
+# disk (see app.object_cache), so a cold process doesn't refetch them.
+_DVC_DIR_CACHE = cache.Namespace(
+    "dvc-dir", ttl=7 * 24 * 3600, local_ttl=3600, local_max=512
+)
+_DVC_DIR_MISS_TTL = 60
+
+
+def _read_dvc_dir_cached(
+    dvc_dir_path: str, md5: str | None = None, fs=None
+) -> list[dict] | None:
     """Cache DVC .dir file contents by path.
 
-    Returns None if file doesn't exist.
+    If ``md5`` is given, the raw file is also read from and saved to the
+    node's disk cache. Returns None if file doesn't exist.
     """
-    fs = get_object_fs()
-    try:
-        with fs.open(dvc_dir_path) as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+    cached = _DVC_DIR_CACHE.get(dvc_dir_path, default=False)
+    if cached is not False:
+        return cached
+    data = object_cache.get(md5) if md5 is not None else None
+    if data is None:
+        if fs is None:
+            fs = get_object_fs()
+        try:
+            with fs.open(dvc_dir_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            _DVC_DIR_CACHE.set(dvc_dir_path, None, ttl=_DVC_DIR_MISS_TTL)
+            return None
+        if md5 is not None:
+            object_cache.put(md5, data)
+    contents = json.loads(data)
+    _DVC_DIR_CACHE.set(dvc_dir_path, contents)
+    return contents
+
+
+def read_dvc_dir(fpath: str, md5: str, fs=None) -> list[dict] | None:
+    """Read the files listed in a DVC .dir manifest stored at ``fpath``,
+    or None if it doesn't exist."""
+    return _read_dvc_dir_cached(fpath, md5=md5, fs=fs)
 
 
 def make_mermaid_diagram(pipeline: dict, params: dict | None = None) -> str:
@@ -45,10 +76,11 @@ def make_mermaid_diagram(pipeline: dict, params: dict | None = None) -> str:
         with tempfile.TemporaryDirectory() as tmpdirname:
             os.chdir(tmpdirname)
             with open("dvc.yaml", "w") as f:
-                yaml.dump(pipeline, f)
+                # Parsed documents are frozen, which ruamel can't represent
+                yaml.dump(thaw(pipeline), f)
             if params is not None:
                 with open("params.yaml", "w") as f:
-                    yaml.dump(params, f)
+                    yaml.dump(thaw(params), f)
             with Repo.init(
                 ".",
                 no_scm=True,
@@ -84,8 +116,7 @@ def output_from_pipeline(
     for out in outs:
         outpath = os.path.join(wdir, out["path"])
         if os.path.abspath(outpath) == os.path.abspath(path):
-            out["path"] = path
-            return out
+            return out | dict(path=path)
     # If there's only one output, no need to check path if we don't have an
     # exact match
     if len(outs) == 1:
@@ -98,38 +129,47 @@ def get_data_fpath_for_md5(
     md5: str,
     fs=None,
 ) -> str | None:
-    """Return the first existing object-storage path for a DVC MD5.
+    """Return the object-storage path for a DVC MD5, or None if it's not in
+    storage.
 
-    Supports both the current `files/md5` layout and the legacy layout.
+    Supports both the current `files/md5` layout and the legacy layout. See
+    ``app.object_index``.
     """
     if not md5 or len(md5) < 3:
         return None
     if fs is None:
         fs = get_object_fs()
-    idx = md5[:2]
-    candidates = [
-        make_data_fpath(
-            owner_name=owner_name,
-            project_name=project_name,
-            idx=idx,
-            md5=md5[2:],
-            legacy=False,
-        ),
-        make_data_fpath(
-            owner_name=owner_name,
-            project_name=project_name,
-            idx=idx,
-            md5=md5[2:],
-            legacy=True,
-        ),
-    ]
-    for candidate in candidates:
-        try:
-            if fs.exists(candidate):
-                return candidate
-        except Exception as e:
-            logger.warning(f"Failed existence check for {candidate}: {e}")
-    return None
+    info = object_index.find_object(owner_name, project_name, md5, fs)
+    return info.path if info is not None else None
+
+
+def _get_object_sizes(
+    owner_name: str, project_name: str, md5s: set[str], fs
+) -> dict[str, int | None]:
+    """Return the size of each of a project's objects in storage, leaving
+    out those that aren't there.
+
+    Sizes come from the object index where it has them. The rest are read
+    from storage and saved to the index.
+    """
+    objects = object_index.find_objects(owner_name, project_name, md5s, fs)
+    sizes: dict[str, int | None] = {}
+    new_sizes = []
+    for md5, info in objects.items():
+        if info is None:
+            continue
+        size = info.size
+        if size is None:
+            try:
+                size = fs.size(info.path)
+            except Exception as e:
+                logger.warning(f"Failed to get size for {info.path}: {e}")
+            else:
+                new_sizes.append((md5, info.legacy, size))
+        sizes[md5] = size
+    if new_sizes:
+        object_index.record_objects(owner_name, project_name, new_sizes)
+    return sizes
 
 
 def find_dvc_files(start: str, max_depth=5) -> list[str]:
@@ -220,47 +260,74 @@ def expand_dvc_lock_outs(
         for md5 in dir_md5s
     }
 
-    def _try_read(path: str) -> list[dict] | None:
+    def _try_read(md5: str, path: str) -> list[dict] | None:
         try:
-            return _read_dvc_dir_cached(path)
+            return _read_dvc_dir_cached(path, md5=md5, fs=fs)
         except Exception as e:
             logger.warning(f"Failed to read {path}: {e}")
             return None
 
     md5_to_contents: dict[str, list[dict]] = {}
+    md5_to_path: dict[str, str] = {}
     if dir_md5s:
+        object_cache.start_prewarm(get_object_fs)
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            results = list(executor.map(_try_read, md5_to_candidate.values()))
+            results = list(
+                executor.map(
+                    _try_read,
+                    md5_to_candidate.keys(),
+                    md5_to_candidate.values(),
+                )
+            )
         for md5, contents in zip(md5_to_candidate.keys(), results):
             if contents is not None:
                 md5_to_contents[md5] = contents
+                md5_to_path[md5] = md5_to_candidate[md5]
         missing = [md5 for md5 in dir_md5s if md5 not in md5_to_contents]
         if missing:
+            # The rest are either in the legacy layout or referenced in the
+            # shared store (see app.shared_objects)
+            indexed = object_index.get_indexed_objects(
+                owner_name, project_name, missing
+            )
+            md5_to_fallback = {
+                md5: (
+                    indexed[md5].path
+                    if md5 in indexed and indexed[md5].shared
+                    else md5_to_legacy[md5]
+                )
+                for md5 in missing
+            }
             with concurrent.futures.ThreadPoolExecutor(
                 max_workers=10
             ) as executor:
-                legacy_results = list(
+                fallback_results = list(
                     executor.map(
-                        _try_read, (md5_to_legacy[md5] for md5 in missing)
+                        _try_read,
+                        missing,
+                        (md5_to_fallback[md5] for md5 in missing),
                     )
                 )
-            for md5, contents in zip(missing, legacy_results):
+            for md5, contents in zip(missing, fallback_results):
                 if contents is not None:
                     md5_to_contents[md5] = contents
+                    md5_to_path[md5] = md5_to_fallback[md5]
+        if md5_to_path:
+            object_cache.record_project_objects(
+                owner_name, project_name, md5_to_path
+            )
     dvc_md5_sizes: dict[str, int | None] = {}
-    md5_to_data_fpath: dict[str, str | None] = {}
-
-    def _resolve_data_fpath(md5: str) -> str | None:
-        if md5 in md5_to_data_fpath:
-            return md5_to_data_fpath[md5]
-        resolved = get_data_fpath_for_md5(
-            owner_name=owner_name,
-            project_name=project_name,
-            md5=md5,
-            fs=fs,
+    if get_sizes:
+        dvc_md5_sizes = _get_object_sizes(
+            owner_name,
+            project_name,
+            {
+                dvc_obj.get("md5")
+                for contents in md5_to_contents.values()
+                for dvc_obj in contents
+            },
+            fs,
         )
-        md5_to_data_fpath[md5] = resolved
-        return resolved
 
     for stage_name, stage in stages.items():
         for out in stage.get("outs", []):
@@ -271,7 +338,8 @@ def expand_dvc_lock_outs(
             if md5 and md5.endswith(".dir"):
                 if md5 in md5_to_contents:
                     dvc_dir_contents = md5_to_contents[md5]
-                    dvc_lock_outs[outpath] = out
+                    # Copy, since parsed lockfiles are shared and immutable
+                    dvc_lock_outs[outpath] = dict(out)
                     dvc_lock_outs[outpath]["dirname"] = os.path.dirname(
                         outpath
                     )
@@ -288,18 +356,9 @@ def expand_dvc_lock_outs(
                         fname = os.path.basename(relpath)
                         subdir = os.path.dirname(relpath)
                         md5 = dvc_obj.get("md5")
+                        # Skip files missing from storage
                         if get_sizes and md5 not in dvc_md5_sizes:
-                            fpath_i = _resolve_data_fpath(md5)
-                            if fpath_i is None:
-                                dvc_md5_sizes[md5] = None
-                                continue
-                            try:
-                                size = fs.size(fpath_i)
-                            except Exception as e:
-                                logger.warning(
-                                    f"Failed to get size for {fpath_i}: {e}"
-                                )
-                            dvc_md5_sizes[md5] = size
+                            continue
                         if subdir:
                             subdir_full_relpath = os.path.join(outpath, subdir)
                             if subdir_full_relpath not in dvc_lock_outs:
@@ -0,0 +1,448 @@
+"""Copies of DVC objects from one project's storage to another's.
+
+When a project imports a dataset from another project, the client would
+otherwise pull every object from the source and push it back up to the
+destination. Instead, ``start_import`` copies them within object storage
+(S3 copies, GCS rewrites), so the bytes never pass through the client or
+API workers. The MD5s to import are those of the dataset's outs, e.g., from
+``get_project_dataset``'s ``dvc_import``, and .dir manifests are expanded
+into the files they list.
+
+Imports are kept in the database (see ``DvcObjectImport``) and run in the
+background, at most ``IMPORT_MAX_RUNNING`` at a time and
+``IMPORT_MAX_WORKERS`` copies at a time per process, skipping objects the
+destination already has. Objects the source references in the shared store
+are imported by reference when ``settings.DVC_SHARED_OBJECTS`` is on (see
+``app.shared_objects``). An import is refused before anything is copied if
+it would take the owner over their storage limit.
+
+While a process has an import, it bumps the import's ``updated`` time every
+``IMPORT_HEARTBEAT_SECONDS``. Imports left running by a process that
+stopped are resumed when they're next read, or when another import starts,
+and skip the objects copied before, charging any the import copied but
+hadn't recorded yet.
+"""
+
+from __future__ import annotations
+
+import logging
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from sqlmodel import Session, col, select, update
+
+from app import object_index, shared_objects, utcnow
+from app.config import settings
+from app.db import engine
+from app.dvc import read_dvc_dir
+from app.models import DvcObjectImport
+from app.storage import (
+    get_object_fs,
+    get_storage_usage,
+    record_storage_usage,
+)
+
+logger = logging.getLogger(__name__)
+
+# Max imports run at once per process
+IMPORT_MAX_RUNNING = 2
+# Max concurrent copies per process, across all imports
+IMPORT_MAX_WORKERS = 16
+# How often a process bumps the imports it has
+IMPORT_HEARTBEAT_SECONDS = 60
+# Imports that haven't been bumped for this long are resumed
+IMPORT_STALE_SECONDS = 5 * 60
+# Progress is saved at most this often while copying
+PROGRESS_INTERVAL_SECONDS = 1
+
+_lock = threading.Lock()
+_import_executor: ThreadPoolExecutor | None = None
+_copy_executor: ThreadPoolExecutor | None = None
+_heartbeat: threading.Thread | None = None
+# IDs of the imports queued or running in this process
+_active: set[str] = set()
+
+
+def _get_copy_executor() -> ThreadPoolExecutor:
+    global _copy_executor
+    with _lock:
+        if _copy_executor is None:
+            _copy_executor = ThreadPoolExecutor(
+                max_workers=IMPORT_MAX_WORKERS,
+                thread_name_prefix="dvc-import-copy",
+            )
+        return _copy_executor
+
+
+def _update(import_id: str, **values) -> None:
+    with Session(engine) as session:
+        session.exec(  # type: ignore
+            update(DvcObjectImport)
+            .where(col(DvcObjectImport.id) == import_id)
+            .values(updated=utcnow(), **values)
+        )
+        session.commit()
+
+
+def get_import(
+    owner_name: str, project_name: str, import_id: str
+) -> DvcObjectImport | None:
+    """Get a project's import, resuming it if its worker stopped."""
+    with Session(engine) as session:
+        row = session.get(DvcObjectImport, import_id)
+    if (
+        row is None
+        or row.owner_name != owner_name.lower()
+        or row.project_name != project_name.lower()
+    ):
+        return None
+    if row.status == "running":
+        _resume(import_id)
+    return row
+
+
+def _find_source_objects(
+    owner_name: str, project_name: str, md5s: list[str], fs
+) -> dict[str, object_index.ObjectInfo | None]:
+    """Find a project's objects, along with the files listed in any .dir
+    manifests among them."""
+    found = object_index.find_objects(owner_name, project_name, md5s, fs)
+    children = set()
+    for md5, info in found.items():
+        if info is None or not md5.endswith(".dir"):
+            continue
+        for entry in read_dvc_dir(info.path, md5, fs=fs) or []:
+            child = entry.get("md5")
+            if child and child not in found:
+                children.add(child)
+    if children:
+        found |= object_index.find_objects(
+            owner_name, project_name, children, fs
+        )
+    return found
+
+
+def _record_copied(
+    owner_name: str, project_name: str, copied: list[tuple[str, int]]
+) -> None:
+    """Index copied objects and count the ones that weren't already stored
+    here toward usage, so a resumed import never charges twice."""
+    previous = object_index.get_indexed_objects(
+        owner_name, project_name, [md5 for md5, _ in copied]
+    )
+    delta = 0
+    for md5, size in copied:
+        info = previous.get(md5)
+        if info is None or info.legacy:
+            delta += size
+        else:
+            delta += size - (info.size or size)
+    object_index.record_objects(
+        owner_name, project_name, [(md5, False, size) for md5, size in copied]
+    )
+    record_storage_usage(owner_name, project_name, delta)
+
+
+@dataclass
+class _Progress:
+    total: int | None = None
+    copied: int = 0
+    referenced: int = 0
+    skipped: int = 0
+    missing: int = 0
+    failed: int = 0
+    bytes_copied: int = 0
+    error: str | None = None
+
+
+def run_import(import_id: str, fs=None) -> DvcObjectImport:
+    """Run an import, saving its progress as objects are copied, and return
+    it once it's finished."""
+    with Session(engine) as session:
+        row = session.get(DvcObjectImport, import_id)
+    if row is None:
+        raise ValueError(f"Unknown DVC import {import_id}")
+    owner_name = row.owner_name
+    project_name = row.project_name
+    # The total is saved before anything is copied
+    resumed = row.total is not None
+    if fs is None:
+        fs = get_object_fs()
+    # Counts start over when resuming, with objects copied before skipped
+    progress = _Progress()
+    try:
+        src = _find_source_objects(
+            row.src_owner_name, row.src_project_name, row.md5s, fs
+        )
+        progress.total = len(src)
+        progress.missing = sum(info is None for info in src.values())
+        src = {md5: info for md5, info in src.items() if info is not None}
+        indexed = object_index.get_indexed_objects(
+            owner_name, project_name, list(src)
+        )
+        existing = object_index.find_objects(
+            owner_name, project_name, list(src), fs
+        )
+        todo = {
+            md5: info
+            for md5, info in src.items()
+            if existing.get(md5) is None or existing[md5].legacy
+        }
+        # Objects the destination had were indexed when the import first
+        # looked for them, so ones only found now were copied by the import
+        # before it stopped, without being recorded
+        recovered = (
+            [
+                md5
+                for md5, info in existing.items()
+                if info is not None and not info.legacy and md5 not in indexed
+            ]
+            if resumed
+            else []
+        )
+        progress.skipped = len(src) - len(todo) - len(recovered)
+        executor = _get_copy_executor()
+        # Imported objects are charged whether copied or referenced
+        unknown = [md5 for md5 in [*todo, *recovered] if src[md5].size is None]
+        sizes = dict(
+            zip(
+                unknown,
+                executor.map(lambda md5: fs.size(src[md5].path), unknown),
+            )
+        )
+        needed_gb = (
+            sum(
+                info.size if info.size is not None else sizes[md5]
+                for md5, info in todo.items()
+            )
+            / 1e9
+        )
+        used_gb = get_storage_usage(owner_name, fs=fs)
+        if used_gb + needed_gb > row.storage_limit_gb:
+            logger.info(
+                f"Refusing DVC import {import_id}: {needed_gb} GB would "
+                f"exceed {owner_name}'s limit ({used_gb}/"
+                f"{row.storage_limit_gb} GB used)"
+            )
+            progress.error = "Storage limit exceeded"
+            _update(import_id, status="failed", **asdict(progress))
+            return _get(import_id)
+        if recovered:
+            # Indexed without a size when found, so charged in full here
+            recovered_sizes = [
+                (
+                    md5,
+                    src[md5].size if src[md5].size is not None else sizes[md5],
+                )
+                for md5 in recovered
+            ]
+            object_index.record_objects(
+                owner_name,
+                project_name,
+                [(md5, False, size) for md5, size in recovered_sizes],
+            )
+            record_storage_usage(
+                owner_name,
+                project_name,
+                sum(size for _, size in recovered_sizes),
+            )
+            progress.copied = len(recovered)
+            progress.bytes_copied = sum(size for _, size in recovered_sizes)
+        if settings.DVC_SHARED_OBJECTS:
+            referenced = shared_objects.import_objects(
+                owner_name,
+                project_name,
+                row.src_owner_name,
+                row.src_project_name,
+                [md5 for md5, info in todo.items() if info.shared],
+            )
+            for md5 in referenced:
+                del todo[md5]
+            progress.referenced = len(referenced)
+        _update(import_id, **asdict(progress))
+
+        def _copy(md5: str, info: object_index.ObjectInfo) -> int:
+            fpath = object_index.get_object_fpath(
+                owner_name, project_name, md5
+            )
+            fs.copy(info.path, fpath)
+            return info.size if info.size is not None else sizes[md5]
+
+        futures = {
+            executor.submit(_copy, md5, info): md5
+            for md5, info in todo.items()
+        }
+        copied: list[tuple[str, int]] = []
+        saved = time.monotonic()
+        for future in as_completed(futures):
+            md5 = futures[future]
+            try:
+                size = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to import DVC object {md5}: {e}")
+                progress.failed += 1
+            else:
+                copied.append((md5, size))
+                progress.copied += 1
+                progress.bytes_copied += size
+            if time.monotonic() - saved >= PROGRESS_INTERVAL_SECONDS:
+                # Record as we go, so a resumed import skips these
+                if copied:
+                    _record_copied(owner_name, project_name, copied)
+                    copied = []
+                _update(import_id, **asdict(progress))
+                saved = time.monotonic()
+        if copied:
+            _record_copied(owner_name, project_name, copied)
+        _update(import_id, status="completed", **asdict(progress))
+    except Exception as e:
+        logger.exception("DVC import %s failed", import_id)
+        progress.error = str(e)
+        _update(import_id, status="failed", **asdict(progress))
+    return _get(import_id)
+
+
+def _get(import_id: str) -> DvcObjectImport:
+    with Session(engine) as session:
+        row = session.get(DvcObjectImport, import_id)
+    assert row is not None
+    return row
+
+
+def _run(import_id: str) -> None:
+    try:
+        run_import(import_id)
+    except Exception:
+        logger.exception("DVC import %s failed", import_id)
+    finally:
+        with _lock:
+            _active.discard(import_id)
+
+
+def _submit(import_id: str) -> None:
+    """Queue an import in this process, unless it already is."""
+    global _import_executor, _heartbeat
+    with _lock:
+        if import_id in _active:
+            return
+        if _import_executor is None:
+            _import_executor = ThreadPoolExecutor(
+                max_workers=IMPORT_MAX_RUNNING,
+                thread_name_prefix="dvc-import",
+            )
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(
+                target=_heartbeat_forever,
+                name="dvc-import-heartbeat",
+                daemon=True,
+            )
+            _heartbeat.start()
+        _active.add(import_id)
+        _import_executor.submit(_run, import_id)
+
+
+def _heartbeat_forever() -> None:
+    while True:
+        time.sleep(IMPORT_HEARTBEAT_SECONDS)
+        with _lock:
+            import_ids = list(_active)
+        if not import_ids:
+            continue
+        try:
+            with Session(engine) as session:
+                session.exec(  # type: ignore
+                    update(DvcObjectImport)
+                    .where(col(DvcObjectImport.id).in_(import_ids))
+                    .where(col(DvcObjectImport.status) == "running")
+                    .values(updated=utcnow())
+                )
+                session.commit()
+        except Exception:
+            logger.exception("Failed to bump running DVC imports")
+
+
+def _resume(import_id: str) -> bool:
+    """Take over a running import if its worker stopped, returning whether
+    it was resumed here."""
+    cutoff = utcnow() - timedelta(seconds=IMPORT_STALE_SECONDS)
+    # Bumping it first means only one process takes it over
+    with Session(engine) as session:
+        result = session.exec(  # type: ignore
+            update(DvcObjectImport)
+            .where(col(DvcObjectImport.id) == import_id)
+            .where(col(DvcObjectImport.status) == "running")
+            .where(col(DvcObjectImport.updated) < cutoff)
+            .values(updated=utcnow())
+        )
+        session.commit()
+    if result.rowcount != 1:
+        return False
+    logger.info(f"Resuming DVC import {import_id}")
+    _submit(import_id)
+    return True
+
+
+def resume_stale_imports() -> int:
+    """Resume running imports whose worker stopped, returning how many."""
+    cutoff = utcnow() - timedelta(seconds=IMPORT_STALE_SECONDS)
+    with Session(engine) as session:
+        import_ids = session.exec(
+            select(DvcObjectImport.id)
+            .where(col(DvcObjectImport.status) == "running")
+            .where(col(DvcObjectImport.updated) < cutoff)
+        ).all()
+    return sum(_resume(import_id) for import_id in import_ids)
+
+
+def create_import(
+    owner_name: str,
+    project_name: str,
+    src_owner_name: str,
+    src_project_name: str,
+    md5s: list[str],
+    storage_limit_gb: float,
+) -> DvcObjectImport:
+    row = DvcObjectImport(
+        id=secrets.token_hex(16),
+        owner_name=owner_name.lower(),
+        project_name=project_name.lower(),
+        src_owner_name=src_owner_name.lower(),
+        src_project_name=src_project_name.lower(),
+        md5s=md5s,
+        storage_limit_gb=storage_limit_gb,
+    )
+    with Session(engine) as session:
+        session.add(row)
+        session.commit()
+        session.refresh(row)
+    return row
+
+
+def start_import(
+    owner_name: str,
+    project_name: str,
+    src_owner_name: str,
+    src_project_name: str,
+    md5s: list[str],
+    storage_limit_gb: float,
+) -> DvcObjectImport:
+    """Start importing objects from one project into another in the
+    background, returning the import."""
+    row = create_import(
+        owner_name,
+        project_name,
+        src_owner_name,
+        src_project_name,
+        md5s,
+        storage_limit_gb,
+    )
+    _submit(row.id)
+    try:
+        resume_stale_imports()
+    except Exception:
+        logger.exception("Failed to resume stale DVC imports")
+    return row
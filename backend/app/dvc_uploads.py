@@ -0,0 +1,236 @@
+"""Storing DVC objects uploaded to a project.
+
+Objects are first written to a pending path next to where they belong,
+then, once their content is verified, moved into place, indexed (see
+``app.object_index``) and counted toward the owner's storage usage. This is
+shared by the DVC remote routes and the routes that upload a figure,
+dataset or publication along with its ``.dvc`` file, so objects stored
+either way are indexed, charged and, with ``settings.DVC_SHARED_OBJECTS``,
+deduplicated alike.
+
+Objects uploaded straight to storage are first put at a staging key (see
+``get_staging_prefix``) and verified when the client finalizes them.
+Large ones are hashed in the background by ``start_verifying``, on a pool
+of ``VERIFY_MAX_WORKERS`` threads per process, which leaves a marker next
+to the staged object so any worker can tell it's being verified. Staged
+uploads that are never finalized are deleted by ``expire_staged_uploads``
+after ``STAGED_UPLOAD_TTL_SECONDS``, which runs in the background as
+uploads are started, and aren't counted toward the owner's usage
+meanwhile.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from app import object_cache, shared_objects, utcnow
+from app.config import settings
+from app.object_index import (
+    get_indexed_objects,
+    get_object_fpath,
+    record_objects,
+)
+from app.storage import (
+    get_data_prefix_for_owner,
+    get_object_fs,
+    record_storage_usage,
+    remove_gcs_content_type,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGED_UPLOAD_TTL_SECONDS = 24 * 3600
+# Max staged uploads hashed at once per process
+VERIFY_MAX_WORKERS = 2
+# Longest a staged upload is expected to take to hash in the background,
+# after which it's assumed the worker hashing it stopped
+VERIFY_TTL_SECONDS = 3600
+
+_verify_lock = threading.Lock()
+_verify_executor: ThreadPoolExecutor | None = None
+
+
+def record_upload(
+    owner_name: str,
+    project_name: str,
+    md5: str,
+    size: int,
+    data: bytes | None = None,
+) -> None:
+    """Index an object that was just stored and count it toward usage.
+
+    ``data`` is the object's content, if at hand, for caching ``.dir``
+    manifests on this node.
+    """
+    # Only count bytes for objects that weren't already stored here
+    previous = get_indexed_objects(owner_name, project_name, [md5]).get(md5)
+    if previous is None or previous.legacy:
+        delta = size
+    else:
+        delta = size - (previous.size or size)
+    record_objects(owner_name, project_name, [(md5, False, size)])
+    record_storage_usage(owner_name, project_name, delta)
+    if data is not None:
+        object_cache.put(md5, data)
+
+
+def store_upload(
+    fs,
+    owner_name: str,
+    project_name: str,
+    md5: str,
+    size: int,
+    pending_fpath: str,
+    data: bytes | None = None,
+) -> str:
+    """Move a verified upload into place and record it, returning the
+    object's path.
+
+    With ``settings.DVC_SHARED_OBJECTS``, the object goes to the shared
+    store, unless the project already has its own copy.
+    """
+    if settings.DVC_SHARED_OBJECTS:
+        stored = shared_objects.store_object(
+            owner_name, project_name, md5, size, pending_fpath, fs=fs
+        )
+        if stored is not None:
+            if data is not None:
+                object_cache.put(md5, data)
+            return stored
+    fpath = get_object_fpath(owner_name, project_name, md5)
+    fs.mv(pending_fpath, fpath)
+    record_upload(owner_name, project_name, md5, size, data=data)
+    return fpath
+
+
+def remove_pending(fs, pending_fpath: str) -> None:
+    """Delete an upload that won't be stored, logging rather than raising
+    any error, since it's usually cleanup after another one."""
+    try:
+        if fs.exists(pending_fpath):
+            fs.rm(pending_fpath)
+    except Exception:
+        logger.exception(
+            "Failed to remove pending DVC upload %s", pending_fpath
+        )
+
+
+def put_object(
+    owner_name: str, project_name: str, md5: str, data: bytes, fs=None
+) -> str:
+    """Store an object whose content is at hand, e.g., a file uploaded along
+    with the ``.dvc`` file ``dvc add`` wrote for it, returning its path."""
+    if fs is None:
+        fs = get_object_fs()
+    pending_fpath = (
+        get_object_fpath(owner_name, project_name, md5) + ".pending"
+    )
+    try:
+        with fs.open(pending_fpath, "wb") as f:
+            f.write(data)
+        # If using Google Cloud Storage, we need to remove the content type
+        # metadata in order to set it for signed URLs
+        if settings.ENVIRONMENT != "local":
+            remove_gcs_content_type(pending_fpath)
+        return store_upload(
+            fs, owner_name, project_name, md5, len(data), pending_fpath
+        )
+    except BaseException:
+        remove_pending(fs, pending_fpath)
+        raise
+
+
+def get_staging_prefix(owner_name: str, project_name: str) -> str:
+    # Outside files/md5, so staged objects are never mistaken for stored ones
+    return (
+        f"{get_data_prefix_for_owner(owner_name)}/{project_name.lower()}"
+        "/files/staging"
+    )
+
+
+def _get_modified(fs, fpath: str) -> datetime:
+    """Get when an object was last modified, as a naive UTC datetime like
+    ``utcnow``."""
+    modified = fs.modified(fpath)
+    if modified.tzinfo is not None:
+        modified = modified.astimezone(timezone.utc).replace(tzinfo=None)
+    return modified
+
+
+def get_verifying_fpath(staging_fpath: str) -> str:
+    return staging_fpath + ".verifying"
+
+
+def is_verifying(fs, staging_fpath: str) -> bool:
+    """Whether a staged upload is being hashed in the background, by this
+    or any other worker."""
+    try:
+        modified = _get_modified(fs, get_verifying_fpath(staging_fpath))
+    except FileNotFoundError:
+        return False
+    return modified > utcnow() - timedelta(seconds=VERIFY_TTL_SECONDS)
+
+
+def start_verifying(
+    fs, staging_fpath: str, verify: Callable[[], object]
+) -> None:
+    """Run ``verify`` for a staged upload in the background, marking the
+    upload as being verified until it's done."""
+    global _verify_executor
+    fs.pipe(get_verifying_fpath(staging_fpath), b"")
+    with _verify_lock:
+        if _verify_executor is None:
+            _verify_executor = ThreadPoolExecutor(
+                max_workers=VERIFY_MAX_WORKERS,
+                thread_name_prefix="dvc-upload-verify",
+            )
+        _verify_executor.submit(_run_verify, fs, staging_fpath, verify)
+
+
+def _run_verify(fs, staging_fpath: str, verify: Callable[[], object]) -> None:
+    try:
+        verify()
+    except Exception:
+        logger.exception("Failed to verify staged upload %s", staging_fpath)
+    finally:
+        remove_pending(fs, get_verifying_fpath(staging_fpath))
+
+
+def expire_staged_uploads(
+    owner_name: str,
+    project_name: str,
+    fs=None,
+    ttl_seconds: float = STAGED_UPLOAD_TTL_SECONDS,
+) -> int:
+    """Delete a project's staged uploads that weren't finalized within
+    ``ttl_seconds`` of being uploaded, returning how many."""
+    if fs is None:
+        fs = get_object_fs()
+    cutoff = utcnow() - timedelta(seconds=ttl_seconds)
+    try:
+        fpaths = fs.find(get_staging_prefix(owner_name, project_name))
+    except FileNotFoundError:
+        return 0
+    n_deleted = 0
+    for fpath in fpaths:
+        try:
+            if _get_modified(fs, fpath) > cutoff:
+                continue
+            fs.rm(fpath)
+        except FileNotFoundError:
+            # Finalized in the meantime
+            continue
+        except Exception:
+            logger.exception("Failed to expire staged upload %s", fpath)
+            continue
+        n_deleted += 1
+    if n_deleted:
+        logger.info(
+            f"Deleted {n_deleted} expired staged uploads for "
+            f"{owner_name}/{project_name}"
+        )
+    return n_deleted
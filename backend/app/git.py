@@ -4,6 +4,7 @@ import atexit
 import json
 import os
 import posixpath
+import re
 import shutil
 import stat
 import subprocess
@@ -12,6 +13,7 @@ import time
 from abc import ABC, abstractmethod
 from collections import OrderedDict
 from contextlib import contextmanager
+from typing import Hashable, Iterator, NamedTuple
 
 import calkit
 import git
@@ -21,11 +23,18 @@ from git.exc import GitCommandError
 from ruamel.yaml import YAMLError
 from sqlmodel import Session, select
 
-from app import github, users
-from app.core import logger, ryaml
-from app.models import GitRef, Project, User, UserProjectAccess
-
-_SYMLINK_MODE = 0o120000
+from app import catfile, documents, github, metrics, repo_cache, users
+from app import cache as shared_cache
+from app.config import settings
+from app.core import logger
+from app.models import (
+    GitRef,
+    Project,
+    ProjectGitHead,
+    User,
+    UserProjectAccess,
+)
+from app.refresh import PREEMPT_FRACTION, refresh_scheduler
 
 # Max seconds a single git network subprocess may run before being killed,
 # so a stalled remote can't wedge a worker indefinitely. Clone gets a
@@ -33,6 +42,20 @@ _SYMLINK_MODE = 0o120000
 # legitimately slower.
 GIT_CLONE_TIMEOUT = 300
 GIT_FETCH_TIMEOUT = 120
+# With a head recorded from a push webhook, clones and mirrors are still
+# refreshed once this old, in case a delivery was missed or failed
+KNOWN_HEAD_MAX_AGE_SECONDS = 6 * 3600
+
+# Root of the on-disk repo cache. Per-user working clones live under
+# ``{REPO_CACHE_DIR}/{user}/{owner}/{project}`` and borrow their objects
+# (via alternates) from a single bare mirror per project under
+# ``{REPO_CACHE_DIR}/.mirrors/{owner}/{project}``, so clone time, disk use
+# and fetch traffic scale with projects rather than projects x users. The
+# leading dot keeps the mirrors dir from colliding with a GitHub username.
+REPO_CACHE_DIR = "/tmp"
+_MIRRORS_DIRNAME = repo_cache.MIRRORS_DIRNAME
+# Object filter for partial clones (see settings.GIT_PARTIAL_CLONE)
+_PARTIAL_CLONE_FILTER = "blob:none"
 
 
 @contextmanager
@@ -129,6 +152,402 @@ def _make_git_auth_env(
     return env
 
 
+def _get_mtime(fpath: str) -> float | None:
+    try:
+        return os.path.getmtime(fpath)
+    except OSError:
+        return None
+
+
+def _mark_updated(updated_fpath: str, started: float) -> None:
+    """Stamp a cache dir's ``updated.txt`` with when its update started.
+
+    Using the start rather than the end time means the stamp never claims
+    the repo reflects a moment later than it does, which single-flight
+    waiters rely on.
+    """
+    open(updated_fpath, "a").close()
+    os.utime(updated_fpath, (started, started))
+
+
+@contextmanager
+def _single_flight(base_dir: str, kind: str, timeout: float, strict: bool):
+    """Take a cached repo's update lock, coalescing with an update that
+    another worker or process already has in flight.
+
+    Yields whether the repo was updated while waiting for the lock, in
+    which case the caller should reuse that result instead of repeating the
+    work. If ``strict``, only an update that started after we began
+    waiting counts, for callers that must see the remote as of the call.
+    Raises a 503 if the lock can't be had within ``timeout`` seconds.
+    """
+    updated_fpath = os.path.join(base_dir, "updated.txt")
+    lock = FileLock(os.path.join(base_dir, "updating.lock"), timeout=timeout)
+    updated_before = _get_mtime(updated_fpath)
+    wait_start = time.time()
+    perf_start = time.perf_counter()
+    try:
+        lock.acquire()
+    except Timeout:
+        metrics.repo_lock_wait_seconds.labels(
+            kind=kind, outcome="timeout"
+        ).observe(time.perf_counter() - perf_start)
+        logger.warning(f"Git {kind} lock timed out for {base_dir}")
+        raise HTTPException(
+            503, "Repo is busy being updated; please try again shortly"
+        )
+    try:
+        updated_after = _get_mtime(updated_fpath)
+        coalesced = updated_after is not None and (
+            updated_after >= wait_start
+            if strict
+            else updated_after != updated_before
+        )
+        metrics.repo_lock_wait_seconds.labels(
+            kind=kind, outcome="coalesced" if coalesced else "acquired"
+        ).observe(time.perf_counter() - perf_start)
+        yield coalesced
+    finally:
+        lock.release()
+
+
+# Run maintenance on a cached repo at most this often
+MAINTENANCE_INTERVAL = 6 * 3600
+# Paths whose history the maintenance probe times, in order of preference
+_MAINTENANCE_PROBE_PATHS = ["dvc.lock", "calkit.yaml", "README.md"]
+
+
+def _time_probe(repo_dir: str) -> dict[str, float]:
+    """Time a path-limited log and a ref listing, the queries history and
+    ref search endpoints lean on, in milliseconds."""
+    timings = {}
+    probes = {
+        "log_path_ms": ["log", "--format=%H", "HEAD", "--"]
+        + _MAINTENANCE_PROBE_PATHS,
+        "for_each_ref_ms": [
+            "for-each-ref",
+            "--format=%(refname) %(committerdate:unix)",
+        ],
+    }
+    for name, args in probes.items():
+        start = time.perf_counter()
+        subprocess.run(
+            ["git", *args],
+            cwd=repo_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=GIT_FETCH_TIMEOUT,
+        )
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    return timings
+
+
+def maintain_repo(base_dir: str, repo_dir: str) -> dict | None:
+    """Optimize a cached repo's on-disk layout for reads.
+
+    - Commit-graph with changed-path Bloom filters, written incrementally
+      as a split chain, so path-limited ``git log`` (file history) can
+      skip commits without opening their trees, and ref walks don't parse
+      commit objects.
+    - Geometric repack, which rolls the small packs left by frequent
+      fetches (and loose objects) into fewer packs without rewriting the
+      big ones every time. Only local packs are touched, so a clone never
+      copies objects it borrows from the mirror.
+    - A multi-pack index over the remaining packs, so object lookups
+      don't probe each pack's index in turn.
+
+    Runs under the repo's maintenance lock and is skipped if that's held.
+    It doesn't take the update lock, so refreshes and clones aren't held
+    up by a long repack; git's own pack and commit-graph locking makes
+    these safe alongside a fetch. The probes run outside the lock.
+    Returns probe timings from before and after, or None if skipped.
+    """
+    lock = FileLock(os.path.join(base_dir, "maintenance.lock"), timeout=0)
+    before = _time_probe(repo_dir)
+    try:
+        lock.acquire()
+    except Timeout:
+        return None
+    try:
+        steps = [
+            [
+                "commit-graph",
+                "write",
+                "--reachable",
+                "--changed-paths",
+                "--split",
+            ],
+            ["repack", "--geometric=2", "-d", "-l", "--write-midx"],
+        ]
+        for step in steps:
+            with _timed(f"maintenance-{step[0]}", repo=repo_dir):
+                subprocess.run(
+                    ["git", *step],
+                    cwd=repo_dir,
+                    check=True,
+                    capture_output=True,
+                    timeout=GIT_CLONE_TIMEOUT,
+                )
+        subprocess.call(["touch", os.path.join(base_dir, "maintained.txt")])
+    finally:
+        lock.release()
+    after = _time_probe(repo_dir)
+    report = {"before": before, "after": after}
+    logger.info(
+        f"Maintained {repo_dir}",
+        extra={
+            "git_op": "maintenance",
+            **{f"before_{k}": v for k, v in before.items()},
+            **{f"after_{k}": v for k, v in after.items()},
+        },
+    )
+    return report
+
+
+def _maybe_schedule_maintenance(base_dir: str, repo_dir: str) -> None:
+    """Queue background maintenance for a cached repo if it's due."""
+    age = _get_age(os.path.join(base_dir, "maintained.txt"))
+    if age < MAINTENANCE_INTERVAL:
+        return
+    refresh_scheduler.schedule(
+        f"maintain:{repo_dir}", lambda: maintain_repo(base_dir, repo_dir)
+    )
+
+
+def get_mirror_base_dir(owner_name: str, project_name: str) -> str:
+    """Return the cache dir holding a project's shared bare mirror."""
+    return os.path.join(
+        REPO_CACHE_DIR, _MIRRORS_DIRNAME, owner_name, project_name
+    )
+
+
+def _refresh_mirror(
+    owner_name: str,
+    project_name: str,
+    git_plain_url: str,
+    access_token: str | None,
+    ttl: int | None = None,
+    known_head: tuple[str, str] | None = None,
+) -> str:
+    """Ensure the project's shared bare mirror exists and is fresh enough.
+
+    The mirror is the only clone of a project that talks to the remote;
+    per-user working clones fetch from it locally. It tracks branches and
+    tags only (not e.g. GitHub's ``refs/pull/*``), and never prunes
+    unreachable objects, since working clones borrow objects from it via
+    alternates and may still reference commits that were force-pushed
+    away upstream.
+
+    Parameters
+    ----------
+    owner_name, project_name : str
+        Identify the project, and therefore the mirror location.
+    git_plain_url : str
+        Remote URL without credentials.
+    access_token : str | None
+        Token for the credential helper; None for unauthenticated access.
+    ttl : int | None
+        Skip the fetch if the mirror was updated within this many seconds.
+        If None, always fetch.
+    known_head : tuple[str, str] | None
+        A ``(branch, sha)`` recorded from a push webhook. If given, it
+        decides staleness instead of the TTL: the fetch is skipped if the
+        mirror's branch is already at (or past) that SHA and it was fetched
+        within ``KNOWN_HEAD_MAX_AGE_SECONDS``.
+
+    Returns
+    -------
+    str
+        Path to the bare mirror repo.
+    """
+    base_dir = get_mirror_base_dir(owner_name, project_name)
+    mirror_dir = os.path.join(base_dir, "repo.git")
+    updated_fpath = os.path.join(base_dir, "updated.txt")
+    os.makedirs(base_dir, exist_ok=True)
+    auth_env = _make_git_auth_env(access_token) if access_token else {}
+    repo_label = f"{owner_name}/{project_name}"
+    exists = os.path.isdir(mirror_dir)
+    repo_cache.record_access(base_dir, "mirror", hit=exists)
+    with _single_flight(
+        base_dir,
+        "mirror",
+        timeout=GIT_FETCH_TIMEOUT if exists else GIT_CLONE_TIMEOUT,
+        strict=ttl is None and known_head is None,
+    ) as coalesced:
+        if not os.path.isdir(mirror_dir):
+            logger.info(f"Creating bare mirror in {mirror_dir}")
+            started = time.time()
+            # Clone next to the final location and rename into place so
+            # a failed or interrupted clone never leaves a half-written
+            # mirror behind for other workers to pick up.
+            tmp_dir = tempfile.mkdtemp(prefix="repo.git.", dir=base_dir)
+            clone_args = ["--bare"]
+            if settings.GIT_PARTIAL_CLONE:
+                # Later fetches inherit the filter from the remote config
+                clone_args.append(f"--filter={_PARTIAL_CLONE_FILTER}")
+            try:
+                with _timed("clone-mirror", repo=repo_label):
+                    subprocess.check_call(
+                        ["git", "clone", *clone_args, git_plain_url, tmp_dir],
+                        env={**os.environ, **auth_env},
+                        timeout=GIT_CLONE_TIMEOUT,
+                    )
+                mirror = git.Repo(tmp_dir)
+                mirror.git.config(
+                    ["remote.origin.fetch", "+refs/heads/*:refs/heads/*"]
+                )
+                mirror.git.config(
+                    [
+                        "--add",
+                        "remote.origin.fetch",
+                        "+refs/tags/*:refs/tags/*",
+                    ]
+                )
+                mirror.git.config(["gc.pruneExpire", "never"])
+                os.rename(tmp_dir, mirror_dir)
+            except subprocess.CalledProcessError:
+                logger.error(f"Failed to clone mirror for {repo_label}")
+                raise HTTPException(404, "Git repo not found")
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            _mark_updated(updated_fpath, started)
+            return mirror_dir
+        mirror = git.Repo(mirror_dir)
+        if coalesced:
+            # Someone else fetched while we waited. With a known head we
+            # can still tell whether that was enough.
+            if known_head is None or _mirror_is_fresh(
+                mirror, updated_fpath, ttl, known_head
+            ):
+                return mirror_dir
+        elif _mirror_is_fresh(mirror, updated_fpath, ttl, known_head):
+            return mirror_dir
+        if mirror.remotes.origin.url != git_plain_url:
+            mirror.remotes.origin.set_url(git_plain_url)
+        if auth_env:
+            mirror.git.update_environment(**auth_env)
+        started = time.time()
+        with _timed("fetch-mirror", repo=repo_label):
+            mirror.git.fetch(
+                ["--prune", "origin"],
+                kill_after_timeout=GIT_FETCH_TIMEOUT,
+            )
+        _mark_updated(updated_fpath, started)
+    _maybe_schedule_maintenance(base_dir, mirror_dir)
+    return mirror_dir
+
+
+def _mirror_is_fresh(
+    mirror: git.Repo,
+    updated_fpath: str,
+    ttl: int | None,
+    known_head: tuple[str, str] | None,
+) -> bool:
+    """Decide whether a mirror can be used without fetching.
+
+    See ``_refresh_mirror`` for the meaning of ``ttl`` and ``known_head``.
+    """
+    if known_head is not None:
+        branch_name, head_sha = known_head
+        return (
+            _has_commit(mirror, f"refs/heads/{branch_name}", head_sha)
+            and _get_age(updated_fpath) <= KNOWN_HEAD_MAX_AGE_SECONDS
+        )
+    if ttl is None:
+        return False
+    return _get_age(updated_fpath) <= ttl
+
+
+def _get_age(updated_fpath: str) -> float:
+    """Return seconds since a cache dir's ``updated.txt`` was touched."""
+    if os.path.isfile(updated_fpath):
+        return time.time() - os.path.getmtime(updated_fpath)
+    return float("inf")
+
+
+def _revalidate_mirror(
+    owner_name: str,
+    project_name: str,
+    git_plain_url: str,
+    access_token: str | None,
+    ttl: int,
+    known_head: tuple[str, str] | None = None,
+) -> bool:
+    """Refresh the shared mirror in the background if it's stale.
+
+    The mirror is also tracked so it gets refreshed pre-emptively while it
+    keeps being read. Returns whether a refresh was needed; the caller
+    should serve what the mirror already has either way.
+    """
+    base_dir = get_mirror_base_dir(owner_name, project_name)
+    mirror_dir = os.path.join(base_dir, "repo.git")
+    updated_fpath = os.path.join(base_dir, "updated.txt")
+    repo_cache.record_access(base_dir, "mirror", hit=True)
+
+    def refresh(
+        ttl: int | None = ttl,
+        known_head: tuple[str, str] | None = known_head,
+    ) -> None:
+        _refresh_mirror(
+            owner_name,
+            project_name,
+            git_plain_url,
+            access_token=access_token,
+            ttl=ttl,
+            known_head=known_head,
+        )
+
+    # With a webhook-recorded head the mirror mostly goes stale on push, but
+    # is still refreshed on the long fallback TTL in case one was missed
+    track_ttl = KNOWN_HEAD_MAX_AGE_SECONDS if known_head is not None else ttl
+    if track_ttl > 0:
+        refresh_scheduler.track(
+            mirror_dir,
+            # Passing the pre-emption threshold as the TTL lets a worker
+            # whose refresh lost the race to another process skip the fetch
+            job=lambda: refresh(int(track_ttl * PREEMPT_FRACTION), None),
+            ttl=track_ttl,
+            get_age=lambda: time.time() - os.path.getmtime(updated_fpath),
+        )
+    is_fresh = _mirror_is_fresh(
+        git.Repo(mirror_dir), updated_fpath, ttl, known_head
+    )
+    if not is_fresh:
+        refresh_scheduler.schedule(mirror_dir, refresh)
+    return not is_fresh
+
+
+def _get_ref_sha(repo: git.Repo, ref_path: str) -> str | None:
+    """Return the commit SHA a full ref path points to, if it exists."""
+    try:
+        return git.Reference(repo, ref_path).commit.hexsha
+    except ValueError:
+        return None
+
+
+def _has_commit(repo: git.Repo, ref_path: str, sha: str) -> bool:
+    """Whether a ref is at or past a commit, e.g., a head recorded from a
+    push webhook, which it can be past if a later delivery was missed."""
+    ref_sha = _get_ref_sha(repo, ref_path)
+    if ref_sha is None:
+        return False
+    if ref_sha == sha:
+        return True
+    try:
+        return repo.is_ancestor(sha, ref_sha)
+    except GitCommandError:
+        # We don't have the commit
+        return False
+
+
+def _get_known_remote_head(
+    session: Session, project: Project, branch_name: str
+) -> str | None:
+    """Return the remote head of a branch recorded from a push webhook."""
+    head = session.get(ProjectGitHead, (project.id, branch_name))
+    return head.sha if head is not None else None
+
+
 def get_repo(
     project: Project,
     user: User | None,
@@ -141,6 +560,8 @@ def get_repo(
 
     Handles concurrency in case multiple API calls request the repo
     simultaneously. If TTL is None, the latest version is always fetched.
+    Otherwise an expired TTL triggers a background refresh and the cached
+    copy is served in the meantime.
     """
     owner_name = project.owner_github_name
     project_name = project.name
@@ -150,17 +571,24 @@ def get_repo(
         # github_username is None for GitHub-less users; fall back to the
         # (always-present, unique) account name for a stable temp path.
         user_dir = user.github_username or user.account.name
-        base_dir = f"/tmp/{user_dir}/{owner_name}/{project_name}"
+        base_dir = os.path.join(
+            REPO_CACHE_DIR, user_dir, owner_name, project_name
+        )
     else:
-        base_dir = f"/tmp/anonymous/{owner_name}/{project_name}"
+        base_dir = os.path.join(
+            REPO_CACHE_DIR, "anonymous", owner_name, project_name
+        )
     repo_dir = os.path.join(base_dir, "repo")
     updated_fpath = os.path.join(base_dir, "updated.txt")
-    lock_fpath = os.path.join(base_dir, "updating.lock")
-    lock = FileLock(lock_fpath, timeout=5)
     os.makedirs(base_dir, exist_ok=True)
     if os.path.isdir(repo_dir) and fresh:
         logger.info("Deleting repo directory to clone a fresh copy")
         shutil.rmtree(repo_dir, ignore_errors=True)
+    is_cached = os.path.isdir(repo_dir)
+    repo_cache.record_access(base_dir, "clone", hit=is_cached)
+    repo_cache.maybe_evict(REPO_CACHE_DIR, new_repo=not is_cached)
+    if is_cached:
+        _maybe_schedule_maintenance(base_dir, repo_dir)
     # Clone the repo if it doesn't exist -- it will be in a "repo" dir
     access_token: str | None = None
     if user is not None:
@@ -241,48 +669,100 @@ def get_repo(
         git_plain_url += ".git"
     newly_cloned = False
     repo = None
+    repo_label = f"{owner_name}/{project_name}"
+    mirror_base_dir = get_mirror_base_dir(owner_name, project_name)
+    mirror_dir = os.path.join(mirror_base_dir, "repo.git")
+    mirror_updated_fpath = os.path.join(mirror_base_dir, "updated.txt")
+
+    def mark_synced_with_mirror() -> None:
+        # Stamp the clone with the time the mirror's contents date from,
+        # so comparing the two stamps tells whether the clone is behind
+        _mark_updated(
+            updated_fpath, _get_mtime(mirror_updated_fpath) or time.time()
+        )
+
     if not os.path.isdir(repo_dir):
         newly_cloned = True
         logger.info(f"Git cloning into {repo_dir}")
-        try:
-            with lock:
-                try:
-                    clone_cmd = ["git", "clone", git_plain_url, repo_dir]
-                    env = (
-                        {**os.environ, **_make_git_auth_env(access_token)}
-                        if access_token
-                        else None
+        # If another user already has the project, clone from the mirror as
+        # it is and bring it up to date in the background
+        revalidate = (
+            ttl is not None and not fresh and os.path.isdir(mirror_dir)
+        )
+        # Concurrent requests for the same new clone wait for the first
+        # one; the re-check under the lock makes the rest reuse its result
+        with _single_flight(
+            base_dir, "clone", timeout=GIT_CLONE_TIMEOUT, strict=ttl is None
+        ):
+            if not os.path.isdir(repo_dir):
+                # Make sure the shared mirror is there and recent enough,
+                # then clone from it locally, borrowing its objects
+                if not revalidate:
+                    mirror_dir = _refresh_mirror(
+                        owner_name,
+                        project_name,
+                        git_plain_url,
+                        access_token=access_token,
+                        ttl=None if fresh else ttl,
                     )
-                    with _timed(
-                        "clone",
-                        repo=f"{owner_name}/{project_name}",
-                    ):
-                        subprocess.check_call(
-                            clone_cmd,
-                            env=env,
-                            timeout=GIT_CLONE_TIMEOUT,
-                        )
-                except subprocess.CalledProcessError:
-                    logger.error("Failed to clone repo")
-                    # It's possible another process cloned this repo just as
-                    # we were about to, so check again
-                    if not os.path.isdir(repo_dir):
-                        raise HTTPException(404, "Git repo not found")
-                # Touch a file so we can compute a TTL
-                subprocess.check_call(["touch", updated_fpath])
-                repo = git.Repo(repo_dir)
-        except Timeout:
-            logger.warning("Git repo lock timed out")
+                is_partial = _is_partial_clone(git.Repo(mirror_dir))
+                with _timed("clone", repo=repo_label):
+                    subprocess.check_call(
+                        ["git", "clone", "--shared"]
+                        + (["--no-checkout"] if is_partial else [])
+                        + [mirror_dir, repo_dir],
+                        timeout=GIT_CLONE_TIMEOUT,
+                    )
+                # Point origin at the real remote so pushes (and any
+                # caller-initiated pulls) go there, not to the mirror
+                subprocess.check_call(
+                    ["git", "remote", "set-url", "origin", git_plain_url],
+                    cwd=repo_dir,
+                )
+                if is_partial:
+                    # Fault in blobs the mirror doesn't have straight from
+                    # the remote, which needs credentials from here on
+                    _configure_partial_clone(
+                        repo_dir, access_token=access_token
+                    )
+                # Stamp a file so we can compute a TTL
+                mark_synced_with_mirror()
+            repo = git.Repo(repo_dir)
+        if revalidate and ttl is not None:
+            _revalidate_mirror(
+                owner_name,
+                project_name,
+                git_plain_url,
+                access_token=access_token,
+                ttl=ttl,
+            )
     if os.path.isfile(updated_fpath):
         last_updated = os.path.getmtime(updated_fpath)
     else:
         last_updated = 0
     did_refresh = newly_cloned
     if not newly_cloned:
-        # TODO: Only pull if we know we need to, perhaps with a call to GitHub
-        # for the latest rev
         repo = git.Repo(repo_dir)
         ttl_expired = ttl is None or ((time.time() - last_updated) > ttl)
+        # If a push webhook told us where the remote branch is, we know
+        # whether we're stale, so skip the network when we're not and
+        # refresh right away, synchronously, when we are. The TTL is then
+        # replaced by the long KNOWN_HEAD_MAX_AGE_SECONDS, in case a delivery
+        # was missed.
+        known_head = None
+        known_stale = False
+        if ref is None and not repo.head.is_detached:
+            branch_name = repo.active_branch.name
+            head_sha = _get_known_remote_head(session, project, branch_name)
+            if head_sha is not None:
+                known_head = (branch_name, head_sha)
+                if ttl is not None:
+                    known_stale = not _has_commit(
+                        repo, f"refs/remotes/origin/{branch_name}", head_sha
+                    )
+                    ttl_expired = known_stale or (
+                        time.time() - last_updated > KNOWN_HEAD_MAX_AGE_SECONDS
+                    )
         # Legacy shallow repos must be unshallowed regardless of TTL, so
         # force the slow path when we detect one.
         is_shallow = os.path.isfile(os.path.join(repo.git_dir, "shallow"))
@@ -294,65 +774,73 @@ def get_repo(
             if access_token:
                 repo.git.update_environment(**_make_git_auth_env(access_token))
             return repo
-        try:
-            with lock:
-                # Migrate repos cloned with an embedded token in the remote
-                # URL to the plain URL so our credential helper is used
-                # instead. Plain https URLs from GitHub never contain "@", so
-                # this heuristic is safe for our inputs.
-                try:
-                    current_url = repo.remotes.origin.url
-                    if "@" in current_url:
-                        logger.info("Stripping token from remote URL")
-                        repo.remotes.origin.set_url(git_plain_url)
-                except (GitCommandError, AttributeError) as e:
-                    # Best-effort migration; log but continue
-                    logger.warning(f"Could not migrate remote URL: {e}")
-                # Set credentials on the git object before any network ops
+        # Stale-while-revalidate: rather than making this request wait on
+        # the network, refresh the mirror in the background and serve the
+        # clone as is -- unless the mirror has been fetched since the clone
+        # last synced from it, in which case a cheap local fetch catches up.
+        # A forced refresh (no TTL), a clone a webhook head shows is behind,
+        # a legacy shallow clone or a clone made before mirrors existed
+        # still takes the synchronous path.
+        revalidate = (
+            ttl is not None
+            and not known_stale
+            and not is_shallow
+            and os.path.isdir(mirror_dir)
+        )
+        if revalidate and ttl is not None:
+            _revalidate_mirror(
+                owner_name,
+                project_name,
+                git_plain_url,
+                access_token=access_token,
+                ttl=ttl,
+                known_head=known_head,
+            )
+            # Compare the stamps themselves rather than ages computed a
+            # moment apart, which would make an in-sync clone look behind
+            clone_stamp = _get_mtime(updated_fpath) or 0.0
+            if clone_stamp >= (_get_mtime(mirror_updated_fpath) or 0.0):
                 if access_token:
                     repo.git.update_environment(
                         **_make_git_auth_env(access_token)
                     )
-                # Unshallow any repo that was cloned with --depth before we
-                # switched to always doing full clones.
-                repo_label = f"{owner_name}/{project_name}"
-                if is_shallow:
-                    logger.info("Unshallowing legacy shallow repo")
-                    with _timed("fetch-unshallow", repo=repo_label):
-                        repo.git.fetch(
-                            ["--unshallow", "--tags"],
-                            kill_after_timeout=GIT_FETCH_TIMEOUT,
+                return repo
+        try:
+            # If another request refreshed this clone while we waited for
+            # the lock, reuse its result rather than fetching again
+            with _single_flight(
+                base_dir,
+                "clone",
+                timeout=GIT_FETCH_TIMEOUT,
+                strict=ttl is None,
+            ) as coalesced:
+                if coalesced:
+                    logger.info("Reusing concurrent refresh of repo")
+                else:
+                    _migrate_remote_url(repo, git_plain_url)
+                    # Only the mirror talks to the remote; the working clone
+                    # is then updated from it with a local fetch. Legacy
+                    # clones made before the mirror existed don't borrow its
+                    # objects, but fetching from it works all the same.
+                    if not revalidate:
+                        mirror_dir = _refresh_mirror(
+                            owner_name,
+                            project_name,
+                            git_plain_url,
+                            access_token=access_token,
+                            ttl=ttl,
+                            known_head=known_head,
                         )
-                    subprocess.call(["touch", updated_fpath])
-                if not is_shallow:
-                    logger.info("Git fetching")
-                    if ref is None:
-                        branch_name = repo.active_branch.name
-                        with _timed(
-                            "fetch", repo=repo_label, branch=branch_name
-                        ):
-                            repo.git.fetch(
-                                ["origin", branch_name],
-                                kill_after_timeout=GIT_FETCH_TIMEOUT,
-                            )
-                        # If we had any failed previous transactions, reset
-                        # and clean
-                        repo.git.reset()
-                        repo.git.clean("-fd")
-                        repo.git.stash("save", "Auto-stash before pull")
-                        repo.git.checkout([f"origin/{branch_name}"])
-                        repo.git.branch(["-D", branch_name])
-                        repo.git.checkout(["-b", branch_name])
-                    else:
-                        with _timed("fetch-all", repo=repo_label):
-                            repo.git.fetch(
-                                ["--all", "--tags"],
-                                kill_after_timeout=GIT_FETCH_TIMEOUT,
-                            )
-                    subprocess.call(["touch", updated_fpath])
-                did_refresh = True
-        except Timeout:
-            logger.warning("Git repo lock timed out")
+                    mirror_stamp = _get_mtime(mirror_updated_fpath)
+                    _sync_clone_from_mirror(
+                        repo,
+                        _get_fetch_source(repo, mirror_dir),
+                        ref=ref,
+                        is_shallow=is_shallow,
+                        repo_label=repo_label,
+                    )
+                    _mark_updated(updated_fpath, mirror_stamp or time.time())
+                    did_refresh = True
         except GitCommandError as e:
             logger.error(f"Failed to refresh repo: {e}")
     if repo is None:
@@ -373,6 +861,205 @@ def get_repo(
     return repo
 
 
+def _is_partial_clone(repo: git.Repo) -> bool:
+    """Whether ``repo`` may be missing objects its origin can provide."""
+    try:
+        return repo.config_reader("repository").getboolean(
+            'remote "origin"', "promisor", fallback=False
+        )
+    except Exception:
+        return False
+
+
+def _configure_partial_clone(repo_dir: str, access_token: str | None) -> None:
+    """Make a ``--no-checkout`` clone of a partial mirror a partial clone of
+    the remote itself, then check out its default branch."""
+    repo = git.Repo(repo_dir)
+    with repo.config_writer("repository") as cw:
+        cw.set_value('remote "origin"', "promisor", "true")
+        cw.set_value(
+            'remote "origin"', "partialclonefilter", _PARTIAL_CLONE_FILTER
+        )
+        cw.set_value("extensions", "partialClone", "origin")
+        cw.set_value("core", "repositoryformatversion", "1")
+    if access_token:
+        repo.git.update_environment(**_make_git_auth_env(access_token))
+    # Fetch the blobs checkout needs into the mirror first, so later clones
+    # of the project find them there
+    out = _run_git(repo, ["ls-tree", "-r", repo.active_branch.name])
+    _prefetch_blobs(
+        repo,
+        [
+            fields[2]
+            for line in (out or "").splitlines()
+            if len(fields := line.split(None, 3)) == 4 and fields[1] == "blob"
+        ],
+    )
+    repo.git.checkout(["--force", repo.active_branch.name])
+
+
+def _get_blob_store(repo: git.Repo) -> str:
+    """Return the git dir that blobs fetched for a partial clone go into.
+
+    That's the partial mirror the clone borrows objects from, if any, so
+    blobs fetched for one user's clone serve every clone of the project.
+    Otherwise, e.g., for legacy clones, it's the clone itself.
+    """
+    objects_dir = os.path.join(repo.git_dir, "objects")
+    try:
+        with open(os.path.join(objects_dir, "info", "alternates")) as f:
+            alternates = f.read().split()
+    except FileNotFoundError:
+        return repo.git_dir
+    for path in alternates:
+        git_dir = os.path.dirname(
+            os.path.realpath(os.path.join(objects_dir, path))
+        )
+        try:
+            if _is_partial_clone(git.Repo(git_dir)):
+                return git_dir
+        except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+            continue
+    return repo.git_dir
+
+
+def _prefetch_blobs(repo: git.Repo, oids: list[str]) -> None:
+    """Fetch whichever of ``oids`` a partial clone is missing in one request.
+
+    Otherwise each missing blob is faulted in by its own round trip to the
+    remote as it's read. The blobs go into the mirror the clone borrows
+    from (see ``_get_blob_store``), where other users' clones find them.
+    Blobs git faults in by itself still land in the clone, and are fetched
+    again for each clone that reads them. Objects already present are
+    skipped without contacting the remote, and full clones skip this
+    entirely. Failures are only logged, since reads still fault blobs in
+    one by one.
+    """
+    if not oids or not _is_partial_clone(repo):
+        return
+    try:
+        with _timed("prefetch-blobs", count=len(oids)):
+            subprocess.run(
+                [
+                    "git",
+                    "-c",
+                    "fetch.negotiationAlgorithm=noop",
+                    "fetch",
+                    "origin",
+                    "--no-tags",
+                    "--no-write-fetch-head",
+                    "--recurse-submodules=no",
+                    f"--filter={_PARTIAL_CLONE_FILTER}",
+                    "--stdin",
+                ],
+                input="\n".join(oids) + "\n",
+                text=True,
+                cwd=_get_blob_store(repo),
+                env={**os.environ, **repo.git.environment()},
+                capture_output=True,
+                check=True,
+                timeout=GIT_FETCH_TIMEOUT,
+            )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Failed to prefetch {len(oids)} blobs: {e}")
+
+
+def _get_fetch_source(repo: git.Repo, mirror_dir: str) -> str:
+    """Return where a working clone should fetch updates from.
+
+    That's the mirror, except for legacy full clones that don't borrow its
+    objects when it's partial, since it can't give them the blobs they'd
+    expect; those fetch from the remote directly.
+    """
+    if not _is_partial_clone(git.Repo(mirror_dir)):
+        return mirror_dir
+    alternates = os.path.join(repo.git_dir, "objects", "info", "alternates")
+    mirror_objects = os.path.realpath(os.path.join(mirror_dir, "objects"))
+    try:
+        with open(alternates) as f:
+            if mirror_objects in (
+                os.path.realpath(x) for x in f.read().split()
+            ):
+                return mirror_dir
+    except FileNotFoundError:
+        pass
+    return "origin"
+
+
+def _migrate_remote_url(repo: git.Repo, git_plain_url: str) -> None:
+    """Strip a token embedded in the remote URL by older clones.
+
+    Plain https URLs from GitHub never contain "@", so this heuristic is
+    safe for our inputs. The credential helper is used instead.
+    """
+    try:
+        current_url = repo.remotes.origin.url
+        if "@" in current_url:
+            logger.info("Stripping token from remote URL")
+            repo.remotes.origin.set_url(git_plain_url)
+    except (GitCommandError, AttributeError) as e:
+        # Best-effort migration; log but continue
+        logger.warning(f"Could not migrate remote URL: {e}")
+
+
+def _sync_clone_from_mirror(
+    repo: git.Repo,
+    source: str,
+    ref: str | None,
+    is_shallow: bool,
+    repo_label: str,
+) -> None:
+    """Update a working clone by fetching from ``source``.
+
+    That's normally the project's mirror, so this is a local fetch (see
+    ``_get_fetch_source``). For branch reads (no ``ref``) the checked out
+    branch is hard reset to the fetched one, stashing any leftovers from
+    failed previous transactions.
+    """
+    # Unshallow any repo that was cloned with --depth before we switched to
+    # always doing full clones.
+    if is_shallow:
+        logger.info("Unshallowing legacy shallow repo")
+        with _timed("fetch-unshallow", repo=repo_label):
+            repo.git.fetch(
+                [
+                    "--unshallow",
+                    "--tags",
+                    source,
+                    "+refs/heads/*:refs/remotes/origin/*",
+                ],
+                kill_after_timeout=GIT_FETCH_TIMEOUT,
+            )
+        return
+    logger.info("Git fetching from mirror")
+    if ref is not None:
+        with _timed("fetch-all", repo=repo_label):
+            repo.git.fetch(
+                ["--tags", source, "+refs/heads/*:refs/remotes/origin/*"],
+                kill_after_timeout=GIT_FETCH_TIMEOUT,
+            )
+        return
+    branch_name = repo.active_branch.name
+    with _timed("fetch", repo=repo_label, branch=branch_name):
+        repo.git.fetch(
+            [
+                source,
+                (
+                    f"+refs/heads/{branch_name}:"
+                    f"refs/remotes/origin/{branch_name}"
+                ),
+            ],
+            kill_after_timeout=GIT_FETCH_TIMEOUT,
+        )
+    # If we had any failed previous transactions, reset and clean
+    repo.git.reset()
+    repo.git.clean("-fd")
+    repo.git.stash("save", "Auto-stash before pull")
+    repo.git.checkout([f"origin/{branch_name}"])
+    repo.git.branch(["-D", branch_name])
+    repo.git.checkout(["-b", branch_name])
+
+
 def _detect_full_name_from_history(repo: git.Repo, email: str) -> str | None:
     """Look for a prior commit by ``email`` with a usable author name.
 
@@ -490,11 +1177,9 @@ def get_dvc_pipeline(
 
 
 def get_dvc_pipeline_from_repo(repo: git.Repo) -> dict:
-    if os.path.isfile(os.path.join(repo.working_dir, "dvc.yaml")):
-        with open(os.path.join(repo.working_dir, "dvc.yaml")) as f:
-            return ryaml.load(f)
-    else:
-        return {}
+    return documents.read_document(
+        WorkingTree(repo.working_dir), "dvc.yaml", {}
+    )
 
 
 def get_overleaf_repo(
@@ -503,7 +1188,7 @@ def get_overleaf_repo(
     """Get a freshly pulled Overleaf repository for a user/project."""
     owner_name, project_name = project.owner_github_name, project.name
     base_dir = (
-        f"/tmp/{user.github_username}/{owner_name}/"
+        f"{REPO_CACHE_DIR}/{user.github_username}/{owner_name}/"
         f"{project_name}/overleaf/{overleaf_project_id}"
     )
     repo_dir = os.path.join(base_dir, "repo")
@@ -513,18 +1198,31 @@ def get_overleaf_repo(
     # (username "git" for Overleaf)
     git_plain_url = f"https://git.overleaf.com/{overleaf_project_id}"
     overleaf_auth = _make_git_auth_env(overleaf_token, username="git")
-    if os.path.isdir(repo_dir):
-        repo = git.Repo(repo_dir)
-        repo.git.update_environment(**overleaf_auth)
-        repo.git.pull()
-    else:
-        subprocess.check_call(
-            ["git", "clone", git_plain_url, repo_dir],
-            env={**os.environ, **overleaf_auth},
-            timeout=300,
-        )
-        repo = git.Repo(repo_dir)
-        repo.git.update_environment(**overleaf_auth)
+    is_cached = os.path.isdir(repo_dir)
+    repo_cache.record_access(base_dir, "overleaf", hit=is_cached)
+    repo_cache.maybe_evict(REPO_CACHE_DIR, new_repo=not is_cached)
+    # Hold the lock while cloning or pulling so eviction leaves it alone.
+    # Requests that wait on another's pull reuse it, and ones that wait too
+    # long get a 503.
+    with _single_flight(
+        base_dir, "overleaf", timeout=GIT_CLONE_TIMEOUT, strict=True
+    ) as coalesced:
+        started = time.time()
+        if os.path.isdir(repo_dir):
+            repo = git.Repo(repo_dir)
+            repo.git.update_environment(**overleaf_auth)
+            if not coalesced:
+                repo.git.pull()
+        else:
+            subprocess.check_call(
+                ["git", "clone", git_plain_url, repo_dir],
+                env={**os.environ, **overleaf_auth},
+                timeout=300,
+            )
+            repo = git.Repo(repo_dir)
+            repo.git.update_environment(**overleaf_auth)
+        if not coalesced:
+            _mark_updated(os.path.join(base_dir, "updated.txt"), started)
     # Run git config so we make commits as this user (with safe fallbacks)
     _configure_committer(repo, user, session=session)
     return repo
@@ -551,31 +1249,282 @@ def get_default_branch(repo: git.Repo) -> str:
         return "main"
 
 
-def _ahead_behind(
-    repo: git.Repo, branch_ref: str, base_ref: str
-) -> tuple[int, int]:
-    """Return (ahead, behind) commit counts of branch_ref vs base_ref."""
+# Field and record separators for ``git for-each-ref --format`` output, so
+# messages can contain newlines
+_REF_US = "\x1f"
+_REF_RS = "\x1e"
+# For annotated tags, the starred fields describe the tagged commit
+_REF_FIELDS = [
+    "refname",
+    "objectname",
+    "objecttype",
+    "*objectname",
+    "*objecttype",
+    "authorname",
+    "*authorname",
+    "committerdate:iso-strict",
+    "*committerdate:iso-strict",
+    "contents",
+    "*contents",
+]
+_REF_FMT = _REF_US.join(f"%({f})" for f in _REF_FIELDS) + _REF_RS
+# Max number of recent commits offered alongside branches and tags
+_SEARCH_REFS_MAX_COMMITS = 50
+
+# Results of search_refs keyed by (git_dir, query, refs state), so a repeat
+# query is served from memory until a fetch or commit moves a ref
+_SEARCH_REFS_CACHE: OrderedDict[tuple, list["GitRef"]] = OrderedDict()
+_SEARCH_REFS_CACHE_MAX = 128
+# Whether this git supports the ``ahead-behind`` for-each-ref atom (2.41+);
+# None until checked
+_ahead_behind_atom: bool | None = None
+# Ahead/behind counts keyed by (ref SHA, base SHA), which never change, for
+# gits without the atom
+_AHEAD_BEHIND_CACHE = shared_cache.Namespace(
+    "ahead-behind", ttl=7 * 24 * 3600, local_ttl=3600, local_max=4096
+)
+# Most commits walked to count every ref at once; past this, e.g., when a
+# ref is far behind, each ref is counted separately with capped counts
+_AHEAD_BEHIND_MAX_WALK = 5000
+# Cap on each count when refs are counted separately
+_AHEAD_BEHIND_MAX_COUNT = 200
+
+
+def _run_git(repo: git.Repo, args: list[str]) -> str | None:
+    """Run a read-only git command in ``repo`` and return its output, or
+    None if it fails."""
     try:
-        ahead = sum(
-            1
-            for _ in repo.iter_commits(
-                f"{base_ref}..{branch_ref}", max_count=200
-            )
+        proc = subprocess.run(
+            ["git", *args],
+            cwd=repo.git_dir,
+            env={**os.environ, **repo.git.environment()},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
         )
-        behind = sum(
-            1
-            for _ in repo.iter_commits(
-                f"{branch_ref}..{base_ref}", max_count=200
-            )
+    except OSError as e:
+        logger.warning(f"git {args[0]} failed to start: {e}")
+        return None
+    if proc.returncode != 0:
+        logger.debug(
+            f"git {args[0]} failed: "
+            f"{proc.stderr.decode('utf-8', errors='replace').strip()}"
         )
-        return ahead, behind
-    except Exception:
-        return 0, 0
+        return None
+    return proc.stdout.decode("utf-8", errors="replace")
+
+
+def _get_refs_state(git_dir: str) -> tuple:
+    """Return a token that changes whenever any ref or HEAD does.
+
+    Covers ``packed-refs``, ``HEAD`` and every loose ref file, using stat
+    info alone so computing it is much cheaper than listing refs.
+    """
+    state = []
+    for fname in ("packed-refs", "HEAD"):
+        try:
+            st = os.stat(os.path.join(git_dir, fname))
+            state.append((fname, st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            state.append((fname, None))
+    for dirpath, _, filenames in os.walk(os.path.join(git_dir, "refs")):
+        for fname in filenames:
+            fpath = os.path.join(dirpath, fname)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            state.append((fpath, st.st_mtime_ns, st.st_size, st.st_ino))
+    return tuple(sorted(state, key=str))
+
+
+def _list_refs(repo: git.Repo) -> list[dict[str, str]]:
+    """List branches and tags with their commit info in one
+    ``git for-each-ref`` call."""
+    out = _run_git(
+        repo,
+        [
+            "for-each-ref",
+            f"--format={_REF_FMT}",
+            "refs/remotes/origin",
+            "refs/heads",
+            "refs/tags",
+        ],
+    )
+    if out is None:
+        return []
+    rows = []
+    for rec in out.split(_REF_RS):
+        parts = rec.lstrip("\n").split(_REF_US)
+        if len(parts) != len(_REF_FIELDS):
+            continue
+        rows.append(dict(zip(_REF_FIELDS, parts)))
+    return rows
+
+
+def _git_has_ahead_behind_atom() -> bool:
+    """Check once, from ``git --version``, whether the ``ahead-behind``
+    for-each-ref atom (git 2.41+) is available."""
+    global _ahead_behind_atom
+    if _ahead_behind_atom is None:
+        try:
+            out = subprocess.run(
+                ["git", "--version"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            major, minor = (int(n) for n in re.findall(r"\d+", out)[:2])
+            _ahead_behind_atom = (major, minor) >= (2, 41)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            logger.warning(f"Failed to check git version: {e}")
+            _ahead_behind_atom = False
+    return _ahead_behind_atom
+
+
+def _get_ahead_behind(
+    repo: git.Repo, refs: dict[str, str], base_ref: str, base_sha: str
+) -> dict[str, tuple[int, int]]:
+    """Return ``{refname: (ahead, behind)}`` commit counts vs ``base_ref``
+    for ``refs``, given as ``{refname: commit SHA}``.
+
+    Uses a single ``for-each-ref`` with the ``ahead-behind`` atom where git
+    supports it, and otherwise ``_count_ahead_behind``. Refs that can't be
+    compared are left out.
+    """
+    if not refs:
+        return {}
+    if _git_has_ahead_behind_atom():
+        out = _run_git(
+            repo,
+            [
+                "for-each-ref",
+                f"--format=%(refname) %(ahead-behind:{base_ref})",
+                *refs,
+            ],
+        )
+        if out is not None:
+            counts = {}
+            for line in out.splitlines():
+                parts = line.rsplit(" ", 2)
+                if len(parts) == 3 and parts[0] in refs:
+                    counts[parts[0]] = (int(parts[1]), int(parts[2]))
+            return counts
+    return _count_ahead_behind(repo, refs, base_sha)
+
+
+def _count_ahead_behind(
+    repo: git.Repo, refs: dict[str, str], base_sha: str
+) -> dict[str, tuple[int, int]]:
+    """Count commits ahead of and behind ``base_sha`` for each of ``refs``
+    with one history walk, reusing counts cached by SHA.
+
+    Every commit reachable from the tips and base, back to where they all
+    meet, is marked with a bit per tip that reaches it (and one for the
+    base), propagated from children to parents in topological order. A
+    tip's ahead count is then its commits without the base bit, and its
+    behind count the base's commits without its bit.
+
+    If that walk would pass ``_AHEAD_BEHIND_MAX_WALK`` commits, e.g.,
+    because a tip is far behind and they only meet far back, each ref is
+    counted separately instead, each count capped at
+    ``_AHEAD_BEHIND_MAX_COUNT``.
+    """
+    counts: dict[str, tuple[int, int]] = {}
+    missing: dict[str, list[str]] = {}
+    for refname, sha in refs.items():
+        cached = _AHEAD_BEHIND_CACHE.get((sha, base_sha))
+        if cached is not None:
+            counts[refname] = cached
+        else:
+            missing.setdefault(sha, []).append(refname)
+    if not missing:
+        return counts
+    tips = list(missing)
+    args = ["rev-list", "--topo-order", "--parents", base_sha, *tips]
+    # Commits reachable from where everything meets count for nobody
+    merge_base = _run_git(repo, ["merge-base", "--octopus", base_sha, *tips])
+    if merge_base:
+        args.append("^" + merge_base.strip())
+    args.append(f"--max-count={_AHEAD_BEHIND_MAX_WALK}")
+    out = _run_git(repo, args)
+    if out is None:
+        return counts
+    if out.count("\n") >= _AHEAD_BEHIND_MAX_WALK:
+        for sha, refnames in missing.items():
+            result = _count_ahead_behind_capped(repo, sha, base_sha)
+            if result is None:
+                continue
+            _AHEAD_BEHIND_CACHE.set((sha, base_sha), result)
+            for refname in refnames:
+                counts[refname] = result
+        return counts
+    base_bit = 1
+    masks = {base_sha: base_bit}
+    for i, sha in enumerate(tips):
+        masks[sha] = masks.get(sha, 0) | 1 << (i + 1)
+    ahead = [0] * len(tips)
+    both = [0] * len(tips)
+    n_base = 0
+    for line in out.splitlines():
+        commit, *parents = line.split()
+        mask = masks.pop(commit, 0)
+        for parent in parents:
+            masks[parent] = masks.get(parent, 0) | mask
+        in_base = mask & base_bit
+        n_base += bool(in_base)
+        bits = mask >> 1
+        i = 0
+        while bits:
+            if bits & 1:
+                if in_base:
+                    both[i] += 1
+                else:
+                    ahead[i] += 1
+            bits >>= 1
+            i += 1
+    for i, sha in enumerate(tips):
+        result = (ahead[i], n_base - both[i])
+        _AHEAD_BEHIND_CACHE.set((sha, base_sha), result)
+        for refname in missing[sha]:
+            counts[refname] = result
+    return counts
+
+
+def _count_ahead_behind_capped(
+    repo: git.Repo, sha: str, base_sha: str
+) -> tuple[int, int] | None:
+    """Count commits ahead of and behind ``base_sha`` for one commit, each
+    up to ``_AHEAD_BEHIND_MAX_COUNT``."""
+    counts = []
+    for revs in (f"{base_sha}..{sha}", f"{sha}..{base_sha}"):
+        out = _run_git(
+            repo,
+            [
+                "rev-list",
+                "--count",
+                f"--max-count={_AHEAD_BEHIND_MAX_COUNT}",
+                revs,
+            ],
+        )
+        if out is None:
+            return None
+        counts.append(int(out))
+    return counts[0], counts[1]
+
+
+def _first_line(message: str) -> str:
+    return message.split("\n")[0]
 
 
 def search_refs(repo: git.Repo, query: str | None = None) -> list["GitRef"]:
     """Search for refs (branches, tags, commits) in a repository.
 
+    Branches and tags come from one ``git for-each-ref`` call, ahead/behind
+    counts from one batched comparison against the default branch, and
+    recent commits from one ``git log``. Results are cached until a ref
+    changes.
+
     Parameters
     ----------
     repo : git.Repo
@@ -588,210 +1537,164 @@ def search_refs(repo: git.Repo, query: str | None = None) -> list["GitRef"]:
     list[GitRef]
         Refs with name, type, message, author, timestamp.
     """
+    cache_key = (repo.git_dir, query, _get_refs_state(repo.git_dir))
+    cached = _SEARCH_REFS_CACHE.get(cache_key)
+    if cached is not None:
+        _SEARCH_REFS_CACHE.move_to_end(cache_key)
+        return list(cached)
     refs = []
     query_lower = query.lower() if query else None
 
-    default_branch = get_default_branch(repo)
+    def matches(*fields: str | None) -> bool:
+        return query_lower is None or any(
+            query_lower in (f or "").lower() for f in fields
+        )
 
+    default_branch = get_default_branch(repo)
+    rows = _list_refs(repo)
     # Add branches--prefer remote refs so shallow clones see all branches
-    seen_branches: set[str] = set()
-    try:
-        remote_refs = list(repo.remotes.origin.refs)
-    except Exception:
-        remote_refs = []
-    branch_sources = [
-        (ref.name.removeprefix("origin/"), ref)
-        for ref in remote_refs
-        if not ref.name.endswith("/HEAD")
-    ] + [
-        (branch.name, branch)
-        for branch in repo.branches
-        if branch.name
-        not in {
-            r.name.removeprefix("origin/")
-            for r in remote_refs
-            if not r.name.endswith("/HEAD")
-        }
-    ]
-    for name, ref in branch_sources:
-        if name in seen_branches:
+    branches: dict[str, dict[str, str]] = {}
+    for row in rows:
+        refname = row["refname"]
+        if refname.startswith("refs/remotes/origin/"):
+            name = refname.removeprefix("refs/remotes/origin/")
+            if name != "HEAD" and row["objecttype"] == "commit":
+                branches[name] = row
+    for row in rows:
+        refname = row["refname"]
+        if refname.startswith("refs/heads/"):
+            name = refname.removeprefix("refs/heads/")
+            branches.setdefault(name, row)
+    matched = {
+        name: row
+        for name, row in branches.items()
+        if matches(name, row["contents"], row["authorname"])
+    }
+    default_row = branches.get(default_branch)
+    ahead_behind = (
+        _get_ahead_behind(
+            repo,
+            {
+                row["refname"]: row["objectname"]
+                for name, row in matched.items()
+                if name != default_branch
+            },
+            default_row["refname"],
+            default_row["objectname"],
+        )
+        if default_row is not None
+        else {}
+    )
+    for name, row in matched.items():
+        ahead, behind = ahead_behind.get(row["refname"], (0, 0))
+        refs.append(
+            {
+                "name": name,
+                "kind": "branch",
+                "message": _first_line(row["contents"]),
+                "author": row["authorname"],
+                "timestamp": row["committerdate:iso-strict"],
+                "hash": row["objectname"],
+                "short_hash": row["objectname"][:7],
+                "is_default": name == default_branch,
+                "ahead": ahead,
+                "behind": behind,
+            }
+        )
+    # Add tags
+    for row in rows:
+        refname = row["refname"]
+        if not refname.startswith("refs/tags/"):
             continue
-        seen_branches.add(name)
-        if query_lower and query_lower not in name.lower():
-            try:
-                commit = ref.commit
-                msg = (
-                    commit.message
-                    if isinstance(commit.message, str)
-                    else bytes(commit.message).decode()
-                )
-                if (
-                    query_lower not in msg.lower()
-                    and query_lower not in (commit.author.name or "").lower()
-                ):
-                    continue
-            except Exception:
+        name = refname.removeprefix("refs/tags/")
+        if row["objecttype"] == "tag":
+            # Annotated: the tag has its own message; the rest describes
+            # the tagged commit
+            if row["*objecttype"] != "commit":
+                if matches(name, row["contents"]):
+                    refs.append({"name": name, "kind": "tag"})
                 continue
-        try:
-            commit = ref.commit
-            msg = (
-                commit.message
-                if isinstance(commit.message, str)
-                else bytes(commit.message).decode()
-            )
-            is_default = name == default_branch
-            ahead, behind = (
-                (0, 0)
-                if is_default
-                else _ahead_behind(repo, name, default_branch)
-            )
-            refs.append(
-                {
-                    "name": name,
-                    "kind": "branch",
-                    "message": msg.split("\n")[0],
-                    "author": commit.author.name,
-                    "timestamp": commit.committed_datetime.isoformat(),
-                    "hash": commit.hexsha,
-                    "short_hash": commit.hexsha[:7],
-                    "is_default": is_default,
-                    "ahead": ahead,
-                    "behind": behind,
-                }
-            )
-        except Exception as e:
-            logger.warning(f"Failed to get commit info for branch {name}: {e}")
-            refs.append(
-                {
-                    "name": name,
-                    "kind": "branch",
-                    "is_default": name == default_branch,
-                    "ahead": 0,
-                    "behind": 0,
-                }
-            )
-
-    # Add tags
-    try:
-        for tag in repo.tags:
-            name = tag.name
-            if query_lower and query_lower not in name.lower():
-                # Try to get tag message for fuzzy matching
-                try:
-                    if tag.tag and tag.tag.message:
-                        if query_lower not in tag.tag.message.lower():
-                            continue
-                except Exception:
-                    pass
-
-            try:
-                commit = tag.commit
-                message = None
-                if tag.tag and tag.tag.message:
-                    message = tag.tag.message.split("\n")[0]
-                elif commit.message:
-                    raw = commit.message
-                    msg_str = (
-                        raw if isinstance(raw, str) else bytes(raw).decode()
-                    )
-                    message = msg_str.split("\n")[0]
-
-                refs.append(
-                    {
-                        "name": name,
-                        "kind": "tag",
-                        "message": message,
-                        "author": commit.author.name
-                        if commit.author
-                        else None,
-                        "timestamp": commit.committed_datetime.isoformat()
-                        if commit.committed_datetime
-                        else None,
-                        "hash": commit.hexsha,
-                        "short_hash": commit.hexsha[:7],
-                    }
-                )
-            except Exception as e:
-                logger.warning(
-                    f"Failed to get commit info for tag {name}: {e}"
-                )
-                refs.append(
-                    {
-                        "name": name,
-                        "kind": "tag",
-                    }
-                )
-    except Exception as e:
-        logger.warning(f"Failed to list tags: {e}")
-
-    # Add recent commits
-    try:
-        max_commits = 50
-        for commit in repo.iter_commits("HEAD", max_count=max_commits):
-            short_hash = commit.hexsha[:7]
-            raw_msg = commit.message
-            message = (
-                (
-                    raw_msg
-                    if isinstance(raw_msg, str)
-                    else bytes(raw_msg).decode()
-                ).split("\n")[0]
-                if raw_msg
-                else ""
-            )
-            # Check if this commit matches the query
-            if query_lower:
-                if not (
-                    query_lower in short_hash.lower()
-                    or query_lower in message.lower()
-                    or query_lower in (commit.author.name or "").lower()
-                ):
-                    continue
-            # Avoid duplicates with branches/tags
-            if short_hash not in [r.get("short_hash", "") for r in refs]:
-                refs.append(
-                    {
-                        "name": short_hash,
-                        "kind": "commit",
-                        "message": message,
-                        "author": commit.author.name,
-                        "timestamp": commit.committed_datetime.isoformat(),
-                        "hash": commit.hexsha,
-                        "short_hash": short_hash,
-                    }
-                )
-    except Exception as e:
-        logger.warning(f"Failed to list commits: {e}")
+            message = row["contents"] or row["*contents"]
+            commit = {
+                "hash": row["*objectname"],
+                "author": row["*authorname"],
+                "timestamp": row["*committerdate:iso-strict"],
+            }
+        elif row["objecttype"] == "commit":
+            message = row["contents"]
+            commit = {
+                "hash": row["objectname"],
+                "author": row["authorname"],
+                "timestamp": row["committerdate:iso-strict"],
+            }
+        else:
+            continue
+        if not matches(name, message):
+            continue
+        refs.append(
+            {
+                "name": name,
+                "kind": "tag",
+                "message": _first_line(message) if message else None,
+                "author": commit["author"] or None,
+                "timestamp": commit["timestamp"] or None,
+                "hash": commit["hash"],
+                "short_hash": commit["hash"][:7],
+            }
+        )
+    # Add recent commits, skipping any a branch or tag already points at
+    seen_short_hashes = {r["short_hash"] for r in refs if "short_hash" in r}
+    out = _run_git(
+        repo,
+        [
+            "log",
+            f"--max-count={_SEARCH_REFS_MAX_COMMITS}",
+            f"--format={_LOG_FMT}",
+            "HEAD",
+        ],
+    )
+    for commit in _parse_log_records(out or ""):
+        message = _first_line(commit["message"])
+        if not matches(commit["short_hash"], message, commit["author"]):
+            continue
+        if commit["short_hash"] in seen_short_hashes:
+            continue
+        refs.append(
+            {
+                "name": commit["short_hash"],
+                "kind": "commit",
+                "message": message,
+                "author": commit["author"],
+                "timestamp": commit["timestamp"],
+                "hash": commit["hash"],
+                "short_hash": commit["short_hash"],
+            }
+        )
     # Sort refs: branches first, then tags, then commits; newest first in each
     kind_order = {"branch": 0, "tag": 1, "commit": 2}
-    refs.sort(
-        key=lambda r: (
-            kind_order.get(r.get("kind", "commit"), 3),
-            r.get("timestamp") or "",
-            r.get("name") or "",
-        ),
-        reverse=False,
-    )
+    refs.sort(key=lambda r: r.get("name") or "")
     refs.sort(key=lambda r: r.get("timestamp") or "", reverse=True)
-    refs.sort(
-        key=lambda r: kind_order.get(r.get("kind", "commit"), 3),
-        reverse=False,
-    )
-    return [GitRef(**r) for r in refs]
-
-
-# Cache for get_file_history results, keyed by (repo_dir, path, max_count,
-# head_sha)
-# Bounded to 256 entries; keyed by HEAD SHA so stale entries are never
-# returned
-_FILE_HISTORY_CACHE: OrderedDict[tuple, list[dict]] = OrderedDict()
-_FILE_HISTORY_CACHE_MAX = 256
+    refs.sort(key=lambda r: kind_order.get(r.get("kind", "commit"), 3))
+    result = [GitRef(**r) for r in refs]
+    _SEARCH_REFS_CACHE[cache_key] = result
+    if len(_SEARCH_REFS_CACHE) > _SEARCH_REFS_CACHE_MAX:
+        _SEARCH_REFS_CACHE.popitem(last=False)
+    return list(result)
+
+
+# Cache for get_file_history results, keyed by (path, max_count, storage,
+# head_sha). Keyed by HEAD SHA so stale entries are never returned, and
+# shared by every clone of the project and every worker.
+_FILE_HISTORY_CACHE = shared_cache.Namespace(
+    "file-history", ttl=24 * 3600, local_ttl=600, local_max=256
+)
 
 # Cache of parsed dvc.lock blobs: {blob_sha: {out_path: md5}}.
-# Shared across all file-history requests in the process so the YAML parse
-# for any given dvc.lock revision only happens once.
-_DVC_LOCK_PARSE_CACHE: OrderedDict[str, dict[str, str]] = OrderedDict()
-_DVC_LOCK_PARSE_CACHE_MAX = 512
+# Shared across all file-history requests and workers so the YAML parse for
+# any given dvc.lock revision only happens once.
+_DVC_LOCK_PARSE_CACHE = shared_cache.Namespace(
+    "dvc-lock-outs", ttl=7 * 24 * 3600, local_ttl=3600, local_max=512
+)
 
 
 def _dvc_lock_outs_at(commit: git.Commit) -> dict[str, str] | None:
@@ -815,10 +1718,9 @@ def _parse_dvc_lock_outs(blob_sha: str, read_bytes) -> dict[str, str]:
     """
     cached = _DVC_LOCK_PARSE_CACHE.get(blob_sha)
     if cached is not None:
-        _DVC_LOCK_PARSE_CACHE.move_to_end(blob_sha)
         return cached
     try:
-        data = ryaml.load(read_bytes()) or {}
+        data = documents.parse_blob(blob_sha, read_bytes) or {}
     except Exception:
         data = {}
     outs: dict[str, str] = {}
@@ -828,9 +1730,7 @@ def _parse_dvc_lock_outs(blob_sha: str, read_bytes) -> dict[str, str]:
             if not p:
                 continue
             outs[p] = out.get("md5") or out.get("hash") or ""
-    _DVC_LOCK_PARSE_CACHE[blob_sha] = outs
-    if len(_DVC_LOCK_PARSE_CACHE) > _DVC_LOCK_PARSE_CACHE_MAX:
-        _DVC_LOCK_PARSE_CACHE.popitem(last=False)
+    _DVC_LOCK_PARSE_CACHE.set(blob_sha, outs)
     return outs
 
 
@@ -844,9 +1744,10 @@ _LOG_FMT = (
 )
 
 
-def _parse_log_records(out: str) -> list[dict]:
-    """Parse the output of ``git log --format=<_LOG_FMT>`` into commit dicts."""
-    commits: list[dict] = []
+def _split_log_records(out: str) -> list[list[str]]:
+    """Split the output of ``git log --format=<_LOG_FMT>`` into the fields
+    of each commit."""
+    records = []
     for rec in out.split(_LOG_RS):
         rec = rec.lstrip("\n")
         if not rec:
@@ -854,21 +1755,28 @@ def _parse_log_records(out: str) -> list[dict]:
         parts = rec.split(_LOG_US)
         if len(parts) < 8:
             continue
-        h, ct, ci, an, ae, parents, subject, body = parts[:8]
-        commits.append(
-            {
-                "hash": h,
-                "short_hash": h[:7],
-                "message": body.rstrip("\n"),
-                "author": an,
-                "author_email": ae,
-                "timestamp": ci,
-                "committed_date": int(ct),
-                "parent_hashes": [p[:7] for p in parents.split() if p],
-                "summary": subject,
-            }
-        )
-    return commits
+        records.append(parts[:8])
+    return records
+
+
+def _log_record_to_dict(parts: list[str]) -> dict:
+    h, ct, ci, an, ae, parents, subject, body = parts
+    return {
+        "hash": h,
+        "short_hash": h[:7],
+        "message": body.rstrip("\n"),
+        "author": an,
+        "author_email": ae,
+        "timestamp": ci,
+        "committed_date": int(ct),
+        "parent_hashes": [p[:7] for p in parents.split() if p],
+        "summary": subject,
+    }
+
+
+def _parse_log_records(out: str) -> list[dict]:
+    """Parse the output of ``git log --format=<_LOG_FMT>`` into commit dicts."""
+    return [_log_record_to_dict(parts) for parts in _split_log_records(out)]
 
 
 def _get_commits_for_paths(
@@ -913,52 +1821,34 @@ def _batch_read_blobs(
 ) -> dict[str, tuple[str, bytes] | None]:
     """Return ``{spec: (blob_sha, content)}`` via ``git cat-file --batch``.
 
-    Missing/ambiguous specs map to ``None``. A single subprocess handles all
-    specs, so we avoid per-commit tree walks through GitPython.
+    Missing/ambiguous specs map to ``None``. All specs are pipelined through
+    one persistent worker, so we avoid per-commit tree walks through
+    GitPython.
     """
     results: dict[str, tuple[str, bytes] | None] = {s: None for s in specs}
     if not specs:
         return results
+    if _is_partial_clone(repo):
+        # Resolving specs only needs trees, which partial clones have
+        try:
+            oids = repo.git.rev_parse(specs).split()
+        except GitCommandError:
+            # Some spec doesn't resolve; fault blobs in one by one instead
+            oids = []
+        _prefetch_blobs(repo, oids)
     try:
-        proc = subprocess.Popen(
-            ["git", "cat-file", "--batch"],
-            cwd=repo.working_dir,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-    except OSError as exc:
-        logger.warning(f"git cat-file --batch failed to start: {exc}")
-        return results
-    payload = ("\n".join(specs) + "\n").encode()
-    stdout, stderr = proc.communicate(payload)
-    if proc.returncode != 0:
-        logger.warning(
-            f"git cat-file --batch failed (exit {proc.returncode}): "
-            f"{stderr.decode('utf-8', errors='replace').strip()}"
+        # The env carries credentials for faulting in blobs from the remote
+        responses = catfile.pool.request(
+            repo.git_dir, specs, env=repo.git.environment()
         )
+    except (OSError, catfile.CatFileError) as exc:
+        logger.warning(f"git cat-file --batch failed: {exc}")
         return results
-    idx = 0
-    for spec in specs:
-        nl = stdout.find(b"\n", idx)
-        if nl < 0:
-            break
-        header = stdout[idx:nl].decode("utf-8", errors="replace")
-        idx = nl + 1
-        parts = header.split(" ")
-        # "<name> missing" or "<name> ambiguous"
-        if len(parts) == 2 and parts[1] in ("missing", "ambiguous"):
-            continue
-        if len(parts) < 3:
-            continue
-        sha = parts[0]
-        try:
-            size = int(parts[2])
-        except ValueError:
-            continue
-        content = stdout[idx : idx + size]
-        idx += size + 1  # trailing newline after content
-        results[spec] = (sha, content)
+    for spec, response in zip(specs, responses):
+        if response is not None:
+            info, content = response
+            assert content is not None
+            results[spec] = (info.oid, content)
     return results
 
 
@@ -1035,11 +1925,11 @@ def get_file_history(
         except Exception:
             pass  # leave storage=None, fall back to full search
     head_sha = repo.head.commit.hexsha
-    cache_key = (repo.working_dir, path, max_count, storage, head_sha)
-    if cache_key in _FILE_HISTORY_CACHE:
+    cache_key = (path, max_count, storage, head_sha)
+    cached = _FILE_HISTORY_CACHE.get(cache_key)
+    if cached is not None:
         logger.info(f"Cache hit for file history: {path}")
-        _FILE_HISTORY_CACHE.move_to_end(cache_key)
-        return _FILE_HISTORY_CACHE[cache_key]
+        return cached
     check_file = storage in (None, "git", "dvc")
     check_dvc_pointer = storage in (None, "dvc", "dvc-zip")
     check_dvc_lock = storage in (None, "dvc", "dvc-zip")
@@ -1050,11 +1940,12 @@ def get_file_history(
         direct_paths.append(path)
     if check_dvc_pointer:
         direct_paths.append(f"{path}.dvc")
-    for direct_path in direct_paths:
-        for c in _get_commits_for_paths(repo, max_count, [direct_path]):
-            if c["hash"] not in seen:
-                seen.add(c["hash"])
-                commits.append(c)
+    # One walk over all direct paths returns the same newest ``max_count``
+    # commits as walking each path separately and merging
+    for c in _get_commits_for_paths(repo, max_count, direct_paths):
+        if c["hash"] not in seen:
+            seen.add(c["hash"])
+            commits.append(c)
     if check_dvc_lock:
         # Walk a few multiples of ``max_count`` so we still surface
         # transitions even when most dvc.lock commits don't touch this path,
@@ -1083,17 +1974,136 @@ def get_file_history(
                 prev_hash = current_hash
     commits.sort(key=lambda c: c["committed_date"], reverse=True)
     result = commits[:max_count]
-    _FILE_HISTORY_CACHE[cache_key] = result
-    if len(_FILE_HISTORY_CACHE) > _FILE_HISTORY_CACHE_MAX:
-        _FILE_HISTORY_CACHE.popitem(last=False)
+    _FILE_HISTORY_CACHE.set(cache_key, result)
     return result
 
 
+# Pages of commit history keyed by (walk start SHAs, count), with the SHAs
+# the walk would continue from. Commits are immutable, so entries never go
+# stale, and are shared by every clone of the project and every worker.
+_HISTORY_PAGE_CACHE = shared_cache.Namespace(
+    "history-page", ttl=7 * 24 * 3600, local_ttl=3600, local_max=256
+)
+# Where the walk continues after a commit, keyed by (start SHA, commit
+# SHA), recorded for the last commit of each page served, so the next page
+# can be served by any worker
+_HISTORY_CURSORS = shared_cache.Namespace(
+    "history-cursor", ttl=7 * 24 * 3600, local_ttl=3600, local_max=1024
+)
+
+
+def _cache_put(
+    cache: OrderedDict, key: Hashable, value, max_size: int
+) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def _rev_parse_commit(repo: git.Repo, rev: str) -> str | None:
+    out = _run_git(repo, ["rev-parse", "--verify", "-q", f"{rev}^{{commit}}"])
+    return out.strip() if out else None
+
+
+def _get_history_page(
+    repo: git.Repo, frontier: tuple[str, ...], count: int
+) -> tuple[list[dict], tuple[str, ...]]:
+    """Return up to ``count`` commits of a ``git log`` walk starting from
+    ``frontier``, and the frontier to continue the walk from.
+
+    Git walks history by popping the newest commit off a queue and pushing
+    its parents, so the unvisited parents of the commits returned so far
+    are exactly where the same walk resumes.
+    """
+    key = (frontier, count)
+    cached = _HISTORY_PAGE_CACHE.get(key)
+    if cached is not None:
+        commits, next_frontier = cached
+        return list(commits), tuple(next_frontier)
+    if not frontier:
+        return [], ()
+    out = _run_git(
+        repo,
+        [
+            "log",
+            f"--max-count={count}",
+            f"--format={_LOG_FMT}",
+            *frontier,
+            "--",
+        ],
+    )
+    records = _split_log_records(out or "")
+    shown = {parts[0] for parts in records}
+    next_frontier = [h for h in frontier if h not in shown]
+    for parts in records:
+        next_frontier.extend(p for p in parts[5].split() if p not in shown)
+    commits = []
+    for parts in records:
+        commit = _log_record_to_dict(parts)
+        # Keep the full first line, as GitPython reported it
+        commit["summary"] = commit["message"].split("\n")[0]
+        commits.append(commit)
+    result = (commits, tuple(dict.fromkeys(next_frontier)))
+    _HISTORY_PAGE_CACHE.set(key, result)
+    return result
+
+
+def _find_history_cursor(
+    repo: git.Repo, start: str, cursor: str
+) -> tuple[str, ...] | None:
+    """Return where the history walk from ``start`` continues after
+    ``cursor``, or None if ``cursor`` isn't in that history.
+
+    Normally this was recorded when the page ending at ``cursor`` was
+    served. Otherwise, walk the commit graph up to ``cursor`` with
+    ``rev-list``, which reads hashes only.
+    """
+    key = (start, cursor)
+    frontier = _HISTORY_CURSORS.get(key)
+    if frontier is not None:
+        return tuple(frontier)
+    shown: set[str] = set()
+    parents: list[str] = []
+    found = False
+    proc = subprocess.Popen(
+        ["git", "rev-list", "--parents", start, "--"],
+        cwd=repo.git_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    assert proc.stdout is not None
+    try:
+        for line in proc.stdout:
+            sha, *commit_parents = line.split()
+            shown.add(sha)
+            parents.extend(commit_parents)
+            if sha == cursor:
+                found = True
+                break
+    finally:
+        proc.kill()
+        proc.wait()
+    if not found:
+        return None
+    frontier = tuple(dict.fromkeys(p for p in parents if p not in shown))
+    _HISTORY_CURSORS.set(key, frontier)
+    return frontier
+
+
 def get_commit_history(
-    repo: git.Repo, max_count: int = 100, ref: str | None = None
+    repo: git.Repo,
+    max_count: int = 100,
+    ref: str | None = None,
+    cursor: str | None = None,
 ) -> list[dict]:
     """Get detailed commit history for a repository.
 
+    Commits come from a single ``git log`` and pages are cached by where
+    their walk starts, so paging through deep history with ``cursor`` costs
+    one page of work per request.
+
     Parameters
     ----------
     repo : git.Repo
@@ -1102,46 +2112,257 @@ def get_commit_history(
         Maximum number of commits to return.
     ref : str, optional
         Branch, tag, or commit to start from (defaults to HEAD).
+    cursor : str, optional
+        Full hash of the last commit of the previous page; the history
+        continues after it.
 
     Returns
     -------
     list[dict]
         Commit dicts with hash, message, author, date, etc.
     """
-    commits = []
     start = ref if ref else "HEAD"
     # If the ref doesn't exist locally, try the remote tracking branch
     candidates = [start]
     if ref:
         candidates.append(f"origin/{ref}")
+    start_sha = None
     for candidate in candidates:
-        try:
-            for commit in repo.iter_commits(candidate, max_count=max_count):
-                commits.append(
-                    {
-                        "hash": commit.hexsha,
-                        "short_hash": commit.hexsha[:7],
-                        "message": commit.message,
-                        "author": commit.author.name,
-                        "author_email": commit.author.email,
-                        "timestamp": commit.committed_datetime.isoformat(),
-                        "committed_date": commit.committed_date,
-                        "parent_hashes": [
-                            p.hexsha[:7] for p in commit.parents
-                        ],
-                        "summary": (
-                            commit.message
-                            if isinstance(commit.message, str)
-                            else bytes(commit.message).decode()
-                        ).split("\n")[0],
-                    }
-                )
+        start_sha = _rev_parse_commit(repo, candidate)
+        if start_sha is not None:
             break
-        except Exception as e:
-            logger.warning(
-                f"Failed to get commit history for {candidate}: {e}"
+        logger.warning(f"Failed to get commit history for {candidate}")
+    if start_sha is None:
+        return []
+    if cursor is None:
+        frontier: tuple[str, ...] | None = (start_sha,)
+    else:
+        cursor_sha = _rev_parse_commit(repo, cursor)
+        frontier = (
+            _find_history_cursor(repo, start_sha, cursor_sha)
+            if cursor_sha is not None
+            else None
+        )
+        if frontier is None:
+            raise HTTPException(
+                400, "Cursor is not a commit in the history of this ref"
             )
-    return commits
+    commits, next_frontier = _get_history_page(repo, frontier, max_count)
+    if commits:
+        _HISTORY_CURSORS.set((start_sha, commits[-1]["hash"]), next_frontier)
+    return list(commits)
+
+
+# Max files listed in a commit's detail; a giant commit (e.g., a large
+# generated dir or a wide merge) can't balloon the response
+COMMIT_DETAIL_MAX_FILES = 500
+# Default and max bytes of a file's patch returned per request
+COMMIT_PATCH_PAGE_BYTES = 100_000
+COMMIT_PATCH_MAX_PAGE_BYTES = 1_000_000
+# Commit details keyed by (git_dir, full SHA); commits never change
+_COMMIT_DETAIL_CACHE: OrderedDict[tuple, dict] = OrderedDict()
+_COMMIT_DETAIL_CACHE_MAX = 256
+# Pages of per-file patches keyed by (git_dir, SHA, path, offset, limit)
+_COMMIT_PATCH_CACHE: OrderedDict[tuple, dict] = OrderedDict()
+_COMMIT_PATCH_CACHE_MAX = 256
+
+
+def _get_diff_base(commit_sha: str, parents: list[str]) -> list[str]:
+    """Return the ``diff-tree`` revisions comparing a commit with its first
+    parent, or with the empty tree for a root commit."""
+    if parents:
+        return [parents[0], commit_sha]
+    return ["--root", commit_sha]
+
+
+def _parse_raw_numstat(out: str) -> list[dict]:
+    """Parse ``diff-tree -z --raw --numstat`` output into changed files.
+
+    Git prints every ``--raw`` entry, then every ``--numstat`` entry, in
+    the same order. Renames and copies carry both paths.
+    """
+    tokens = out.split("\0")
+    raw: list[tuple[str, str, str | None]] = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(":"):
+        status = tokens[i].split(" ")[4]
+        if status[0] in ("R", "C"):
+            raw.append((status[0], tokens[i + 2], tokens[i + 1]))
+            i += 3
+        else:
+            raw.append((status[0], tokens[i + 1], None))
+            i += 2
+    files = []
+    for change_type, path, old_path in raw:
+        if i >= len(tokens) or not tokens[i]:
+            insertions = deletions = None
+        else:
+            added, deleted, numstat_path = tokens[i].split("\t", 2)
+            # A rename's paths follow as their own tokens
+            i += 1 if numstat_path else 3
+            if added == "-":
+                insertions = deletions = None
+            else:
+                insertions, deletions = int(added), int(deleted)
+        files.append(
+            {
+                "path": path,
+                "old_path": old_path,
+                "change_type": change_type,
+                "insertions": insertions,
+                "deletions": deletions,
+                "is_binary": insertions is None,
+            }
+        )
+    return files
+
+
+def get_commit_detail(repo: git.Repo, commit_hash: str) -> dict | None:
+    """Get a commit's metadata and the files it changed vs. its first
+    parent, with line counts but no patches.
+
+    Uses one ``git diff-tree --raw --numstat`` call, which never renders a
+    patch, so even huge merge commits are cheap. Per-file patches are
+    served separately by ``get_commit_file_patch``. Results are cached by
+    commit SHA.
+
+    Returns None if the commit doesn't exist.
+    """
+    sha = _rev_parse_commit(repo, commit_hash)
+    if sha is None:
+        return None
+    key = (repo.git_dir, sha)
+    cached = _COMMIT_DETAIL_CACHE.get(key)
+    if cached is not None:
+        _COMMIT_DETAIL_CACHE.move_to_end(key)
+        return cached
+    records = _split_log_records(
+        _run_git(repo, ["log", "-1", f"--format={_LOG_FMT}", sha]) or ""
+    )
+    if not records:
+        return None
+    h, ct, ci, an, ae, parents, subject, body = records[0]
+    base = _get_diff_base(sha, parents.split())
+    if _is_partial_clone(repo):
+        # Line counts need both sides' blobs; fetch them in one go
+        raw_out = _run_git(
+            repo, ["diff-tree", "-r", "-z", "--no-commit-id", *base]
+        )
+        oids = [
+            oid
+            for tok in (raw_out or "").split("\0")
+            if tok.startswith(":")
+            for oid in tok.split(" ")[2:4]
+            if oid.strip("0")
+        ]
+        _prefetch_blobs(repo, oids)
+    out = _run_git(
+        repo,
+        [
+            "diff-tree",
+            "-r",
+            "-z",
+            "-M",
+            "--no-commit-id",
+            "--raw",
+            "--numstat",
+            *base,
+        ],
+    )
+    changed_files = _parse_raw_numstat(out or "")
+    message = body.rstrip("\n")
+    detail = {
+        "hash": h,
+        "short_hash": h[:7],
+        "message": message,
+        "summary": message.split("\n")[0],
+        "author": an,
+        "author_email": ae,
+        "timestamp": ci,
+        "parent_hashes": [p[:7] for p in parents.split()],
+        "changed_files": changed_files[:COMMIT_DETAIL_MAX_FILES],
+        "files_truncated": len(changed_files) > COMMIT_DETAIL_MAX_FILES,
+    }
+    _cache_put(_COMMIT_DETAIL_CACHE, key, detail, _COMMIT_DETAIL_CACHE_MAX)
+    return detail
+
+
+def get_commit_file_patch(
+    repo: git.Repo,
+    commit_hash: str,
+    path: str,
+    offset: int = 0,
+    limit: int = COMMIT_PATCH_PAGE_BYTES,
+) -> dict | None:
+    """Get a page of one changed file's patch in a commit.
+
+    The patch is streamed from ``git diff`` and only read up to the end of
+    the requested page, so a page costs the bytes before and in it rather
+    than the whole patch. Pages end on a line boundary when more follow.
+
+    Returns None if the commit doesn't exist or didn't change ``path``.
+    The result has the ``patch`` text, the ``offset`` it starts at and the
+    ``next_offset`` to request, which is None on the last page.
+    """
+    detail = get_commit_detail(repo, commit_hash)
+    if detail is None:
+        return None
+    changed = next(
+        (f for f in detail["changed_files"] if f["path"] == path), None
+    )
+    if changed is None:
+        return None
+    sha = detail["hash"]
+    key = (repo.git_dir, sha, path, offset, limit)
+    cached = _COMMIT_PATCH_CACHE.get(key)
+    if cached is not None:
+        _COMMIT_PATCH_CACHE.move_to_end(key)
+        return cached
+    parents = _rev_parse_parents(repo, sha)
+    paths = [changed["old_path"], path] if changed["old_path"] else [path]
+    args = ["git", "diff-tree", "-p", "-M", "--no-commit-id"]
+    args += _get_diff_base(sha, parents) + ["--", *paths]
+    proc = subprocess.Popen(
+        args,
+        cwd=repo.git_dir,
+        env={**os.environ, **repo.git.environment()},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    assert proc.stdout is not None
+    try:
+        skipped = 0
+        while skipped < offset:
+            chunk = proc.stdout.read(min(offset - skipped, 1024 * 1024))
+            if not chunk:
+                break
+            skipped += len(chunk)
+        # One extra byte tells whether anything follows the page
+        data = proc.stdout.read(limit + 1)
+    finally:
+        proc.kill()
+        proc.wait()
+    has_more = len(data) > limit
+    data = data[:limit]
+    if has_more:
+        # End on a line boundary unless a single line fills the page
+        cut = data.rfind(b"\n")
+        if cut >= 0:
+            data = data[: cut + 1]
+    result = {
+        "path": path,
+        "patch": data.decode("utf-8", errors="replace"),
+        "offset": offset,
+        "next_offset": offset + len(data) if has_more else None,
+        "is_binary": changed["is_binary"],
+    }
+    _cache_put(_COMMIT_PATCH_CACHE, key, result, _COMMIT_PATCH_CACHE_MAX)
+    return result
+
+
+def _rev_parse_parents(repo: git.Repo, sha: str) -> list[str]:
+    out = _run_git(repo, ["rev-list", "--parents", "-n", "1", sha])
+    return out.split()[1:] if out else []
 
 
 class RepoTree(ABC):
@@ -1175,6 +2396,11 @@ class RepoTree(ABC):
     def read_text(self, path: str, encoding: str = "utf-8") -> str:
         return self.read_bytes(path).decode(encoding)
 
+    def get_blob_sha(self, path: str) -> str:
+        """Return the Git blob SHA of the file at *path*, for keying caches
+        on its content."""
+        return documents.get_blob_sha(self.read_bytes(path))
+
     @abstractmethod
     def size(self, path: str) -> int: ...
 
@@ -1183,6 +2409,12 @@ class RepoTree(ABC):
         """Immediate child names (not full paths) under *path*; None = root."""
         ...
 
+    def prefetch(self, paths: list[str]) -> None:
+        """Hint that the files at *paths* are about to be read.
+
+        Lets implementations that load content lazily batch the loads.
+        """
+
 
 class WorkingTree(RepoTree):
     """RepoTree backed by a live filesystem checkout."""
@@ -1227,22 +2459,87 @@ class WorkingTree(RepoTree):
         return os.listdir(self._abs(path))
 
 
+# Parsed tree objects: {tree_sha: {name: (mode, sha)}}. Trees are
+# immutable and content-addressed, so entries are valid for any repo.
+_TREE_CACHE: OrderedDict[str, dict[str, tuple[str, str]]] = OrderedDict()
+_TREE_CACHE_MAX = 4096
+# Entry modes in tree objects, as git writes them
+_TREE_MODE = "40000"
+_SYMLINK_MODE = "120000"
+_SUBMODULE_MODE = "160000"
+# Only blobs up to this size are held in memory by GitTree.prefetch
+_PREFETCH_MAX_BLOB_BYTES = 1024 * 1024
+
+
+def _parse_tree(data: bytes, oid_len: int) -> dict[str, tuple[str, str]]:
+    """Parse raw tree object content into ``{name: (mode, sha)}``."""
+    entries = {}
+    i = 0
+    while i < len(data):
+        space = data.index(b" ", i)
+        nul = data.index(b"\0", space)
+        mode = data[i:space].decode()
+        name = data[space + 1 : nul].decode("utf-8", errors="surrogateescape")
+        entries[name] = (mode, data[nul + 1 : nul + 1 + oid_len].hex())
+        i = nul + 1 + oid_len
+    return entries
+
+
 class GitTree(RepoTree):
     """RepoTree that reads directly from git's object database.
 
     No working-tree checkout required--file content streams straight from
     blob objects. Suitable for browsing any historical ref without touching
-    the filesystem beyond the git object store.
+    the filesystem beyond the git object store. Objects are read through
+    the persistent ``cat-file`` workers in ``app.catfile``, and parsed trees
+    are cached by SHA across requests.
     """
 
     def __init__(self, repo: git.Repo, ref: str) -> None:
-        self._git_tree = _resolve_commit(repo, ref).tree
-
-    def _get(self, path: str) -> git.Blob | git.Tree:
-        try:
-            return self._git_tree[path]  # type: ignore[return-value]
-        except KeyError:
-            raise KeyError(path)
+        self._repo = repo
+        self._git_dir = repo.git_dir
+        # Carries credentials for faulting in blobs in partial clones
+        self._env = repo.git.environment()
+        self._root_sha = _resolve_commit(repo, ref).tree.hexsha
+        # Blob contents loaded ahead of reads by ``prefetch``
+        self._prefetched: dict[str, bytes] = {}
+
+    def _read_tree(self, sha: str) -> dict[str, tuple[str, str]]:
+        cached = _TREE_CACHE.get(sha)
+        if cached is not None:
+            _TREE_CACHE.move_to_end(sha)
+            return cached
+        result = catfile.pool.read(self._git_dir, sha, env=self._env)
+        if result is None or result[0].type != "tree":
+            raise KeyError(sha)
+        entries = _parse_tree(result[1], oid_len=len(sha) // 2)
+        _TREE_CACHE[sha] = entries
+        if len(_TREE_CACHE) > _TREE_CACHE_MAX:
+            _TREE_CACHE.popitem(last=False)
+        return entries
+
+    def _get(self, path: str) -> tuple[str, str]:
+        """Return ``(mode, sha)`` of the entry at *path*."""
+        entry = (_TREE_MODE, self._root_sha)
+        for part in path.strip("/").split("/"):
+            if not part:
+                continue
+            if entry[0] != _TREE_MODE:
+                raise KeyError(path)
+            try:
+                entry = self._read_tree(entry[1])[part]
+            except KeyError:
+                raise KeyError(path)
+        return entry
+
+    def _read_blob(self, sha: str) -> bytes:
+        content = self._prefetched.get(sha)
+        if content is not None:
+            return content
+        result = catfile.pool.read(self._git_dir, sha, env=self._env)
+        if result is None:
+            raise KeyError(sha)
+        return result[1]
 
     def exists(self, path: str) -> bool:
         try:
@@ -1253,32 +2550,31 @@ class GitTree(RepoTree):
 
     def is_file(self, path: str) -> bool:
         try:
-            e = self._get(path)
-            return isinstance(e, git.Blob) and e.mode != _SYMLINK_MODE
+            mode, _ = self._get(path)
         except KeyError:
             return False
+        return mode not in (_TREE_MODE, _SYMLINK_MODE, _SUBMODULE_MODE)
 
     def is_dir(self, path: str | None) -> bool:
         if not path:
             return True  # root is always a tree
         try:
-            return isinstance(self._get(path), git.Tree)
+            return self._get(path)[0] == _TREE_MODE
         except KeyError:
             return False
 
     def is_symlink(self, path: str) -> bool:
         try:
-            e = self._get(path)
-            return isinstance(e, git.Blob) and e.mode == _SYMLINK_MODE
+            return self._get(path)[0] == _SYMLINK_MODE
         except KeyError:
             return False
 
     def is_safe_symlink(self, path: str) -> bool:
         try:
-            e = self._get(path)
-            if not isinstance(e, git.Blob) or e.mode != _SYMLINK_MODE:
+            mode, sha = self._get(path)
+            if mode != _SYMLINK_MODE:
                 return False
-            target = e.data_stream.read().decode()
+            target = self._read_blob(sha).decode()
             parent = posixpath.dirname(path)
             resolved = posixpath.normpath(posixpath.join(parent, target))
             return not resolved.startswith("..") and not posixpath.isabs(
@@ -1288,16 +2584,66 @@ class GitTree(RepoTree):
             return False
 
     def read_bytes(self, path: str) -> bytes:
-        return self._get(path).data_stream.read()
+        mode, sha = self._get(path)
+        if mode == _TREE_MODE:
+            raise IsADirectoryError(path)
+        return self._read_blob(sha)
+
+    def get_blob_sha(self, path: str) -> str:
+        mode, sha = self._get(path)
+        if mode == _TREE_MODE:
+            raise IsADirectoryError(path)
+        return sha
 
     def size(self, path: str) -> int:
-        return self._get(path).size
+        _, sha = self._get(path)
+        if sha in self._prefetched:
+            return len(self._prefetched[sha])
+        info = catfile.pool.request(
+            self._git_dir, [sha], mode="batch-check", env=self._env
+        )[0]
+        if info is None:
+            raise KeyError(path)
+        return info[0].size
 
     def listdir(self, path: str | None) -> list[str]:
-        t = self._git_tree if not path else self._get(path)
-        if not isinstance(t, git.Tree):
+        mode, sha = (
+            (_TREE_MODE, self._root_sha) if not path else self._get(path)
+        )
+        if mode != _TREE_MODE:
             raise NotADirectoryError(path)
-        return [posixpath.basename(item.path) for item in t]
+        return list(self._read_tree(sha))
+
+    def prefetch(self, paths: list[str]) -> None:
+        # Load small blobs in one pipelined round trip rather than one
+        # request per read, fetching any a partial clone is missing first
+        shas = []
+        for path in paths:
+            try:
+                mode, sha = self._get(path)
+            except KeyError:
+                continue
+            if mode not in (_TREE_MODE, _SUBMODULE_MODE):
+                shas.append(sha)
+        shas = [
+            sha for sha in dict.fromkeys(shas) if sha not in self._prefetched
+        ]
+        if not shas:
+            return
+        _prefetch_blobs(self._repo, shas)
+        infos = catfile.pool.request(
+            self._git_dir, shas, mode="batch-check", env=self._env
+        )
+        small = [
+            sha
+            for sha, info in zip(shas, infos)
+            if info is not None and info[0].size <= _PREFETCH_MAX_BLOB_BYTES
+        ]
+        for sha, result in zip(
+            small, catfile.pool.request(self._git_dir, small, env=self._env)
+        ):
+            if result is not None and result[1] is not None:
+                self._prefetched[sha] = result[1]
 
 
 def _resolve_commit(repo: git.Repo, ref: str) -> git.Commit:
@@ -1336,3 +2682,285 @@ def get_repo_tree_for_ref(repo: git.Repo, ref: str | None) -> RepoTree:
     if not ref or ref.startswith("-") or any(c in ref for c in " \t\n\r\x00"):
         raise HTTPException(400, f"Invalid Git ref: {ref!r}")
     return GitTree(repo, ref)
+
+
+# Flattened per-tree file indexes, for auto-detecting artifacts (figures,
+# presentations, references, notebooks, etc.) without walking the tree on
+# every request. They're keyed by tree SHA, so they never go stale, and
+# shared on disk by all clones and workers.
+_TREE_INDEX_DIRNAME = ".tree-index"
+_TREE_INDEX_VERSION = 1
+# How many first-parent commits back to look for an index to derive from
+_TREE_INDEX_MAX_DEPTH = 20
+_TREE_INDEX_MEMORY_MAX = 32
+# Least recently used indexes over this many are deleted from disk
+_TREE_INDEX_DISK_MAX = 5000
+# Check the on-disk count after this many writes per process
+_TREE_INDEX_PRUNE_EVERY = 100
+
+_TREE_INDEX_CACHE: OrderedDict[str, "TreeIndex"] = OrderedDict()
+_tree_index_writes = 0
+
+
+class TreeIndexEntry(NamedTuple):
+    path: str
+    mode: str
+    sha: str
+    # None if unknown, e.g., a blob a partial clone hasn't fetched
+    size: int | None
+    # For a ``.dvc`` pointer file, the repo-relative path of its output
+    dvc_out_path: str | None = None
+
+
+class TreeIndex:
+    """Every file (blob or symlink) in a Git tree, by path."""
+
+    def __init__(self, tree_sha: str, entries: dict[str, TreeIndexEntry]):
+        self.tree_sha = tree_sha
+        self.entries = entries
+
+    def __iter__(self) -> Iterator[TreeIndexEntry]:
+        return iter(self.entries.values())
+
+    def __contains__(self, path: object) -> bool:
+        return path in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, path: str) -> TreeIndexEntry | None:
+        return self.entries.get(path)
+
+    def iter_paths(self, with_dvc_outs: bool = False) -> Iterator[str]:
+        """Yield every file path, plus, optionally, the output paths of
+        ``.dvc`` pointer files, which aren't in the tree themselves."""
+        for entry in self.entries.values():
+            yield entry.path
+            if with_dvc_outs and entry.dvc_out_path:
+                yield entry.dvc_out_path
+
+
+def _get_tree_index_fpath(tree_sha: str) -> str:
+    return os.path.join(
+        REPO_CACHE_DIR, _TREE_INDEX_DIRNAME, tree_sha[:2], f"{tree_sha}.json"
+    )
+
+
+def _load_tree_index(tree_sha: str) -> TreeIndex | None:
+    """Return a tree's index from memory or disk, if it's been built."""
+    index = _TREE_INDEX_CACHE.get(tree_sha)
+    if index is not None:
+        _TREE_INDEX_CACHE.move_to_end(tree_sha)
+        return index
+    fpath = _get_tree_index_fpath(tree_sha)
+    try:
+        with open(fpath) as f:
+            data = json.load(f)
+        os.utime(fpath)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != _TREE_INDEX_VERSION:
+        return None
+    index = TreeIndex(
+        tree_sha,
+        {e[0]: TreeIndexEntry(*e) for e in data["entries"]},
+    )
+    _cache_put(_TREE_INDEX_CACHE, tree_sha, index, _TREE_INDEX_MEMORY_MAX)
+    return index
+
+
+def _save_tree_index(index: TreeIndex) -> None:
+    global _tree_index_writes
+    _cache_put(
+        _TREE_INDEX_CACHE, index.tree_sha, index, _TREE_INDEX_MEMORY_MAX
+    )
+    fpath = _get_tree_index_fpath(index.tree_sha)
+    try:
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        fd, tmp_fpath = tempfile.mkstemp(dir=os.path.dirname(fpath))
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "version": _TREE_INDEX_VERSION,
+                    "entries": [list(e) for e in index],
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_fpath, fpath)
+    except OSError as e:
+        logger.warning(f"Failed to save tree index {index.tree_sha}: {e}")
+        return
+    _tree_index_writes += 1
+    if _tree_index_writes % _TREE_INDEX_PRUNE_EVERY == 0:
+        _prune_tree_indexes()
+
+
+def _prune_tree_indexes() -> None:
+    """Delete the least recently read indexes beyond the on-disk cap."""
+    index_dir = os.path.join(REPO_CACHE_DIR, _TREE_INDEX_DIRNAME)
+    fpaths = []
+    for dirpath, _, filenames in os.walk(index_dir):
+        for fname in filenames:
+            fpath = os.path.join(dirpath, fname)
+            try:
+                fpaths.append((os.path.getmtime(fpath), fpath))
+            except OSError:
+                pass
+    fpaths.sort()
+    for _, fpath in fpaths[: max(len(fpaths) - _TREE_INDEX_DISK_MAX, 0)]:
+        try:
+            os.remove(fpath)
+        except OSError:
+            pass
+
+
+def _parse_dvc_out_path(pointer_path: str, content: bytes | None) -> str:
+    """Return the repo-relative path of a ``.dvc`` pointer's output."""
+    try:
+        dvc_data = (
+            documents.load_yaml(content) if content is not None else None
+        )
+        outs = dvc_data.get("outs") if isinstance(dvc_data, dict) else None
+        out = outs[0] if isinstance(outs, list) and outs else None
+        out_path = out.get("path") if isinstance(out, dict) else None
+    except Exception:
+        out_path = None
+    if isinstance(out_path, str) and out_path:
+        return posixpath.normpath(
+            posixpath.join(posixpath.dirname(pointer_path), out_path)
+        )
+    return pointer_path[: -len(".dvc")]
+
+
+def _fill_tree_index_entries(
+    repo: git.Repo, entries: list[TreeIndexEntry], need_sizes: bool
+) -> list[TreeIndexEntry]:
+    """Add sizes (if ``need_sizes``) and ``.dvc`` output paths to new
+    entries, reading objects in batches."""
+    is_partial = _is_partial_clone(repo)
+    env = repo.git.environment()
+    if need_sizes and not is_partial:
+        infos = catfile.pool.request(
+            repo.git_dir, [e.sha for e in entries], "batch-check", env=env
+        )
+        entries = [
+            e._replace(size=info[0].size) if info is not None else e
+            for e, info in zip(entries, infos)
+        ]
+    pointers = [
+        i
+        for i, e in enumerate(entries)
+        if e.path.endswith(".dvc") and e.mode != _SYMLINK_MODE
+    ]
+    if pointers:
+        shas = [entries[i].sha for i in pointers]
+        if is_partial:
+            _prefetch_blobs(repo, shas)
+        contents = catfile.pool.request(repo.git_dir, shas, env=env)
+        for i, result in zip(pointers, contents):
+            entry = entries[i]
+            entries[i] = entry._replace(
+                dvc_out_path=_parse_dvc_out_path(
+                    entry.path, result[1] if result is not None else None
+                )
+            )
+    return entries
+
+
+def _build_tree_index(repo: git.Repo, tree_sha: str) -> TreeIndex:
+    """Index a whole tree with one ``git ls-tree``."""
+    # Sizes come with the listing, except in partial clones, where they'd
+    # make git fetch every blob
+    long = not _is_partial_clone(repo)
+    out = _run_git(
+        repo,
+        ["ls-tree", "-r", "-z", "--full-tree"]
+        + (["--long"] if long else [])
+        + [tree_sha],
+    )
+    if out is None:
+        raise HTTPException(500, f"Failed to list tree {tree_sha}")
+    entries = []
+    for rec in out.split("\0"):
+        if not rec:
+            continue
+        meta, path = rec.split("\t", 1)
+        fields = meta.split()
+        if fields[1] != "blob":
+            continue
+        size = int(fields[3]) if long and fields[3] != "-" else None
+        entries.append(TreeIndexEntry(path, fields[0], fields[2], size))
+    entries = _fill_tree_index_entries(repo, entries, need_sizes=False)
+    return TreeIndex(tree_sha, {e.path: e for e in entries})
+
+
+def _derive_tree_index(
+    repo: git.Repo, base: TreeIndex, tree_sha: str
+) -> TreeIndex:
+    """Index a tree by applying its diff from an already indexed one."""
+    out = _run_git(
+        repo,
+        ["diff-tree", "-r", "-z", "--no-renames", base.tree_sha, tree_sha],
+    )
+    if out is None:
+        return _build_tree_index(repo, tree_sha)
+    entries = dict(base.entries)
+    changed = []
+    tokens = out.split("\0")
+    for meta, path in zip(tokens[::2], tokens[1::2]):
+        _, new_mode, _, new_sha, status = meta.lstrip(":").split(" ")
+        entries.pop(path, None)
+        if status != "D" and new_mode != _SUBMODULE_MODE:
+            changed.append(TreeIndexEntry(path, new_mode, new_sha, None))
+    for entry in _fill_tree_index_entries(repo, changed, need_sizes=True):
+        entries[entry.path] = entry
+    return TreeIndex(tree_sha, entries)
+
+
+def get_tree_index(repo: git.Repo, ref: str | None = None) -> TreeIndex:
+    """Return the file index of the tree at ``ref`` (default ``HEAD``).
+
+    Indexes are built once per tree SHA and kept in memory and on disk next
+    to the repo cache. A new commit's index is derived from the nearest
+    indexed first-parent ancestor's by applying the diff between them, so
+    it costs the size of the change rather than of the tree. Each entry
+    holds a file's mode, blob SHA and size, and for ``.dvc`` pointers, the
+    path of the output they track.
+    """
+    if ref is not None and (
+        not ref or ref.startswith("-") or any(c in ref for c in " \t\n\r\x00")
+    ):
+        raise HTTPException(400, f"Invalid Git ref: {ref!r}")
+    out = None
+    for candidate in (ref, f"origin/{ref}") if ref else ("HEAD",):
+        out = _run_git(
+            repo,
+            [
+                "log",
+                "--first-parent",
+                f"--max-count={_TREE_INDEX_MAX_DEPTH}",
+                "--format=%T",
+                candidate,
+                "--",
+            ],
+        )
+        if out:
+            break
+    if not out:
+        raise HTTPException(404, f"Git ref '{ref or 'HEAD'}' was not found")
+    tree_shas = out.split()
+    index = _load_tree_index(tree_shas[0])
+    if index is not None:
+        return index
+    with _timed("tree-index", tree=tree_shas[0]):
+        for base_sha in tree_shas[1:]:
+            base = _load_tree_index(base_sha)
+            if base is not None:
+                index = _derive_tree_index(repo, base, tree_shas[0])
+                break
+        else:
+            index = _build_tree_index(repo, tree_shas[0])
+    _save_tree_index(index)
+    return index
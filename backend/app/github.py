@@ -1,5 +1,7 @@
 """GitHub related functionality."""
 
+import hashlib
+import hmac
 import os
 import threading
 import time
@@ -51,6 +53,8 @@ def create_app_token() -> str:
 # before expiry means a GitHub-less user's request doesn't mint a fresh token
 # (two GitHub API calls) on every repo operation. This is a per-worker
 # in-process cache, so each worker mints at most once per repo per ~hour.
+# Tokens are credentials, so they're deliberately kept out of the shared
+# cache (see app.cache).
 _installation_token_cache: dict[tuple[str, str], tuple[str, float]] = {}
 _installation_token_cache_lock = threading.Lock()
 # Refresh this long before GitHub's stated expiry so a cached token can't lapse
@@ -133,6 +137,22 @@ def _mint_app_installation_token(
     return data["token"], data.get("expires_at")
 
 
+def verify_webhook_signature(
+    payload: bytes, signature: str | None, secret: str
+) -> bool:
+    """Check a webhook's ``X-Hub-Signature-256`` header against its body.
+
+    GitHub signs the raw request body with HMAC-SHA256 using the webhook
+    secret and sends it as ``sha256=<hexdigest>``.
+    """
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(
+        secret.encode(), msg=payload, digestmod=hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(signature.removeprefix("sha256="), expected)
+
+
 def token_resp_text_to_dict(resp_text: str) -> dict:
     items = resp_text.split("&")
     out = {}
@@ -0,0 +1,94 @@
+"""MD5 hashing whose running state can be saved and resumed.
+
+Resumable uploads arrive as chunks in separate requests, possibly handled
+by different workers, and the MD5 of the whole object has to be known at
+the end without reading it back from storage. ``hashlib`` objects can't be
+serialized, so ``ResumableMD5`` drives OpenSSL's MD5 directly (the same
+library behind ``hashlib``), whose context is a plain struct that can be
+saved as bytes between chunks.
+
+If OpenSSL's MD5 functions can't be loaded, ``AVAILABLE`` is false, and
+callers have to fall back to hashing the assembled object.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# sizeof(MD5_CTX): A, B, C, D, Nl, Nh, data[16] and num, as 32-bit ints
+_MD5_CTX_BYTES = 92
+
+
+def _load_libcrypto() -> ctypes.CDLL | None:
+    names = ["libcrypto.so.3", ctypes.util.find_library("crypto")]
+    for name in names:
+        if not name:
+            continue
+        try:
+            lib = ctypes.CDLL(name)
+            for func in (lib.MD5_Init, lib.MD5_Update, lib.MD5_Final):
+                func.restype = ctypes.c_int
+            lib.MD5_Update.argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_char_p,
+                ctypes.c_size_t,
+            ]
+        except (OSError, AttributeError):
+            continue
+        return lib
+    return None
+
+
+_lib = _load_libcrypto()
+
+
+class ResumableMD5:
+    """An MD5 hash that can be saved with ``state`` and resumed later by
+    passing that state back in."""
+
+    def __init__(self, state: bytes | None = None) -> None:
+        if _lib is None:
+            raise RuntimeError("OpenSSL MD5 functions are not available")
+        self._ctx = ctypes.create_string_buffer(_MD5_CTX_BYTES)
+        if state is None:
+            _lib.MD5_Init(self._ctx)
+        else:
+            if len(state) != _MD5_CTX_BYTES:
+                raise ValueError("Invalid MD5 state")
+            ctypes.memmove(self._ctx, state, _MD5_CTX_BYTES)
+
+    @property
+    def state(self) -> bytes:
+        return self._ctx.raw
+
+    def update(self, data: bytes) -> None:
+        _lib.MD5_Update(self._ctx, data, len(data))  # type: ignore[union-attr]
+
+    def hexdigest(self) -> str:
+        # Finalize a copy so the hash can still be updated after
+        ctx = ctypes.create_string_buffer(self._ctx.raw, _MD5_CTX_BYTES)
+        digest = ctypes.create_string_buffer(16)
+        _lib.MD5_Final(digest, ctx)  # type: ignore[union-attr]
+        return digest.raw.hex()
+
+
+def _check() -> bool:
+    if _lib is None:
+        return False
+    try:
+        md5 = ResumableMD5()
+        md5.update(b"resumable")
+        md5 = ResumableMD5(md5.state)
+        md5.update(b" md5")
+        return md5.hexdigest() == hashlib.md5(b"resumable md5").hexdigest()
+    except Exception as e:
+        logger.warning(f"Resumable MD5 failed its self-check: {e}")
+        return False
+
+
+AVAILABLE = _check()
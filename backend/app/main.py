@@ -1,7 +1,6 @@
 """Main FastAPI application and entry point for the Calkit Cloud backend."""
 
 import logging
-import os
 import time
 from collections.abc import Awaitable, Callable
 
@@ -13,18 +12,13 @@ from git.exc import GitCommandError
 from pythonjsonlogger import jsonlogger
 from starlette.middleware.cors import CORSMiddleware
 
-from app.api.main import api_router
-from app.config import settings
-
 # Prometheus multiprocess mode requires its data dir to exist *before*
 # prometheus_client is imported (which the instrumentator import below
-# triggers). Create it here so this holds even if the startup script
-# didn't pre-create it.
-_prom_dir = os.environ.get(
-    "PROMETHEUS_MULTIPROC_DIR", os.environ.get("prometheus_multiproc_dir")
-)
-if _prom_dir:
-    os.makedirs(_prom_dir, exist_ok=True)
+# triggers). app.metrics creates it, so this holds even if the startup
+# script didn't pre-create it.
+from app import cache, metrics  # noqa: F401
+from app.api.main import api_router
+from app.config import settings
 
 from prometheus_fastapi_instrumentator import Instrumentator  # noqa: E402
 
@@ -60,6 +54,9 @@ logging.getLogger("uvicorn.access").addFilter(_SkipMetricsAccessLog())
 
 logger = logging.getLogger(__name__)
 
+# Fail at startup, not on first use, if the shared cache is misconfigured
+cache.check_backend()
+
 
 def custom_generate_unique_id(route: APIRoute) -> str:
     if route.tags:
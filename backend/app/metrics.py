@@ -0,0 +1,60 @@
+"""Prometheus metrics for app internals.
+
+Per-request HTTP metrics come from the instrumentator in ``app.main``; the
+metrics here cover background work and caches that requests don't see
+directly.
+
+Prometheus multiprocess mode requires its data dir to exist *before*
+prometheus_client is imported, and this module is imported (via the
+routes) before ``app.main`` sets up the instrumentator, so the dir is
+created here.
+"""
+
+import os
+
+_prom_dir = os.environ.get(
+    "PROMETHEUS_MULTIPROC_DIR", os.environ.get("prometheus_multiproc_dir")
+)
+if _prom_dir:
+    os.makedirs(_prom_dir, exist_ok=True)
+
+from prometheus_client import Counter, Gauge, Histogram  # noqa: E402
+
+# Gauges are aggregated across workers in multiprocess mode; the modes
+# below only take effect when PROMETHEUS_MULTIPROC_DIR is set.
+repo_refresh_queue_depth = Gauge(
+    "calkit_repo_refresh_queue_depth",
+    "Background repo refreshes queued or running",
+    multiprocess_mode="livesum",
+)
+repo_max_age_seconds = Gauge(
+    "calkit_repo_max_age_seconds",
+    "Seconds since the stalest recently-read repo was fetched",
+    multiprocess_mode="livemax",
+)
+repo_cache_requests = Counter(
+    "calkit_repo_cache_requests_total",
+    "Lookups of cached repos, by kind and whether it was already on disk",
+    ["kind", "result"],
+)
+repo_cache_evictions = Counter(
+    "calkit_repo_cache_evictions_total",
+    "Cached repos evicted to stay within the disk budget, by kind",
+    ["kind"],
+)
+repo_cache_evicted_bytes = Counter(
+    "calkit_repo_cache_evicted_bytes_total",
+    "Bytes freed by evicting cached repos",
+)
+repo_cache_size_bytes = Gauge(
+    "calkit_repo_cache_size_bytes",
+    "Disk used by cached repos as of the last eviction pass",
+    multiprocess_mode="mostrecent",
+)
+repo_lock_wait_seconds = Histogram(
+    "calkit_repo_lock_wait_seconds",
+    "Time spent waiting for a cached repo's update lock, by kind and "
+    "outcome (acquired, coalesced with another update, or timed out)",
+    ["kind", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
@@ -561,6 +561,9 @@ class Project(ProjectBase, table=True):
     file_locks: list["FileLock"] = Relationship(
         back_populates="project", cascade_delete=True
     )
+    git_heads: list["ProjectGitHead"] = Relationship(
+        back_populates="project", cascade_delete=True
+    )
     project_comments: list["ProjectComment"] = Relationship(
         back_populates="project", cascade_delete=True
     )
@@ -1052,9 +1055,102 @@ class FileLock(SQLModel, table=True):
         return self.user.email
 
 
+class ProjectGitHead(SQLModel, table=True):
+    """The latest known head of a branch on a project's Git remote.
+
+    Recorded from GitHub push webhooks so cached clones can tell whether
+    they're stale without polling the remote.
+    """
+
+    project_id: uuid.UUID = Field(foreign_key="project.id", primary_key=True)
+    branch: str = Field(primary_key=True)
+    sha: str = Field(max_length=40)
+    updated: datetime = Field(default_factory=utcnow)
+    # Relationships
+    project: Project = Relationship(back_populates="git_heads")
+
+
+class DvcObject(SQLModel, table=True):
+    """An object known to be in a project's DVC storage.
+
+    Lets presence checks skip object storage round trips. Rows are added
+    when an object is uploaded or a probe finds it, and reconciled against
+    the bucket by ``scripts/reconcile-dvc-objects.py``. See
+    ``app.object_index``.
+    """
+
+    owner_name: str = Field(primary_key=True, max_length=255)
+    project_name: str = Field(primary_key=True, max_length=255)
+    # Includes the ``.dir`` suffix for directory manifests
+    md5: str = Field(primary_key=True, max_length=40)
+    # Stored in the old layout, without ``files/md5/``
+    legacy: bool = False
+    # A reference to the object in the shared store rather than a copy in
+    # the project's prefix. See ``app.shared_objects``.
+    shared: bool = Field(
+        default=False,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.Boolean, nullable=False, server_default="false"
+        ),
+    )
+    size: int | None = Field(
+        default=None, sa_column=sqlalchemy.Column(sqlalchemy.BigInteger)
+    )
+    created: datetime = Field(default_factory=utcnow)
+
+
+class DvcSharedObject(SQLModel, table=True):
+    """An object in the shared, content-addressed DVC store.
+
+    ``refcount`` is the number of projects referencing the object, i.e.,
+    ``dvcobject`` rows with ``shared`` set. Objects are garbage collected a
+    while after it drops to zero. See ``app.shared_objects``.
+    """
+
+    md5: str = Field(primary_key=True, max_length=40)
+    size: int | None = Field(
+        default=None, sa_column=sqlalchemy.Column(sqlalchemy.BigInteger)
+    )
+    refcount: int = Field(
+        default=0,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.Integer, nullable=False, server_default="0"
+        ),
+    )
+    # SHA-256 of the stored content, recorded the first time an upload is
+    # checked against it, so MD5 collisions aren't deduplicated
+    sha256: str | None = Field(default=None, max_length=64)
+    created: datetime = Field(default_factory=utcnow)
+    # When the last reference was removed, if there are none
+    released: datetime | None = Field(default=None, index=True)
+
+
+class StorageLedger(SQLModel, table=True):
+    """Bytes each project uses in object storage.
+
+    Kept current by deltas as objects are written, and periodically
+    reconciled against a listing of the owner's storage. See
+    ``app.storage.get_storage_usage``.
+    """
+
+    owner_name: str = Field(primary_key=True, max_length=64)
+    # Empty for objects outside any project's prefix
+    project_name: str = Field(primary_key=True, max_length=255)
+    size: int = Field(
+        default=0,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.BigInteger, nullable=False, server_default="0"
+        ),
+    )
+    updated: datetime = Field(default_factory=utcnow)
+    reconciled: datetime = Field(default_factory=utcnow)
+
+
 class StorageUsage(BaseModel):
     limit_gb: float
     used_gb: float
+    # Usage of each of the owner's projects
+    by_project_gb: dict[str, float] = {}
 
 
 class ItemLock(BaseModel):
@@ -1228,3 +1324,80 @@ class GitRef(BaseModel):
     is_default: bool = False  # Whether this is the default branch
     ahead: int = 0  # Commits ahead of default branch
     behind: int = 0  # Commits behind default branch
+
+
+class DvcUploadSession(SQLModel, table=True):
+    """A resumable upload of an object to a project's DVC storage.
+
+    Each chunk is stored as its own object under the session's prefix, and
+    they're concatenated once the last one arrives. Sessions that aren't
+    completed are deleted once they expire. See ``app.upload_sessions``.
+    """
+
+    id: str = Field(primary_key=True, max_length=64)
+    owner_name: str = Field(max_length=255)
+    project_name: str = Field(max_length=255)
+    # Includes the ``.dir`` suffix for directory manifests
+    md5: str = Field(max_length=40)
+    size: int = Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.BigInteger, nullable=False)
+    )
+    # Bytes received so far, i.e., the offset of the next chunk
+    received: int = Field(
+        default=0,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.BigInteger, nullable=False, server_default="0"
+        ),
+    )
+    # Running MD5 of the bytes received so far. See ``app.hashing``.
+    md5_state: bytes | None = Field(
+        default=None, sa_column=sqlalchemy.Column(sqlalchemy.LargeBinary)
+    )
+    # Storage paths of the chunks received so far, in order
+    parts: list[str] = Field(
+        default_factory=list,
+        sa_column=sqlalchemy.Column(sqlalchemy.JSON, nullable=False),
+    )
+    created: datetime = Field(default_factory=utcnow)
+    expires: datetime = Field(index=True)
+
+
+class DvcObjectImport(SQLModel, table=True):
+    """A copy of DVC objects from one project's storage into another's.
+
+    Holds the import's request and progress, so it can be reported by any
+    worker and resumed if the worker running it stops. See
+    ``app.dvc_imports``.
+    """
+
+    id: str = Field(primary_key=True, max_length=64)
+    owner_name: str = Field(max_length=255)
+    project_name: str = Field(max_length=255)
+    src_owner_name: str = Field(max_length=255)
+    src_project_name: str = Field(max_length=255)
+    # As requested, before .dir manifests are expanded
+    md5s: list[str] = Field(
+        default_factory=list,
+        sa_column=sqlalchemy.Column(sqlalchemy.JSON, nullable=False),
+    )
+    # The owner's limit when the import was started
+    storage_limit_gb: float
+    # One of "running", "completed" or "failed"
+    status: str = Field(default="running", max_length=16)
+    total: int | None = None
+    copied: int = 0
+    referenced: int = 0
+    skipped: int = 0
+    missing: int = 0
+    failed: int = 0
+    bytes_copied: int = Field(
+        default=0,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.BigInteger, nullable=False, server_default="0"
+        ),
+    )
+    error: str | None = None
+    created: datetime = Field(default_factory=utcnow)
+    # Bumped periodically while a worker has the import, so one whose
+    # worker stopped can be told apart and resumed
+    updated: datetime = Field(default_factory=utcnow, index=True)
@@ -0,0 +1,245 @@
+"""Node-local disk cache for small, immutable DVC objects.
+
+DVC objects are content-addressed: an object's path in storage is its MD5,
+so its bytes never change. ``.dir`` manifests in particular are read on
+nearly every project request (to expand directory outputs), and reading
+one from object storage costs a network round trip. Instead, objects read
+once are kept on local disk at ``{CACHE_DIR}/{md5[:2]}/{md5[2:]}``, shared
+by every worker on the node and across restarts.
+
+Entries are written to a temporary file and renamed into place, so readers
+never see a partial object and need no locks. Each read touches the
+entry's mtime, and once the cache exceeds
+``settings.DVC_OBJECT_CACHE_MAX_MB``, the least recently read entries are
+deleted.
+
+Which ``.dir`` objects each project needs is journaled under
+``.projects/``, so ``prewarm`` can fetch those of the most recently
+accessed projects that aren't on disk (e.g., after eviction or on a fresh
+node) before a request asks for them.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from filelock import FileLock, Timeout
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "/tmp/.dvc-objects"
+# Only objects up to this size are cached
+MAX_OBJECT_BYTES = 16 * 1024 * 1024
+# Check the budget after this many writes per process
+PRUNE_EVERY = 200
+# How many of the most recently accessed projects to prewarm
+PREWARM_PROJECTS = 50
+# Rewrite a project's journal at most this often if its objects are the same
+JOURNAL_TOUCH_SECONDS = 60
+
+_JOURNAL_DIRNAME = ".projects"
+_writes = 0
+_writes_lock = threading.Lock()
+_prewarm_started = False
+
+
+def _get_fpath(md5: str) -> str:
+    return os.path.join(CACHE_DIR, md5[:2], md5[2:])
+
+
+def _is_valid_md5(md5: str) -> bool:
+    digest = md5.removesuffix(".dir")
+    return len(digest) == 32 and all(c in "0123456789abcdef" for c in digest)
+
+
+def get(md5: str) -> bytes | None:
+    """Return an object's bytes if it's cached on this node."""
+    if not _is_valid_md5(md5):
+        return None
+    fpath = _get_fpath(md5)
+    try:
+        with open(fpath, "rb") as f:
+            data = f.read()
+        os.utime(fpath)
+    except OSError:
+        return None
+    return data
+
+
+def put(md5: str, data: bytes) -> bool:
+    """Cache an object's bytes, returning whether they were stored.
+
+    Bytes that don't hash to ``md5`` aren't stored, so a corrupt read can
+    never poison the cache.
+    """
+    global _writes
+    if not _is_valid_md5(md5) or len(data) > MAX_OBJECT_BYTES:
+        return False
+    if hashlib.md5(data).hexdigest() != md5.removesuffix(".dir"):
+        logger.warning(f"Not caching DVC object {md5}: MD5 does not match")
+        return False
+    fpath = _get_fpath(md5)
+    try:
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        fd, tmp_fpath = tempfile.mkstemp(dir=os.path.dirname(fpath))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_fpath, fpath)
+    except OSError as e:
+        logger.warning(f"Failed to cache DVC object {md5}: {e}")
+        return False
+    with _writes_lock:
+        _writes += 1
+        due = _writes % PRUNE_EVERY == 0
+    if due:
+        prune()
+    return True
+
+
+def prune(max_bytes: float | None = None) -> None:
+    """Delete the least recently read objects until the cache fits its
+    budget. Only one worker on the node prunes at a time."""
+    if max_bytes is None:
+        max_bytes = settings.DVC_OBJECT_CACHE_MAX_MB * 1024 * 1024
+    if max_bytes <= 0:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    try:
+        with FileLock(os.path.join(CACHE_DIR, "prune.lock"), timeout=0):
+            _prune(max_bytes)
+    except Timeout:
+        pass
+
+
+def _prune(max_bytes: float) -> None:
+    entries = []
+    total = 0
+    with os.scandir(CACHE_DIR) as subdirs:
+        for subdir in subdirs:
+            if len(subdir.name) != 2 or not subdir.is_dir():
+                continue
+            with os.scandir(subdir.path) as files:
+                for entry in files:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+    entries.sort()
+    for _, size, fpath in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(fpath)
+        except OSError:
+            continue
+        total -= size
+
+
+def _get_journal_fpath(owner_name: str, project_name: str) -> str:
+    return os.path.join(
+        CACHE_DIR, _JOURNAL_DIRNAME, owner_name, f"{project_name}.json"
+    )
+
+
+def record_project_objects(
+    owner_name: str, project_name: str, paths: dict[str, str]
+) -> None:
+    """Journal the objects a project needs, keyed by MD5 with their path in
+    object storage, for ``prewarm``."""
+    fpath = _get_journal_fpath(owner_name.lower(), project_name.lower())
+    try:
+        with open(fpath) as f:
+            if json.load(f) == paths:
+                # Only the access time needs updating
+                if time.time() - os.path.getmtime(fpath) > (
+                    JOURNAL_TOUCH_SECONDS
+                ):
+                    os.utime(fpath)
+                return
+    except (OSError, ValueError):
+        pass
+    try:
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        fd, tmp_fpath = tempfile.mkstemp(dir=os.path.dirname(fpath))
+        with os.fdopen(fd, "w") as f:
+            json.dump(paths, f)
+        os.replace(tmp_fpath, fpath)
+    except OSError as e:
+        logger.warning(f"Failed to journal objects for {fpath}: {e}")
+
+
+def prewarm(fs, max_projects: int = PREWARM_PROJECTS) -> int:
+    """Fetch missing objects for the most recently accessed projects.
+
+    Returns the number of objects fetched.
+    """
+    journal_dir = os.path.join(CACHE_DIR, _JOURNAL_DIRNAME)
+    journals = []
+    for dirpath, _, filenames in os.walk(journal_dir):
+        for fname in filenames:
+            fpath = os.path.join(dirpath, fname)
+            try:
+                journals.append((os.path.getmtime(fpath), fpath))
+            except OSError:
+                pass
+    journals.sort(reverse=True)
+    missing: dict[str, str] = {}
+    for _, fpath in journals[:max_projects]:
+        try:
+            with open(fpath) as f:
+                paths = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for md5, path in paths.items():
+            if md5 not in missing and not os.path.exists(_get_fpath(md5)):
+                missing[md5] = path
+
+    def _fetch(item: tuple[str, str]) -> bool:
+        md5, path = item
+        try:
+            with fs.open(path, "rb") as f:
+                return put(md5, f.read())
+        except Exception as e:
+            logger.info(f"Failed to prewarm {path}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        n_fetched = sum(executor.map(_fetch, missing.items()))
+    if n_fetched:
+        logger.info(f"Prewarmed {n_fetched} DVC objects")
+    return n_fetched
+
+
+def start_prewarm(get_fs) -> None:
+    """Prewarm in a background thread, once per process, if no other worker
+    on the node is already doing it."""
+    global _prewarm_started
+    if _prewarm_started:
+        return
+    _prewarm_started = True
+
+    def _run() -> None:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with FileLock(os.path.join(CACHE_DIR, "prewarm.lock"), timeout=0):
+                prewarm(get_fs())
+        except Timeout:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to prewarm DVC object cache: {e}")
+
+    threading.Thread(
+        target=_run, name="dvc-object-prewarm", daemon=True
+    ).start()
@@ -0,0 +1,322 @@
+"""Index of which DVC objects are in each project's object storage.
+
+Answering "is MD5 X in storage?" used to take one or two ``fs.exists``
+calls (the current ``files/md5`` layout, then the legacy one), and pipeline
+statuses and directory listings fan out hundreds of them. Instead, known
+objects are recorded in the ``dvcobject`` table, keyed by owner, project
+and MD5 (mirroring the storage layout), so a batch of checks is one indexed
+query.
+
+Rows are added when an object is uploaded through the DVC remote, when a
+probe finds one the index didn't know about, and by ``reconcile``, which
+rebuilds a project's rows from a listing of its storage (see
+``scripts/reconcile-dvc-objects.py``). Only MD5s the index doesn't know are
+probed in storage, and those found missing are remembered briefly, since
+they may be uploaded at any time.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, delete, select
+
+from app import cache, utcnow
+from app.db import engine
+from app.models import DvcObject
+from app.storage import (
+    get_data_prefix_for_owner,
+    make_data_fpath,
+    make_shared_data_fpath,
+)
+
+logger = logging.getLogger(__name__)
+
+# Max concurrent storage probes for MD5s the index doesn't know
+PROBE_MAX_WORKERS = 16
+# Max MD5s per query
+_QUERY_CHUNK = 1000
+
+# How long MD5s probed and found missing are remembered
+MISSING_TTL_SECONDS = 60
+# Max missing MD5s remembered per project
+MISSING_MAX_MD5S = 10_000
+
+# MD5s probed and found missing, by owner and project, as one entry of
+# ``{md5: expires_at}`` so a batch is a single round trip to the backend
+_missing_cache = cache.Namespace(
+    "dvc-object-missing", ttl=MISSING_TTL_SECONDS, version=2
+)
+
+
+class ObjectInfo(NamedTuple):
+    path: str
+    legacy: bool
+    size: int | None
+    # Referenced in the shared store rather than in the project's prefix
+    shared: bool = False
+
+
+def _is_valid_md5(md5: str) -> bool:
+    digest = md5.removesuffix(".dir")
+    return len(digest) == 32 and all(c in "0123456789abcdef" for c in digest)
+
+
+def get_object_fpath(
+    owner_name: str, project_name: str, md5: str, legacy: bool = False
+) -> str:
+    return make_data_fpath(
+        owner_name=owner_name,
+        project_name=project_name,
+        idx=md5[:2],
+        md5=md5[2:],
+        legacy=legacy,
+    )
+
+
+def _get_missing(owner_name: str, project_name: str) -> dict[str, float]:
+    """Get a project's MD5s recently found missing, with when they stop
+    being remembered."""
+    now = time.time()
+    missing = _missing_cache.get((owner_name, project_name)) or {}
+    return {md5: t for md5, t in missing.items() if t > now}
+
+
+def _add_missing(owner_name: str, project_name: str, md5s: list[str]) -> None:
+    # Re-read to keep what other requests have added meanwhile
+    missing = _get_missing(owner_name, project_name)
+    expires_at = time.time() + MISSING_TTL_SECONDS
+    missing.update(dict.fromkeys(md5s, expires_at))
+    if len(missing) > MISSING_MAX_MD5S:
+        missing = dict(
+            sorted(missing.items(), key=lambda item: item[1])[
+                -MISSING_MAX_MD5S:
+            ]
+        )
+    _missing_cache.set((owner_name, project_name), missing)
+
+
+def find_objects(
+    owner_name: str, project_name: str, md5s: Iterable[str], fs
+) -> dict[str, ObjectInfo | None]:
+    """Look up where each MD5 is in a project's object storage.
+
+    Returns ``{md5: info}``, where ``info`` is None for objects that aren't
+    in storage.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    res: dict[str, ObjectInfo | None] = {}
+    for md5 in md5s:
+        if md5 and len(md5) >= 3:
+            res[md5] = None
+    known = get_indexed_objects(owner_name, project_name, list(res))
+    res.update(known)
+    # Objects that get stored are indexed, which takes precedence, so
+    # missing ones needn't be forgotten when they're uploaded
+    missing = _get_missing(owner_name, project_name)
+    unknown = [md5 for md5 in res if md5 not in known and md5 not in missing]
+    if not unknown:
+        return res
+
+    def _probe(md5: str) -> tuple[str, bool | None, bool]:
+        """Get whether an object is in the legacy layout, or None if it
+        wasn't found, and whether it could be checked."""
+        for legacy in (False, True):
+            fpath = get_object_fpath(owner_name, project_name, md5, legacy)
+            try:
+                if fs.exists(fpath):
+                    return md5, legacy, True
+            except Exception as e:
+                logger.warning(f"Failed existence check for {fpath}: {e}")
+                return md5, None, False
+        return md5, None, True
+
+    found = []
+    newly_missing = []
+    with ThreadPoolExecutor(
+        max_workers=min(PROBE_MAX_WORKERS, len(unknown))
+    ) as executor:
+        for md5, legacy, checked in executor.map(_probe, unknown):
+            if legacy is None:
+                if checked:
+                    newly_missing.append(md5)
+                continue
+            res[md5] = ObjectInfo(
+                get_object_fpath(owner_name, project_name, md5, legacy),
+                legacy,
+                None,
+            )
+            found.append((md5, legacy, None))
+    if found:
+        record_objects(owner_name, project_name, found)
+    if newly_missing:
+        _add_missing(owner_name, project_name, newly_missing)
+    return res
+
+
+def find_object(
+    owner_name: str, project_name: str, md5: str, fs
+) -> ObjectInfo | None:
+    return find_objects(owner_name, project_name, [md5], fs).get(md5)
+
+
+def get_indexed_objects(
+    owner_name: str, project_name: str, md5s: list[str]
+) -> dict[str, ObjectInfo]:
+    """Look up MD5s in the index only, without probing storage."""
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    res = {}
+    md5s = [md5 for md5 in md5s if _is_valid_md5(md5)]
+    if not md5s:
+        return res
+    try:
+        with Session(engine) as session:
+            for start in range(0, len(md5s), _QUERY_CHUNK):
+                rows = session.exec(
+                    select(
+                        DvcObject.md5,
+                        DvcObject.legacy,
+                        DvcObject.size,
+                        DvcObject.shared,
+                    ).where(
+                        DvcObject.owner_name == owner_name,
+                        DvcObject.project_name == project_name,
+                        col(DvcObject.md5).in_(
+                            md5s[start : start + _QUERY_CHUNK]
+                        ),
+                    )
+                ).all()
+                for md5, legacy, size, shared in rows:
+                    if shared:
+                        fpath = make_shared_data_fpath(md5)
+                    else:
+                        fpath = get_object_fpath(
+                            owner_name, project_name, md5, legacy
+                        )
+                    res[md5] = ObjectInfo(fpath, legacy, size, shared)
+    except Exception as e:
+        # Fall back to probing storage for everything
+        logger.warning(f"Failed to query DVC object index: {e}")
+    return res
+
+
+def record_objects(
+    owner_name: str,
+    project_name: str,
+    objects: list[tuple[str, bool, int | None]],
+) -> None:
+    """Add ``(md5, legacy, size)`` objects to a project's index.
+
+    Existing rows take the new layout, and the new size if it's known,
+    unless they reference the shared store, which is left to
+    ``app.shared_objects``.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    values = [
+        dict(
+            owner_name=owner_name,
+            project_name=project_name,
+            md5=md5,
+            legacy=legacy,
+            size=size,
+            created=utcnow(),
+        )
+        for md5, legacy, size in objects
+        if _is_valid_md5(md5)
+    ]
+    if not values:
+        return
+    try:
+        with Session(engine) as session:
+            for start in range(0, len(values), _QUERY_CHUNK):
+                stmt = insert(DvcObject).values(
+                    values[start : start + _QUERY_CHUNK]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["owner_name", "project_name", "md5"],
+                    set_=dict(
+                        legacy=stmt.excluded.legacy,
+                        size=func.coalesce(
+                            stmt.excluded.size, DvcObject.__table__.c.size
+                        ),
+                    ),
+                    where=DvcObject.__table__.c.shared.is_(False),
+                )
+                session.exec(stmt)  # type: ignore
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to record DVC objects: {e}")
+
+
+def _list_objects(owner_name: str, project_name: str, fs) -> dict:
+    """List a project's objects in storage as ``{md5: (legacy, size)}``,
+    preferring the current layout if an object is in both."""
+    res = {}
+    project_prefix = f"{get_data_prefix_for_owner(owner_name)}/{project_name}"
+    layouts = [
+        (True, project_prefix, 2),
+        (False, f"{project_prefix}/files/md5", None),
+    ]
+    for legacy, prefix, maxdepth in layouts:
+        root = fs._strip_protocol(prefix).rstrip("/")
+        try:
+            listing = fs.find(prefix, maxdepth=maxdepth, detail=True)
+        except FileNotFoundError:
+            continue
+        for fpath, info in listing.items():
+            idx_dir, fname = os.path.split(fpath)
+            parent, idx = os.path.split(idx_dir)
+            md5 = idx + fname
+            if parent != root or len(idx) != 2 or not _is_valid_md5(md5):
+                continue
+            res[md5] = (legacy, info.get("size"))
+    return res
+
+
+def reconcile(owner_name: str, project_name: str, fs) -> tuple[int, int]:
+    """Rebuild a project's index from a listing of its storage.
+
+    References to the shared store aren't in the listing, so they're left
+    alone. Returns the number of rows added and removed.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    listed = _list_objects(owner_name, project_name, fs)
+    with Session(engine) as session:
+        indexed = set(
+            session.exec(
+                select(DvcObject.md5).where(
+                    DvcObject.owner_name == owner_name,
+                    DvcObject.project_name == project_name,
+                    col(DvcObject.shared).is_(False),
+                )
+            ).all()
+        )
+        stale = sorted(indexed - set(listed))
+        for start in range(0, len(stale), _QUERY_CHUNK):
+            session.exec(  # type: ignore
+                delete(DvcObject).where(
+                    col(DvcObject.owner_name) == owner_name,
+                    col(DvcObject.project_name) == project_name,
+                    col(DvcObject.shared).is_(False),
+                    col(DvcObject.md5).in_(
+                        stale[start : start + _QUERY_CHUNK]
+                    ),
+                )
+            )
+        session.commit()
+    record_objects(
+        owner_name,
+        project_name,
+        [(md5, legacy, size) for md5, (legacy, size) in listed.items()],
+    )
+    return len(set(listed) - indexed), len(stale)
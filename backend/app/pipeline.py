@@ -14,46 +14,39 @@ when ``dvc.yaml`` needs recompiling from ``calkit.yaml``).
 from __future__ import annotations
 
 import hashlib
-import io
 import itertools
 import json
 import logging
 import re
-import threading
-import time
-from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
 
-import ruamel.yaml
 from pydantic import BaseModel, Field
 
-from app.dvc import get_data_fpath_for_md5
+from app import cache
+from app.documents import read_document
 from app.git import RepoTree
+from app.object_index import find_objects
 
 logger = logging.getLogger(__name__)
 
-_yaml = ruamel.yaml.YAML(typ="safe")
-
 StatusLiteral = Literal[
     "up-to-date", "stale", "not-run", "unknown", "always-run", "frozen"
 ]
 OverallStatusLiteral = Literal["up-to-date", "stale", "unknown"]
 
 # Object-storage existence checks are the dominant cost in
-# compute_stage_statuses (one+ network round-trip per dep/out md5). We both
-# parallelize them within a computation and cache the whole result keyed by a
+# compute_stage_statuses (one lookup per dep/out md5). They're batched
+# through the object index, and the whole result is cached keyed by a
 # content token (the tree/commit SHA) so repeat reads of the same ref are free.
-_STORAGE_CHECK_MAX_WORKERS = 16
-_STAGE_STATUS_CACHE_MAX = 64
 # TTL bounds the one non-deterministic dimension: objects uploaded after a
 # cache entry was written (the SHA pins everything in the tree itself).
 _STAGE_STATUS_CACHE_TTL_S = 600
-_stage_status_cache: "OrderedDict[str, tuple[float, dict[str, StageStatus]]]" = OrderedDict()
-# Sync endpoints run in a threadpool, so cache reads/evictions/writes can happen
-# concurrently. Guard every mutation with this lock to keep the OrderedDict and
-# its LRU order consistent.
-_stage_status_cache_lock = threading.Lock()
+# Shared across workers, so each ref's statuses are computed once
+_stage_status_cache = cache.Namespace(
+    "stage-status",
+    ttl=_STAGE_STATUS_CACHE_TTL_S,
+    local_ttl=_STAGE_STATUS_CACHE_TTL_S,
+)
 
 
 class StageStatus(BaseModel):
@@ -92,9 +85,9 @@ def _get_uncached_out_paths(dvc_stage: dict | None) -> set[str]:
     return paths
 
 
-def _safe_yaml_load(data: bytes) -> dict | None:
+def _safe_read_yaml(tree: RepoTree, path: str) -> dict | None:
     try:
-        return _yaml.load(io.BytesIO(data))
+        return read_document(tree, path)
     except Exception as e:
         logger.warning(f"Failed to parse YAML: {e}")
         return None
@@ -105,7 +98,7 @@ def _read_dvc_pointer_md5(tree: RepoTree, path: str) -> str | None:
     dvc_path = path + ".dvc"
     if not tree.is_file(dvc_path):
         return None
-    data = _safe_yaml_load(tree.read_bytes(dvc_path))
+    data = _safe_read_yaml(tree, dvc_path)
     if not data:
         return None
     outs = data.get("outs") or []
@@ -124,33 +117,14 @@ def _hash_tree_file(tree: RepoTree, path: str) -> str | None:
         return None
 
 
-def _md5_in_object_storage(
-    md5: str | None, owner_name: str, project_name: str, fs
-) -> bool:
-    if not md5:
-        return False
-    try:
-        return (
-            get_data_fpath_for_md5(
-                owner_name=owner_name,
-                project_name=project_name,
-                md5=md5,
-                fs=fs,
-            )
-            is not None
-        )
-    except Exception as e:
-        logger.warning(f"Object storage existence check failed for {md5}: {e}")
-        return False
-
-
 def _precompute_storage_presence(
     dvc_lock: dict, owner_name: str, project_name: str, fs
 ) -> dict[str, bool]:
-    """Existence in object storage for every dep/out md5, checked in parallel.
+    """Existence in object storage for every dep/out md5.
 
-    Replaces the serial per-md5 ``fs.exists`` round-trips with one concurrent
-    batch. Returns a ``{md5: present}`` map; md5s absent from the map are
+    Looked up in one batch through the object index (see
+    ``app.object_index``), which only probes storage for md5s it doesn't
+    know. Returns a ``{md5: present}`` map; md5s absent from the map are
     treated as not present by callers.
     """
     md5s: set[str] = set()
@@ -161,19 +135,12 @@ def _precompute_storage_presence(
                 md5s.add(m)
     if not md5s:
         return {}
-    presence: dict[str, bool] = {}
-    workers = min(_STORAGE_CHECK_MAX_WORKERS, len(md5s))
-    with ThreadPoolExecutor(max_workers=workers) as ex:
-        results = ex.map(
-            lambda m: (
-                m,
-                _md5_in_object_storage(m, owner_name, project_name, fs),
-            ),
-            md5s,
-        )
-        for m, present in results:
-            presence[m] = present
-    return presence
+    try:
+        objects = find_objects(owner_name, project_name, md5s, fs)
+    except Exception as e:
+        logger.warning(f"Object storage existence check failed: {e}")
+        return {}
+    return {m: info is not None for m, info in objects.items()}
 
 
 def _build_stage_status_cache_key(
@@ -190,29 +157,6 @@ def _build_stage_status_cache_key(
     return h.hexdigest()
 
 
-def _stage_status_cache_get(cache_key: str) -> dict[str, StageStatus] | None:
-    with _stage_status_cache_lock:
-        cached = _stage_status_cache.get(cache_key)
-        if cached is None:
-            return None
-        cached_at, value = cached
-        if time.monotonic() - cached_at > _STAGE_STATUS_CACHE_TTL_S:
-            del _stage_status_cache[cache_key]
-            return None
-        _stage_status_cache.move_to_end(cache_key)
-        return value
-
-
-def _stage_status_cache_put(
-    cache_key: str, value: dict[str, StageStatus]
-) -> None:
-    with _stage_status_cache_lock:
-        _stage_status_cache[cache_key] = (time.monotonic(), value)
-        _stage_status_cache.move_to_end(cache_key)
-        if len(_stage_status_cache) > _STAGE_STATUS_CACHE_MAX:
-            _stage_status_cache.popitem(last=False)
-
-
 def _build_outs_index(dvc_lock: dict) -> dict[str, str | None]:
     """Map out path -> md5 across all stages in the lock."""
     out_map: dict[str, str | None] = {}
@@ -361,7 +305,7 @@ def compute_stage_statuses(
         owner_name, project_name, cache_token
     )
     if cache_key is not None:
-        hit = _stage_status_cache_get(cache_key)
+        hit = _stage_status_cache.get(cache_key)
         if hit is not None:
             return hit
     if fs is None:
@@ -474,9 +418,7 @@ def compute_stage_statuses(
                 for key in locked_params:
                     modified_inputs.append(f"{params_file}:{key}")
                 continue
-            current_params = (
-                _safe_yaml_load(tree.read_bytes(params_file)) or {}
-            )
+            current_params = _safe_read_yaml(tree, params_file) or {}
             for key, locked_val in locked_params.items():
                 if _get_nested(current_params, key) != locked_val:
                     modified_inputs.append(f"{params_file}:{key}")
@@ -556,7 +498,7 @@ def compute_stage_statuses(
         # with no missing outputs are pinned by the SHA and safe to cache.
         storage_dependent = any(s.missing_outputs for s in result.values())
         if not storage_dependent:
-            _stage_status_cache_put(cache_key, result)
+            _stage_status_cache.set(cache_key, result)
     return result
 
 
@@ -5,34 +5,32 @@ import hashlib
 import json
 import logging
 import os
-import threading
 import time
-from collections import OrderedDict
 from typing import Literal, NamedTuple
 
 import git
 import requests
 import sqlalchemy
-import yaml
 from calkit.notebooks import get_executed_notebook_path
 from fastapi import HTTPException
 from sqlmodel import Session, select
 
 import app.users
+from app import cache
 from app.config import settings
-
-
-# libyaml's C loader is ~10x faster than the pure-Python SafeLoader on
-# large dvc.lock files. The Dockerfile asserts `yaml.__with_libyaml__`, so
-# we can rely on CSafeLoader being present in all deployed environments.
-def _yaml_load(data: bytes | str):
-    return yaml.load(data, Loader=yaml.CSafeLoader)
+from app.documents import (
+    get_blob_sha,
+    load_yaml,
+    parse_blob,
+    read_document,
+)
 
 
 from app.git import RepoTree, get_repo_tree_for_ref
-from app.core import CATEGORIES_PLURAL_TO_SINGULAR, params_from_url, ryaml
+from app.core import CATEGORIES_PLURAL_TO_SINGULAR, params_from_url
 from app.dvc import expand_dvc_lock_outs
 from app.dvc import get_data_fpath_for_md5
+from app.object_index import find_object, record_objects
 from app.pipeline import find_stage_for_path
 from app.git import (
     get_ck_info_from_repo,
@@ -53,6 +51,7 @@ from app.storage import (
     get_object_fs,
     get_object_url,
     make_data_fpath,
+    record_storage_usage,
     remove_gcs_content_type,
 )
 
@@ -81,17 +80,17 @@ class CkInfoAndOuts(NamedTuple):
 # (owner/project influence DVC object-storage paths resolved during
 # expansion). Invalidates automatically whenever any of those source files
 # change. Hot-path cost of expanding an 8k-line dvc.lock dominates
-# get_contents_from_tree; caching it removes that work from repeat reads.
-_CK_DVC_CACHE_MAX = 64
+# get_contents_from_tree; caching it removes that work from repeat reads,
+# and sharing it across workers means each project is expanded once rather
+# than once per worker.
 # 10 minute TTL caps staleness in the rare case where dvc.lock is unchanged
 # but new DVC objects (e.g., a .dir blob) have since been uploaded to object
 # storage; cache_key is derived from dvc.lock bytes so normal edits already
 # invalidate immediately.
 _CK_DVC_CACHE_TTL_S = 600
-_ck_dvc_cache: OrderedDict[str, tuple[float, CkInfoAndOuts]] = OrderedDict()
-# Sync endpoints run in a threadpool, so guard the (cheap) cache read/write
-# sections; the expensive expansion between them runs unlocked.
-_ck_dvc_cache_lock = threading.Lock()
+_ck_dvc_cache = cache.Namespace(
+    "ck-dvc-outs", ttl=_CK_DVC_CACHE_TTL_S, local_ttl=_CK_DVC_CACHE_TTL_S
+)
 
 
 def _resolve_github_collaborator_access(
@@ -292,17 +291,7 @@ def get_ck_info_and_dvc_outs_from_tree(
     h.update(hashlib.sha1(dvc_bytes).digest())
     h.update(hashlib.sha1(zip_bytes).digest())
     cache_key = h.hexdigest()
-    now = time.monotonic()
-    with _ck_dvc_cache_lock:
-        cached = _ck_dvc_cache.get(cache_key)
-        hit_value = None
-        if cached is not None:
-            cached_at, value = cached
-            if now - cached_at <= _CK_DVC_CACHE_TTL_S:
-                _ck_dvc_cache.move_to_end(cache_key)
-                hit_value = value
-            else:
-                del _ck_dvc_cache[cache_key]
+    hit_value = _ck_dvc_cache.get(cache_key)
     if hit_value is not None:
         logger.info(
             f"ck/dvc cache hit for {owner_name}/{project_name} "
@@ -314,8 +303,16 @@ def get_ck_info_and_dvc_outs_from_tree(
         f"(read {t_read * 1000:.0f}ms)"
     )
     t1 = time.perf_counter()
-    ck_info = (_yaml_load(ck_bytes) or {}) if ck_bytes else {}
-    dvc_lock = (_yaml_load(dvc_bytes) or {}) if dvc_bytes else {}
+    ck_info = (
+        (parse_blob(get_blob_sha(ck_bytes), lambda: ck_bytes) or {})
+        if ck_bytes
+        else {}
+    )
+    dvc_lock = (
+        (parse_blob(get_blob_sha(dvc_bytes), lambda: dvc_bytes) or {})
+        if dvc_bytes
+        else {}
+    )
     t_parse = time.perf_counter() - t1
     logger.info(f"Parsed calkit.yaml and dvc.lock in {t_parse * 1000:.0f}ms")
     t2 = time.perf_counter()
@@ -332,10 +329,7 @@ def get_ck_info_and_dvc_outs_from_tree(
         except Exception:
             logger.warning("Failed to parse .calkit/zip/paths.json")
     result = CkInfoAndOuts(ck_info, dvc_lock_outs, zip_path_map, dvc_lock)
-    with _ck_dvc_cache_lock:
-        _ck_dvc_cache[cache_key] = (now, result)
-        if len(_ck_dvc_cache) > _CK_DVC_CACHE_MAX:
-            _ck_dvc_cache.popitem(last=False)
+    _ck_dvc_cache.set(cache_key, result)
     return result
 
 
@@ -399,8 +393,9 @@ def get_contents_from_tree(
             )
             continue
         for item in itemlist:
-            item["kind"] = CATEGORIES_PLURAL_TO_SINGULAR[category]
-            ck_objects[item["path"]] = item
+            ck_objects[item["path"]] = item | dict(
+                kind=CATEGORIES_PLURAL_TO_SINGULAR[category]
+            )
             # Handle files inside references objects
             if category == "references":
                 ref_item_files = item.get("files", [])
@@ -420,7 +415,7 @@ def get_contents_from_tree(
         else:
             dvc_fp = p + ".dvc"
             if tree.is_file(dvc_fp):
-                dvo = yaml.safe_load(tree.read_text(dvc_fp))["outs"][0]
+                dvo = read_document(tree, dvc_fp)["outs"][0]
                 ck_outs[p] = dvo
             else:
                 ck_outs[p] = None
@@ -443,6 +438,7 @@ def get_contents_from_tree(
         # Derive tracked paths from standalone .dvc pointer files (files
         # tracked with `dvc add`, not via a DVC pipeline stage in dvc.lock).
         dvc_pointer_outs: dict[str, dict] = {}
+        tree.prefetch([p for p in paths if p.endswith(".dvc")])
         for p in paths:
             if not p.endswith(".dvc"):
                 continue
@@ -452,7 +448,7 @@ def get_contents_from_tree(
             if tree.is_dir(p):
                 continue
             try:
-                dvc_file_data = yaml.safe_load(tree.read_text(p))
+                dvc_file_data = read_document(tree, p)
                 if not isinstance(dvc_file_data, dict):
                     continue
                 outs = dvc_file_data.get("outs")
@@ -552,7 +548,7 @@ def get_contents_from_tree(
             dvc_pointer = zip_path + ".dvc"
             if tree.is_file(dvc_pointer):
                 try:
-                    dvc_out = yaml.safe_load(tree.read_text(dvc_pointer))
+                    dvc_out = read_document(tree, dvc_pointer)
                     size = dvc_out.get("outs", [{}])[0].get("size")
                 except Exception:
                     pass
@@ -598,12 +594,17 @@ def get_contents_from_tree(
                 idx=md5[:2],
                 md5=md5[2:],
             )
-            if not fs.isfile(fp):
+            stored = find_object(owner_name, project_name, md5, fs)
+            if stored is not None:
+                fp = stored.path
+            else:
                 logger.info(f"Writing {path} to object storage")
                 with fs.open(fp, "wb") as f:
                     f.write(content)
                 if settings.ENVIRONMENT != "local":
                     remove_gcs_content_type(fp)
+                record_objects(owner_name, project_name, [(md5, False, size)])
+                record_storage_usage(owner_name, project_name, size)
             url = get_object_url(fp, fname=os.path.basename(path), fs=fs)
             content = None
         return ContentsItem.model_validate(
@@ -635,7 +636,7 @@ def get_contents_from_tree(
         size = None
         if tree.is_file(dvc_pointer):
             try:
-                dvc_out_data = yaml.safe_load(tree.read_text(dvc_pointer))
+                dvc_out_data = read_document(tree, dvc_pointer)
                 size = dvc_out_data.get("outs", [{}])[0].get("size")
             except Exception:
                 pass
@@ -676,12 +677,15 @@ def get_contents_from_tree(
                 size is not None
                 and size <= RETURN_CONTENT_SIZE_LIMIT
                 and fp is not None
-                and fs.exists(fp)
                 and not path.endswith(".h5")
                 and not path.endswith(".parquet")
             ):
-                with fs.open(fp, "rb") as f:
-                    content = base64.b64encode(f.read()).decode()
+                # The object index may lag a deletion from storage
+                try:
+                    with fs.open(fp, "rb") as f:
+                        content = base64.b64encode(f.read()).decode()
+                except FileNotFoundError:
+                    logger.warning(f"Indexed DVC object {fp} not found")
         return ContentsItem.model_validate(
             dict(
                 path=path,
@@ -702,7 +706,7 @@ def get_contents_from_tree(
         dvc_pointer = path + ".dvc"
         if path in dvc_lock_outs or tree.is_file(dvc_pointer):
             if tree.is_file(dvc_pointer):
-                dvc_out = _yaml_load(tree.read_text(dvc_pointer))["outs"][0]
+                dvc_out = read_document(tree, dvc_pointer)["outs"][0]
             else:
                 dvc_out = dvc_lock_outs[path]
             md5 = dvc_out["md5"]
@@ -727,12 +731,15 @@ def get_contents_from_tree(
                 size is not None
                 and size <= RETURN_CONTENT_SIZE_LIMIT
                 and fp is not None
-                and fs.exists(fp)
                 and not path.endswith(".h5")
                 and not path.endswith(".parquet")
             ):
-                with fs.open(fp, "rb") as f:
-                    content = base64.b64encode(f.read()).decode()
+                # The object index may lag a deletion from storage
+                try:
+                    with fs.open(fp, "rb") as f:
+                        content = base64.b64encode(f.read()).decode()
+                except FileNotFoundError:
+                    logger.warning(f"Indexed DVC object {fp} not found")
             # TODO: If this is a directory, list dir_items
             return ContentsItem.model_validate(
                 dict(
@@ -771,7 +778,7 @@ def get_ck_info_for_ref(
     )
     if ck_item.content is None:
         return {}
-    ck_info = yaml.safe_load(base64.b64decode(ck_item.content))
+    ck_info = load_yaml(base64.b64decode(ck_item.content))
     if ck_info is None:
         return {}
     return ck_info
@@ -792,7 +799,7 @@ def get_dvc_pipeline_for_ref(
     tree = get_repo_tree_for_ref(repo, ref)
     if not tree.is_file("dvc.yaml"):
         return {}
-    return ryaml.load(tree.read_text("dvc.yaml")) or {}
+    return read_document(tree, "dvc.yaml", {})
 
 
 def get_figure_from_repo(
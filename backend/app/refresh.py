@@ -0,0 +1,170 @@
+"""Background refresh of cached project repos.
+
+Reads of a cached repo whose TTL has expired are served from the warm
+copy right away, and the network fetch is handed to the scheduler here
+(stale-while-revalidate) instead of blocking the request. Repos that were
+read recently are also refreshed pre-emptively shortly before they would
+go stale, so steady traffic rarely sees a stale copy at all.
+
+The scheduler is per-process. Cross-process deduplication comes from the
+jobs themselves, which take the repo's file lock and re-check freshness
+before touching the network.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Max concurrent background fetches per process
+MAX_WORKERS = 4
+# Refresh recently-read repos once they reach this fraction of their TTL
+PREEMPT_FRACTION = 0.8
+# Stop pre-emptively refreshing repos that haven't been read for this long
+TRACK_IDLE_SECONDS = 600
+# How often the sweeper looks for repos to refresh pre-emptively
+SWEEP_INTERVAL = 15
+# Backoff after consecutive failures: BASE * 2 ** (failures - 1), capped
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+
+
+@dataclass
+class _Tracked:
+    job: Callable[[], object]
+    ttl: int
+    get_age: Callable[[], float]
+    last_read: float
+
+
+class RefreshScheduler:
+    """Run keyed refresh jobs in the background, at most one per key."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS) -> None:
+        self._max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending: set[str] = set()
+        self._failures: dict[str, int] = {}
+        self._retry_at: dict[str, float] = {}
+        self._tracked: dict[str, _Tracked] = {}
+        self._sweeper: threading.Thread | None = None
+
+    def schedule(self, key: str, job: Callable[[], object]) -> bool:
+        """Queue ``job`` unless one is already pending for ``key`` or the
+        key is backing off after a failure.
+
+        Returns whether the job was queued.
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            if time.monotonic() < self._retry_at.get(key, 0):
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers,
+                    thread_name_prefix="repo-refresh",
+                )
+            self._pending.add(key)
+            metrics.repo_refresh_queue_depth.inc()
+            self._executor.submit(self._run, key, job)
+        return True
+
+    def track(
+        self,
+        key: str,
+        job: Callable[[], object],
+        ttl: int,
+        get_age: Callable[[], float],
+    ) -> None:
+        """Record a read of ``key`` so it's refreshed before going stale.
+
+        ``get_age`` returns the seconds since the key was last refreshed.
+        The latest ``job`` replaces any earlier one, so it can close over
+        fresh credentials.
+        """
+        with self._lock:
+            self._tracked[key] = _Tracked(
+                job=job, ttl=ttl, get_age=get_age, last_read=time.monotonic()
+            )
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweep_forever,
+                    name="repo-refresh-sweeper",
+                    daemon=True,
+                )
+                self._sweeper.start()
+
+    def sweep(self) -> None:
+        """Schedule refreshes for tracked keys that are nearly stale."""
+        now = time.monotonic()
+        with self._lock:
+            for key, tracked in list(self._tracked.items()):
+                if now - tracked.last_read > TRACK_IDLE_SECONDS:
+                    del self._tracked[key]
+            tracked_items = list(self._tracked.items())
+        max_age = 0.0
+        for key, tracked in tracked_items:
+            try:
+                age = tracked.get_age()
+            except OSError:
+                # Evicted or not yet created; the next read will recreate it
+                continue
+            max_age = max(max_age, age)
+            if age >= tracked.ttl * PREEMPT_FRACTION:
+                self.schedule(key, tracked.job)
+        metrics.repo_max_age_seconds.set(max_age)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until no jobs are pending. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: not self._pending, timeout=timeout
+            )
+
+    def _run(self, key: str, job: Callable[[], object]) -> None:
+        try:
+            job()
+        except Exception as e:
+            with self._lock:
+                failures = self._failures.get(key, 0) + 1
+                self._failures[key] = failures
+                delay = min(
+                    BACKOFF_BASE_SECONDS * 2 ** (failures - 1),
+                    BACKOFF_MAX_SECONDS,
+                )
+                self._retry_at[key] = time.monotonic() + delay
+            logger.warning(
+                f"Background refresh of {key} failed "
+                f"(attempt {failures}, retrying in {delay}s): {e}"
+            )
+        else:
+            with self._lock:
+                self._failures.pop(key, None)
+                self._retry_at.pop(key, None)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+                metrics.repo_refresh_queue_depth.dec()
+                self._idle.notify_all()
+
+    def _sweep_forever(self) -> None:
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Repo refresh sweep failed")
+
+
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,315 @@
+"""Disk budget for the on-disk Git repo cache.
+
+Every cached repo lives in its own dir holding the repo itself (``repo`` or
+``repo.git``), an ``updated.txt`` touched on each fetch, an ``accessed.txt``
+touched on each read, the ``updating.lock`` held while it's being
+cloned or fetched, and the ``maintenance.lock`` held while it's repacked. There are three kinds, laid out under the cache root as:
+
+- ``.mirrors/{owner}/{project}/repo.git``: shared bare mirrors
+- ``{user}/{owner}/{project}/repo``: per-user working clones
+- ``{user}/{owner}/{project}/overleaf/{overleaf_id}/repo``: Overleaf clones
+
+When the total size exceeds the budget, the least recently read repos are
+deleted until it fits again. Repos that are locked, were read very
+recently, or (for mirrors) still have working clones borrowing their
+objects, including clones still being created, are never evicted. Only the repo and its marker files are removed;
+the next read simply clones it again.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import stat
+import time
+from dataclasses import dataclass
+
+from filelock import FileLock, Timeout
+
+from app import metrics
+from app.config import settings
+from app.refresh import refresh_scheduler
+
+logger = logging.getLogger(__name__)
+
+MIRRORS_DIRNAME = ".mirrors"
+# Never evict a repo read this recently, since a request may still be
+# using the working tree after get_repo released its lock
+MIN_IDLE_SECONDS = 300
+# Check the budget at least this often even without new clones, since
+# fetches grow repos too
+EVICTION_INTERVAL = 600
+
+_last_eviction = 0.0
+# Sizes keyed by repo path, valid while its updated.txt mtime is unchanged
+_size_cache: dict[str, tuple[float, int]] = {}
+
+
+@dataclass
+class CacheEntry:
+    kind: str  # "mirror", "clone" or "overleaf"
+    base_dir: str
+    repo_dir: str
+    # For mirrors, and clones that may borrow objects from them
+    owner_name: str
+    project_name: str
+    last_access: float
+    size: int = 0
+
+
+def record_access(base_dir: str, kind: str, hit: bool) -> None:
+    """Mark a cached repo as just read and count the lookup."""
+    metrics.repo_cache_requests.labels(
+        kind=kind, result="hit" if hit else "miss"
+    ).inc()
+    fpath = os.path.join(base_dir, "accessed.txt")
+    try:
+        os.utime(fpath)
+    except FileNotFoundError:
+        os.makedirs(base_dir, exist_ok=True)
+        open(fpath, "a").close()
+
+
+def maybe_evict(cache_dir: str, new_repo: bool = False) -> None:
+    """Check the disk budget in the background if it's due.
+
+    A check is due after a repo was newly cloned, or when the last one ran
+    more than ``EVICTION_INTERVAL`` seconds ago.
+    """
+    global _last_eviction
+    if settings.REPO_CACHE_MAX_GB <= 0:
+        return
+    now = time.monotonic()
+    if not new_repo and now - _last_eviction < EVICTION_INTERVAL:
+        return
+    _last_eviction = now
+    max_bytes = int(settings.REPO_CACHE_MAX_GB * 1024**3)
+    refresh_scheduler.schedule(
+        f"evict:{cache_dir}", lambda: evict(cache_dir, max_bytes)
+    )
+
+
+def _get_last_access(base_dir: str) -> float | None:
+    for fname in ("accessed.txt", "updated.txt"):
+        try:
+            return os.path.getmtime(os.path.join(base_dir, fname))
+        except OSError:
+            pass
+    return None
+
+
+def _make_entry(
+    kind: str, base_dir: str, repo_dirname: str, owner: str, project: str
+) -> CacheEntry | None:
+    repo_dir = os.path.join(base_dir, repo_dirname)
+    # Only count dirs that look like ours, since the cache root may be
+    # shared with other programs (e.g. /tmp)
+    if not os.path.isfile(os.path.join(base_dir, "updated.txt")):
+        return None
+    if not os.path.isdir(repo_dir):
+        return None
+    last_access = _get_last_access(base_dir)
+    if last_access is None:
+        return None
+    return CacheEntry(
+        kind=kind,
+        base_dir=base_dir,
+        repo_dir=repo_dir,
+        owner_name=owner,
+        project_name=project,
+        last_access=last_access,
+    )
+
+
+def _subdirs(path: str) -> list[str]:
+    try:
+        return [e.name for e in os.scandir(path) if e.is_dir()]
+    except OSError:
+        return []
+
+
+def list_entries(cache_dir: str) -> list[CacheEntry]:
+    """Find all cached repos under ``cache_dir``."""
+    entries = []
+    mirrors_dir = os.path.join(cache_dir, MIRRORS_DIRNAME)
+    for owner in _subdirs(mirrors_dir):
+        for project in _subdirs(os.path.join(mirrors_dir, owner)):
+            base_dir = os.path.join(mirrors_dir, owner, project)
+            entry = _make_entry("mirror", base_dir, "repo.git", owner, project)
+            if entry is not None:
+                entries.append(entry)
+    for user in _subdirs(cache_dir):
+        if user == MIRRORS_DIRNAME:
+            continue
+        for owner in _subdirs(os.path.join(cache_dir, user)):
+            for project in _subdirs(os.path.join(cache_dir, user, owner)):
+                base_dir = os.path.join(cache_dir, user, owner, project)
+                entry = _make_entry("clone", base_dir, "repo", owner, project)
+                if entry is not None:
+                    entries.append(entry)
+                overleaf_dir = os.path.join(base_dir, "overleaf")
+                for overleaf_id in _subdirs(overleaf_dir):
+                    entry = _make_entry(
+                        "overleaf",
+                        os.path.join(overleaf_dir, overleaf_id),
+                        "repo",
+                        owner,
+                        project,
+                    )
+                    if entry is not None:
+                        entries.append(entry)
+    return entries
+
+
+def _get_disk_usage(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if not stat.S_ISDIR(st.st_mode):
+                total += st.st_blocks * 512
+    return total
+
+
+def _get_size(entry: CacheEntry) -> int:
+    """Return the disk usage of a cached repo, reusing the last measurement
+    if it hasn't been fetched since."""
+    try:
+        updated = os.path.getmtime(os.path.join(entry.base_dir, "updated.txt"))
+    except OSError:
+        updated = 0.0
+    cached = _size_cache.get(entry.repo_dir)
+    if cached is not None and cached[0] == updated:
+        return cached[1]
+    size = _get_disk_usage(entry.repo_dir)
+    _size_cache[entry.repo_dir] = (updated, size)
+    return size
+
+
+def _is_locked(lock_fpath: str) -> bool:
+    try:
+        with FileLock(lock_fpath, timeout=0):
+            return False
+    except Timeout:
+        return True
+
+
+def _clone_in_progress(cache_dir: str, owner: str, project: str) -> bool:
+    """Check whether a working clone of a project is being created.
+
+    Such a clone already borrows objects from the project's mirror, but it
+    isn't listed until it has its marker files, so its lock is the only
+    sign of it.
+    """
+    for user in _subdirs(cache_dir):
+        if user == MIRRORS_DIRNAME:
+            continue
+        lock_fpath = os.path.join(
+            cache_dir, user, owner, project, "updating.lock"
+        )
+        if os.path.exists(lock_fpath) and _is_locked(lock_fpath):
+            return True
+    return False
+
+
+def _remove(entry: CacheEntry, cache_dir: str) -> bool:
+    """Delete a cached repo unless it's being updated or maintained or was
+    just read, or, for a mirror, one of its clones is being created."""
+    lock = FileLock(os.path.join(entry.base_dir, "updating.lock"), timeout=0)
+    try:
+        with lock:
+            # Re-check under the lock in case it was read since we listed it
+            last_access = _get_last_access(entry.base_dir) or 0
+            if time.time() - last_access < MIN_IDLE_SECONDS:
+                return False
+            # New clones refresh the mirror under its lock first, so none
+            # can start while we hold it
+            if entry.kind == "mirror" and _clone_in_progress(
+                cache_dir, entry.owner_name, entry.project_name
+            ):
+                return False
+            if _is_locked(os.path.join(entry.base_dir, "maintenance.lock")):
+                return False
+            for fname in ("updated.txt", "accessed.txt"):
+                try:
+                    os.remove(os.path.join(entry.base_dir, fname))
+                except FileNotFoundError:
+                    pass
+            shutil.rmtree(entry.repo_dir, ignore_errors=True)
+    except Timeout:
+        return False
+    _size_cache.pop(entry.repo_dir, None)
+    return True
+
+
+def evict(cache_dir: str, max_bytes: int) -> list[CacheEntry]:
+    """Evict least recently read repos until the cache fits in
+    ``max_bytes``.
+
+    Returns the evicted entries.
+    """
+    lock = FileLock(os.path.join(cache_dir, ".repo-cache.lock"), timeout=0)
+    try:
+        with lock:
+            return _evict(cache_dir, max_bytes)
+    except Timeout:
+        # Another process is already on it
+        return []
+
+
+def _evict(cache_dir: str, max_bytes: int) -> list[CacheEntry]:
+    entries = list_entries(cache_dir)
+    for entry in entries:
+        entry.size = _get_size(entry)
+    total = sum(entry.size for entry in entries)
+    metrics.repo_cache_size_bytes.set(total)
+    if total <= max_bytes:
+        return []
+    # Working clones borrow objects from their project's mirror, so a
+    # mirror can only go once none are left
+    clone_counts: dict[tuple[str, str], int] = {}
+    for entry in entries:
+        if entry.kind == "clone":
+            key = (entry.owner_name, entry.project_name)
+            clone_counts[key] = clone_counts.get(key, 0) + 1
+    evicted: list[CacheEntry] = []
+    now = time.time()
+    # A mirror is read through its clones' fast path without being marked,
+    # so it can sort ahead of them; any skipped for still having clones
+    # get a second chance once the clones after them are gone
+    deferred: list[CacheEntry] = []
+    candidates = sorted(entries, key=lambda e: e.last_access)
+    for pass_entries in (candidates, deferred):
+        for entry in pass_entries:
+            if total <= max_bytes:
+                break
+            if now - entry.last_access < MIN_IDLE_SECONDS:
+                continue
+            key = (entry.owner_name, entry.project_name)
+            if entry.kind == "mirror" and clone_counts.get(key):
+                if pass_entries is candidates:
+                    deferred.append(entry)
+                continue
+            if not _remove(entry, cache_dir):
+                continue
+            logger.info(
+                f"Evicted cached {entry.kind} {entry.repo_dir} "
+                f"({entry.size} bytes) to stay within the repo cache budget"
+            )
+            if entry.kind == "clone":
+                clone_counts[key] -= 1
+            total -= entry.size
+            metrics.repo_cache_evictions.labels(kind=entry.kind).inc()
+            metrics.repo_cache_evicted_bytes.inc(entry.size)
+            evicted.append(entry)
+    metrics.repo_cache_size_bytes.set(total)
+    if total > max_bytes:
+        logger.warning(
+            f"Repo cache is {total} bytes, over its {max_bytes} byte budget, "
+            "but nothing else can be evicted right now"
+        )
+    return evicted
@@ -0,0 +1,332 @@
+"""A content-addressed DVC object store shared by all projects.
+
+Objects are normally stored under each project's prefix, so a dataset
+imported or copied into another project is stored, and billed, once per
+project. With ``settings.DVC_SHARED_OBJECTS`` on, objects pushed to the DVC
+remote are instead stored once under ``.shared/files/md5``, and each
+project holds a reference to them: a row in the object index
+(``dvcobject``) with ``shared`` set. Importing an object another project
+already references then only adds a row (see ``import_objects``).
+
+Each object's references are counted in ``dvcsharedobject``. When the
+count drops to zero the object is marked released, and
+``collect_garbage`` deletes it once it's been released for
+``GC_GRACE_SECONDS`` (see ``scripts/collect-shared-dvc-objects.py``).
+References are always added before an object is written, and the count is
+rechecked under a row lock before it's deleted, so an object being stored
+or imported is never collected.
+
+For storage usage, each project referencing an object is charged its full
+size, as if it had its own copy, so usage and limits don't depend on what
+other projects happen to store. Deduplication only reduces the size of the
+bucket.
+
+Since MD5 collisions can be crafted, an upload is only discarded in favor
+of the shared object with its MD5 if their SHA-256s match too. Otherwise
+the upload is stored in the project, like any object the project has its
+own copy of, so nobody can get their content served in place of someone
+else's by uploading it first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from datetime import timedelta
+
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, delete, select, update
+
+from app import utcnow
+from app.db import engine
+from app.models import DvcObject, DvcSharedObject
+from app.storage import (
+    get_object_fs,
+    get_upload_chunk_size,
+    make_shared_data_fpath,
+    record_storage_usage,
+)
+
+logger = logging.getLogger(__name__)
+
+# How long released objects are kept before they're deleted, so a
+# reference removed by mistake can be restored
+GC_GRACE_SECONDS = 7 * 24 * 3600
+# Max MD5s per query
+_QUERY_CHUNK = 1000
+
+
+def add_references(
+    owner_name: str,
+    project_name: str,
+    objects: list[tuple[str, int | None]],
+) -> list[str]:
+    """Add references from a project to ``(md5, size)`` objects in the
+    shared store and count them toward the project's usage.
+
+    Objects the project already references, or has its own copy of, are
+    skipped. Returns the MD5s of the references added.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    sizes = dict(objects)
+    added = []
+    with Session(engine) as session:
+        md5s = list(sizes)
+        for start in range(0, len(md5s), _QUERY_CHUNK):
+            chunk = md5s[start : start + _QUERY_CHUNK]
+            stmt = (
+                insert(DvcObject)
+                .values(
+                    [
+                        dict(
+                            owner_name=owner_name,
+                            project_name=project_name,
+                            md5=md5,
+                            legacy=False,
+                            shared=True,
+                            size=sizes[md5],
+                            created=utcnow(),
+                        )
+                        for md5 in chunk
+                    ]
+                )
+                .on_conflict_do_nothing(
+                    index_elements=["owner_name", "project_name", "md5"]
+                )
+                .returning(DvcObject.__table__.c.md5)
+            )
+            added += session.exec(stmt).scalars().all()  # type: ignore
+        for start in range(0, len(added), _QUERY_CHUNK):
+            stmt = insert(DvcSharedObject).values(
+                [
+                    dict(
+                        md5=md5,
+                        size=sizes[md5],
+                        refcount=1,
+                        created=utcnow(),
+                    )
+                    for md5 in added[start : start + _QUERY_CHUNK]
+                ]
+            )
+            table = DvcSharedObject.__table__
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["md5"],
+                set_=dict(
+                    refcount=table.c.refcount + 1,
+                    released=None,
+                    size=stmt.excluded.size,
+                ),
+            )
+            session.exec(stmt)  # type: ignore
+        session.commit()
+    record_storage_usage(
+        owner_name,
+        project_name,
+        sum(sizes[md5] or 0 for md5 in added),
+    )
+    return added
+
+
+def remove_references(
+    owner_name: str, project_name: str, md5s: list[str] | None = None
+) -> list[str]:
+    """Remove a project's references to objects in the shared store, or
+    all of them if ``md5s`` is None, and release objects left without any.
+
+    Returns the MD5s of the references removed.
+    """
+    owner_name = owner_name.lower()
+    project_name = project_name.lower()
+    removed: list[tuple[str, int | None]] = []
+    with Session(engine) as session:
+        where = [
+            col(DvcObject.owner_name) == owner_name,
+            col(DvcObject.project_name) == project_name,
+            col(DvcObject.shared).is_(True),
+        ]
+        if md5s is None:
+            stmts = [delete(DvcObject).where(*where)]
+        else:
+            stmts = [
+                delete(DvcObject).where(
+                    *where,
+                    col(DvcObject.md5).in_(md5s[start : start + _QUERY_CHUNK]),
+                )
+                for start in range(0, len(md5s), _QUERY_CHUNK)
+            ]
+        for stmt in stmts:
+            removed += session.exec(  # type: ignore
+                stmt.returning(DvcObject.md5, DvcObject.size)
+            ).all()
+        removed_md5s = [md5 for md5, _ in removed]
+        now = utcnow()
+        for start in range(0, len(removed_md5s), _QUERY_CHUNK):
+            session.exec(  # type: ignore
+                update(DvcSharedObject)
+                .where(
+                    col(DvcSharedObject.md5).in_(
+                        removed_md5s[start : start + _QUERY_CHUNK]
+                    )
+                )
+                .values(
+                    refcount=DvcSharedObject.refcount - 1,
+                    released=case(
+                        (DvcSharedObject.refcount <= 1, now),
+                        else_=DvcSharedObject.released,
+                    ),
+                )
+            )
+        session.commit()
+    record_storage_usage(
+        owner_name, project_name, -sum(size or 0 for _, size in removed)
+    )
+    return removed_md5s
+
+
+def store_object(
+    owner_name: str,
+    project_name: str,
+    md5: str,
+    size: int,
+    pending_fpath: str,
+    fs=None,
+) -> str | None:
+    """Move a verified upload at ``pending_fpath`` into the shared store
+    and reference it from a project.
+
+    If the object is already in the shared store, the upload is deleted,
+    once its SHA-256 is checked against the stored object's. Returns the
+    object's path, or None if the project has its own copy of the object,
+    or the upload's content differs from the shared object's (an MD5
+    collision), in which case the upload should be stored in the project
+    instead.
+    """
+    if fs is None:
+        fs = get_object_fs()
+    # Referenced first, so the object can't be collected while it's moved
+    add_references(owner_name, project_name, [(md5, size)])
+    with Session(engine) as session:
+        shared = session.exec(
+            select(DvcObject.shared).where(
+                DvcObject.owner_name == owner_name.lower(),
+                DvcObject.project_name == project_name.lower(),
+                DvcObject.md5 == md5,
+            )
+        ).first()
+    if not shared:
+        return None
+    fpath = make_shared_data_fpath(md5)
+    if not fs.exists(fpath):
+        fs.mv(pending_fpath, fpath)
+        return fpath
+    # Only the same content is deduplicated, so an upload whose MD5
+    # collides with a shared object is never swapped for it
+    if _get_sha256(md5, fpath, fs) == _hash_sha256(pending_fpath, fs):
+        fs.rm(pending_fpath)
+        return fpath
+    logger.warning(
+        f"Upload of DVC object {md5} to {owner_name}/{project_name} doesn't "
+        "match the shared object with its MD5; storing it in the project"
+    )
+    remove_references(owner_name, project_name, [md5])
+    return None
+
+
+def _hash_sha256(fpath: str, fs) -> str:
+    sig = hashlib.sha256()
+    with fs.open(fpath, "rb") as f:
+        while chunk := f.read(get_upload_chunk_size()):
+            sig.update(chunk)
+    return sig.hexdigest()
+
+
+def _get_sha256(md5: str, fpath: str, fs) -> str:
+    """Get the SHA-256 of a shared object, hashing it the first time."""
+    with Session(engine) as session:
+        sha256 = session.exec(
+            select(DvcSharedObject.sha256).where(DvcSharedObject.md5 == md5)
+        ).first()
+    if sha256 is not None:
+        return sha256
+    sha256 = _hash_sha256(fpath, fs)
+    with Session(engine) as session:
+        session.exec(  # type: ignore
+            update(DvcSharedObject)
+            .where(col(DvcSharedObject.md5) == md5)
+            .where(col(DvcSharedObject.sha256).is_(None))
+            .values(sha256=sha256)
+        )
+        session.commit()
+    return sha256
+
+
+def import_objects(
+    owner_name: str,
+    project_name: str,
+    src_owner_name: str,
+    src_project_name: str,
+    md5s: list[str],
+) -> list[str]:
+    """Reference objects from a project that the source project references
+    in the shared store, without copying them.
+
+    Returns the MD5s that were available to import, whether or not the
+    project already referenced them. Objects the source project has its
+    own copy of need to be copied.
+    """
+    available: list[tuple[str, int | None]] = []
+    with Session(engine) as session:
+        for start in range(0, len(md5s), _QUERY_CHUNK):
+            available += session.exec(
+                select(DvcObject.md5, DvcObject.size).where(
+                    DvcObject.owner_name == src_owner_name.lower(),
+                    DvcObject.project_name == src_project_name.lower(),
+                    col(DvcObject.shared).is_(True),
+                    col(DvcObject.md5).in_(md5s[start : start + _QUERY_CHUNK]),
+                )
+            ).all()
+    if available:
+        add_references(owner_name, project_name, available)
+    return [md5 for md5, _ in available]
+
+
+def collect_garbage(fs=None, grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Delete objects that have had no references for ``grace_seconds``,
+    returning how many."""
+    cutoff = utcnow() - timedelta(seconds=grace_seconds)
+    where = [
+        col(DvcSharedObject.refcount) <= 0,
+        col(DvcSharedObject.released) <= cutoff,
+    ]
+    with Session(engine) as session:
+        md5s = session.exec(select(DvcSharedObject.md5).where(*where)).all()
+    if md5s and fs is None:
+        fs = get_object_fs()
+    n_deleted = 0
+    for md5 in md5s:
+        with Session(engine) as session:
+            # Locked until the object is deleted, so it can't be referenced
+            # again in the meantime
+            row = session.exec(
+                select(DvcSharedObject)
+                .where(DvcSharedObject.md5 == md5, *where)
+                .with_for_update()
+            ).first()
+            if row is None:
+                continue
+            fpath = make_shared_data_fpath(md5)
+            try:
+                fs.rm(fpath)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logger.exception("Failed to delete shared object %s", fpath)
+                continue
+            session.delete(row)
+            session.commit()
+        n_deleted += 1
+    if n_deleted:
+        logger.info(f"Deleted {n_deleted} unreferenced shared DVC objects")
+    return n_deleted
@@ -1,32 +1,41 @@
 """Functionality for managing object storage."""
 
+import base64
+import hashlib
 import json
+import logging
 import os
+import threading
 from typing import Any, Literal
 
 import boto3
-import cachetools
 import gcsfs
 import s3fs
 from botocore.config import Config
 from google.cloud import storage as gcs
 from google.oauth2 import service_account as gcs_service_account
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, col, delete, select
 
+from app import utcnow
 from app.config import settings
+from app.db import engine
+from app.models import DvcObject, StorageLedger
+from app.refresh import refresh_scheduler
+
+logger = logging.getLogger(__name__)
 
 # Multipart/chunked upload configuration
 MULTIPART_THRESHOLD_BYTES = 64 * 1024 * 1024  # 64 MB
 MULTIPART_PART_SIZE_BYTES = 16 * 1024 * 1024  # 16 MB
 CHUNKED_CHUNK_SIZE_BYTES = 16 * 1024 * 1024  # 16 MB
 S3_MAX_PARTS = 10000  # S3 multipart upload limit
-STORAGE_USAGE_CACHE_TTL_SECONDS = 300
-STORAGE_USAGE_CACHE_MAXSIZE = 2048
-
-# In-process cache for owner-level storage usage reads
-_storage_usage_cache: cachetools.TTLCache[str, float] = cachetools.TTLCache(
-    maxsize=STORAGE_USAGE_CACHE_MAXSIZE,
-    ttl=STORAGE_USAGE_CACHE_TTL_SECONDS,
-)
+GCS_MAX_COMPOSE_SOURCES = 32  # GCS compose limit per request
+# Reconcile an owner's usage ledger against its storage this often
+STORAGE_USAGE_RECONCILE_SECONDS = 24 * 3600
+# Locks for seeding owners' usage ledgers in this process, striped by owner
+_SEED_LOCKS = [threading.Lock() for _ in range(64)]
 
 
 def get_backend() -> Literal["s3", "gcs"]:
@@ -127,6 +136,13 @@ def make_data_fpath(
         return f"{prefix}/{project_name.lower()}/files/md5/{idx}/{md5}"
 
 
+def make_shared_data_fpath(md5: str) -> str:
+    """Make the path of an object in the shared, content-addressed store,
+    where it's referenced by projects rather than copied into each. See
+    ``app.shared_objects``."""
+    return f"{get_data_prefix()}/.shared/files/md5/{md5[:2]}/{md5[2:]}"
+
+
 def _replace_local_object_host(url: str) -> str:
     if settings.ENVIRONMENT == "local":
         return url.replace(
@@ -351,33 +367,339 @@ def get_multipart_upload_info(
         raise ValueError("Unsupported filesystem type")
 
 
+def get_metadata_md5(info: dict) -> str | None:
+    """Get the hex MD5 of an object's content from its ``fs.info``, if
+    storage keeps one: GCS's ``md5Hash``, or S3's ETag for objects uploaded
+    in a single part."""
+    if info.get("md5Hash"):
+        return base64.b64decode(info["md5Hash"]).hex()
+    etag = str(info.get("ETag") or "").strip('"')
+    if len(etag) == 32 and "-" not in etag:
+        return etag.lower()
+    return None
+
+
+def get_object_md5(
+    fpath: str,
+    fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None,
+    from_metadata: bool = True,
+) -> str:
+    """Get the hex MD5 of an object's content.
+
+    If ``from_metadata`` is true, the MD5 that storage already keeps is used
+    when there is one (see ``get_metadata_md5``). Otherwise, e.g., for
+    multipart uploads, the object is streamed back and hashed.
+    """
+    if fs is None:
+        fs = get_object_fs()
+    if from_metadata:
+        digest = get_metadata_md5(fs.info(fpath))
+        if digest is not None:
+            return digest
+    sig = hashlib.md5()
+    with fs.open(fpath, "rb") as f:
+        while chunk := f.read(get_upload_chunk_size()):
+            sig.update(chunk)
+    return sig.hexdigest()
+
+
+def merge_objects(
+    fpath: str,
+    parts: list[str],
+    fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None,
+) -> None:
+    """Concatenate objects, in order, into ``fpath``.
+
+    With S3 and GCS this happens server-side (multipart copy or compose),
+    without downloading the parts, which are left in place. For S3, every
+    part but the last must be at least 5 MiB.
+    """
+    if fs is None:
+        fs = get_object_fs()
+    if not hasattr(fs, "merge"):
+        with fs.open(fpath, "wb") as f:
+            for part in parts:
+                with fs.open(part, "rb") as p:
+                    while chunk := p.read(get_upload_chunk_size()):
+                        f.write(chunk)
+        return
+    if isinstance(fs, gcsfs.GCSFileSystem):
+        # Compose in rounds, since each request takes a limited number of
+        # sources. Intermediate objects go next to the first part.
+        n_round = 0
+        while len(parts) > GCS_MAX_COMPOSE_SOURCES:
+            composed = []
+            for start in range(0, len(parts), GCS_MAX_COMPOSE_SOURCES):
+                batch = parts[start : start + GCS_MAX_COMPOSE_SOURCES]
+                dest = f"{parts[0]}.compose-{n_round}-{start}"
+                fs.merge(dest, batch)
+                composed.append(dest)
+            parts = composed
+            n_round += 1
+    fs.merge(fpath, parts)
+
+
+def _lock_ledger(session: Session, owner_name: str) -> None:
+    """Lock an owner's usage ledger until the session's transaction ends,
+    so only one worker writes it from a listing at a time."""
+    session.exec(
+        select(
+            func.pg_advisory_xact_lock(
+                func.hashtext(f"storage-ledger:{owner_name}")
+            )
+        )
+    )
+
+
+def _get_ledger(session: Session, owner_name: str) -> dict[str, int]:
+    rows = session.exec(
+        select(StorageLedger).where(StorageLedger.owner_name == owner_name)
+    ).all()
+    return {row.project_name: max(row.size, 0) for row in rows}
+
+
+def get_storage_usage_by_project(
+    owner_name: str, fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None
+) -> dict[str, int]:
+    """Get bytes used by each of an owner's projects from the usage ledger.
+
+    Bytes outside any project's prefix are keyed by an empty string. The
+    first read for an owner seeds its ledger from a listing of its storage.
+    After that, reads are a single indexed query, and a ledger that hasn't
+    been reconciled for ``STORAGE_USAGE_RECONCILE_SECONDS`` is reconciled
+    in the background.
+    """
+    owner_name = owner_name.lower()
+    with Session(engine) as session:
+        rows = session.exec(
+            select(StorageLedger).where(StorageLedger.owner_name == owner_name)
+        ).all()
+    if not rows:
+        return _seed_storage_usage(owner_name, fs=fs)
+    last_reconciled = min(row.reconciled for row in rows)
+    if (
+        utcnow() - last_reconciled
+    ).total_seconds() > STORAGE_USAGE_RECONCILE_SECONDS:
+        refresh_scheduler.schedule(
+            f"storage-usage:{owner_name}",
+            lambda: reconcile_storage_usage(owner_name),
+        )
+    return {row.project_name: max(row.size, 0) for row in rows}
+
+
+def _seed_storage_usage(
+    owner_name: str, fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None
+) -> dict[str, int]:
+    """Seed an owner's ledger from a listing of its storage.
+
+    Seeding is single-flight: the listing runs under the ledger's lock, and
+    callers that were waiting on it, in this worker or another, read the
+    ledger it wrote instead of listing again. Within a worker, they wait on
+    a thread lock first, so they don't each hold a connection meanwhile.
+    """
+    with _SEED_LOCKS[hash(owner_name) % len(_SEED_LOCKS)]:
+        with Session(engine) as session:
+            _lock_ledger(session, owner_name)
+            by_project = _get_ledger(session, owner_name)
+            if by_project:
+                return by_project
+            by_project = _list_storage_usage(owner_name, fs=fs)
+            _add_shared_usage(session, owner_name, by_project)
+            _write_ledger(session, owner_name, by_project)
+            session.commit()
+    logger.info(f"Seeded storage usage for {owner_name}")
+    return by_project
+
+
 def get_storage_usage(
     owner_name: str, fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None
 ) -> float:
     """Get storage usage in GB for a given owner."""
-    cache_key = f"{settings.ENVIRONMENT}:{owner_name}"
-    use_cache = fs is None
-    if use_cache:
-        cached = _storage_usage_cache.get(cache_key)
-        if cached is not None:
-            return cached
-        fs = get_object_fs()
-    assert fs is not None
-    usage = fs.du(get_data_prefix_for_owner(owner_name))
-    if isinstance(usage, dict):
-        usage = sum(float(v) for v in usage.values())
-    usage_gb = float(usage) / 1e9
-    if use_cache:
-        _storage_usage_cache[cache_key] = usage_gb
-    return usage_gb
-
-
-def invalidate_storage_usage_cache(owner_name: str | None = None) -> None:
-    """Invalidate cached storage usage for one owner or all owners."""
-    if owner_name is None:
-        _storage_usage_cache.clear()
+    return sum(get_storage_usage_by_project(owner_name, fs=fs).values()) / 1e9
+
+
+def record_storage_usage(
+    owner_name: str, project_name: str, delta_bytes: int
+) -> None:
+    """Add ``delta_bytes`` to a project's usage in the ledger, e.g., the
+    size of a new object, or minus the size of a deleted one.
+
+    Owners whose ledger hasn't been seeded yet are skipped, since seeding
+    will count the change.
+    """
+    if not delta_bytes:
         return
-    _storage_usage_cache.pop(f"{settings.ENVIRONMENT}:{owner_name}", None)
+    owner_name = owner_name.lower()
+    now = utcnow()
+    try:
+        with Session(engine) as session:
+            seeded = session.exec(
+                select(StorageLedger.project_name)
+                .where(StorageLedger.owner_name == owner_name)
+                .limit(1)
+            ).first()
+            if seeded is None:
+                return
+            stmt = insert(StorageLedger).values(
+                owner_name=owner_name,
+                project_name=project_name.lower(),
+                size=delta_bytes,
+                updated=now,
+                reconciled=now,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["owner_name", "project_name"],
+                set_=dict(
+                    size=StorageLedger.__table__.c.size + stmt.excluded.size,
+                    updated=stmt.excluded.updated,
+                ),
+            )
+            session.exec(stmt)  # type: ignore
+            session.commit()
+    except Exception as e:
+        # The next reconciliation will correct it
+        logger.warning(f"Failed to record storage usage for {owner_name}: {e}")
+
+
+def _list_storage_usage(
+    owner_name: str, fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None
+) -> dict[str, int]:
+    """Total the sizes of an owner's objects by project from a listing of
+    its storage."""
+    if fs is None:
+        fs = get_object_fs()
+    prefix = get_data_prefix_for_owner(owner_name)
+    root = fs._strip_protocol(prefix).rstrip("/") + "/"
+    try:
+        sizes = fs.du(prefix, total=False)
+    except FileNotFoundError:
+        sizes = {}
+    by_project = {"": 0}
+    for path, size in sizes.items():
+        project_name, sep, rest = path.removeprefix(root).partition("/")
+        if rest.startswith(("files/staging/", "files/uploads/")) or (
+            rest.endswith(".pending")
+        ):
+            # Uploads in flight, i.e., staged (see app.dvc_uploads), in an
+            # upload session (see app.upload_sessions) or pending
+            # verification, which are counted once they're stored
+            continue
+        key = project_name if sep else ""
+        by_project[key] = by_project.get(key, 0) + int(size or 0)
+    return by_project
+
+
+def _add_shared_usage(
+    session: Session, owner_name: str, by_project: dict[str, int]
+) -> None:
+    """Add the objects an owner's projects reference in the shared store to
+    usage from a listing, since each project referencing one is charged its
+    full size."""
+    shared = session.exec(
+        select(DvcObject.project_name, func.sum(DvcObject.size))
+        .where(
+            DvcObject.owner_name == owner_name,
+            col(DvcObject.shared).is_(True),
+        )
+        .group_by(DvcObject.project_name)
+    ).all()
+    for project_name, size in shared:
+        by_project[project_name] = by_project.get(project_name, 0) + int(
+            size or 0
+        )
+
+
+def _write_ledger(
+    session: Session, owner_name: str, by_project: dict[str, int]
+) -> None:
+    """Replace an owner's ledger with usage from a listing.
+
+    Rows are upserted rather than deleted and reinserted, so concurrent
+    deltas from ``record_storage_usage`` can't conflict with them. The
+    caller holds the ledger's lock and commits.
+    """
+    now = utcnow()
+    stmt = insert(StorageLedger).values(
+        [
+            dict(
+                owner_name=owner_name,
+                project_name=project_name,
+                size=size,
+                updated=now,
+                reconciled=now,
+            )
+            for project_name, size in by_project.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["owner_name", "project_name"],
+        set_=dict(
+            size=stmt.excluded.size,
+            updated=stmt.excluded.updated,
+            reconciled=stmt.excluded.reconciled,
+        ),
+    )
+    session.exec(stmt)  # type: ignore
+    session.exec(  # type: ignore
+        delete(StorageLedger).where(
+            col(StorageLedger.owner_name) == owner_name,
+            col(StorageLedger.project_name).not_in(list(by_project)),
+        )
+    )
+
+
+def reconcile_storage_usage(
+    owner_name: str, fs: s3fs.S3FileSystem | gcsfs.GCSFileSystem | None = None
+) -> dict[str, int]:
+    """Rebuild an owner's usage ledger from a listing of its storage.
+
+    Corrects drift from writes that bypass the API or whose deltas failed
+    to record. The listing runs before taking the ledger's lock, so it
+    doesn't hold up seeding, and deltas recorded while it ran are added
+    back on top of it, since the listing may have missed their objects.
+    If another worker reconciled the ledger meanwhile, its result is kept.
+    """
+    owner_name = owner_name.lower()
+    with Session(engine) as session:
+        before = {
+            row.project_name: row
+            for row in session.exec(
+                select(StorageLedger).where(
+                    StorageLedger.owner_name == owner_name
+                )
+            ).all()
+        }
+        by_project: dict[str, int] = {}
+        _add_shared_usage(session, owner_name, by_project)
+    listed = _list_storage_usage(owner_name, fs=fs)
+    for project_name, size in listed.items():
+        by_project[project_name] = by_project.get(project_name, 0) + size
+    with Session(engine) as session:
+        _lock_ledger(session, owner_name)
+        rows = session.exec(
+            select(StorageLedger).where(StorageLedger.owner_name == owner_name)
+        ).all()
+        for row in rows:
+            previous = before.get(row.project_name)
+            if previous is None:
+                # Created by deltas during the listing
+                delta = row.size
+            elif previous.reconciled != row.reconciled:
+                logger.info(
+                    f"Storage usage for {owner_name} was reconciled "
+                    "concurrently"
+                )
+                return _get_ledger(session, owner_name)
+            else:
+                delta = row.size - previous.size
+            if delta:
+                by_project[row.project_name] = (
+                    by_project.get(row.project_name, 0) + delta
+                )
+        _write_ledger(session, owner_name, by_project)
+        session.commit()
+    logger.info(f"Reconciled storage usage for {owner_name}")
+    return by_project
 
 
 def migrate_legacy_dvc_paths(dry_run=True):
@@ -4,15 +4,18 @@ import uuid
 from types import SimpleNamespace
 from unittest.mock import ANY, patch
 
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
 from app import users
 from app.api.routes.projects.core import get_project_comments
 from app.config import settings
+from app.documents import get_blob_sha
+from app.git import TreeIndex, TreeIndexEntry
 from app.models import Project, UserCreate
 from app.models.core import ContentsItem, UserProjectAccess
 from app.projects import CkInfoAndOuts
 from app.tests import authentication_token_from_email, create_random_user
-from fastapi.testclient import TestClient
-from sqlmodel import Session, select
 
 
 def test_get_project_contents_forwards_ref(client: TestClient) -> None:
@@ -77,15 +80,16 @@ def test_get_project_content_paths_merges_git_and_dvc(
     client: TestClient,
 ) -> None:
     fake_project = SimpleNamespace()
-    fake_repo = SimpleNamespace(
-        git=SimpleNamespace(
-            ls_files=lambda: (
-                "README.md\nfigs/plot.png.dvc\n.dvc/config\nscripts/run.py"
-            )
-        )
+    fake_repo = SimpleNamespace()
+    fake_index = _make_fake_index(
+        ["README.md", "figs/plot.png.dvc", ".dvc/config", "scripts/run.py"]
     )
     dvc_outs = {"figs/plot.png": {"type": "file"}, "data": {"type": "dir"}}
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -262,9 +266,22 @@ def test_get_project_comments_uses_all_results() -> None:
     mock_sync.assert_called_once_with(session, [fake_comment], None)
 
 
-def _make_fake_blob(path: str) -> SimpleNamespace:
-    """Return a minimal git blob-like object for auto-detection tests."""
-    return SimpleNamespace(type="blob", path=path)
+def _make_fake_index(paths: list[str]) -> TreeIndex:
+    """Return a tree index over ``paths`` for auto-detection tests, where
+    each ``.dvc`` pointer tracks its path minus the suffix."""
+    return TreeIndex(
+        "0" * 40,
+        {
+            p: TreeIndexEntry(
+                p,
+                "100644",
+                "0" * 40,
+                0,
+                p[:-4] if p.endswith(".dvc") else None,
+            )
+            for p in paths
+        },
+    )
 
 
 def test_get_project_figures_autodetects_deeply_nested(
@@ -288,11 +305,8 @@ def test_get_project_figures_autodetects_deeply_nested(
         ".calkit/figures/hidden.png",  # hidden directory
         "figures/plot.txt",  # unsupported extension
     ]
-    blobs = [_make_fake_blob(p) for p in detected_paths + ignored_paths]
-    fake_commit = SimpleNamespace()
-    fake_commit.tree = SimpleNamespace(traverse=lambda: iter(blobs))
+    fake_index = _make_fake_index(detected_paths + ignored_paths)
     fake_repo = SimpleNamespace()
-    fake_repo.head = SimpleNamespace(commit=fake_commit)
     # fake_contents is returned by the mocked get_contents_from_tree for each
     # auto-detected figure, providing the content/url/storage fields the
     # endpoint attaches to every figure dict.
@@ -307,6 +321,10 @@ def test_get_project_figures_autodetects_deeply_nested(
         storage=None,
     )
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -364,10 +382,8 @@ def test_get_project_figures_autodetects_dvc_stored(
     fake_project = SimpleNamespace(id="00000000-0000-0000-0000-000000000001")
     fake_tree = SimpleNamespace()
     fake_repo = SimpleNamespace()
-    # Repo has no git-tracked blobs
-    fake_commit = SimpleNamespace()
-    fake_commit.tree = SimpleNamespace(traverse=lambda: iter([]))
-    fake_repo.head = SimpleNamespace(commit=fake_commit)
+    # Repo has no git-tracked files
+    fake_index = _make_fake_index([])
     # DVC lock outs contain figure files and non-figure files
     dvc_detected_paths = [
         "figures/plot.png",
@@ -393,6 +409,10 @@ def test_get_project_figures_autodetects_dvc_stored(
         storage=None,
     )
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -443,11 +463,8 @@ def test_get_project_figures_dvc_no_duplicates_with_git(
     fake_project = SimpleNamespace(id="00000000-0000-0000-0000-000000000001")
     fake_tree = SimpleNamespace()
     shared_path = "figures/shared.png"
-    fake_blob = _make_fake_blob(shared_path)
-    fake_commit = SimpleNamespace()
-    fake_commit.tree = SimpleNamespace(traverse=lambda: iter([fake_blob]))
+    fake_index = _make_fake_index([shared_path])
     fake_repo = SimpleNamespace()
-    fake_repo.head = SimpleNamespace(commit=fake_commit)
     # Same path also appears in dvc_lock_outs
     dvc_lock_outs = {
         shared_path: {"path": shared_path, "md5": "abc123", "type": "file"},
@@ -463,6 +480,10 @@ def test_get_project_figures_dvc_no_duplicates_with_git(
         storage=None,
     )
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -521,13 +542,10 @@ def test_get_project_figures_autodetects_dvc_pointer_files(
         "data/output.png",  # not in a figure dir
         "figures/data.txt",  # unsupported extension
     ]
-    # Build fake blobs: use the .dvc pointer file paths
-    blobs = [_make_fake_blob(p + ".dvc") for p in dvc_pointer_detected] + [
-        _make_fake_blob(p + ".dvc") for p in dvc_pointer_ignored
-    ]
-    fake_commit = SimpleNamespace()
-    fake_commit.tree = SimpleNamespace(traverse=lambda: iter(blobs))
-    fake_repo.head = SimpleNamespace(commit=fake_commit)
+    # The tree holds the .dvc pointer files
+    fake_index = _make_fake_index(
+        [p + ".dvc" for p in dvc_pointer_detected + dvc_pointer_ignored]
+    )
     fake_contents = ContentsItem(
         name="fig",
         path="fig",
@@ -539,6 +557,10 @@ def test_get_project_figures_autodetects_dvc_pointer_files(
         storage=None,
     )
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -596,12 +618,9 @@ def test_get_project_figures_dvc_pointer_no_duplicates_with_dvc_lock(
     fake_project = SimpleNamespace(id="00000000-0000-0000-0000-000000000001")
     fake_tree = SimpleNamespace()
     shared_path = "figures/shared.png"
-    # Git tree contains a .dvc pointer blob for the same figure
-    fake_blob = _make_fake_blob(shared_path + ".dvc")
-    fake_commit = SimpleNamespace()
-    fake_commit.tree = SimpleNamespace(traverse=lambda: iter([fake_blob]))
+    # Git tree contains a .dvc pointer file for the same figure
+    fake_index = _make_fake_index([shared_path + ".dvc"])
     fake_repo = SimpleNamespace()
-    fake_repo.head = SimpleNamespace(commit=fake_commit)
     # Same path also appears in dvc_lock_outs (pipeline output)
     dvc_lock_outs = {
         shared_path: {"path": shared_path, "md5": "abc123", "type": "file"},
@@ -617,6 +636,10 @@ def test_get_project_figures_dvc_pointer_no_duplicates_with_dvc_lock(
         storage=None,
     )
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -674,6 +697,12 @@ def test_get_project_pipeline_reads_at_ref(client: TestClient) -> None:
         def read_text(self, path: str, encoding: str = "utf-8") -> str:
             return files[path]
 
+        def read_bytes(self, path: str) -> bytes:
+            return files[path].encode()
+
+        def get_blob_sha(self, path: str) -> str:
+            return get_blob_sha(self.read_bytes(path))
+
     fake_tree = FakeTree()
 
     with (
@@ -705,13 +734,6 @@ def test_get_project_pipeline_reads_at_ref(client: TestClient) -> None:
     mock_get_tree.assert_called_once_with(fake_repo, "some-branch")
 
 
-class _EmptyTree:
-    """A repo tree with no files (defeats auto-detection in tests)."""
-
-    def traverse(self):
-        return []
-
-
 def _ref_aware_endpoint_reads_declared_at_ref(
     client: TestClient, endpoint: str, ck_key: str
 ) -> None:
@@ -722,14 +744,15 @@ def _ref_aware_endpoint_reads_declared_at_ref(
     the ref-aware helpers rather than the live working tree.
     """
     fake_project = SimpleNamespace(owner_account_name="o", name="p")
-    fake_repo = SimpleNamespace(
-        working_dir="/tmp/nonexistent",
-        commit=lambda _ref: SimpleNamespace(tree=_EmptyTree()),
-        head=SimpleNamespace(commit=SimpleNamespace(tree=_EmptyTree())),
-    )
+    fake_repo = SimpleNamespace(working_dir="/tmp/nonexistent")
     declared = [{"path": f"declared/from-{ck_key}.pdf", "title": "Declared"}]
 
     with (
+        # An empty tree defeats auto-detection
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=_make_fake_index([]),
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -955,15 +978,13 @@ def test_get_project_results_autodetects_and_reads_ref(
         ".results/hidden.json",  # hidden directory
         "results/plot.png",  # not a result extension
     ]
-    blobs = [_make_fake_blob(p) for p in detected_paths + ignored_paths]
-    fake_commit = SimpleNamespace(
-        tree=SimpleNamespace(traverse=lambda: iter(blobs))
-    )
-    fake_repo = SimpleNamespace(
-        commit=lambda _ref: fake_commit,
-        head=SimpleNamespace(commit=fake_commit),
-    )
+    fake_index = _make_fake_index(detected_paths + ignored_paths)
+    fake_repo = SimpleNamespace()
     with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
         patch(
             "app.api.routes.projects.core.app.projects.get_project",
             return_value=fake_project,
@@ -1143,3 +1164,70 @@ def test_apply_question_update_collapses_to_string_when_cleared() -> None:
     # Empty request clears hypothesis/answer/evidence and collapses to a string.
     out = _apply_question_update(existing, QuestionPut())
     assert out == "q?"
+
+
+def test_get_project_notebooks_autodetects_from_tree(
+    client: TestClient,
+) -> None:
+    """Undeclared notebooks are found in the ref's tree, including ones
+    tracked with DVC, rather than in the clone's working directory, so
+    untracked files there are no longer picked up."""
+    fake_project = SimpleNamespace(id="00000000-0000-0000-0000-000000000001")
+    fake_index = _make_fake_index(
+        [
+            "analysis.ipynb",
+            "nested/dir/explore.ipynb",
+            "big/results.ipynb.dvc",  # tracked with DVC
+            ".hidden/scratch.ipynb",  # hidden directory
+            "script.py",
+        ]
+    )
+    fake_contents = ContentsItem(
+        name="nb",
+        path="nb",
+        type="file",
+        size=0,
+        in_repo=True,
+        content="{}",
+        url=None,
+        storage=None,
+    )
+    with (
+        patch(
+            "app.api.routes.projects.core.get_tree_index",
+            return_value=fake_index,
+        ),
+        patch(
+            "app.api.routes.projects.core.app.projects.get_project",
+            return_value=fake_project,
+        ),
+        patch(
+            "app.api.routes.projects.core.get_repo",
+            return_value=SimpleNamespace(),
+        ),
+        patch(
+            "app.api.routes.projects.core.app.projects.get_ck_info_for_ref",
+            return_value={"notebooks": [{"path": "analysis.ipynb"}]},
+        ),
+        patch(
+            "app.api.routes.projects.core.app.projects.get_repo_tree_for_ref",
+            return_value=SimpleNamespace(),
+        ),
+        patch(
+            "app.api.routes.projects.core.app.projects.get_ck_info_and_dvc_outs_from_tree",
+            return_value=CkInfoAndOuts({}, {}, {}, {}),
+        ),
+        patch(
+            "app.api.routes.projects.core.app.projects.get_contents_from_tree",
+            return_value=fake_contents,
+        ),
+    ):
+        response = client.get(
+            f"{settings.API_V1_STR}/projects/test-owner/test-project/notebooks"
+        )
+    assert response.status_code == 200
+    assert [nb["path"] for nb in response.json()] == [
+        "analysis.ipynb",
+        "nested/dir/explore.ipynb",
+        "big/results.ipynb",
+    ]
@@ -1,13 +1,28 @@
 """Tests for app.api.routes.projects.dvc endpoints."""
 
+import asyncio
 import hashlib
 import io
+import threading
+import time
+from datetime import timedelta
 from types import SimpleNamespace
-from unittest.mock import ANY, MagicMock, patch
+from unittest.mock import ANY, MagicMock, call, patch
 
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from fsspec.implementations.memory import MemoryFileSystem
+from sqlmodel import Session, delete
 
+import app.api.routes.projects.dvc as dvc_routes
+from app import dvc_uploads, hashing, upload_sessions, utcnow
+from app.api.routes.projects.fs import PresignedUrlAccess
 from app.config import settings
+from app.models import DvcUploadSession
+from app.refresh import refresh_scheduler
+
+pytestmark = pytest.mark.usefixtures("object_index")
 
 OWNER = "testowner"
 PROJECT = "testproject"
@@ -43,7 +58,7 @@ def test_get_dvc_file_lowercases_owner_and_project_name(
 ) -> None:
     headers = _dvc_scope_headers(client, normal_user_token_headers)
     fake_fs = MagicMock()
-    fake_fs.exists.return_value = True
+    fake_fs.info.return_value = {"size": 4}
     fake_fs.open.return_value.__enter__.return_value = io.BytesIO(b"data")
     fake_fs.open.return_value.__exit__.return_value = False
     mixed_owner = "TestOwner"
@@ -89,7 +104,7 @@ def test_get_dvc_file_not_found_returns_404(
 ) -> None:
     headers = _dvc_scope_headers(client, normal_user_token_headers)
     fake_fs = MagicMock()
-    fake_fs.exists.return_value = False
+    fake_fs.info.side_effect = FileNotFoundError
     with (
         patch(
             "app.api.routes.projects.dvc.app.projects.get_project",
@@ -109,6 +124,153 @@ def test_get_dvc_file_not_found_returns_404(
     assert response.status_code == 404
 
 
+def test_get_dvc_file_redirects_to_presigned_url(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    fake_fs = MagicMock()
+    fake_fs.info.return_value = {"size": 4}
+    fake_fs.open.return_value.__enter__.return_value = io.BytesIO(b"data")
+    fake_fs.open.return_value.__exit__.return_value = False
+    fpath = "s3://data/testowner/testproject/files/md5/ab/cdef"
+    signed_url = "https://objects.example.com/signed"
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ) as mock_get_project,
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pulled"),
+        patch(
+            "app.api.routes.projects.dvc.get_object_fs",
+            return_value=fake_fs,
+        ),
+        patch(
+            "app.api.routes.projects.dvc.make_data_fpath",
+            return_value=fpath,
+        ),
+        patch(
+            "app.api.routes.projects.dvc.get_object_url",
+            return_value=signed_url,
+        ) as mock_get_url,
+        patch.object(settings, "DVC_DOWNLOAD_REDIRECT", True),
+    ):
+        response = client.get(GET_URL, headers=headers, follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == signed_url
+        mock_get_project.assert_called_once()
+        mock_get_url.assert_called_once_with(
+            fpath,
+            expires=dvc_routes.DOWNLOAD_URL_EXPIRES_SECONDS,
+            fs=fake_fs,
+        )
+        # Clients that don't follow redirects can still have it proxied
+        response = client.get(
+            GET_URL,
+            headers=headers,
+            params={"redirect": "false"},
+            follow_redirects=False,
+        )
+        assert response.status_code == 200
+        assert response.content == b"data"
+        # As can objects that can't be signed
+        mock_get_url.side_effect = ValueError("Unsupported filesystem type")
+        fake_fs.open.return_value.__enter__.return_value = io.BytesIO(b"data")
+        response = client.get(GET_URL, headers=headers, follow_redirects=False)
+        assert response.status_code == 200
+        assert response.content == b"data"
+    # Access is checked before anything is signed
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            side_effect=HTTPException(404),
+        ),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pulled"),
+        patch(
+            "app.api.routes.projects.dvc.get_object_url",
+        ) as mock_get_url,
+        patch.object(settings, "DVC_DOWNLOAD_REDIRECT", True),
+    ):
+        response = client.get(GET_URL, headers=headers, follow_redirects=False)
+    assert response.status_code == 404
+    mock_get_url.assert_not_called()
+
+
+def test_get_dvc_file_ranges_and_etags(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    # An in-memory fsspec filesystem stands in for object storage, so reads
+    # go through real file objects with seeks like s3fs and gcsfs
+    fs = MemoryFileSystem()
+    fpath = "memory://data/testowner/testproject/files/md5/ab/cdef"
+    data = bytes(range(256)) * 40
+    fs.pipe(fpath, data)
+    etag = f'"{IDX}{MD5}"'
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pulled"),
+        patch("app.api.routes.projects.dvc.get_object_fs", return_value=fs),
+        patch(
+            "app.api.routes.projects.dvc.make_data_fpath",
+            return_value=fpath,
+        ),
+    ):
+
+        def get(**extra_headers: str):
+            return client.get(GET_URL, headers=headers | extra_headers)
+
+        response = get()
+        assert response.status_code == 200
+        assert response.content == data
+        assert response.headers["content-length"] == str(len(data))
+        assert response.headers["accept-ranges"] == "bytes"
+        assert response.headers["etag"] == etag
+        # Resuming partway through
+        response = get(Range="bytes=1000-")
+        assert response.status_code == 206
+        assert response.content == data[1000:]
+        assert response.headers["content-range"] == (
+            f"bytes 1000-{len(data) - 1}/{len(data)}"
+        )
+        assert response.headers["content-length"] == str(len(data) - 1000)
+        response = get(Range="bytes=10-19")
+        assert response.status_code == 206
+        assert response.content == data[10:20]
+        response = get(Range="bytes=-5")
+        assert response.status_code == 206
+        assert response.content == data[-5:]
+        # Ends past the object are clamped
+        response = get(Range=f"bytes=10-{10 * len(data)}")
+        assert response.status_code == 206
+        assert response.content == data[10:]
+        response = get(Range=f"bytes={len(data)}-")
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(data)}"
+        # Multiple or malformed ranges get the whole object
+        for value in ("bytes=0-1,5-6", "bytes=abc", "items=0-1"):
+            response = get(Range=value)
+            assert response.status_code == 200
+            assert response.content == data
+        # Ranges only apply if the client's copy is the same object
+        response = get(Range="bytes=10-19", **{"If-Range": etag})
+        assert response.status_code == 206
+        response = get(Range="bytes=10-19", **{"If-Range": '"other"'})
+        assert response.status_code == 200
+        assert response.content == data
+        # Clients holding the object can revalidate without downloading it
+        for value in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            response = get(**{"If-None-Match": value})
+            assert response.status_code == 304
+            assert response.content == b""
+            assert response.headers["etag"] == etag
+        response = get(**{"If-None-Match": '"other"'})
+        assert response.status_code == 200
+        assert response.content == data
+
+
 def test_post_dvc_file_lowercases_owner_and_project_name(
     client: TestClient, normal_user_token_headers: dict[str, str]
 ) -> None:
@@ -151,9 +313,7 @@ def test_post_dvc_file_lowercases_owner_and_project_name(
             return_value=f"s3://data/myorg/myproject/files/md5/{idx}/{md5}",
         ) as mock_make_fpath,
         patch("app.api.routes.projects.dvc.remove_gcs_content_type"),
-        patch(
-            "app.api.routes.projects.dvc.invalidate_storage_usage_cache"
-        ) as mock_invalidate,
+        patch("app.dvc_uploads.record_storage_usage") as mock_record_usage,
     ):
         response = client.post(post_url, headers=headers, content=body)
     assert response.status_code == 200
@@ -170,7 +330,7 @@ def test_post_dvc_file_lowercases_owner_and_project_name(
         idx=idx,
         md5=md5,
     )
-    mock_invalidate.assert_called_once_with("myorg")
+    mock_record_usage.assert_called_once_with("myorg", "myproject", len(body))
 
 
 def test_post_dvc_file_storage_limit_exceeded_returns_400(
@@ -258,3 +418,582 @@ def test_post_dvc_file_md5_mismatch_cleans_pending_file(
         response = client.post(post_url, headers=headers, content=body)
     assert response.status_code == 400
     fake_fs.rm.assert_called_once()
+
+
+def test_post_dvc_objects_exist(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    present = hashlib.md5(b"present").hexdigest()
+    legacy = hashlib.md5(b"legacy").hexdigest()
+    missing = hashlib.md5(b"missing").hexdigest()
+    fake_fs = MagicMock()
+    fake_fs.exists.side_effect = lambda path: (
+        path.endswith(f"files/md5/{present[:2]}/{present[2:]}")
+        or path.endswith(f"{PROJECT}/{legacy[:2]}/{legacy[2:]}")
+    )
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ) as mock_get_project,
+        patch(
+            "app.api.routes.projects.dvc.get_object_fs",
+            return_value=fake_fs,
+        ),
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}"
+            "/dvc/objects/exist",
+            headers=headers,
+            json={"md5s": [missing, present, legacy]},
+        )
+        assert response.status_code == 200
+        # Legacy-layout objects can't be downloaded from the remote
+        assert response.json() == {"exists": [False, True, False]}
+        mock_get_project.assert_called_once()
+        # Anything that isn't an MD5 is rejected rather than looked up
+        for bad in ["../../other/files/md5/ab/cd", present.upper(), ""]:
+            response = client.post(
+                f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}"
+                "/dvc/objects/exist",
+                headers=headers,
+                json={"md5s": [present, bad]},
+            )
+            assert response.status_code == 422
+        # Existence checks for single objects don't open a download
+        fake_fs.exists.reset_mock()
+        response = client.head(
+            f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}"
+            f"/dvc/files/md5/{present[:2]}/{present[2:]}",
+            headers=headers,
+        )
+        assert response.status_code == 200
+        fake_fs.exists.assert_not_called()
+        fake_fs.open.assert_not_called()
+        response = client.head(
+            f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}"
+            f"/dvc/files/md5/{missing[:2]}/{missing[2:]}",
+            headers=headers,
+        )
+        assert response.status_code == 404
+
+
+def test_dvc_direct_upload(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    fs = MemoryFileSystem()
+    base_url = f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}/dvc"
+    data = b"directly uploaded"
+    md5 = hashlib.md5(data).hexdigest()
+    put_access = PresignedUrlAccess(
+        url="https://objects.example.com/put", http_method="PUT"
+    )
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pushed"),
+        patch("app.api.routes.projects.dvc.get_object_fs", return_value=fs),
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch(
+            "app.api.routes.projects.dvc.get_data_prefix",
+            return_value="memory://data",
+        ),
+        patch(
+            "app.api.routes.projects.dvc.get_storage_usage", return_value=0.1
+        ),
+        patch("app.dvc_uploads.record_storage_usage") as mock_record_usage,
+        patch(
+            "app.api.routes.projects.dvc.make_put_access",
+            return_value=put_access,
+        ) as mock_put_access,
+    ):
+        try:
+
+            def start(md5: str, size: int) -> dict:
+                response = client.post(
+                    f"{base_url}/uploads",
+                    headers=headers,
+                    json={"md5": md5, "size": size},
+                )
+                assert response.status_code == 200
+                return response.json()
+
+            def finalize(upload_id: str):
+                return client.post(
+                    f"{base_url}/uploads/{upload_id}/finalize",
+                    headers=headers,
+                )
+
+            upload = start(md5, len(data))
+            assert not upload["exists"]
+            assert upload["access"]["url"] == put_access.url
+            staging_fpath = dvc_routes._get_staging_fpath(
+                OWNER, PROJECT, upload["upload_id"]
+            )
+            mock_put_access.assert_called_once_with(
+                fs=fs,
+                backend=ANY,
+                full_path=staging_fpath,
+                content_length=len(data),
+            )
+            # Nothing is stored until the client has uploaded and finalized
+            assert finalize(upload["upload_id"]).status_code == 404
+            fs.pipe(staging_fpath, data)
+            response = finalize(upload["upload_id"])
+            assert response.status_code == 200
+            assert not fs.exists(staging_fpath)
+            object_fpath = f"memory://data/{OWNER}/{PROJECT}/files/md5/"
+            assert fs.cat(object_fpath + f"{md5[:2]}/{md5[2:]}") == data
+            mock_record_usage.assert_called_once_with(
+                OWNER, PROJECT, len(data)
+            )
+            # Objects the project already has aren't uploaded again
+            assert start(md5, len(data)) == {
+                "exists": True,
+                "upload_id": None,
+                "access": None,
+            }
+            # Corrupt uploads are rejected and removed
+            other_md5 = hashlib.md5(b"expected").hexdigest()
+            upload = start(other_md5, 8)
+            staging_fpath = dvc_routes._get_staging_fpath(
+                OWNER, PROJECT, upload["upload_id"]
+            )
+            fs.pipe(staging_fpath, b"corrupt!")
+            response = finalize(upload["upload_id"])
+            assert response.status_code == 400
+            assert not fs.exists(staging_fpath)
+            assert not fs.exists(
+                object_fpath + f"{other_md5[:2]}/{other_md5[2:]}"
+            )
+            assert finalize("not-an-upload").status_code == 404
+            # Large objects without an MD5 in their metadata are hashed in
+            # the background while the client polls
+            with patch.object(dvc_routes, "UPLOAD_VERIFY_INLINE_MAX_BYTES", 0):
+                large_md5 = hashlib.md5(b"verified").hexdigest()
+                for content, status_code in [
+                    (b"corrupt!", 400),
+                    (b"verified", 200),
+                ]:
+                    upload = start(large_md5, 8)
+                    staging_fpath = dvc_routes._get_staging_fpath(
+                        OWNER, PROJECT, upload["upload_id"]
+                    )
+                    fs.pipe(staging_fpath, content)
+                    response = finalize(upload["upload_id"])
+                    assert response.status_code == 202
+                    for _ in range(100):
+                        response = finalize(upload["upload_id"])
+                        if response.status_code != 202:
+                            break
+                        time.sleep(0.05)
+                    assert response.status_code == status_code
+                    assert not fs.exists(staging_fpath)
+                    assert not fs.exists(
+                        dvc_uploads.get_verifying_fpath(staging_fpath)
+                    )
+                # Uploads another worker is verifying aren't hashed again
+                upload = start(other_md5, 8)
+                staging_fpath = dvc_routes._get_staging_fpath(
+                    OWNER, PROJECT, upload["upload_id"]
+                )
+                fs.pipe(staging_fpath, b"expected")
+                fs.pipe(dvc_uploads.get_verifying_fpath(staging_fpath), b"")
+                response = finalize(upload["upload_id"])
+                assert response.status_code == 202
+                assert fs.exists(staging_fpath)
+            assert (
+                fs.cat(object_fpath + f"{large_md5[:2]}/{large_md5[2:]}")
+                == b"verified"
+            )
+        finally:
+            refresh_scheduler.wait(timeout=10)
+            fs.rm(f"memory://data/{OWNER}", recursive=True)
+
+
+def test_dvc_shared_objects(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    fs = MemoryFileSystem()
+    data = b"shared between projects"
+    md5 = hashlib.md5(data).hexdigest()
+    other_project = "otherproject"
+
+    def url(project_name: str) -> str:
+        return (
+            f"{settings.API_V1_STR}/projects/{OWNER}/{project_name}"
+            f"/dvc/files/md5/{md5[:2]}/{md5[2:]}"
+        )
+
+    with (
+        patch.object(settings, "DVC_SHARED_OBJECTS", True),
+        patch.object(settings, "DVC_DOWNLOAD_REDIRECT", False),
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pushed"),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pulled"),
+        patch("app.api.routes.projects.dvc.get_object_fs", return_value=fs),
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch(
+            "app.api.routes.projects.dvc.get_data_prefix",
+            return_value="memory://data",
+        ),
+        patch(
+            "app.api.routes.projects.dvc.get_storage_usage", return_value=0.1
+        ),
+        patch("app.shared_objects.record_storage_usage") as mock_record_usage,
+    ):
+        try:
+            for project_name in (PROJECT, other_project):
+                response = client.post(
+                    url(project_name), headers=headers, content=data
+                )
+                assert response.status_code == 200
+            # Stored once, and charged to each project
+            assert (
+                fs.cat(f"memory://data/.shared/files/md5/{md5[:2]}/{md5[2:]}")
+                == data
+            )
+            assert not fs.exists(f"memory://data/{OWNER}")
+            assert mock_record_usage.call_args_list == [
+                call(OWNER, PROJECT, len(data)),
+                call(OWNER, other_project, len(data)),
+            ]
+            for project_name in (PROJECT, other_project):
+                response = client.head(url(project_name), headers=headers)
+                assert response.status_code == 200
+                response = client.get(url(project_name), headers=headers)
+                assert response.status_code == 200
+                assert response.content == data
+            response = client.get(url("unrelated"), headers=headers)
+            assert response.status_code == 404
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+def test_dvc_import(
+    client: TestClient, normal_user_token_headers: dict[str, str]
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    fs = MemoryFileSystem()
+    data = b"imported"
+    md5 = hashlib.md5(data).hexdigest()
+    base_url = f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}/dvc"
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ) as mock_get_project,
+        patch("app.api.routes.projects.dvc.get_object_fs", return_value=fs),
+        patch("app.dvc_imports.get_object_fs", return_value=fs),
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch(
+            "app.api.routes.projects.dvc.get_data_prefix",
+            return_value="memory://data",
+        ),
+        patch(
+            "app.api.routes.projects.dvc.get_storage_usage", return_value=0.1
+        ),
+        patch("app.dvc_imports.get_storage_usage", return_value=0.1),
+        patch("app.dvc_imports.record_storage_usage"),
+    ):
+        try:
+            fs.pipe(
+                f"memory://data/source/proj/files/md5/{md5[:2]}/{md5[2:]}",
+                data,
+            )
+            response = client.post(
+                f"{base_url}/imports",
+                headers=headers,
+                json={"project": "Source/proj", "md5s": [md5]},
+            )
+            assert response.status_code == 200
+            assert response.json()["status"] == "running"
+            # Reading the source needs read access
+            assert mock_get_project.call_args_list[0].kwargs == {
+                "session": ANY,
+                "owner_name": "source",
+                "project_name": "proj",
+                "current_user": ANY,
+                "min_access_level": "read",
+            }
+            import_url = f"{base_url}/imports/{response.json()['id']}"
+            for _ in range(100):
+                progress = client.get(import_url, headers=headers).json()
+                if progress["status"] != "running":
+                    break
+                time.sleep(0.05)
+            assert progress["status"] == "completed"
+            assert progress["copied"] == 1
+            assert progress["bytes_copied"] == len(data)
+            assert (
+                fs.cat(
+                    f"memory://data/{OWNER}/{PROJECT}/files/md5/"
+                    f"{md5[:2]}/{md5[2:]}"
+                )
+                == data
+            )
+            response = client.get(
+                f"{base_url}/imports/unknown", headers=headers
+            )
+            assert response.status_code == 404
+            response = client.post(
+                f"{base_url}/imports",
+                headers=headers,
+                json={"project": "source/proj", "md5s": ["not-an-md5"]},
+            )
+            assert response.status_code == 422
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+class _GatedFile(io.BytesIO):
+    """File whose writes block until the gate is opened."""
+
+    def __init__(self, gate: threading.Event) -> None:
+        super().__init__()
+        self.gate = gate
+        self.stored = b""
+
+    def write(self, data) -> int:  # type: ignore[override]
+        self.gate.wait()
+        if data == b"fail":
+            raise OSError("Storage went away")
+        return super().write(data)
+
+    def close(self) -> None:
+        self.stored = self.getvalue()
+        super().close()
+
+
+def test_object_writer_backpressure(monkeypatch) -> None:
+    monkeypatch.setattr(dvc_routes, "UPLOAD_BUFFER_BYTES", 4)
+    monkeypatch.setattr(dvc_routes, "UPLOAD_MAX_PENDING_BUFFERS", 2)
+
+    async def main() -> None:
+        gate = threading.Event()
+        f = _GatedFile(gate)
+        fs = MagicMock()
+        fs.open.return_value = f
+        writer = dvc_routes._ObjectWriter(fs, "pending", keep_bytes=100)
+        # Once two buffers are pending (one being written, blocked on the
+        # gate), writing has to wait
+        for chunk in (b"aa", b"aa", b"bbbb"):
+            await asyncio.wait_for(writer.write(chunk), 1)
+        stalled = asyncio.ensure_future(writer.write(b"cccc"))
+        # The event loop is free in the meantime
+        await asyncio.sleep(0.1)
+        assert not stalled.done()
+        gate.set()
+        await asyncio.wait_for(stalled, 1)
+        await writer.write(b"dddd")
+        await writer.write(b"e")
+        await asyncio.wait_for(writer.close(), 1)
+        data = b"aaaabbbbccccdddde"
+        assert f.stored == data
+        assert writer.size == len(data)
+        assert writer.md5.hexdigest() == hashlib.md5(data).hexdigest()
+        assert writer.content == data
+        # Storage errors surface in the request
+        fs.open.return_value = _GatedFile(gate)
+        writer = dvc_routes._ObjectWriter(fs, "pending")
+        await writer.write(b"fail")
+        with pytest.raises(OSError, match="Storage went away"):
+            for _ in range(10):
+                await asyncio.wait_for(writer.write(b"more"), 1)
+        with pytest.raises(OSError, match="Storage went away"):
+            await writer.close()
+        assert writer.content is None
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("resumable_md5", [True, False])
+def test_dvc_upload_sessions(
+    client: TestClient,
+    normal_user_token_headers: dict[str, str],
+    db: Session,
+    monkeypatch,
+    resumable_md5: bool,
+) -> None:
+    headers = _dvc_scope_headers(client, normal_user_token_headers)
+    monkeypatch.setattr(upload_sessions, "MIN_CHUNK_BYTES", 4)
+    # Without a resumable MD5, the object is hashed once it's complete
+    monkeypatch.setattr(
+        hashing, "AVAILABLE", resumable_md5 and hashing.AVAILABLE
+    )
+    fs = MemoryFileSystem()
+    base_url = f"{settings.API_V1_STR}/projects/{OWNER}/{PROJECT}/dvc"
+    data = b"0123456789"
+    md5 = hashlib.md5(data).hexdigest()
+    object_fpath = f"memory://data/{OWNER}/{PROJECT}/files/md5/"
+    with (
+        patch(
+            "app.api.routes.projects.dvc.app.projects.get_project",
+            return_value=_fake_project(),
+        ),
+        patch("app.api.routes.projects.dvc.mixpanel.user_dvc_pushed"),
+        patch("app.api.routes.projects.dvc.get_object_fs", return_value=fs),
+        patch("app.upload_sessions.get_object_fs", return_value=fs),
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch(
+            "app.api.routes.projects.dvc.get_data_prefix",
+            return_value="memory://data",
+        ),
+        patch(
+            "app.api.routes.projects.dvc.get_storage_usage", return_value=0.1
+        ),
+        patch("app.dvc_uploads.record_storage_usage") as mock_record_usage,
+    ):
+        try:
+
+            def start(md5: str, size: int) -> dict:
+                response = client.post(
+                    f"{base_url}/upload-sessions",
+                    headers=headers,
+                    json={"md5": md5, "size": size},
+                )
+                assert response.status_code == 200
+                return response.json()
+
+            def send(session_id: str, offset: int, chunk: bytes):
+                return client.patch(
+                    f"{base_url}/upload-sessions/{session_id}",
+                    headers=headers | {"Upload-Offset": str(offset)},
+                    content=chunk,
+                )
+
+            def get_offset(session_id: str) -> int | None:
+                response = client.get(
+                    f"{base_url}/upload-sessions/{session_id}",
+                    headers=headers,
+                )
+                if response.status_code == 404:
+                    return None
+                return response.json()["offset"]
+
+            upload = start(md5, len(data))
+            assert upload["offset"] == 0 and not upload["completed"]
+            session_id = upload["id"]
+            response = send(session_id, 0, data[:4])
+            assert response.status_code == 200
+            assert response.json()["offset"] == 4
+            # Chunks have to start where the last one ended
+            response = send(session_id, 0, data[:4])
+            assert response.status_code == 409
+            assert response.headers["upload-offset"] == "4"
+            # A failed chunk leaves the session where it was
+            assert send(session_id, 4, data[4:6]).status_code == 400
+            assert get_offset(session_id) == 4
+            prefix = upload_sessions.get_session_prefix(
+                OWNER, PROJECT, session_id
+            )
+            assert len(fs.find(prefix)) == 1
+            # Chunks past the object's size are rejected before they're
+            # written
+            assert send(session_id, 4, data[4:] + b"!").status_code == 400
+            assert len(fs.find(prefix)) == 1
+            # So are chunks for owners over their storage limit
+            with (
+                patch(
+                    "app.api.routes.projects.dvc.get_storage_usage",
+                    return_value=100.0,
+                ),
+                patch(
+                    "app.api.routes.projects.dvc.mixpanel.user_out_of_storage"
+                ),
+            ):
+                assert send(session_id, 4, data[4:]).status_code == 400
+            assert get_offset(session_id) == 4
+            response = send(session_id, 4, data[4:])
+            assert response.status_code == 200
+            assert response.json()["completed"]
+            assert fs.cat(object_fpath + f"{md5[:2]}/{md5[2:]}") == data
+            assert not fs.exists(prefix)
+            assert get_offset(session_id) is None
+            mock_record_usage.assert_called_once_with(
+                OWNER, PROJECT, len(data)
+            )
+            # Objects the project already has aren't uploaded again
+            upload = start(md5, len(data))
+            assert upload["completed"] and upload["id"] is None
+            # Objects that don't match their MD5 aren't stored
+            other_md5 = hashlib.md5(b"expected").hexdigest()
+            upload = start(other_md5, 8)
+            response = send(upload["id"], 0, b"corrupt!")
+            assert response.status_code == 400
+            assert not fs.exists(
+                object_fpath + f"{other_md5[:2]}/{other_md5[2:]}"
+            )
+            assert get_offset(upload["id"]) is None
+            # Abandoned sessions expire along with their chunks
+            upload = start(other_md5, 8)
+            assert send(upload["id"], 0, b"expe").status_code == 200
+            row = db.get(DvcUploadSession, upload["id"])
+            assert row is not None
+            row.expires = utcnow() - timedelta(seconds=1)
+            db.add(row)
+            db.commit()
+            assert get_offset(upload["id"]) is None
+            assert upload_sessions.expire_sessions(fs) == 1
+            assert not fs.exists(
+                upload_sessions.get_session_prefix(
+                    OWNER, PROJECT, upload["id"]
+                )
+            )
+            # If storing the object is interrupted once it's all received, an
+            # empty chunk at the end retries it
+            upload = start(other_md5, 8)
+            prefix = upload_sessions.get_session_prefix(
+                OWNER, PROJECT, upload["id"]
+            )
+            with (
+                patch.object(
+                    upload_sessions,
+                    "complete_session",
+                    side_effect=RuntimeError("Worker stopped"),
+                ),
+                pytest.raises(RuntimeError),
+            ):
+                send(upload["id"], 0, b"expected")
+            assert get_offset(upload["id"]) == 8
+            # Storage errors while completing keep the chunks for a retry
+            with (
+                patch.object(
+                    upload_sessions,
+                    "merge_objects",
+                    side_effect=OSError("Storage went away"),
+                ),
+                pytest.raises(OSError),
+            ):
+                send(upload["id"], 8, b"")
+            with (
+                patch(
+                    "app.api.routes.projects.dvc.dvc_uploads.store_upload",
+                    side_effect=OSError("Storage went away"),
+                ),
+                pytest.raises(OSError),
+            ):
+                send(upload["id"], 8, b"")
+            assert get_offset(upload["id"]) == 8
+            assert len(fs.find(prefix)) == 1
+            response = send(upload["id"], 8, b"")
+            assert response.status_code == 200
+            assert response.json()["completed"]
+            assert (
+                fs.cat(object_fpath + f"{other_md5[:2]}/{other_md5[2:]}")
+                == b"expected"
+            )
+            assert get_offset(upload["id"]) is None
+            assert not fs.exists(prefix)
+        finally:
+            db.exec(delete(DvcUploadSession))  # type: ignore
+            db.commit()
+            fs.rm(f"memory://data/{OWNER}", recursive=True)
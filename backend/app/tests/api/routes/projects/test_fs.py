@@ -1,7 +1,7 @@
 """Tests for app.api.routes.projects.fs endpoints."""
 
 from types import SimpleNamespace
-from unittest.mock import ANY, MagicMock, patch
+from unittest.mock import ANY, MagicMock, call, patch
 
 from fastapi.testclient import TestClient
 
@@ -200,3 +200,49 @@ def test_list_returns_empty_for_missing_prefix(client: TestClient):
     assert response.status_code == 200
     body = response.json()
     assert body["result"]["paths"] == []
+
+
+def test_put_records_storage_usage(client: TestClient):
+    fake_fs = MagicMock()
+    fake_fs.exists.return_value = True
+    fake_fs.size.side_effect = [FileNotFoundError, 300]
+    with (
+        patch(
+            "app.api.routes.projects.fs.app.projects.get_project",
+            return_value=_fake_project(),
+        ),
+        patch(
+            "app.api.routes.projects.fs.storage.get_backend",
+            return_value="s3",
+        ),
+        patch(
+            "app.api.routes.projects.fs.storage.get_object_fs",
+            return_value=fake_fs,
+        ),
+        patch(
+            "app.api.routes.projects.fs.storage.get_data_prefix",
+            return_value="s3://data",
+        ),
+        patch(
+            "app.api.routes.projects.fs.get_object_url",
+            return_value="https://objects.example.com/put",
+        ),
+        patch(
+            "app.api.routes.projects.fs.storage.record_storage_usage"
+        ) as mock_record_usage,
+    ):
+        for _ in range(2):
+            response = client.post(
+                FS_OPS_URL,
+                json={
+                    "operation": "put",
+                    "path": "data.csv",
+                    "content_length": 1000,
+                },
+            )
+            assert response.status_code == 200
+    # Overwrites are charged the difference
+    assert mock_record_usage.call_args_list == [
+        call(OWNER, PROJECT, 1000),
+        call(OWNER, PROJECT, 700),
+    ]
@@ -0,0 +1,116 @@
+import hashlib
+import hmac
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.config import settings
+from app.models import Account, Project, ProjectGitHead
+
+SECRET = "test-webhook-secret"
+
+
+def _signed_push(payload: dict, secret: str = SECRET) -> dict:
+    body = json.dumps(payload).encode()
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return dict(
+        content=body,
+        headers={
+            "X-GitHub-Event": "push",
+            "X-Hub-Signature-256": f"sha256={signature}",
+            "Content-Type": "application/json",
+        },
+    )
+
+
+def _push_payload(repo: str, branch: str, after: str, **kwargs) -> dict:
+    return {
+        "ref": f"refs/heads/{branch}",
+        "after": after,
+        "repository": {
+            "full_name": repo,
+            "html_url": f"https://github.com/{repo}",
+        },
+        **kwargs,
+    }
+
+
+@pytest.fixture
+def webhook_project(db: Session, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "GH_WEBHOOK_SECRET", SECRET)
+    suffix = uuid.uuid4().hex[:8]
+    account = Account(name=f"hook-owner-{suffix}", github_name="Hook-Owner")
+    project = Project(
+        name="hook-project",
+        title="Hook Project",
+        git_repo_url=f"https://github.com/Hook-Owner/hook-project-{suffix}",
+        owner_account_id=account.id,
+        owner_account=account,
+    )
+    db.add(account)
+    db.add(project)
+    db.commit()
+    yield project
+    db.delete(project)
+    db.delete(account)
+    db.commit()
+
+
+def test_github_push_event_records_branch_head(
+    client: TestClient, db: Session, webhook_project: Project
+) -> None:
+    repo = webhook_project.git_repo_url.removeprefix("https://github.com/")
+    # GitHub reports the repo name with its own casing
+    payload = _push_payload(repo.lower(), "main", "a" * 40)
+    r = client.post(
+        f"{settings.API_V1_STR}/github-events", **_signed_push(payload)
+    )
+    assert r.status_code == 200
+    head = db.get(ProjectGitHead, (webhook_project.id, "main"))
+    assert head is not None
+    assert head.sha == "a" * 40
+    # A later push moves the recorded head
+    payload = _push_payload(repo, "main", "b" * 40)
+    r = client.post(
+        f"{settings.API_V1_STR}/github-events", **_signed_push(payload)
+    )
+    assert r.status_code == 200
+    db.refresh(head)
+    assert head.sha == "b" * 40
+    # Deleting the branch removes the record
+    payload = _push_payload(repo, "main", "0" * 40, deleted=True)
+    r = client.post(
+        f"{settings.API_V1_STR}/github-events", **_signed_push(payload)
+    )
+    assert r.status_code == 200
+    db.expire_all()
+    assert db.get(ProjectGitHead, (webhook_project.id, "main")) is None
+
+
+def test_github_event_bad_signature_rejected(
+    client: TestClient, db: Session, webhook_project: Project
+) -> None:
+    repo = webhook_project.git_repo_url.removeprefix("https://github.com/")
+    payload = _push_payload(repo, "main", "c" * 40)
+    r = client.post(
+        f"{settings.API_V1_STR}/github-events",
+        **_signed_push(payload, secret="wrong-secret"),
+    )
+    assert r.status_code == 401
+    assert db.get(ProjectGitHead, (webhook_project.id, "main")) is None
+
+
+def test_github_event_ignores_tags(
+    client: TestClient, db: Session, webhook_project: Project
+) -> None:
+    repo = webhook_project.git_repo_url.removeprefix("https://github.com/")
+    payload = _push_payload(repo, "main", "d" * 40)
+    payload["ref"] = "refs/tags/v1.0"
+    r = client.post(
+        f"{settings.API_V1_STR}/github-events", **_signed_push(payload)
+    )
+    assert r.status_code == 200
+    assert db.get(ProjectGitHead, (webhook_project.id, "v1.0")) is None
@@ -21,6 +21,7 @@ from app.api.routes.projects.releases import (
     _build_stored_release_filename,
 )
 from app.config import settings
+from app.documents import get_blob_sha
 from app.models import ReleaseStaleness, ReleaseUrlMetadata
 from app.pipeline import StageStatus
 from fastapi.testclient import TestClient
@@ -450,7 +451,9 @@ def test_path_staleness_stale_stage_flags_not_up_to_date() -> None:
     from app.api.routes.projects import releases
 
     fake_tree = SimpleNamespace(
-        is_file=lambda p: True, read_bytes=lambda p: b"stages: {}"
+        is_file=lambda p: True,
+        read_bytes=lambda p: b"stages: {}",
+        get_blob_sha=lambda p: get_blob_sha(b"stages: {}"),
     )
     statuses = {
         "build-paper": StageStatus(
@@ -2,11 +2,13 @@ from collections.abc import Generator
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, delete
 
+from app import cache
 from app.config import settings
 from app.db import engine, init_db
 from app.main import app
+from app.models import DvcObject, DvcObjectImport, DvcSharedObject
 from app.tests import (
     authentication_token_from_email,
     get_superuser_token_headers,
@@ -38,3 +40,23 @@ def normal_user_token_headers(
     return authentication_token_from_email(
         client=client, email=settings.EMAIL_TEST_USER, db=db
     )
+
+
+@pytest.fixture(autouse=True)
+def shared_cache() -> Generator[None, None, None]:
+    """Start each test with an empty shared cache."""
+    cache.set_backend(cache.MemoryBackend())
+    yield
+    cache.set_backend(None)
+
+
+@pytest.fixture
+def object_index(db: Session) -> Generator[None, None, None]:
+    """Empty the DVC object index after a test, since tests reuse owner and
+    project names with different fake storage contents. Modules whose tests
+    store DVC objects use it."""
+    yield
+    db.exec(delete(DvcObject))  # type: ignore
+    db.exec(delete(DvcSharedObject))  # type: ignore
+    db.exec(delete(DvcObjectImport))  # type: ignore
+    db.commit()
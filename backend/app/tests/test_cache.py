@@ -0,0 +1,133 @@
+"""Tests for the ``cache`` module."""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app import cache
+from app.config import settings
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        backend = cache.MemoryBackend()
+    else:
+        backend = cache.SqliteBackend(str(tmp_path / "cache.db"))
+    cache.set_backend(backend)
+    yield backend
+    cache.set_backend(None)
+
+
+def test_namespace_round_trip(backend):
+    ns = cache.Namespace("test-round-trip", ttl=60)
+    assert ns.get(("a", 1)) is None
+    assert ns.get(("a", 1), default=False) is False
+    ns.set(("a", 1), None)
+    assert ns.get(("a", 1), default=False) is None
+    big = {"paths": [f"data/file-{i}.csv" for i in range(1000)]}
+    ns.set("big", big)
+    assert ns.get("big") == big
+    # Large values are stored compressed
+    stored = backend.get(ns.make_key("big"))
+    assert stored is not None
+    assert stored[cache.SIGNATURE_BYTES : cache.SIGNATURE_BYTES + 1] == b"z"
+    assert len(stored) < len(repr(big))
+    ns.delete("big")
+    assert ns.get("big") is None
+
+
+def test_namespace_ttl_and_clear(backend):
+    ns = cache.Namespace("test-ttl", ttl=60)
+    other = cache.Namespace("test-ttl-other", ttl=60)
+    ns.set("short", 1, ttl=0.05)
+    ns.set("long", 2)
+    other.set("long", 3)
+    time.sleep(0.1)
+    assert ns.get("short") is None
+    assert ns.get("long") == 2
+    ns.clear()
+    assert ns.get("long") is None
+    assert other.get("long") == 3
+
+
+def test_namespace_local_copies(backend):
+    ns = cache.Namespace("test-local", ttl=60, local_ttl=60)
+    ns.set("key", {"value": 1})
+    first = ns.get("key")
+    # Served from this process without deserializing again
+    backend.delete(ns.make_key("key"))
+    assert ns.get("key") is first
+    ns.clear()
+    assert ns.get("key") is None
+
+
+def test_namespace_rejects_unsigned_entries(backend):
+    ns = cache.Namespace("test-signed", ttl=60)
+    ns.set("key", [1, 2])
+    full_key = ns.make_key("key")
+    stored = backend.get(full_key)
+    assert stored is not None
+    # Entries written with another key, or not by a worker at all, are
+    # discarded without being unpickled
+    with patch.object(settings, "SHARED_CACHE_SECRET", "other"):
+        assert ns.get("key") is None
+    backend.set(full_key, b"\0" * cache.SIGNATURE_BYTES + stored[-8:], 60)
+    assert ns.get("key") is None
+    backend.set(full_key, stored, 60)
+    assert ns.get("key") == [1, 2]
+
+
+def test_sqlite_backend_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    writer = cache.SqliteBackend(path, max_entries=2)
+    reader = cache.SqliteBackend(path)
+    writer.set("calkit:a", b"1", ttl=None)
+    assert reader.get("calkit:a") == b"1"
+    writer.set("calkit:b", b"2", ttl=None)
+    writer.set("calkit:c", b"3", ttl=None)
+    writer.prune()
+    assert reader.get("calkit:a") is None
+    assert reader.get("calkit:c") == b"3"
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_backend_bounds_each_namespace(kind, tmp_path):
+    if kind == "memory":
+        backend = cache.MemoryBackend(max_entries=2)
+    else:
+        backend = cache.SqliteBackend(
+            str(tmp_path / "cache.db"), max_entries=2
+        )
+    backend.set("calkit:quiet:1:a", b"1", ttl=None)
+    for n in range(5):
+        backend.set(f"calkit:busy:1:{n}", b"2", ttl=None)
+    if kind == "sqlite":
+        backend.prune()
+    # A busy namespace only evicts its own entries
+    assert backend.get("calkit:quiet:1:a") == b"1"
+    assert backend.get("calkit:busy:1:0") is None
+    assert backend.get("calkit:busy:1:4") == b"2"
+
+
+def test_make_backend():
+    assert isinstance(cache.make_backend("memory://"), cache.MemoryBackend)
+    with pytest.raises(ValueError):
+        cache.make_backend("ftp://example.com")
+
+
+def test_check_backend(tmp_path):
+    cache.set_backend(cache.SqliteBackend(str(tmp_path / "cache.db")))
+    try:
+        # A shared backend needs a signing key every worker agrees on
+        with (
+            patch.object(settings, "SHARED_CACHE_SECRET", None),
+            patch.object(settings, "__pydantic_fields_set__", set()),
+            pytest.raises(ValueError),
+        ):
+            cache.check_backend()
+        with patch.object(settings, "SHARED_CACHE_SECRET", "secret"):
+            cache.check_backend()
+    finally:
+        cache.set_backend(None)
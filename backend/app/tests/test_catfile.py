@@ -0,0 +1,96 @@
+"""Tests for the ``catfile`` module."""
+
+import threading
+import time
+
+import git
+
+from app import catfile
+
+
+def _make_repo(tmp_path, n_files=3, size=10):
+    repo = git.Repo.init(tmp_path / "repo")
+    repo.git.config(["user.name", "CI Test"])
+    repo.git.config(["user.email", "ci-test@example.com"])
+    for i in range(n_files):
+        (tmp_path / "repo" / f"file-{i}.txt").write_text(str(i) * size)
+    repo.git.add(["."])
+    repo.git.commit(["-m", "Add files"])
+    return repo
+
+
+def test_request_pipelines_many_objects(tmp_path):
+    # Enough content that responses overflow the pipe buffer many times
+    repo = _make_repo(tmp_path, n_files=200, size=5000)
+    pool = catfile.CatFilePool()
+    names = [f"HEAD:file-{i}.txt" for i in range(200)] + ["HEAD:nope.txt"]
+    results = pool.request(repo.git_dir, names)
+    assert len(results) == 201
+    for i, result in enumerate(results[:-1]):
+        assert result is not None
+        info, content = result
+        assert info.type == "blob"
+        assert content == (str(i) * 5000).encode()
+    assert results[-1] is None
+    infos = pool.request(repo.git_dir, names[:2], mode="batch-check")
+    assert [r[0].size for r in infos] == [5000, 5000]
+    assert all(r[1] is None for r in infos)
+    pool.close()
+
+
+def test_worker_restarts_after_crash(tmp_path):
+    repo = _make_repo(tmp_path)
+    pool = catfile.CatFilePool()
+    assert pool.read(repo.git_dir, "HEAD:file-0.txt")[1] == b"0" * 10
+    (worker,) = next(iter(pool._workers.values()))
+    worker._proc.kill()
+    worker._proc.wait()
+    assert pool.read(repo.git_dir, "HEAD:file-1.txt")[1] == b"1" * 10
+    pool.close()
+
+
+def test_idle_workers_are_closed(tmp_path):
+    repo = _make_repo(tmp_path)
+    pool = catfile.CatFilePool()
+    pool.read(repo.git_dir, "HEAD:file-0.txt")
+    (worker,) = next(iter(pool._workers.values()))
+    proc = worker._proc
+    with pool._lock:
+        for key in list(pool._workers):
+            pool._close_idle(key, max_idle=catfile.IDLE_TIMEOUT)
+    # Used just now, so still open
+    assert proc.poll() is None
+    worker.last_used -= catfile.IDLE_TIMEOUT
+    with pool._lock:
+        for key in list(pool._workers):
+            pool._close_idle(key, max_idle=catfile.IDLE_TIMEOUT)
+    assert proc.poll() is not None
+    assert not pool._workers
+
+
+def test_waiter_skips_worker_closed_while_waiting(tmp_path, monkeypatch):
+    monkeypatch.setattr(catfile, "MAX_WORKERS_PER_REPO", 1)
+    repo = _make_repo(tmp_path)
+    pool = catfile.CatFilePool()
+    busy = pool._acquire(repo.git_dir, "batch", {})
+    acquired = []
+    waiter = threading.Thread(
+        target=lambda: acquired.append(
+            pool._acquire(repo.git_dir, "batch", {})
+        )
+    )
+    waiter.start()
+    # Let the waiter queue behind the busy worker
+    time.sleep(0.1)
+    # Closed by the reaper between its user releasing it and the waiter
+    # getting it
+    with pool._lock:
+        pool._workers.clear()
+        busy.close()
+        busy.lock.release()
+    waiter.join(5)
+    (worker,) = acquired
+    assert worker is not busy
+    assert pool._workers[(repo.git_dir, "batch", ())] == [worker]
+    worker.lock.release()
+    pool.close()
@@ -0,0 +1,61 @@
+"""Tests for the ``documents`` module."""
+
+import copy
+
+import git
+import pytest
+
+from app import documents
+from app.git import GitTree, WorkingTree
+
+
+def test_read_document_parses_each_blob_once(tmp_path, monkeypatch):
+    repo = git.Repo.init(tmp_path / "repo")
+    repo.git.config(["user.name", "CI Test"])
+    repo.git.config(["user.email", "ci-test@example.com"])
+    (tmp_path / "repo" / "dvc.lock").write_text(
+        "schema: '2.0'\nstages:\n  train:\n    outs:\n    - path: model.pkl\n"
+    )
+    (tmp_path / "repo" / "empty.yaml").write_text("")
+    repo.git.add(["."])
+    repo.git.commit(["-m", "Add lockfile"])
+    documents.clear()
+    loads = []
+    load_yaml = documents.load_yaml
+
+    def _counting_load_yaml(data):
+        loads.append(data)
+        return load_yaml(data)
+
+    monkeypatch.setattr(documents, "load_yaml", _counting_load_yaml)
+    git_tree = GitTree(repo, "HEAD")
+    lock = documents.read_document(git_tree, "dvc.lock")
+    assert git_tree.get_blob_sha("dvc.lock") == (
+        repo.head.commit.tree["dvc.lock"].hexsha
+    )
+    # The same content read through another tree hits the cache
+    working_tree = WorkingTree(repo.working_dir)
+    assert working_tree.get_blob_sha("dvc.lock") == (
+        git_tree.get_blob_sha("dvc.lock")
+    )
+    assert documents.read_document(working_tree, "dvc.lock") is lock
+    assert len(loads) == 1
+    assert lock["stages"]["train"]["outs"][0]["path"] == "model.pkl"
+    assert documents.read_document(git_tree, "empty.yaml", {}) == {}
+    assert documents.read_document(git_tree, "nope.yaml", {}) == {}
+
+
+def test_documents_are_immutable():
+    doc = documents.freeze({"stages": {"train": {"outs": [{"path": "a"}]}}})
+    with pytest.raises(TypeError):
+        doc["stages"]["train"]["outs"].append({"path": "b"})
+    with pytest.raises(TypeError):
+        doc.pop("stages")
+    assert isinstance(doc["stages"], dict)
+    # Merging or copying gives plain, mutable containers
+    merged = doc | {"extra": True}
+    merged["more"] = 1
+    thawed = copy.deepcopy(doc)
+    thawed["stages"]["train"]["outs"].append({"path": "b"})
+    assert type(thawed["stages"]) is dict
+    assert len(doc["stages"]["train"]["outs"]) == 1
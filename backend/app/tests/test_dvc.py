@@ -1,9 +1,23 @@
 """Tests for the ``dvc`` module."""
 
+import hashlib
+import io
+import json
 import os
 from copy import deepcopy
 
-from app.dvc import make_mermaid_diagram, output_from_pipeline
+import pytest
+
+from app import cache, object_cache, shared_objects
+from app.dvc import (
+    _DVC_DIR_CACHE,
+    expand_dvc_lock_outs,
+    make_mermaid_diagram,
+    output_from_pipeline,
+)
+from app.storage import make_data_fpath, make_shared_data_fpath
+
+pytestmark = pytest.mark.usefixtures("object_index")
 
 
 def test_make_mermaid_diagram():
@@ -96,3 +110,79 @@ def test_expand_dvc_lock_outs():
     populated in the dev environment.
     """
     pass  # TODO
+
+
+class _FakeObjectFS:
+    def __init__(self, objects: dict[str, bytes]):
+        self.objects = objects
+        self.opened: list[str] = []
+
+    def open(self, path, mode="rb"):
+        self.opened.append(path)
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        return io.BytesIO(self.objects[path])
+
+
+def test_expand_dvc_lock_outs_reads_dir_manifests_from_disk(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(object_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(object_cache, "_prewarm_started", True)
+    cache.set_backend(cache.MemoryBackend())
+    manifest = json.dumps(
+        [
+            {"md5": "c3dddc7bf94809e09559b0ae327037f7", "relpath": "a.csv"},
+            {"md5": "d3dddc7bf94809e09669b0ae327037f7", "relpath": "b.csv"},
+        ]
+    ).encode()
+    md5 = hashlib.md5(manifest).hexdigest() + ".dir"
+    fpath = make_data_fpath(
+        owner_name="someone", project_name="proj", idx=md5[:2], md5=md5[2:]
+    )
+    fs = _FakeObjectFS({fpath: manifest})
+    lock = {"stages": {"get": {"outs": [{"path": "data/raw", "md5": md5}]}}}
+    try:
+        outs = expand_dvc_lock_outs(lock, "someone", "proj", fs=fs)
+        assert outs["data/raw/a.csv"]["md5"].startswith("c3ddd")
+        assert fs.opened == [fpath]
+        # A cold process reads the manifest from disk, not the network
+        _DVC_DIR_CACHE.clear()
+        fs.objects.clear()
+        assert expand_dvc_lock_outs(lock, "someone", "proj", fs=fs) == outs
+        assert fs.opened == [fpath]
+        # Objects evicted from disk are refetched for recent projects
+        object_cache.prune(max_bytes=1)
+        assert object_cache.get(md5) is None
+        fs.objects[fpath] = manifest
+        assert object_cache.prewarm(fs) == 1
+        assert object_cache.get(md5) == manifest
+    finally:
+        cache.set_backend(None)
+
+
+def test_expand_dvc_lock_outs_reads_shared_dir_manifests(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(object_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(object_cache, "_prewarm_started", True)
+    manifest = json.dumps(
+        [{"md5": "c3dddc7bf94809e09559b0ae327037f7", "relpath": "a.csv"}]
+    ).encode()
+    md5 = hashlib.md5(manifest).hexdigest() + ".dir"
+    shared_objects.add_references("someone", "proj", [(md5, len(manifest))])
+    fs = _FakeObjectFS({make_shared_data_fpath(md5): manifest})
+    lock = {"stages": {"get": {"outs": [{"path": "data/raw", "md5": md5}]}}}
+    outs = expand_dvc_lock_outs(lock, "someone", "proj", fs=fs)
+    assert outs["data/raw/a.csv"]["md5"].startswith("c3ddd")
+    assert fs.opened[-1] == make_shared_data_fpath(md5)
+
+
+def test_object_cache_rejects_mismatched_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(object_cache, "CACHE_DIR", str(tmp_path))
+    md5 = hashlib.md5(b"[]").hexdigest() + ".dir"
+    assert not object_cache.put(md5, b"[{}]")
+    assert object_cache.get(md5) is None
+    assert object_cache.put(md5, b"[]")
+    assert object_cache.get(md5) == b"[]"
+    assert object_cache.get("../../etc/passwd") is None
@@ -0,0 +1,179 @@
+"""Tests for the ``dvc_imports`` module."""
+
+import hashlib
+import json
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from fsspec.implementations.memory import MemoryFileSystem
+from sqlmodel import Session
+
+from app import dvc_imports, shared_objects
+from app.config import settings
+from app.models import DvcObjectImport
+from app.object_index import (
+    find_objects,
+    get_indexed_objects,
+    get_object_fpath,
+)
+from app.storage import make_shared_data_fpath
+
+pytestmark = pytest.mark.usefixtures("object_index")
+
+
+def _put(fs, owner_name: str, project_name: str, data: bytes) -> str:
+    md5 = hashlib.md5(data).hexdigest()
+    fs.pipe(get_object_fpath(owner_name, project_name, md5), data)
+    return md5
+
+
+def test_run_import():
+    fs = MemoryFileSystem()
+    files = [b"file a", b"file b", b"file c"]
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.dvc_imports.get_storage_usage", return_value=0.0),
+        patch("app.dvc_imports.record_storage_usage") as mock_record_usage,
+    ):
+        try:
+            md5s = [_put(fs, "src", "proj", data) for data in files]
+            manifest = json.dumps(
+                [
+                    {"md5": md5, "relpath": f"{n}.csv"}
+                    for n, md5 in enumerate(md5s)
+                ]
+                # A file the source doesn't have
+                + [{"md5": "0" * 32, "relpath": "missing.csv"}]
+            ).encode()
+            dir_md5 = hashlib.md5(manifest).hexdigest() + ".dir"
+            fs.pipe(get_object_fpath("src", "proj", dir_md5), manifest)
+            # The destination already has one of the files
+            _put(fs, "dst", "proj", files[0])
+            created = dvc_imports.create_import(
+                "Dst", "proj", "src", "proj", [dir_md5], storage_limit_gb=1
+            )
+            dvc_import = dvc_imports.run_import(created.id, fs=fs)
+            assert dvc_import.status == "completed"
+            assert dvc_import.total == 5
+            assert dvc_import.missing == 1
+            assert dvc_import.skipped == 1
+            assert dvc_import.copied == 3
+            assert dvc_import.bytes_copied == len(manifest) + 12
+            assert dvc_imports.get_import("dst", "proj", created.id) == (
+                dvc_import
+            )
+            assert dvc_imports.get_import("other", "proj", created.id) is None
+            for md5 in md5s + [dir_md5]:
+                assert fs.exists(get_object_fpath("dst", "proj", md5))
+            assert set(get_indexed_objects("dst", "proj", md5s)) == set(md5s)
+            mock_record_usage.assert_called_once_with(
+                "dst", "proj", len(manifest) + 12
+            )
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+def test_run_import_shared_objects():
+    fs = MemoryFileSystem()
+    data = b"shared file"
+    md5 = hashlib.md5(data).hexdigest()
+    with (
+        patch.object(settings, "DVC_SHARED_OBJECTS", True),
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.shared_objects.record_storage_usage"),
+        patch("app.dvc_imports.get_storage_usage", return_value=0.0),
+        patch("app.dvc_imports.record_storage_usage"),
+    ):
+        try:
+            fs.pipe(make_shared_data_fpath(md5), data)
+            shared_objects.add_references("src", "proj", [(md5, len(data))])
+            created = dvc_imports.create_import(
+                "dst", "proj", "src", "proj", [md5], storage_limit_gb=1
+            )
+            dvc_import = dvc_imports.run_import(created.id, fs=fs)
+            # Nothing is copied
+            assert dvc_import.referenced == 1
+            assert dvc_import.copied == 0
+            assert not fs.exists("memory://data/dst")
+            assert get_indexed_objects("dst", "proj", [md5])[md5].shared
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+def test_run_import_storage_limit():
+    fs = MemoryFileSystem()
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.dvc_imports.get_storage_usage", return_value=0.5),
+        patch("app.dvc_imports.record_storage_usage") as mock_record_usage,
+    ):
+        try:
+            md5 = _put(fs, "src", "proj", b"x" * 1000)
+            # The import itself fits, but not on top of what's used
+            created = dvc_imports.create_import(
+                "dst", "proj", "src", "proj", [md5], storage_limit_gb=0.5
+            )
+            dvc_import = dvc_imports.run_import(created.id, fs=fs)
+            assert dvc_import.status == "failed"
+            assert dvc_import.error == "Storage limit exceeded"
+            assert not fs.exists(get_object_fpath("dst", "proj", md5))
+            mock_record_usage.assert_not_called()
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+def test_run_import_resumed():
+    fs = MemoryFileSystem()
+    files = [b"file a", b"file b", b"file c"]
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.dvc_imports.get_storage_usage", return_value=0.0),
+        patch("app.dvc_imports.record_storage_usage") as mock_record_usage,
+    ):
+        try:
+            md5s = [_put(fs, "src", "proj", data) for data in files]
+            # The destination already had one, which was indexed when the
+            # import first looked for it
+            _put(fs, "dst", "proj", files[0])
+            created = dvc_imports.create_import(
+                "dst", "proj", "src", "proj", md5s, storage_limit_gb=1
+            )
+            with patch("app.object_index.MISSING_TTL_SECONDS", 0):
+                find_objects("dst", "proj", md5s, fs)
+            dvc_imports._update(created.id, total=3)
+            # And it copied another before it stopped, without recording it,
+            # so it's found by looking in storage
+            _put(fs, "dst", "proj", files[1])
+            dvc_import = dvc_imports.run_import(created.id, fs=fs)
+            assert dvc_import.status == "completed"
+            assert dvc_import.skipped == 1
+            assert dvc_import.copied == 2
+            indexed = get_indexed_objects("dst", "proj", md5s)
+            assert [indexed[md5].size for md5 in md5s] == [None, 6, 6]
+            # Both objects it copied are charged, the one it had isn't
+            assert [c.args[2] for c in mock_record_usage.call_args_list] == [
+                6,
+                6,
+            ]
+        finally:
+            fs.rm("memory://data", recursive=True)
+
+
+def test_resume_stale_import(db: Session):
+    created = dvc_imports.create_import(
+        "dst", "proj", "src", "proj", ["0" * 32], storage_limit_gb=1
+    )
+    with patch("app.dvc_imports._submit") as mock_submit:
+        # Imports that are being bumped are left alone
+        assert dvc_imports.resume_stale_imports() == 0
+        row = db.get(DvcObjectImport, created.id)
+        assert row is not None
+        row.updated -= timedelta(seconds=dvc_imports.IMPORT_STALE_SECONDS + 1)
+        db.add(row)
+        db.commit()
+        assert dvc_imports.get_import("dst", "proj", created.id) is not None
+        mock_submit.assert_called_once_with(created.id)
+        # Only one worker takes it over
+        assert dvc_imports.resume_stale_imports() == 0
+        mock_submit.assert_called_once()
@@ -0,0 +1,66 @@
+"""Tests for the ``dvc_uploads`` module."""
+
+import hashlib
+from unittest.mock import patch
+
+import pytest
+from fsspec.implementations.memory import MemoryFileSystem
+
+from app import dvc_uploads
+from app.config import settings
+from app.object_index import get_indexed_objects, get_object_fpath
+from app.storage import make_shared_data_fpath
+
+pytestmark = pytest.mark.usefixtures("object_index")
+
+
+def test_put_object():
+    fs = MemoryFileSystem()
+    data = b"figure bytes"
+    md5 = hashlib.md5(data).hexdigest()
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.dvc_uploads.record_storage_usage") as mock_record_usage,
+        patch("app.shared_objects.record_storage_usage"),
+    ):
+        try:
+            fpath = dvc_uploads.put_object("Owner", "proj", md5, data, fs=fs)
+            assert fpath == get_object_fpath("owner", "proj", md5)
+            assert fs.cat(fpath) == data
+            assert not fs.exists(fpath + ".pending")
+            indexed = get_indexed_objects("owner", "proj", [md5])[md5]
+            assert indexed.size == len(data)
+            mock_record_usage.assert_called_once_with(
+                "Owner", "proj", len(data)
+            )
+            # With the shared store, the object is stored there instead
+            with patch.object(settings, "DVC_SHARED_OBJECTS", True):
+                assert dvc_uploads.put_object(
+                    "owner", "other", md5, data, fs=fs
+                ) == make_shared_data_fpath(md5)
+            assert get_indexed_objects("owner", "other", [md5])[md5].shared
+        finally:
+            if fs.exists("memory://data"):
+                fs.rm("memory://data", recursive=True)
+
+
+def test_expire_staged_uploads():
+    fs = MemoryFileSystem()
+    with patch("app.storage.get_data_prefix", return_value="memory://data"):
+        prefix = dvc_uploads.get_staging_prefix("Owner", "Proj")
+        try:
+            fs.pipe(f"{prefix}/upload-1", b"abandoned")
+            assert dvc_uploads.expire_staged_uploads("owner", "proj", fs) == 0
+            assert fs.exists(f"{prefix}/upload-1")
+            assert (
+                dvc_uploads.expire_staged_uploads(
+                    "owner", "proj", fs, ttl_seconds=0
+                )
+                == 1
+            )
+            assert not fs.exists(f"{prefix}/upload-1")
+            # Projects without any staged uploads are fine
+            assert dvc_uploads.expire_staged_uploads("owner", "other", fs) == 0
+        finally:
+            if fs.exists("memory://data"):
+                fs.rm("memory://data", recursive=True)
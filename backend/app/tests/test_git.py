@@ -1,15 +1,23 @@
 """Tests for app.git."""
 
 import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from pathlib import Path
+from unittest.mock import MagicMock, patch
 
 import git
 import pytest
 from fastapi import HTTPException
+from filelock import FileLock
 
 import app.git
 import app.github
 import app.projects
+from app.models import Account, Project, ProjectGitHead
 
 
 class _FakeResp:
@@ -50,6 +58,572 @@ def _init_repo(repo_dir: Path) -> tuple[git.Repo, str]:
     return repo, ref_v1
 
 
+def _init_remote(tmp_path: Path) -> tuple[Path, git.Repo]:
+    """Create a bare "remote" with two commits on ``main``, and return it
+    along with the working repo used to push to it."""
+    remote_dir = tmp_path / "remote.git"
+    git.Repo.init(remote_dir, bare=True)
+    git.Repo(remote_dir).git.symbolic_ref(["HEAD", "refs/heads/main"])
+    src, _ = _init_repo(tmp_path / "src")
+    src.create_remote("origin", str(remote_dir))
+    src.git.push(["origin", "HEAD:refs/heads/main"])
+    return remote_dir, src
+
+
+def _make_project(git_repo_url: str) -> Project:
+    account = Account(
+        id=uuid.uuid4(),
+        name="owneracct",
+        github_name="ownergh",
+        user_id=uuid.uuid4(),
+    )
+    return Project(
+        id=uuid.uuid4(),
+        name="project-name",
+        title="Project Name",
+        git_repo_url=git_repo_url,
+        owner_account_id=account.id,
+        owner_account=account,
+    )
+
+
+def test_get_repo_clones_from_shared_mirror(tmp_path, monkeypatch, db):
+    """Working clones borrow objects from one bare mirror per project, and
+    pick up new remote commits through it."""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(app.git, "REPO_CACHE_DIR", str(cache_dir))
+    remote_dir, src = _init_remote(tmp_path)
+    project = _make_project(str(remote_dir))
+    repo = app.git.get_repo(project=project, user=None, session=db, ttl=60)
+    assert repo.working_dir == str(
+        cache_dir / "anonymous" / "ownergh" / "project-name" / "repo"
+    )
+    assert (Path(repo.working_dir) / "notes.txt").read_text() == (
+        "version-two\n"
+    )
+    mirror_dir = os.path.join(
+        app.git.get_mirror_base_dir("ownergh", "project-name"), "repo.git"
+    )
+    assert git.Repo(mirror_dir).bare
+    alternates = Path(repo.git_dir) / "objects" / "info" / "alternates"
+    assert alternates.read_text().strip() == os.path.join(
+        mirror_dir, "objects"
+    )
+    # Pushes go to the real remote, not the mirror
+    assert repo.remotes.origin.url == str(remote_dir)
+    # A new commit upstream reaches the working clone via the mirror
+    (tmp_path / "src" / "notes.txt").write_text("version-three\n")
+    src.git.commit(["-am", "Update notes again"])
+    src.git.push(["origin", "HEAD:refs/heads/main"])
+    repo = app.git.get_repo(project=project, user=None, session=db, ttl=None)
+    assert repo.head.commit.hexsha == src.head.commit.hexsha
+    assert git.Repo(mirror_dir).commit("main").hexsha == (
+        src.head.commit.hexsha
+    )
+    assert (Path(repo.working_dir) / "notes.txt").read_text() == (
+        "version-three\n"
+    )
+
+
+def test_get_repo_partial_clone(tmp_path, monkeypatch, db):
+    """In partial clone mode the mirror starts without blobs, and the ones
+    working clones read are fetched from the remote into the mirror."""
+    monkeypatch.setattr(app.git, "REPO_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(app.git.settings, "GIT_PARTIAL_CLONE", True)
+    remote_dir, src = _init_remote(tmp_path)
+    remote = git.Repo(remote_dir)
+    remote.git.config(["uploadpack.allowFilter", "true"])
+    remote.git.config(["uploadpack.allowAnySHA1InWant", "true"])
+    # Filters only apply over a transport, not to plain local paths
+    project = _make_project(remote_dir.as_uri())
+    ref_v1 = src.commit("HEAD~1").hexsha
+    repo = app.git.get_repo(project=project, user=None, session=db, ttl=60)
+    mirror = git.Repo(
+        os.path.join(
+            app.git.get_mirror_base_dir("ownergh", "project-name"),
+            "repo.git",
+        )
+    )
+    assert app.git._is_partial_clone(mirror)
+    assert app.git._is_partial_clone(repo)
+    v1_blob = src.commit(ref_v1).tree["notes.txt"].hexsha
+    v2_blob = src.commit("HEAD").tree["notes.txt"].hexsha
+
+    def get_missing() -> list[str]:
+        return mirror.git.rev_list(
+            ["--objects", "--missing=print", "--all"]
+        ).split()
+
+    assert f"?{v1_blob}" in get_missing()
+    # What checkout needed was fetched into the mirror, for other clones
+    assert f"?{v2_blob}" not in get_missing()
+    assert (Path(repo.working_dir) / "notes.txt").read_text() == (
+        "version-two\n"
+    )
+    # History only needs commits and trees
+    history = app.git.get_file_history(repo, path="notes.txt", storage="git")
+    assert len(history) == 2
+    # Old versions are fetched on demand
+    tree = app.git.get_repo_tree_for_ref(repo, ref_v1)
+    tree.prefetch(["notes.txt"])
+    assert f"?{v1_blob}" not in get_missing()
+    assert tree.read_text("notes.txt") == "version-one\n"
+    blobs = app.git._batch_read_blobs(repo, [f"{ref_v1}:notes.txt"])
+    assert blobs[f"{ref_v1}:notes.txt"] == (v1_blob, b"version-one\n")
+    # Updates still flow through the mirror
+    (tmp_path / "src" / "notes.txt").write_text("version-three\n")
+    src.git.commit(["-am", "Update notes again"])
+    src.git.push(["origin", "HEAD:refs/heads/main"])
+    repo = app.git.get_repo(project=project, user=None, session=db, ttl=None)
+    assert (Path(repo.working_dir) / "notes.txt").read_text() == (
+        "version-three\n"
+    )
+
+
+def test_get_repo_uses_recorded_head_instead_of_ttl(tmp_path, monkeypatch, db):
+    """With a head recorded by the push webhook, get_repo skips the network
+    while it's current, and refreshes as soon as it isn't, or once the
+    fallback TTL passes."""
+    monkeypatch.setattr(app.git, "REPO_CACHE_DIR", str(tmp_path / "cache"))
+    remote_dir, src = _init_remote(tmp_path)
+    account = Account(name=f"owner-{uuid.uuid4().hex[:8]}", github_name="gh")
+    project = _make_project(str(remote_dir))
+    project.owner_account_id = account.id
+    project.owner_account = account
+    db.add(account)
+    db.add(project)
+    db.add(
+        ProjectGitHead(
+            project_id=project.id, branch="main", sha=src.head.commit.hexsha
+        )
+    )
+    db.commit()
+    try:
+        v2 = src.head.commit.hexsha
+        repo = app.git.get_repo(project=project, user=None, session=db)
+        assert repo.head.commit.hexsha == v2
+        fetches = []
+        real_refresh = app.git._refresh_mirror
+
+        def spy_refresh(*args, **kwargs):
+            fetches.append(kwargs.get("known_head"))
+            return real_refresh(*args, **kwargs)
+
+        monkeypatch.setattr(app.git, "_refresh_mirror", spy_refresh)
+        # Push upstream without the webhook firing: even with an expired TTL
+        # the recorded head says we're current, so nothing is fetched
+        (tmp_path / "src" / "notes.txt").write_text("version-three\n")
+        src.git.commit(["-am", "Update notes again"])
+        src.git.push(["origin", "HEAD:refs/heads/main"])
+        repo = app.git.get_repo(project=project, user=None, session=db, ttl=0)
+        assert repo.head.commit.hexsha == v2
+        assert fetches == []
+        # Once the new head is recorded, a warm TTL doesn't hide it: the
+        # clone is refreshed right away
+        v3 = src.head.commit.hexsha
+        head = db.get(ProjectGitHead, (project.id, "main"))
+        head.sha = v3
+        db.add(head)
+        db.commit()
+        repo = app.git.get_repo(
+            project=project, user=None, session=db, ttl=3600
+        )
+        assert repo.head.commit.hexsha == v3
+        assert fetches == [("main", v3)]
+        repo = app.git.get_repo(
+            project=project, user=None, session=db, ttl=3600
+        )
+        assert len(fetches) == 1
+        # A missed delivery is caught up on the long fallback TTL, after
+        # which the clone being past the recorded head isn't stale
+        (tmp_path / "src" / "notes.txt").write_text("version-four\n")
+        src.git.commit(["-am", "Update notes once more"])
+        src.git.push(["origin", "HEAD:refs/heads/main"])
+        monkeypatch.setattr(app.git, "KNOWN_HEAD_MAX_AGE_SECONDS", 0)
+        app.git.get_repo(project=project, user=None, session=db, ttl=3600)
+        assert app.git.refresh_scheduler.wait(timeout=30)
+        repo = app.git.get_repo(
+            project=project, user=None, session=db, ttl=3600
+        )
+        assert repo.head.commit.hexsha == src.head.commit.hexsha
+        assert app.git.refresh_scheduler.wait(timeout=30)
+        monkeypatch.setattr(app.git, "KNOWN_HEAD_MAX_AGE_SECONDS", 3600)
+        n_fetches = len(fetches)
+        repo = app.git.get_repo(
+            project=project, user=None, session=db, ttl=3600
+        )
+        assert len(fetches) == n_fetches
+    finally:
+        db.delete(project)
+        db.delete(account)
+        db.commit()
+
+
+def test_single_flight_reuses_concurrent_update(tmp_path):
+    """A waiter for a repo's lock learns whether the holder updated it."""
+    lock = FileLock(str(tmp_path / "updating.lock"))
+    updated = tmp_path / "updated.txt"
+    updated.touch()
+    os.utime(updated, (1, 1))
+
+    def update_while_holding_lock(stamp_at: float):
+        with lock:
+            acquired.set()
+            time.sleep(0.2)
+            os.utime(updated, (stamp_at, stamp_at))
+
+    # An update that started before we began waiting is good enough for
+    # TTL-based reads, but not for strict ones
+    for strict, expected in [(False, True), (True, False)]:
+        acquired = threading.Event()
+        t = threading.Thread(target=update_while_holding_lock, args=(2,))
+        t.start()
+        acquired.wait()
+        with app.git._single_flight(
+            str(tmp_path), "clone", timeout=10, strict=strict
+        ) as coalesced:
+            assert coalesced is expected
+        t.join()
+        os.utime(updated, (1, 1))
+    # With nobody else updating, the caller does the work itself
+    with app.git._single_flight(
+        str(tmp_path), "clone", timeout=10, strict=False
+    ) as coalesced:
+        assert not coalesced
+
+
+def test_single_flight_deadline(tmp_path):
+    with FileLock(str(tmp_path / "updating.lock")):
+        with pytest.raises(HTTPException) as exc_info:
+            with app.git._single_flight(
+                str(tmp_path), "mirror", timeout=0.1, strict=False
+            ):
+                pass
+    assert exc_info.value.status_code == 503
+
+
+def test_get_overleaf_repo_busy(tmp_path, monkeypatch):
+    """Waiting too long on another request's Overleaf pull is a 503."""
+    monkeypatch.setattr(app.git, "REPO_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(app.git, "GIT_CLONE_TIMEOUT", 0.1)
+    # MagicMock takes name as its own, so it's set afterwards
+    project = MagicMock(owner_github_name="owner")
+    project.name = "proj"
+    user = MagicMock(github_username="user")
+    base_dir = tmp_path / "user" / "owner" / "proj" / "overleaf" / "abc"
+    base_dir.mkdir(parents=True)
+    with (
+        patch("app.git.users.get_overleaf_token", return_value="token"),
+        patch("app.git.subprocess.check_call") as mock_clone,
+        FileLock(str(base_dir / "updating.lock")),
+    ):
+        with pytest.raises(HTTPException) as exc_info:
+            app.git.get_overleaf_repo(project, user, MagicMock(), "abc")
+    assert exc_info.value.status_code == 503
+    mock_clone.assert_not_called()
+
+
+def test_git_tree(tmp_path):
+    """GitTree reads paths, listings and sizes straight from objects."""
+    repo, ref_v1 = _init_repo(tmp_path / "repo")
+    (tmp_path / "repo" / "data").mkdir()
+    (tmp_path / "repo" / "data" / "raw.csv.dvc").write_text("outs: []\n")
+    os.symlink("../notes.txt", tmp_path / "repo" / "data" / "notes-link")
+    os.symlink("../../outside", tmp_path / "repo" / "data" / "bad-link")
+    repo.git.add(["."])
+    repo.git.commit(["-m", "Add data"])
+    tree = app.git.get_repo_tree_for_ref(repo, "HEAD")
+    assert sorted(tree.listdir(None)) == ["data", "new-file.txt", "notes.txt"]
+    assert sorted(tree.listdir("data")) == [
+        "bad-link",
+        "notes-link",
+        "raw.csv.dvc",
+    ]
+    assert tree.is_dir("data") and not tree.is_file("data")
+    assert tree.is_file("data/raw.csv.dvc")
+    assert tree.is_symlink("data/notes-link")
+    assert not tree.is_file("data/notes-link")
+    assert tree.is_safe_symlink("data/notes-link")
+    assert not tree.is_safe_symlink("data/bad-link")
+    assert not tree.exists("data/missing") and not tree.exists("notes.txt/x")
+    assert tree.size("notes.txt") == len("version-two\n")
+    tree.prefetch(["data/raw.csv.dvc", "notes.txt", "missing"])
+    assert tree.read_text("data/raw.csv.dvc") == "outs: []\n"
+    with pytest.raises(NotADirectoryError):
+        tree.listdir("notes.txt")
+    with pytest.raises(KeyError):
+        tree.read_bytes("missing")
+    old_tree = app.git.get_repo_tree_for_ref(repo, ref_v1)
+    assert old_tree.read_text("notes.txt") == "version-one\n"
+    assert not old_tree.exists("data")
+
+
+def test_maintain_repo(tmp_path):
+    """Maintenance writes a commit-graph with Bloom filters and a
+    multi-pack index, and is skipped while it's already running, but not
+    while the repo is being updated."""
+    repo, _ = _init_repo(tmp_path / "repo")
+    objects_dir = tmp_path / "repo" / ".git" / "objects"
+    with FileLock(str(tmp_path / "maintenance.lock")):
+        assert app.git.maintain_repo(str(tmp_path), repo.working_dir) is None
+    with FileLock(str(tmp_path / "updating.lock")):
+        report = app.git.maintain_repo(str(tmp_path), repo.working_dir)
+    assert report is not None
+    assert set(report["before"]) == set(report["after"])
+    assert (objects_dir / "info" / "commit-graphs").is_dir()
+    assert (objects_dir / "pack" / "multi-pack-index").is_file()
+    assert (tmp_path / "maintained.txt").is_file()
+    # Bloom filters make path-limited logs answer from the graph
+    assert repo.git.log(["--format=%s", "--", "notes.txt"]).splitlines() == [
+        "Update notes and add new file",
+        "Add v1 notes",
+    ]
+
+
+def test_search_refs(tmp_path, monkeypatch):
+    """search_refs lists branches with ahead/behind counts, tags and recent
+    commits, and serves repeat queries from its cache until a ref moves."""
+    repo, ref_v1 = _init_repo(tmp_path / "repo")
+    repo.git.branch(["-M", "main"])
+    repo.git.checkout(["-b", "feature", ref_v1])
+    (tmp_path / "repo" / "feature.txt").write_text("feature\n")
+    repo.git.add(["feature.txt"])
+    repo.git.commit(["-m", "Add feature\n\nWith a body"])
+    repo.git.checkout(["main"])
+    repo.git.tag(["v1", ref_v1])
+    repo.git.tag(["-a", "v2", "-m", "Release two", "main"])
+    refs = {(r.kind, r.name): r for r in app.git.search_refs(repo)}
+    assert refs[("branch", "main")].is_default
+    feature = refs[("branch", "feature")]
+    assert (feature.ahead, feature.behind) == (1, 1)
+    assert feature.message == "Add feature"
+    assert refs[("tag", "v1")].hash == ref_v1
+    assert refs[("tag", "v2")].message == "Release two"
+    assert refs[("tag", "v2")].hash == repo.head.commit.hexsha
+    # Commits that a branch or tag points at aren't repeated
+    assert [name for kind, name in refs if kind == "commit"] == []
+    assert [r.name for r in app.git.search_refs(repo, query="release")] == [
+        "v2"
+    ]
+    # Served from the cache while no ref changes
+    monkeypatch.setattr(app.git, "_list_refs", lambda repo: [])
+    assert len(app.git.search_refs(repo)) == len(refs)
+    monkeypatch.undo()
+    repo.git.commit(["--allow-empty", "-m", "Move main"])
+    refs = {(r.kind, r.name): r for r in app.git.search_refs(repo)}
+    feature = refs[("branch", "feature")]
+    assert (feature.ahead, feature.behind) == (1, 2)
+    assert ("commit", repo.head.commit.hexsha[:7]) not in refs
+    assert ("commit", repo.head.commit.parents[0].hexsha[:7]) not in refs
+
+
+def test_count_ahead_behind(tmp_path, monkeypatch):
+    """Without the ahead-behind atom, counts for every ref come from one
+    history walk, and match rev-list's."""
+    repo, ref_v1 = _init_repo(tmp_path / "repo")
+    repo.git.branch(["-M", "main"])
+    repo.git.branch(["behind", ref_v1])
+    for name, start, n_commits in [
+        ("diverged", ref_v1, 2),
+        ("ahead", "main", 1),
+    ]:
+        repo.git.checkout(["-b", name, start])
+        for i in range(n_commits):
+            repo.git.commit(["--allow-empty", "-m", f"{name} {i}"])
+    repo.git.checkout(["--orphan", "unrelated"])
+    repo.git.commit(["--allow-empty", "-m", "Unrelated"])
+    repo.git.checkout(["main"])
+    repo.git.commit(["--allow-empty", "-m", "Move main"])
+    refs = {
+        f"refs/heads/{name}": repo.commit(name).hexsha
+        for name in ("behind", "diverged", "ahead", "unrelated")
+    }
+    expected = {}
+    for refname in refs:
+        behind, ahead = repo.git.rev_list(
+            ["--left-right", "--count", f"main...{refname}"]
+        ).split()
+        expected[refname] = (int(ahead), int(behind))
+    monkeypatch.setattr(app.git, "_ahead_behind_atom", False)
+    main_sha = repo.commit("main").hexsha
+    counts = app.git._get_ahead_behind(repo, refs, "refs/heads/main", main_sha)
+    assert counts == expected
+    assert counts["refs/heads/diverged"] == (2, 2)
+    # Repeat counts come from the cache
+    with patch.object(app.git, "_run_git") as mock_run_git:
+        assert (
+            app.git._get_ahead_behind(repo, refs, "refs/heads/main", main_sha)
+            == expected
+        )
+    mock_run_git.assert_not_called()
+    # Refs are counted separately, with capped counts, rather than walking
+    # far back to where they all meet
+    app.git._AHEAD_BEHIND_CACHE.clear()
+    monkeypatch.setattr(app.git, "_AHEAD_BEHIND_MAX_WALK", 3)
+    monkeypatch.setattr(app.git, "_AHEAD_BEHIND_MAX_COUNT", 1)
+    counts = app.git._get_ahead_behind(repo, refs, "refs/heads/main", main_sha)
+    assert counts == {
+        refname: (min(ahead, 1), min(behind, 1))
+        for refname, (ahead, behind) in expected.items()
+    }
+
+
+def test_get_commit_history_cursor(tmp_path, monkeypatch):
+    """Paging with a cursor walks the same history as one big log, merges
+    included, whether or not the cursor was recorded by an earlier page."""
+    repo, _ = _init_repo(tmp_path / "repo")
+    main = repo.active_branch.name
+    repo.git.checkout(["-b", "side"])
+    for i in range(3):
+        repo.git.commit(["--allow-empty", "-m", f"Side {i}"])
+    repo.git.checkout([main])
+    for i in range(3):
+        repo.git.commit(["--allow-empty", "-m", f"Main {i}"])
+    repo.git.merge(["--no-ff", "-m", "Merge side", "side"])
+    expected = repo.git.rev_list(["HEAD"]).split()
+    assert [c["hash"] for c in app.git.get_commit_history(repo)] == expected
+    pages = []
+    cursor = None
+    while True:
+        page = app.git.get_commit_history(repo, max_count=3, cursor=cursor)
+        if not page:
+            break
+        pages.append([c["hash"] for c in page])
+        cursor = page[-1]["hash"]
+    assert all(len(page) <= 3 for page in pages)
+    assert sum(pages, []) == expected
+    # Without a recorded cursor (e.g. the entry expired from the cache)
+    # the walk is recovered from the commit graph
+    app.git._HISTORY_CURSORS.clear()
+    page = app.git.get_commit_history(repo, max_count=3, cursor=expected[4])
+    assert [c["hash"] for c in page] == expected[5:8]
+    assert page[0]["summary"] == repo.commit(expected[5]).summary
+    with pytest.raises(HTTPException):
+        app.git.get_commit_history(repo, ref="side", cursor=expected[0])
+
+
+def test_get_commit_detail_and_patch(tmp_path):
+    """Commit details list changed files with line counts only, and each
+    file's patch is served separately in line-aligned pages."""
+    repo, ref_v1 = _init_repo(tmp_path / "repo")
+    root_detail = app.git.get_commit_detail(repo, ref_v1[:7])
+    assert root_detail is not None
+    assert root_detail["changed_files"] == [
+        {
+            "path": "notes.txt",
+            "old_path": None,
+            "change_type": "A",
+            "insertions": 1,
+            "deletions": 0,
+            "is_binary": False,
+        }
+    ]
+    (tmp_path / "repo" / "notes.txt").rename(tmp_path / "repo" / "moved.txt")
+    (tmp_path / "repo" / "data.bin").write_bytes(b"\x00\x01")
+    (tmp_path / "repo" / "long.txt").write_text(
+        "".join(f"line {i}\n" for i in range(200))
+    )
+    repo.git.add(["-A"])
+    repo.git.commit(["-m", "Move notes\n\nAnd add data"])
+    detail = app.git.get_commit_detail(repo, "HEAD")
+    assert detail is not None
+    assert detail["summary"] == "Move notes"
+    assert detail["message"] == "Move notes\n\nAnd add data"
+    files = {f["path"]: f for f in detail["changed_files"]}
+    assert files["moved.txt"]["change_type"] == "R"
+    assert files["moved.txt"]["old_path"] == "notes.txt"
+    assert files["data.bin"]["is_binary"]
+    assert files["data.bin"]["insertions"] is None
+    assert files["long.txt"]["insertions"] == 200
+    assert app.git.get_commit_detail(repo, "0" * 40) is None
+    full = repo.git.show(["--format=", "HEAD", "--", "long.txt"]) + "\n"
+    patch = ""
+    offset: int | None = 0
+    while offset is not None:
+        page = app.git.get_commit_file_patch(
+            repo, "HEAD", "long.txt", offset=offset, limit=500
+        )
+        assert page is not None
+        assert len(page["patch"].encode()) <= 500
+        if page["next_offset"] is not None:
+            assert page["patch"].endswith("\n")
+        patch += page["patch"]
+        offset = page["next_offset"]
+    assert patch == full
+    rename = app.git.get_commit_file_patch(repo, "HEAD", "moved.txt")
+    assert rename is not None and "rename from notes.txt" in rename["patch"]
+    assert app.git.get_commit_file_patch(repo, "HEAD", "nope.txt") is None
+
+
+def test_get_tree_index(tmp_path, monkeypatch):
+    """Tree indexes list every file with its size and any .dvc output path,
+    are saved to disk, and are derived from an ancestor's index."""
+    monkeypatch.setattr(app.git, "REPO_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(app.git, "_TREE_INDEX_CACHE", OrderedDict())
+    repo, _ = _init_repo(tmp_path / "repo")
+    repo_dir = tmp_path / "repo"
+    (repo_dir / "figs").mkdir()
+    (repo_dir / "figs" / "plot.png.dvc").write_text(
+        "outs:\n- md5: abc\n  path: plot.png\n"
+    )
+    (repo_dir / "data.csv.dvc").write_text("not: a pointer\n")
+    repo.git.add(["-A"])
+    repo.git.commit(["-m", "Add DVC files"])
+    index = app.git.get_tree_index(repo)
+    assert index.tree_sha == repo.head.commit.tree.hexsha
+    assert sorted(index.iter_paths()) == [
+        "data.csv.dvc",
+        "figs/plot.png.dvc",
+        "new-file.txt",
+        "notes.txt",
+    ]
+    assert sorted(index.iter_paths(with_dvc_outs=True)) == [
+        "data.csv",
+        "data.csv.dvc",
+        "figs/plot.png",
+        "figs/plot.png.dvc",
+        "new-file.txt",
+        "notes.txt",
+    ]
+    notes = index.get("notes.txt")
+    assert notes is not None
+    assert notes.size == len("version-two\n")
+    assert notes.sha == repo.head.commit.tree["notes.txt"].hexsha
+    assert os.path.isfile(app.git._get_tree_index_fpath(index.tree_sha))
+    # A new commit's index is derived from its parent's
+    (repo_dir / "notes.txt").write_text("version-three\n")
+    (repo_dir / "new-file.txt").unlink()
+    (repo_dir / "figs" / "other.png.dvc").write_text(
+        "outs:\n- path: ../other.png\n"
+    )
+    repo.git.add(["-A"])
+    repo.git.commit(["-m", "Change things"])
+    with patch.object(
+        app.git, "_build_tree_index", side_effect=AssertionError
+    ):
+        derived = app.git.get_tree_index(repo, "HEAD")
+    assert sorted(derived.iter_paths(with_dvc_outs=True)) == [
+        "data.csv",
+        "data.csv.dvc",
+        "figs/other.png.dvc",
+        "figs/plot.png",
+        "figs/plot.png.dvc",
+        "notes.txt",
+        "other.png",
+    ]
+    notes = derived.get("notes.txt")
+    assert notes is not None and notes.size == len("version-three\n")
+    # Indexes are read back from disk, and older refs resolve too
+    app.git._TREE_INDEX_CACHE.clear()
+    with patch.object(
+        app.git, "_build_tree_index", side_effect=AssertionError
+    ):
+        assert "new-file.txt" in app.git.get_tree_index(repo, "HEAD~1")
+    with pytest.raises(HTTPException) as exc_info:
+        app.git.get_tree_index(repo, "no-such-branch")
+    assert exc_info.value.status_code == 404
+
+
 def test_get_file_history_git_tracked(tmp_path, monkeypatch):
     """get_file_history returns commits that touched the given file."""
     monkeypatch.setattr(
@@ -0,0 +1,25 @@
+"""Tests for the ``hashing`` module."""
+
+import hashlib
+import os
+
+import pytest
+
+from app import hashing
+
+
+@pytest.mark.skipif(not hashing.AVAILABLE, reason="OpenSSL MD5 unavailable")
+def test_resumable_md5():
+    data = os.urandom(100_000)
+    md5 = hashing.ResumableMD5()
+    for start in range(0, len(data), 30_001):
+        # Save and resume between every chunk, at odd block offsets
+        md5 = hashing.ResumableMD5(md5.state)
+        md5.update(data[start : start + 30_001])
+        assert (
+            md5.hexdigest() == hashlib.md5(data[: start + 30_001]).hexdigest()
+        )
+    assert md5.hexdigest() == hashlib.md5(data).hexdigest()
+    assert hashing.ResumableMD5().hexdigest() == hashlib.md5().hexdigest()
+    with pytest.raises(ValueError):
+        hashing.ResumableMD5(b"not a state")
@@ -0,0 +1,100 @@
+"""Tests for the ``object_index`` module."""
+
+import hashlib
+from unittest.mock import patch
+
+import pytest
+
+from app import cache, object_index
+
+pytestmark = pytest.mark.usefixtures("object_index")
+
+
+def _md5(s: str) -> str:
+    return hashlib.md5(s.encode()).hexdigest()
+
+
+class FakeFS:
+    """Minimal fsspec-like FS over a set of object paths."""
+
+    def __init__(self, paths: dict[str, int]) -> None:
+        self.paths = paths
+        self.probed: list[str] = []
+
+    def _strip_protocol(self, path: str) -> str:
+        return path.split("://", 1)[-1]
+
+    def exists(self, path: str) -> bool:
+        self.probed.append(path)
+        return self._strip_protocol(path) in self.paths
+
+    def find(self, path, maxdepth=None, detail=False):
+        root = self._strip_protocol(path).rstrip("/") + "/"
+        return {
+            p: {"name": p, "size": size}
+            for p, size in self.paths.items()
+            if p.startswith(root)
+            and (maxdepth is None or p[len(root) :].count("/") < maxdepth)
+        }
+
+
+def _fpath(md5: str, legacy: bool = False) -> str:
+    return object_index.get_object_fpath("o", "p", md5, legacy).split(
+        "://", 1
+    )[-1]
+
+
+def test_find_objects_probes_only_unknown_md5s():
+    current, legacy, missing = _md5("a"), _md5("b"), _md5("c")
+    fs = FakeFS({_fpath(current): 1, _fpath(legacy, legacy=True): 2})
+    res = object_index.find_objects("o", "p", [current, legacy, missing], fs)
+    assert res[current].path.endswith(f"files/md5/{current[:2]}/{current[2:]}")
+    assert res[legacy].legacy
+    assert res[missing] is None
+    # Found objects are indexed and misses remembered, so nothing is probed
+    fs.probed.clear()
+    res2 = object_index.find_objects("O", "P", [current, legacy, missing], fs)
+    assert fs.probed == []
+    assert {m: i and i.path for m, i in res2.items()} == {
+        m: i and i.path for m, i in res.items()
+    }
+    # Uploading an object makes it present right away
+    object_index.record_objects("o", "p", [(missing, False, 3)])
+    assert object_index.find_object("o", "p", missing, fs).size == 3
+
+
+def test_find_objects_remembers_misses_per_project():
+    missing = [_md5(str(n)) for n in range(50)]
+    fs = FakeFS({})
+    object_index.find_objects("o", "p", missing, fs)
+    # However many MD5s are missing, a batch is one read from the backend
+    backend = cache.get_backend()
+    with patch.object(backend, "get", wraps=backend.get) as mock_get:
+        fs.probed.clear()
+        object_index.find_objects("o", "p", missing, fs)
+    assert fs.probed == []
+    assert mock_get.call_count == 1
+    # Other projects' misses are separate
+    object_index.find_objects("o", "other", missing[:1], fs)
+    assert len(fs.probed) == 2
+
+
+def test_reconcile():
+    current, legacy, deleted = _md5("a"), _md5("b"), _md5("c")
+    object_index.record_objects("o", "p", [(deleted, False, None)])
+    fs = FakeFS(
+        {
+            _fpath(current): 1,
+            _fpath(legacy, legacy=True): 2,
+            # The same object in both layouts is indexed in the current one
+            _fpath(current, legacy=True): 1,
+            _fpath(current).rsplit("/", 2)[0] + "/not-an-object": 4,
+        }
+    )
+    assert object_index.reconcile("o", "p", fs) == (2, 1)
+    fs.probed.clear()
+    res = object_index.find_objects("o", "p", [current, legacy], fs)
+    assert fs.probed == []
+    assert not res[current].legacy and res[current].size == 1
+    assert res[legacy].legacy and res[legacy].size == 2
+    assert object_index.find_object("o", "p", deleted, fs) is None
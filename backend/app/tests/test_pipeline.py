@@ -3,6 +3,7 @@
 import hashlib
 
 import git
+import pytest
 
 from app.git import get_repo_tree_for_ref
 from app.pipeline import (
@@ -11,6 +12,8 @@ from app.pipeline import (
     calc_overall_pipeline_status,
 )
 
+pytestmark = pytest.mark.usefixtures("object_index")
+
 
 class FakeFS:
     """Minimal fsspec-like FS recording which md5s exist in object storage."""
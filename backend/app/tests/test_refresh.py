@@ -0,0 +1,71 @@
+"""Tests for the ``refresh`` module."""
+
+import threading
+import time
+
+import pytest
+
+import app.refresh
+from app.refresh import RefreshScheduler
+
+
+def test_schedule_dedupes_pending_keys():
+    scheduler = RefreshScheduler(max_workers=2)
+    release = threading.Event()
+    calls = []
+
+    def job():
+        calls.append(1)
+        release.wait(timeout=10)
+
+    assert scheduler.schedule("repo", job)
+    # Already pending, so not queued again
+    assert not scheduler.schedule("repo", job)
+    release.set()
+    assert scheduler.wait(timeout=10)
+    assert calls == [1]
+    # Once done, the key can be scheduled again
+    assert scheduler.schedule("repo", job)
+    assert scheduler.wait(timeout=10)
+    assert calls == [1, 1]
+
+
+def test_schedule_backs_off_after_failure():
+    scheduler = RefreshScheduler(max_workers=1)
+
+    def failing_job():
+        raise RuntimeError("remote unreachable")
+
+    def backoff_remaining() -> float:
+        return scheduler._retry_at["repo"] - time.monotonic()
+
+    assert scheduler.schedule("repo", failing_job)
+    assert scheduler.wait(timeout=10)
+    assert not scheduler.schedule("repo", failing_job)
+    assert 0 < backoff_remaining() <= app.refresh.BACKOFF_BASE_SECONDS
+    # The second consecutive failure doubles the delay
+    scheduler._retry_at["repo"] = 0
+    assert scheduler.schedule("repo", failing_job)
+    assert scheduler.wait(timeout=10)
+    assert backoff_remaining() > app.refresh.BACKOFF_BASE_SECONDS
+    # A success clears the backoff
+    scheduler._retry_at["repo"] = 0
+    assert scheduler.schedule("repo", lambda: None)
+    assert scheduler.wait(timeout=10)
+    assert "repo" not in scheduler._retry_at
+    assert scheduler.schedule("repo", lambda: None)
+    assert scheduler.wait(timeout=10)
+
+
+@pytest.mark.parametrize("age,expected", [(10.0, 0), (90.0, 1)])
+def test_sweep_refreshes_nearly_stale_repos(age, expected):
+    scheduler = RefreshScheduler(max_workers=1)
+    calls = []
+    # Track without starting the background sweeper
+    scheduler._sweeper = threading.Thread(target=lambda: None)
+    scheduler.track(
+        "repo", job=lambda: calls.append(1), ttl=100, get_age=lambda: age
+    )
+    scheduler.sweep()
+    assert scheduler.wait(timeout=10)
+    assert len(calls) == expected
@@ -0,0 +1,92 @@
+"""Tests for the ``repo_cache`` module."""
+
+import os
+import time
+
+from filelock import FileLock
+
+from app import repo_cache
+
+
+def _make_cached_repo(
+    base_dir, repo_dirname="repo", size=4096, accessed_ago=3600
+):
+    repo_dir = base_dir / repo_dirname
+    repo_dir.mkdir(parents=True)
+    (repo_dir / "data.bin").write_bytes(os.urandom(size))
+    (base_dir / "updated.txt").touch()
+    accessed = base_dir / "accessed.txt"
+    accessed.touch()
+    t = time.time() - accessed_ago
+    os.utime(accessed, (t, t))
+    return repo_dir
+
+
+def test_list_entries(tmp_path):
+    _make_cached_repo(tmp_path / ".mirrors" / "owner" / "proj", "repo.git")
+    _make_cached_repo(tmp_path / "alice" / "owner" / "proj")
+    _make_cached_repo(
+        tmp_path / "alice" / "owner" / "proj" / "overleaf" / "abc123"
+    )
+    # Unrelated dirs in the cache root are ignored
+    (tmp_path / "other" / "a" / "b" / "repo").mkdir(parents=True)
+    entries = repo_cache.list_entries(str(tmp_path))
+    assert sorted(e.kind for e in entries) == ["clone", "mirror", "overleaf"]
+
+
+def test_evict_least_recently_used(tmp_path):
+    oldest = _make_cached_repo(tmp_path / "alice" / "o" / "p1", size=64_000)
+    newer = _make_cached_repo(
+        tmp_path / "alice" / "o" / "p2", size=64_000, accessed_ago=1800
+    )
+    evicted = repo_cache.evict(str(tmp_path), max_bytes=100_000)
+    assert [e.repo_dir for e in evicted] == [str(oldest)]
+    assert not oldest.exists()
+    assert not (tmp_path / "alice" / "o" / "p1" / "updated.txt").exists()
+    assert newer.exists()
+
+
+def test_evict_skips_locked_and_recent_repos(tmp_path):
+    locked = _make_cached_repo(tmp_path / "alice" / "o" / "p1")
+    recent = _make_cached_repo(tmp_path / "alice" / "o" / "p2", accessed_ago=5)
+    with FileLock(str(tmp_path / "alice" / "o" / "p1" / "updating.lock")):
+        evicted = repo_cache.evict(str(tmp_path), max_bytes=0)
+    assert evicted == []
+    assert locked.exists()
+    assert recent.exists()
+
+
+def test_evict_mirror_only_after_its_clones(tmp_path):
+    # The mirror was read longest ago, but a clone still borrows from it
+    mirror = _make_cached_repo(
+        tmp_path / ".mirrors" / "o" / "p", "repo.git", accessed_ago=7200
+    )
+    clone = _make_cached_repo(tmp_path / "alice" / "o" / "p")
+    with FileLock(str(tmp_path / "alice" / "o" / "p" / "updating.lock")):
+        assert repo_cache.evict(str(tmp_path), max_bytes=0) == []
+    assert mirror.exists()
+    evicted = repo_cache.evict(str(tmp_path), max_bytes=0)
+    assert [e.kind for e in evicted] == ["clone", "mirror"]
+    assert not clone.exists()
+    assert not mirror.exists()
+
+
+def test_evict_skips_mirror_with_clone_in_progress(tmp_path):
+    mirror = _make_cached_repo(
+        tmp_path / ".mirrors" / "o" / "p", "repo.git", accessed_ago=7200
+    )
+    # A first clone that hasn't written its marker files yet
+    clone_base_dir = tmp_path / "alice" / "o" / "p"
+    (clone_base_dir / "repo").mkdir(parents=True)
+    with FileLock(str(clone_base_dir / "updating.lock")):
+        assert repo_cache.evict(str(tmp_path), max_bytes=0) == []
+    assert mirror.exists()
+    evicted = repo_cache.evict(str(tmp_path), max_bytes=0)
+    assert [e.kind for e in evicted] == ["mirror"]
+
+
+def test_evict_skips_repos_being_maintained(tmp_path):
+    repo_dir = _make_cached_repo(tmp_path / "alice" / "o" / "p")
+    with FileLock(str(tmp_path / "alice" / "o" / "p" / "maintenance.lock")):
+        assert repo_cache.evict(str(tmp_path), max_bytes=0) == []
+    assert repo_dir.exists()
@@ -0,0 +1,185 @@
+"""Tests for the ``shared_objects`` module."""
+
+import hashlib
+from datetime import timedelta
+from unittest.mock import call, patch
+
+import pytest
+from fsspec.implementations.memory import MemoryFileSystem
+from sqlmodel import Session, select
+
+from app import shared_objects
+from app.models import DvcSharedObject
+from app.object_index import get_indexed_objects, record_objects
+from app.storage import make_shared_data_fpath
+
+pytestmark = pytest.mark.usefixtures("object_index")
+
+
+def _refcount(db: Session, md5: str) -> int | None:
+    db.expire_all()
+    row = db.exec(
+        select(DvcSharedObject).where(DvcSharedObject.md5 == md5)
+    ).first()
+    return None if row is None else row.refcount
+
+
+def test_shared_objects(db: Session):
+    fs = MemoryFileSystem()
+    data = b"shared object"
+    md5 = hashlib.md5(data).hexdigest()
+    own_md5 = hashlib.md5(b"own copy").hexdigest()
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.shared_objects.record_storage_usage") as mock_record_usage,
+    ):
+        fpath = make_shared_data_fpath(md5)
+        try:
+            fs.pipe("memory://data/pending-a", data)
+            assert (
+                shared_objects.store_object(
+                    "owner",
+                    "proj-a",
+                    md5,
+                    len(data),
+                    "memory://data/pending-a",
+                    fs,
+                )
+                == fpath
+            )
+            assert fs.cat(fpath) == data
+            # Storing it again for another project only adds a reference
+            fs.pipe("memory://data/pending-b", data)
+            shared_objects.store_object(
+                "owner",
+                "proj-b",
+                md5,
+                len(data),
+                "memory://data/pending-b",
+                fs,
+            )
+            assert not fs.exists("memory://data/pending-b")
+            assert _refcount(db, md5) == 2
+            indexed = get_indexed_objects("owner", "proj-b", [md5])[md5]
+            assert indexed.shared and indexed.path == fpath
+            # Projects with their own copy keep it
+            record_objects("owner", "proj-a", [(own_md5, False, 8)])
+            assert (
+                shared_objects.store_object(
+                    "owner", "proj-a", own_md5, 8, "memory://data/pending", fs
+                )
+                is None
+            )
+            # Imports are metadata-only, and skip objects that aren't shared
+            assert shared_objects.import_objects(
+                "Other", "proj", "owner", "proj-a", [md5, own_md5]
+            ) == [md5]
+            assert _refcount(db, md5) == 3
+            # Re-importing doesn't add references
+            shared_objects.import_objects(
+                "other", "proj", "owner", "proj-a", [md5]
+            )
+            assert _refcount(db, md5) == 3
+            # Each reference is charged in full
+            assert mock_record_usage.call_args_list == [
+                call("owner", "proj-a", len(data)),
+                call("owner", "proj-b", len(data)),
+                call("owner", "proj-a", 0),
+                call("other", "proj", len(data)),
+                call("other", "proj", 0),
+            ]
+            mock_record_usage.reset_mock()
+            assert shared_objects.remove_references("owner", "proj-a") == [md5]
+            assert shared_objects.remove_references(
+                "other", "proj", [md5]
+            ) == [md5]
+            mock_record_usage.assert_has_calls(
+                [
+                    call("owner", "proj-a", -len(data)),
+                    call("other", "proj", -len(data)),
+                ]
+            )
+            # Referenced objects are never collected
+            assert shared_objects.collect_garbage(fs, grace_seconds=0) == 0
+            shared_objects.remove_references("owner", "proj-b")
+            assert _refcount(db, md5) == 0
+            # Released objects are kept for the grace period
+            assert shared_objects.collect_garbage(fs) == 0
+            assert fs.exists(fpath)
+            # And can be referenced again in the meantime
+            shared_objects.add_references("owner", "proj-c", [(md5, 13)])
+            assert _refcount(db, md5) == 1
+            shared_objects.remove_references("owner", "proj-c")
+            row = db.get(DvcSharedObject, md5)
+            assert row is not None
+            row.released -= timedelta(
+                seconds=shared_objects.GC_GRACE_SECONDS + 1
+            )
+            db.add(row)
+            db.commit()
+            assert shared_objects.collect_garbage(fs) == 1
+            assert not fs.exists(fpath)
+            assert _refcount(db, md5) is None
+        finally:
+            if fs.exists("memory://data"):
+                fs.rm("memory://data", recursive=True)
+
+
+def test_store_object_checks_sha256(db: Session):
+    fs = MemoryFileSystem()
+    data = b"uploaded first"
+    md5 = hashlib.md5(data).hexdigest()
+    with (
+        patch("app.storage.get_data_prefix", return_value="memory://data"),
+        patch("app.shared_objects.record_storage_usage") as mock_record_usage,
+    ):
+        fpath = make_shared_data_fpath(md5)
+        try:
+            fs.pipe("memory://data/pending-a", data)
+            shared_objects.store_object(
+                "owner",
+                "proj-a",
+                md5,
+                len(data),
+                "memory://data/pending-a",
+                fs,
+            )
+            # Different content claiming the same MD5, e.g., a collision,
+            # doesn't get swapped for the shared object
+            fs.pipe("memory://data/pending-b", b"uploaded later")
+            assert (
+                shared_objects.store_object(
+                    "owner", "proj-b", md5, 14, "memory://data/pending-b", fs
+                )
+                is None
+            )
+            assert fs.cat("memory://data/pending-b") == b"uploaded later"
+            assert fs.cat(fpath) == data
+            assert _refcount(db, md5) == 1
+            assert md5 not in get_indexed_objects("owner", "proj-b", [md5])
+            assert mock_record_usage.call_args_list[-2:] == [
+                call("owner", "proj-b", 14),
+                call("owner", "proj-b", -14),
+            ]
+            # The same content is still deduplicated
+            fs.pipe("memory://data/pending-c", data)
+            assert (
+                shared_objects.store_object(
+                    "owner",
+                    "proj-c",
+                    md5,
+                    len(data),
+                    "memory://data/pending-c",
+                    fs,
+                )
+                == fpath
+            )
+            assert not fs.exists("memory://data/pending-c")
+            assert _refcount(db, md5) == 2
+            db.expire_all()
+            row = db.get(DvcSharedObject, md5)
+            assert row is not None
+            assert row.sha256 == hashlib.sha256(data).hexdigest()
+        finally:
+            if fs.exists("memory://data"):
+                fs.rm("memory://data", recursive=True)
@@ -0,0 +1,223 @@
+"""Tests for the ``storage`` module."""
+
+import base64
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import gcsfs
+import pytest
+from fsspec.implementations.memory import MemoryFileSystem
+from sqlmodel import Session, delete, select
+
+from app import storage
+from app.models import StorageLedger
+
+pytestmark = pytest.mark.usefixtures("object_index")
+
+
+class FakeFS:
+    def __init__(self, sizes: dict[str, int]) -> None:
+        self.sizes = sizes
+        self.du_calls = 0
+        self.du_seconds = 0.0
+
+    def _strip_protocol(self, path: str) -> str:
+        return path.split("://", 1)[-1]
+
+    def du(self, path: str, total: bool = True):
+        self.du_calls += 1
+        time.sleep(self.du_seconds)
+        root = self._strip_protocol(path) + "/"
+        return {p: s for p, s in self.sizes.items() if p.startswith(root)}
+
+
+def test_storage_usage_ledger(db: Session, monkeypatch):
+    prefix = storage.get_data_prefix_for_owner("ledger-owner").split("://")[1]
+    fs = FakeFS(
+        {
+            f"{prefix}/proj-a/files/md5/ab/cdef": 1000,
+            f"{prefix}/proj-a/files/md5/cd/ef01": 500,
+            f"{prefix}/proj-b/files/md5/ab/cdef": 250,
+            # Not counted until they're stored
+            f"{prefix}/proj-b/files/staging/abcdef-01": 99,
+            f"{prefix}/proj-b/files/uploads/0123/00000000000000000000-ab": 98,
+            f"{prefix}/proj-b/files/md5/ef/0123.pending": 97,
+            f"{prefix}/stray.txt": 5,
+            f"{prefix}-other/proj/files/md5/ab/cdef": 10**9,
+        }
+    )
+    monkeypatch.setattr(storage, "get_object_fs", lambda: fs)
+    scheduled = []
+    monkeypatch.setattr(
+        storage.refresh_scheduler,
+        "schedule",
+        lambda key, job: scheduled.append(key),
+    )
+    try:
+        # The first read seeds the ledger from a listing
+        assert storage.get_storage_usage_by_project("Ledger-Owner") == {
+            "": 5,
+            "proj-a": 1500,
+            "proj-b": 250,
+        }
+        assert fs.du_calls == 1
+        # Writes are recorded as deltas, and reads don't list storage
+        storage.record_storage_usage("ledger-owner", "proj-b", 750)
+        storage.record_storage_usage("ledger-owner", "proj-c", 100)
+        assert storage.get_storage_usage("ledger-owner") == 2605 / 1e9
+        assert fs.du_calls == 1
+        assert scheduled == []
+        # Stale ledgers are reconciled in the background
+        for row in db.exec(
+            select(StorageLedger).where(
+                StorageLedger.owner_name == "ledger-owner"
+            )
+        ):
+            row.reconciled -= timedelta(
+                seconds=storage.STORAGE_USAGE_RECONCILE_SECONDS + 1
+            )
+            db.add(row)
+        db.commit()
+        storage.get_storage_usage("ledger-owner")
+        assert scheduled == ["storage-usage:ledger-owner"]
+        # Reconciling corrects drift
+        assert storage.reconcile_storage_usage("ledger-owner") == {
+            "": 5,
+            "proj-a": 1500,
+            "proj-b": 250,
+        }
+        assert storage.get_storage_usage("ledger-owner") == 1755 / 1e9
+        # Deltas recorded while the listing runs aren't lost
+        du = fs.du
+
+        def du_with_write(path: str, total: bool = True):
+            sizes = du(path, total=total)
+            storage.record_storage_usage("ledger-owner", "proj-a", 40)
+            storage.record_storage_usage("ledger-owner", "proj-d", 60)
+            return sizes
+
+        monkeypatch.setattr(fs, "du", du_with_write)
+        assert storage.reconcile_storage_usage("ledger-owner") == {
+            "": 5,
+            "proj-a": 1540,
+            "proj-b": 250,
+            "proj-d": 60,
+        }
+        assert storage.get_storage_usage("ledger-owner") == 1855 / 1e9
+        monkeypatch.setattr(fs, "du", du)
+        # Owners without a ledger yet are left to seeding
+        storage.record_storage_usage("unseeded-owner", "proj", 100)
+        assert (
+            db.exec(
+                select(StorageLedger).where(
+                    StorageLedger.owner_name == "unseeded-owner"
+                )
+            ).first()
+            is None
+        )
+    finally:
+        db.exec(delete(StorageLedger))  # type: ignore
+        db.commit()
+
+
+def test_storage_usage_seeded_once(db: Session):
+    prefix = storage.get_data_prefix_for_owner("seed-owner").split("://")[1]
+    fs = FakeFS({f"{prefix}/proj/files/md5/ab/cdef": 1000})
+    fs.du_seconds = 0.2
+    barrier = threading.Barrier(8)
+
+    def _read(_) -> dict[str, int]:
+        barrier.wait()
+        return storage.get_storage_usage_by_project("seed-owner", fs=fs)
+
+    try:
+        # Concurrent first reads, e.g., from parallel pushes, wait for one
+        # listing rather than each seeding the ledger
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(_read, range(8)))
+        assert fs.du_calls == 1
+        assert all(r == {"": 0, "proj": 1000} for r in results)
+        # Reconciling while deltas are recorded upserts rather than
+        # conflicting with them
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(
+                    storage.reconcile_storage_usage, "seed-owner", fs
+                )
+                for _ in range(2)
+            ] + [
+                executor.submit(
+                    storage.record_storage_usage, "seed-owner", "proj", 1
+                )
+                for _ in range(2)
+            ]
+            for future in futures:
+                future.result()
+        assert set(storage.get_storage_usage_by_project("seed-owner")) == {
+            "",
+            "proj",
+        }
+    finally:
+        db.exec(delete(StorageLedger))  # type: ignore
+        db.commit()
+
+
+def test_get_object_md5():
+    data = b"some object"
+    md5 = hashlib.md5(data).hexdigest()
+    fs = MemoryFileSystem()
+    fpath = "memory://test-get-object-md5/object"
+    fs.pipe(fpath, data)
+    try:
+        # Without metadata, the object is hashed
+        assert storage.get_object_md5(fpath, fs=fs) == md5
+        with patch.object(fs, "info") as info:
+            # GCS keeps a base64 MD5
+            info.return_value = {
+                "md5Hash": base64.b64encode(bytes.fromhex("ab" * 16))
+            }
+            assert storage.get_object_md5(fpath, fs=fs) == "ab" * 16
+            # S3's ETag is the MD5 for single part uploads...
+            info.return_value = {"ETag": f'"{"CD" * 16}"'}
+            assert storage.get_object_md5(fpath, fs=fs) == "cd" * 16
+            # ...but not multipart ones
+            info.return_value = {"ETag": f'"{"ef" * 16}-3"'}
+            assert storage.get_object_md5(fpath, fs=fs) == md5
+            # And metadata can be skipped
+            info.return_value = {"ETag": f'"{"cd" * 16}"'}
+            assert (
+                storage.get_object_md5(fpath, fs=fs, from_metadata=False)
+                == md5
+            )
+    finally:
+        fs.rm(fpath)
+
+
+def test_merge_objects():
+    fs = MemoryFileSystem()
+    prefix = "memory://test-merge-objects"
+    parts = [f"{prefix}/part-{n}" for n in range(3)]
+    for n, part in enumerate(parts):
+        fs.pipe(part, f"part {n};".encode())
+    try:
+        # Filesystems that can't merge server-side are copied through
+        storage.merge_objects(f"{prefix}/merged", parts, fs=fs)
+        assert fs.cat(f"{prefix}/merged") == b"part 0;part 1;part 2;"
+    finally:
+        fs.rm(prefix, recursive=True)
+    # GCS composes at most 32 objects at a time
+    gcs_fs = MagicMock(spec=gcsfs.GCSFileSystem)
+    parts = [f"gcs://bucket/part-{n}" for n in range(70)]
+    storage.merge_objects("gcs://bucket/merged", parts, fs=gcs_fs)
+    calls = [c.args for c in gcs_fs.merge.call_args_list]
+    composed = [f"gcs://bucket/part-0.compose-0-{n}" for n in (0, 32, 64)]
+    assert calls == [
+        (composed[0], parts[:32]),
+        (composed[1], parts[32:64]),
+        (composed[2], parts[64:]),
+        ("gcs://bucket/merged", composed),
+    ]
@@ -0,0 +1,208 @@
+"""Resumable, chunked uploads of objects to a project's DVC storage.
+
+A session is created for an object's MD5 and size. The client then sends
+the object in chunks, each at the offset where the last one ended, and
+can ask for the current offset to resume after an interruption. Each chunk
+is stored as its own object under the session's prefix, since objects in
+S3 and GCS can't be appended to, and the chunks are concatenated
+server-side once the last one arrives.
+
+The running MD5 of the bytes received is saved with the session after each
+chunk (see ``app.hashing``), so the object is verified when it's complete
+without reading it back. Sessions expire ``SESSION_TTL_SECONDS`` after
+they're created, after which they and their chunks are deleted by
+``expire_sessions``, which runs in the background as sessions are created.
+"""
+
+from __future__ import annotations
+
+import logging
+import secrets
+from datetime import timedelta
+
+from sqlmodel import Session, col, select
+
+from app import hashing, utcnow
+from app.db import engine
+from app.models import DvcUploadSession
+from app.object_index import get_object_fpath
+from app.refresh import refresh_scheduler
+from app.storage import (
+    get_data_prefix_for_owner,
+    get_object_fs,
+    get_object_md5,
+    merge_objects,
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = 24 * 3600
+# Chunks other than the last must be at least this big, since that's the
+# smallest part S3 can concatenate
+MIN_CHUNK_BYTES = 5 * 1024 * 1024
+
+
+def get_session_prefix(
+    owner_name: str, project_name: str, session_id: str
+) -> str:
+    # Outside files/md5, so chunks are never mistaken for stored objects
+    return (
+        f"{get_data_prefix_for_owner(owner_name)}/{project_name.lower()}"
+        f"/files/uploads/{session_id}"
+    )
+
+
+def create_session(
+    owner_name: str, project_name: str, md5: str, size: int
+) -> DvcUploadSession:
+    upload = DvcUploadSession(
+        id=secrets.token_hex(16),
+        owner_name=owner_name.lower(),
+        project_name=project_name.lower(),
+        md5=md5,
+        size=size,
+        md5_state=hashing.ResumableMD5().state if hashing.AVAILABLE else None,
+        expires=utcnow() + timedelta(seconds=SESSION_TTL_SECONDS),
+    )
+    with Session(engine) as session:
+        session.add(upload)
+        session.commit()
+        session.refresh(upload)
+    refresh_scheduler.schedule("dvc-upload-session-expiry", expire_sessions)
+    return upload
+
+
+def get_session(
+    owner_name: str, project_name: str, session_id: str
+) -> DvcUploadSession | None:
+    """Get a project's upload session, if it exists and hasn't expired."""
+    with Session(engine) as session:
+        upload = session.get(DvcUploadSession, session_id)
+    if (
+        upload is None
+        or upload.owner_name != owner_name.lower()
+        or upload.project_name != project_name.lower()
+        or upload.expires <= utcnow()
+    ):
+        return None
+    return upload
+
+
+def resume_md5(upload: DvcUploadSession) -> hashing.ResumableMD5 | None:
+    """Get the running MD5 of the bytes received so far, or None if it
+    wasn't saved, in which case the object is hashed when complete."""
+    if not hashing.AVAILABLE or upload.md5_state is None:
+        return None
+    return hashing.ResumableMD5(upload.md5_state)
+
+
+def make_part_fpath(upload: DvcUploadSession, offset: int) -> str:
+    # Unique per attempt, so a retried chunk never overwrites one that was
+    # already recorded
+    prefix = get_session_prefix(
+        upload.owner_name, upload.project_name, upload.id
+    )
+    return f"{prefix}/{offset:020d}-{secrets.token_hex(4)}"
+
+
+def record_chunk(
+    session_id: str,
+    offset: int,
+    part_fpath: str,
+    size: int,
+    md5_state: bytes | None,
+) -> DvcUploadSession | None:
+    """Add a stored chunk to a session.
+
+    Returns the updated session, or None if the session is gone or another
+    chunk was recorded at ``offset`` first, in which case this one should
+    be discarded.
+    """
+    with Session(engine) as session:
+        upload = session.exec(
+            select(DvcUploadSession)
+            .where(DvcUploadSession.id == session_id)
+            .with_for_update()
+        ).first()
+        if upload is None or upload.received != offset:
+            return None
+        upload.received = offset + size
+        upload.md5_state = md5_state
+        upload.parts = upload.parts + [part_fpath]
+        session.add(upload)
+        session.commit()
+        session.refresh(upload)
+    return upload
+
+
+def complete_session(upload: DvcUploadSession, fs=None) -> str:
+    """Concatenate a fully received session's chunks into a pending object
+    next to where it belongs.
+
+    Returns the pending object's path, which the caller moves into place
+    before deleting the session. Raises ``ValueError`` if the content
+    doesn't match the session's MD5, in which case nothing is stored and
+    the session is deleted. On other errors the session and its chunks are
+    kept, so completing it can be retried.
+    """
+    if fs is None:
+        fs = get_object_fs()
+    expected = upload.md5.removesuffix(".dir")
+    md5 = resume_md5(upload)
+    try:
+        if md5 is not None and md5.hexdigest() != expected:
+            raise ValueError("MD5 does not match")
+        fpath = get_object_fpath(
+            upload.owner_name, upload.project_name, upload.md5
+        )
+        pending_fpath = fpath + ".pending"
+        if upload.parts:
+            merge_objects(pending_fpath, upload.parts, fs=fs)
+        else:
+            fs.pipe(pending_fpath, b"")
+        if md5 is None:
+            digest = get_object_md5(pending_fpath, fs=fs, from_metadata=False)
+            if digest != expected:
+                fs.rm(pending_fpath)
+                raise ValueError("MD5 does not match")
+    except ValueError:
+        delete_session(upload, fs=fs)
+        raise
+    return pending_fpath
+
+
+def delete_session(upload: DvcUploadSession, fs=None) -> None:
+    """Delete a session and any chunks it has stored."""
+    if fs is None:
+        fs = get_object_fs()
+    prefix = get_session_prefix(
+        upload.owner_name, upload.project_name, upload.id
+    )
+    try:
+        fs.rm(prefix, recursive=True)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception("Failed to remove chunks under %s", prefix)
+    with Session(engine) as session:
+        row = session.get(DvcUploadSession, upload.id)
+        if row is not None:
+            session.delete(row)
+            session.commit()
+
+
+def expire_sessions(fs=None) -> int:
+    """Delete expired sessions and their chunks, returning how many."""
+    with Session(engine) as session:
+        expired = session.exec(
+            select(DvcUploadSession).where(
+                col(DvcUploadSession.expires) <= utcnow()
+            )
+        ).all()
+    if expired and fs is None:
+        fs = get_object_fs()
+    for upload in expired:
+        delete_session(upload, fs=fs)
+    if expired:
+        logger.info(f"Deleted {len(expired)} expired DVC upload sessions")
+    return len(expired)
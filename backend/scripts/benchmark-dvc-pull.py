@@ -0,0 +1,202 @@
+"""Benchmark DVC remote downloads proxied through the API vs redirected.
+
+Uploads a set of random objects to a project through the DVC remote, then
+pulls growing numbers of them the way ``dvc pull`` does (concurrent GETs
+that follow redirects), once proxied (``?redirect=false``) and once
+redirected to presigned URLs (``?redirect=true``). For each round it
+reports throughput along with the CPU time and peak memory of the API
+worker processes, sampled from ``/proc``, so run it on the same host as
+the API (e.g., against the local Docker Compose stack).
+
+Usage:
+    python scripts/benchmark-dvc-pull.py --project someone/proj \\
+        --token $DVC_TOKEN --pid $(pgrep -f "uvicorn|fastapi" | paste -sd,)
+    python scripts/benchmark-dvc-pull.py --project someone/proj \\
+        --token $DVC_TOKEN --object-mb 64 --counts 2,4,8,16,32
+
+When proxying, worker CPU grows with the bytes downloaded, and memory with
+the number of concurrent downloads. When redirecting, both should stay
+flat, since workers only check access and sign a URL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def read_cpu_seconds(pids: list[int]) -> float:
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The command name may contain spaces, so split after it
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime are fields 14 and 15 of the full line
+        total += (int(fields[11]) + int(fields[12])) / CLK_TCK
+    return total
+
+
+def read_rss_bytes(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler:
+    """Sample the workers' combined RSS in the background, keeping the
+    peak."""
+
+    def __init__(self, pids: list[int], interval: float = 0.05) -> None:
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, read_rss_bytes(self.pids))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> RssSampler:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def object_url(base_url: str, md5: str) -> str:
+    return f"{base_url}/files/md5/{md5[:2]}/{md5[2:]}"
+
+
+def upload_objects(
+    client: httpx.Client, base_url: str, count: int, size: int
+) -> list[str]:
+    md5s = []
+    for n in range(count):
+        data = os.urandom(size)
+        md5 = hashlib.md5(data).hexdigest()
+        resp = client.post(object_url(base_url, md5), content=data)
+        resp.raise_for_status()
+        md5s.append(md5)
+        print(f"Uploaded object {n + 1}/{count}", end="\r", flush=True)
+    print()
+    return md5s
+
+
+def pull(
+    client: httpx.Client,
+    base_url: str,
+    md5s: list[str],
+    redirect: bool,
+    concurrency: int,
+) -> int:
+    def _get(md5: str) -> int:
+        n_bytes = 0
+        # httpx drops the Authorization header when a redirect goes to
+        # another origin, like object storage does
+        with client.stream(
+            "GET",
+            object_url(base_url, md5),
+            params={"redirect": str(redirect).lower()},
+        ) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_bytes():
+                n_bytes += len(chunk)
+        return n_bytes
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(_get, md5s))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--api-url", default="http://localhost:8000", help="API base URL"
+    )
+    parser.add_argument(
+        "--project", required=True, help="Project as owner/name"
+    )
+    parser.add_argument(
+        "--token",
+        default=os.getenv("CALKIT_DVC_TOKEN"),
+        help="Token with DVC scope (default: $CALKIT_DVC_TOKEN)",
+    )
+    parser.add_argument(
+        "--pid",
+        default="",
+        help="Comma-separated PIDs of API workers to sample",
+    )
+    parser.add_argument("--object-mb", type=float, default=32)
+    parser.add_argument(
+        "--counts",
+        default="1,2,4,8,16",
+        help="Comma-separated numbers of objects to pull per round",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("--token or $CALKIT_DVC_TOKEN is required")
+    pids = [int(pid) for pid in args.pid.split(",") if pid]
+    counts = [int(n) for n in args.counts.split(",")]
+    owner_name, project_name = args.project.split("/")
+    base_url = (
+        f"{args.api_url.rstrip('/')}/projects/{owner_name}/{project_name}/dvc"
+    )
+    client = httpx.Client(
+        headers={"Authorization": f"Bearer {args.token}"},
+        follow_redirects=True,
+        timeout=300,
+    )
+    md5s = upload_objects(
+        client, base_url, max(counts), int(args.object_mb * 1024**2)
+    )
+    if not pids:
+        print("No --pid given; only reporting throughput")
+    print(
+        f"{'mode':<9} {'objects':>7} {'MB':>8} {'MB/s':>8} "
+        f"{'CPU s':>7} {'peak RSS MB':>11}"
+    )
+    for redirect in (False, True):
+        mode = "redirect" if redirect else "proxy"
+        for count in counts:
+            cpu_start = read_cpu_seconds(pids)
+            start = time.perf_counter()
+            with RssSampler(pids) as sampler:
+                n_bytes = pull(
+                    client, base_url, md5s[:count], redirect, args.concurrency
+                )
+            elapsed = time.perf_counter() - start
+            cpu = read_cpu_seconds(pids) - cpu_start
+            mb = n_bytes / 1024**2
+            print(
+                f"{mode:<9} {count:>7} {mb:>8.0f} {mb / elapsed:>8.1f} "
+                f"{cpu:>7.2f} {sampler.peak / 1024**2:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
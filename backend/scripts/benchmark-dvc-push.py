@@ -0,0 +1,170 @@
+"""Benchmark API responsiveness while large DVC pushes are in flight.
+
+Measures the latency of small requests to the DVC remote (HEADs on an
+object, like ``dvc push`` and ``dvc status`` send to check what's stored)
+on their own, then again while a growing number of large objects are
+being pushed to the same API. Since the upload handler writes to object
+storage and hashes off the event loop, small-request latency should stay
+about flat as pushes are added; when uploads block the loop, p99 latency
+grows with them.
+
+Usage:
+    python scripts/benchmark-dvc-push.py --project someone/proj \\
+        --token $DVC_TOKEN
+    python scripts/benchmark-dvc-push.py --project someone/proj \\
+        --token $DVC_TOKEN --object-mb 512 --pushes 0,1,4,8
+
+Run it against a single API worker (e.g., ``fastapi run --workers 1``) so
+that every request shares the event loop with the pushes. Pushed objects
+are random, so each run adds ``--object-mb`` times the total number of
+pushes to the project's storage.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+# Size of each chunk the pushes send, like DVC's HTTP remote
+CHUNK_BYTES = 1024 * 1024
+
+
+def object_url(base_url: str, md5: str) -> str:
+    return f"{base_url}/files/md5/{md5[:2]}/{md5[2:]}"
+
+
+def push(client: httpx.Client, base_url: str, size: int) -> float:
+    """Push ``size`` random bytes, returning the seconds it took."""
+    # Hash ahead of time so generating data doesn't slow the upload
+    chunk = os.urandom(CHUNK_BYTES)
+    n_chunks = max(size // CHUNK_BYTES, 1)
+    sig = hashlib.md5()
+    # Vary the first chunk so each push is a new object
+    first = os.urandom(CHUNK_BYTES)
+    sig.update(first)
+    for _ in range(n_chunks - 1):
+        sig.update(chunk)
+    md5 = sig.hexdigest()
+
+    def body():
+        yield first
+        for _ in range(n_chunks - 1):
+            yield chunk
+
+    start = time.perf_counter()
+    resp = client.post(object_url(base_url, md5), content=body())
+    resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+def probe(
+    client: httpx.Client, url: str, stop: threading.Event, interval: float
+) -> list[float]:
+    """HEAD ``url`` until ``stop`` is set, returning latencies in ms."""
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.head(url).raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        stop.wait(interval)
+    return latencies
+
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--api-url", default="http://localhost:8000", help="API base URL"
+    )
+    parser.add_argument(
+        "--project", required=True, help="Project as owner/name"
+    )
+    parser.add_argument(
+        "--token",
+        default=os.getenv("CALKIT_DVC_TOKEN"),
+        help="Token with DVC scope (default: $CALKIT_DVC_TOKEN)",
+    )
+    parser.add_argument("--object-mb", type=float, default=256)
+    parser.add_argument(
+        "--pushes",
+        default="0,1,2,4",
+        help="Comma-separated numbers of concurrent pushes per round",
+    )
+    parser.add_argument(
+        "--probes", type=int, default=4, help="Concurrent small requesters"
+    )
+    parser.add_argument(
+        "--idle-seconds",
+        type=float,
+        default=10,
+        help="How long to probe in rounds without pushes",
+    )
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("--token or $CALKIT_DVC_TOKEN is required")
+    owner_name, project_name = args.project.split("/")
+    base_url = (
+        f"{args.api_url.rstrip('/')}/projects/{owner_name}/{project_name}/dvc"
+    )
+    client = httpx.Client(
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=600,
+        limits=httpx.Limits(max_connections=100),
+    )
+    # An object for the small requests to check
+    data = os.urandom(1024)
+    md5 = hashlib.md5(data).hexdigest()
+    client.post(object_url(base_url, md5), content=data).raise_for_status()
+    probe_url = object_url(base_url, md5)
+    size = int(args.object_mb * 1024**2)
+    print(
+        f"{'pushes':>6} {'requests':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'max ms':>8} {'push MB/s':>9}"
+    )
+    for n_pushes in [int(n) for n in args.pushes.split(",")]:
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=args.probes + n_pushes) as pool:
+            probes = [
+                pool.submit(probe, client, probe_url, stop, 0.01)
+                for _ in range(args.probes)
+            ]
+            pushes = [
+                pool.submit(push, client, base_url, size)
+                for _ in range(n_pushes)
+            ]
+            if pushes:
+                push_seconds = [p.result() for p in pushes]
+            else:
+                time.sleep(args.idle_seconds)
+                push_seconds = []
+            stop.set()
+            latencies = [ms for p in probes for ms in p.result()]
+        throughput = (
+            n_pushes * size / 1024**2 / max(push_seconds)
+            if push_seconds
+            else float("nan")
+        )
+        print(
+            f"{n_pushes:>6} {len(latencies):>8} "
+            f"{percentile(latencies, 50):>8.1f} "
+            f"{percentile(latencies, 99):>8.1f} "
+            f"{max(latencies):>8.1f} {throughput:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
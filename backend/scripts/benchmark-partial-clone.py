@@ -0,0 +1,246 @@
+"""Benchmark blobless partial clones against full clones.
+
+Builds a synthetic repo whose history holds a few GB of committed data
+(binary files rewritten on every commit, like a project that commits its
+results), then times the operations the API runs against project repos
+with each clone mode, following the same steps as ``app.git``: a bare
+mirror clone, a ``--shared`` working clone from it, a file history query,
+reading an old revision of a file, and a second user's clone. In partial
+mode, blobs are fetched into the mirror, so the second clone finds the ones
+the first needed there.
+
+Usage:
+    python scripts/benchmark-partial-clone.py
+    python scripts/benchmark-partial-clone.py --size-gb 5 --commits 200
+
+The synthetic repo is cached in the work dir, so reruns only pay for the
+clones. Everything goes over file:// so the numbers reflect git's work and
+the amount of data moved rather than network conditions; against GitHub
+the gap in clone time grows with the data transferred.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+# Files in the synthetic repo: a few small text files that change rarely,
+# and data files that are rewritten each commit and make up the bulk
+TEXT_FILES = ["README.md", "calkit.yaml", "dvc.lock", "scripts/run.py"]
+DATA_FILES = [f"data/results-{i}.bin" for i in range(4)]
+
+
+def run(*args: str, cwd: str | None = None) -> bytes:
+    return subprocess.run(
+        args, cwd=cwd, check=True, capture_output=True
+    ).stdout
+
+
+def du(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def make_synthetic_repo(path: str, size_gb: float, commits: int) -> None:
+    """Create a bare repo with ``commits`` commits totalling ``size_gb`` of
+    incompressible data, using fast-import to keep this quick."""
+    os.makedirs(path)
+    run("git", "init", "--bare", "-q", "-b", "main", path)
+    blob_size = int(size_gb * 1024**3 / commits / len(DATA_FILES))
+    proc = subprocess.Popen(
+        ["git", "fast-import", "--quiet"], cwd=path, stdin=subprocess.PIPE
+    )
+    assert proc.stdin is not None
+    write = proc.stdin.write
+    for n in range(commits):
+        write(b"commit refs/heads/main\n")
+        write(
+            f"committer Bench <bench@example.com> {1e9 + n:.0f} +0000\n".encode()
+        )
+        msg = f"Commit {n}\n".encode()
+        # Successive commits to the same ref chain onto each other
+        write(b"data %d\n%s" % (len(msg), msg))
+        for fname in TEXT_FILES:
+            if n % 10 == 0 or fname == "dvc.lock":
+                content = f"{fname} at commit {n}\n".encode()
+                write(b"M 100644 inline %s\n" % fname.encode())
+                write(b"data %d\n%s\n" % (len(content), content))
+        for fname in DATA_FILES:
+            write(b"M 100644 inline %s\n" % fname.encode())
+            write(b"data %d\n" % blob_size)
+            write(os.urandom(blob_size))
+            write(b"\n")
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError("git fast-import failed")
+    run("git", "config", "uploadpack.allowFilter", "true", cwd=path)
+    run("git", "config", "uploadpack.allowAnySHA1InWant", "true", cwd=path)
+
+
+def blob_oids(rev: str, cwd: str) -> list[str]:
+    out = run("git", "ls-tree", "-r", rev, cwd=cwd).decode()
+    return [
+        fields[2]
+        for line in out.splitlines()
+        if (fields := line.split(None, 3))[1] == "blob"
+    ]
+
+
+def bench(label: str, remote_url: str, work_dir: str, partial: bool) -> dict:
+    mirror_dir = os.path.join(work_dir, f"{label}-mirror.git")
+    clone_dir = os.path.join(work_dir, f"{label}-clone")
+    timings = {}
+
+    def timed(name: str, *args: str, cwd: str | None = None) -> bytes:
+        start = time.perf_counter()
+        out = run(*args, cwd=cwd)
+        timings[name] = time.perf_counter() - start
+        return out
+
+    filter_args = ["--filter=blob:none"] if partial else []
+    timed(
+        "mirror clone",
+        "git",
+        "clone",
+        "--bare",
+        "-q",
+        *filter_args,
+        remote_url,
+        mirror_dir,
+    )
+
+    def clone(name: str, clone_dir: str) -> None:
+        clone_args = ["--no-checkout"] if partial else []
+        timed(
+            name,
+            "git",
+            "clone",
+            "--shared",
+            "-q",
+            *clone_args,
+            mirror_dir,
+            clone_dir,
+        )
+        run("git", "remote", "set-url", "origin", remote_url, cwd=clone_dir)
+        if not partial:
+            return
+        for key, value in [
+            ("remote.origin.promisor", "true"),
+            ("remote.origin.partialclonefilter", "blob:none"),
+            ("extensions.partialClone", "origin"),
+            ("core.repositoryformatversion", "1"),
+        ]:
+            run("git", "config", key, value, cwd=clone_dir)
+        start = time.perf_counter()
+        fetch_into_mirror(blob_oids("main", cwd=clone_dir))
+        run("git", "checkout", "-q", "--force", "main", cwd=clone_dir)
+        timings[f"{name} checkout"] = time.perf_counter() - start
+
+    def fetch_into_mirror(oids: list[str]) -> None:
+        """Fetch missing blobs into the mirror, as ``app.git`` does, so
+        every clone borrowing from it has them."""
+        subprocess.run(
+            [
+                "git",
+                "-c",
+                "fetch.negotiationAlgorithm=noop",
+                "fetch",
+                "origin",
+                "--no-tags",
+                "--no-write-fetch-head",
+                "--filter=blob:none",
+                "--stdin",
+            ],
+            input="\n".join(oids) + "\n",
+            text=True,
+            cwd=mirror_dir,
+            check=True,
+            capture_output=True,
+        )
+
+    clone("working clone", clone_dir)
+    timed(
+        "file history",
+        "git",
+        "log",
+        "--format=%H",
+        "--",
+        "dvc.lock",
+        cwd=clone_dir,
+    )
+    old_rev = f"main~{len(DATA_FILES)}:{DATA_FILES[0]}"
+    start = time.perf_counter()
+    if partial:
+        fetch_into_mirror(
+            [run("git", "rev-parse", old_rev, cwd=clone_dir).decode().strip()]
+        )
+    run("git", "cat-file", "-p", old_rev, cwd=clone_dir)
+    timings["read old revision"] = time.perf_counter() - start
+    # Another user's clone of the project finds what the first one fetched
+    # already in the mirror
+    clone("second clone", clone_dir + "-2")
+    timings["mirror size (MB)"] = du(mirror_dir) / 1024**2
+    # Git dirs only, since the checked out files are the same either way
+    timings["clone .git size (MB)"] = (
+        du(os.path.join(clone_dir, ".git")) / 1024**2
+    )
+    timings["second clone .git size (MB)"] = (
+        du(os.path.join(clone_dir + "-2", ".git")) / 1024**2
+    )
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-gb", type=float, default=4.0)
+    parser.add_argument("--commits", type=int, default=100)
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(tempfile.gettempdir(), "calkit-partial-bench"),
+    )
+    args = parser.parse_args()
+    remote_dir = os.path.join(
+        args.work_dir, f"remote-{args.size_gb}gb-{args.commits}.git"
+    )
+    if not os.path.isdir(remote_dir):
+        print(
+            f"Building synthetic repo ({args.size_gb} GB over "
+            f"{args.commits} commits) in {remote_dir}"
+        )
+        start = time.perf_counter()
+        try:
+            make_synthetic_repo(remote_dir, args.size_gb, args.commits)
+        except BaseException:
+            shutil.rmtree(remote_dir, ignore_errors=True)
+            raise
+        print(f"Built in {time.perf_counter() - start:.1f} s")
+    remote_url = f"file://{remote_dir}"
+    results = {}
+    for label, partial in [("full", False), ("partial", True)]:
+        for name in os.listdir(args.work_dir):
+            if name.startswith(f"{label}-"):
+                shutil.rmtree(os.path.join(args.work_dir, name))
+        results[label] = bench(label, remote_url, args.work_dir, partial)
+    names = list(dict.fromkeys(k for r in results.values() for k in r))
+    print(f"\n{'':<28}{'full':>12}{'partial':>12}")
+    for name in names:
+        row = [results[label].get(name) for label in ("full", "partial")]
+        cells = "".join(
+            f"{v:>12.2f}" if v is not None else f"{'-':>12}" for v in row
+        )
+        unit = "" if "MB" in name else " (s)"
+        print(f"{name + unit:<28}{cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Delete objects in the shared DVC object store that no project references.
+
+Usage:
+    python scripts/collect-shared-dvc-objects.py
+    python scripts/collect-shared-dvc-objects.py --grace-days 1
+
+Objects are only deleted once they've been without references for the
+grace period (7 days by default), so schedule this periodically.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.shared_objects import GC_GRACE_SECONDS, collect_garbage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--grace-days",
+        type=float,
+        default=GC_GRACE_SECONDS / 86400,
+        help="Only delete objects released at least this long ago",
+    )
+    args = parser.parse_args()
+    n_deleted = collect_garbage(grace_seconds=int(args.grace_days * 86400))
+    logger.info("Deleted %s shared objects", n_deleted)
+
+
+if __name__ == "__main__":
+    main()
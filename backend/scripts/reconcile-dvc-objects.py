@@ -0,0 +1,76 @@
+"""Rebuild the DVC object index from listings of object storage.
+
+Usage:
+    python scripts/reconcile-dvc-objects.py
+    python scripts/reconcile-dvc-objects.py --owner someone
+    python scripts/reconcile-dvc-objects.py --owner someone --project proj
+
+Objects uploaded outside the DVC remote, or deleted from storage, are only
+reflected in the index once this runs, so schedule it periodically.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.db import make_session
+from app.models import Account, Project
+from app.object_index import reconcile
+from app.storage import get_object_fs
+from sqlmodel import select
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def reconcile_projects(
+    owner_name: str | None = None, project_name: str | None = None
+) -> None:
+    query = select(Account.name, Project.name).join(
+        Account, Project.owner_account_id == Account.id
+    )
+    if owner_name is not None:
+        query = query.where(Account.name == owner_name.lower())
+    if project_name is not None:
+        query = query.where(Project.name == project_name)
+    with make_session() as session:
+        projects = session.exec(query).all()
+    fs = get_object_fs()
+    n_added = n_removed = n_failed = 0
+    for account_name, name in projects:
+        try:
+            added, removed = reconcile(account_name, name, fs)
+        except Exception:
+            logger.exception("Failed to reconcile %s/%s", account_name, name)
+            n_failed += 1
+            continue
+        if added or removed:
+            logger.info(
+                "Reconciled %s/%s: %s added, %s removed",
+                account_name,
+                name,
+                added,
+                removed,
+            )
+        n_added += added
+        n_removed += removed
+    logger.info(
+        "Reconciled %s projects: %s added, %s removed, %s failed",
+        len(projects),
+        n_added,
+        n_removed,
+        n_failed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--owner", help="Only reconcile this owner")
+    parser.add_argument("--project", help="Only reconcile this project")
+    args = parser.parse_args()
+    reconcile_projects(owner_name=args.owner, project_name=args.project)
+
+
+if __name__ == "__main__":
+    main()
@@ -6994,6 +6994,14 @@ export const StorageUsageSchema = {
       type: "number",
       title: "Used Gb",
     },
+    by_project_gb: {
+      additionalProperties: {
+        type: "number",
+      },
+      type: "object",
+      title: "By Project Gb",
+      default: {},
+    },
   },
   type: "object",
   required: ["limit_gb", "used_gb"],
@@ -91,6 +91,8 @@ import type {
   GetProjectHistoryResponse,
   GetProjectCommitData,
   GetProjectCommitResponse,
+  GetProjectCommitPatchData,
+  GetProjectCommitPatchResponse,
   GetProjectFileHistoryData,
   GetProjectFileHistoryResponse,
   GetProjectGitContentsData,
@@ -1382,20 +1384,27 @@ export class ProjectsService {
    * Get Project History
    * Get paginated git commit history for a project.
    *
+   * Pass the last commit hash of a page as ``cursor`` to get the next one,
+   * which is cheaper than a growing ``offset`` for deep history.
+   *
    * Parameters
    * ----------
    * limit:
    * Maximum number of commits to return.
    * offset:
-   * Number of commits to skip from the newest commit.
+   * Number of commits to skip from the newest commit, or from
+   * ``cursor`` if given.
    * ref:
    * Optional branch, tag, or commit to read history from.
+   * cursor:
+   * Optional hash of the last commit of the previous page.
    * @param data The data for the request.
    * @param data.ownerName
    * @param data.projectName
    * @param data.limit Max number of commits to return
    * @param data.offset Number of commits to skip
    * @param data.ref Branch, tag, or commit to read history from
+   * @param data.cursor Hash of the last commit of the previous page; returns the commits after it
    * @returns unknown Successful Response
    * @throws ApiError
    */
@@ -1413,6 +1422,7 @@ export class ProjectsService {
         limit: data.limit,
         offset: data.offset,
         ref: data.ref,
+        cursor: data.cursor,
       },
       errors: {
         422: "Validation Error",
@@ -1424,6 +1434,9 @@ export class ProjectsService {
    * Get Project Commit
    * Get details for a specific commit including changed files.
    *
+   * Files come with line counts but no patches; fetch a file's patch from
+   * the ``patch`` endpoint.
+   *
    * Parameters
    * ----------
    * commit_hash:
@@ -1452,6 +1465,53 @@ export class ProjectsService {
     })
   }
 
+  /**
+   * Get Project Commit Patch
+   * Get a page of the patch for one file changed in a commit.
+   *
+   * Parameters
+   * ----------
+   * commit_hash:
+   * Full or short commit hash to inspect.
+   * path:
+   * Path of the changed file, as listed in the commit's details.
+   * offset:
+   * Byte offset to start from; pass the previous page's
+   * ``next_offset`` to continue.
+   * limit:
+   * Max bytes to return.
+   * @param data The data for the request.
+   * @param data.ownerName
+   * @param data.projectName
+   * @param data.commitHash
+   * @param data.path
+   * @param data.offset Byte offset into the patch to start from
+   * @param data.limit Max bytes of the patch to return
+   * @returns unknown Successful Response
+   * @throws ApiError
+   */
+  public static getProjectCommitPatch(
+    data: GetProjectCommitPatchData,
+  ): CancelablePromise<GetProjectCommitPatchResponse> {
+    return __request(OpenAPI, {
+      method: "GET",
+      url: "/projects/{owner_name}/{project_name}/git/commits/{commit_hash}/patch",
+      path: {
+        owner_name: data.ownerName,
+        project_name: data.projectName,
+        commit_hash: data.commitHash,
+      },
+      query: {
+        path: data.path,
+        offset: data.offset,
+        limit: data.limit,
+      },
+      errors: {
+        422: "Validation Error",
+      },
+    })
+  }
+
   /**
    * Get Project File History
    * Get git commit history for a specific file path.
@@ -1450,6 +1450,9 @@ export type status3 =
 export type StorageUsage = {
   limit_gb: number
   used_gb: number
+  by_project_gb?: {
+    [key: string]: number
+  }
 }
 
 export type SubscriptionPlan = {
@@ -1883,6 +1886,10 @@ export type SearchProjectRefsData = {
 export type SearchProjectRefsResponse = Array<GitRef>
 
 export type GetProjectHistoryData = {
+  /**
+   * Hash of the last commit of the previous page; returns the commits after it
+   */
+  cursor?: string | null
   /**
    * Max number of commits to return
    */
@@ -1913,6 +1920,25 @@ export type GetProjectCommitResponse = {
   [key: string]: unknown
 }
 
+export type GetProjectCommitPatchData = {
+  commitHash: string
+  /**
+   * Max bytes of the patch to return
+   */
+  limit?: number
+  /**
+   * Byte offset into the patch to start from
+   */
+  offset?: number
+  ownerName: string
+  path: string
+  projectName: string
+}
+
+export type GetProjectCommitPatchResponse = {
+  [key: string]: unknown
+}
+
 export type GetProjectFileHistoryData = {
   /**
    * Max number of commits to return
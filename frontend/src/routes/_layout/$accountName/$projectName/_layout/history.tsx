@@ -22,7 +22,7 @@ import {
   Collapse,
 } from "@chakra-ui/react"
 import Tooltip from "../../../../../components/Common/Tooltip"
-import { useQuery } from "@tanstack/react-query"
+import { useQueries, useQuery } from "@tanstack/react-query"
 import {
   Link as RouterLink,
   createFileRoute,
@@ -69,9 +69,15 @@ interface ChangedFile {
   change_type: string
   insertions: number | null
   deletions: number | null
-  patch: string | null
   is_binary?: boolean
-  patch_truncated?: boolean
+}
+
+interface FilePatchPage {
+  path: string
+  patch: string
+  offset: number
+  next_offset: number | null
+  is_binary: boolean
 }
 
 interface CommitDetail extends CommitHistory {
@@ -108,11 +114,52 @@ const CHANGE_LABELS: Record<string, string> = {
   C: "Copied",
 }
 
-function FileDiffEntry({ file }: { file: ChangedFile }) {
+function FileDiffEntry({
+  file,
+  ownerName,
+  projectName,
+  commitHash,
+}: {
+  file: ChangedFile
+  ownerName: string
+  projectName: string
+  commitHash: string
+}) {
   const [expanded, setExpanded] = useState(false)
+  // Byte offsets of the patch pages to show; more are added on demand
+  const [offsets, setOffsets] = useState<number[]>([0])
   const borderColor = useColorModeValue("gray.200", "gray.600")
   const hoverBg = useColorModeValue("gray.50", "gray.700")
-  const hasDiff = Boolean(file.patch)
+  const hasDiff = !file.is_binary
+  // Patches are fetched page by page, only once the file is expanded
+  const patchQueries = useQueries({
+    queries: offsets.map((offset) => ({
+      queryKey: [
+        "projects",
+        ownerName,
+        projectName,
+        "commit",
+        commitHash,
+        "patch",
+        file.path,
+        offset,
+      ],
+      queryFn: async () =>
+        (await ProjectsService.getProjectCommitPatch({
+          ownerName,
+          projectName,
+          commitHash,
+          path: file.path,
+          offset,
+        })) as unknown as FilePatchPage,
+      enabled: expanded && hasDiff,
+      staleTime: Number.POSITIVE_INFINITY,
+    })),
+  })
+  const patch = patchQueries.map((q) => q.data?.patch ?? "").join("")
+  const lastPage = patchQueries[patchQueries.length - 1]
+  const nextOffset = lastPage?.data?.next_offset ?? null
+  const isLoadingPatch = patchQueries.some((q) => q.isFetching)
 
   return (
     <Box
@@ -168,18 +215,33 @@ function FileDiffEntry({ file }: { file: ChangedFile }) {
       {hasDiff && (
         <Collapse in={expanded} animateOpacity>
           <Box maxH="400px" overflowY="auto" fontSize="xs">
-            <SyntaxHighlighter
-              language="diff"
-              style={atomOneDark}
-              customStyle={{ margin: 0, borderRadius: 0, fontSize: "12px" }}
-              showLineNumbers={false}
-            >
-              {file.patch!}
-            </SyntaxHighlighter>
-            {file.patch_truncated && (
-              <Text px={3} py={2} fontSize="xs" color="orange.400">
-                Diff truncated for display.
-              </Text>
+            {patch ? (
+              <SyntaxHighlighter
+                language="diff"
+                style={atomOneDark}
+                customStyle={{ margin: 0, borderRadius: 0, fontSize: "12px" }}
+                showLineNumbers={false}
+              >
+                {patch}
+              </SyntaxHighlighter>
+            ) : (
+              isLoadingPatch && (
+                <Flex justify="center" py={2}>
+                  <Spinner size="sm" />
+                </Flex>
+              )
+            )}
+            {nextOffset !== null && (
+              <Flex justify="center" py={2}>
+                <Button
+                  size="xs"
+                  variant="outline"
+                  isLoading={isLoadingPatch}
+                  onClick={() => setOffsets((prev) => [...prev, nextOffset])}
+                >
+                  Load more of this diff
+                </Button>
+              </Flex>
             )}
           </Box>
         </Collapse>
@@ -278,7 +340,13 @@ function CommitDetailModal({
           ) : (
             <VStack align="stretch" spacing={2}>
               {detailQuery.data?.changed_files?.map((f, i) => (
-                <FileDiffEntry key={i} file={f} />
+                <FileDiffEntry
+                  key={i}
+                  file={f}
+                  ownerName={ownerName}
+                  projectName={projectName}
+                  commitHash={commit!.hash}
+                />
               ))}
               {detailQuery.data?.files_truncated && (
                 <Text fontSize="xs" color="orange.400">
@@ -334,7 +402,8 @@ function History() {
   const bgHover = useColorModeValue("gray.50", "gray.700")
   const bgSelected = useColorModeValue("blue.50", "blue.900")
   const borderColor = useColorModeValue("gray.200", "gray.600")
-  const [page, setPage] = useState(0)
+  // Hash of the last commit loaded so far; undefined for the first page
+  const [cursor, setCursor] = useState<string | undefined>(undefined)
   const [allCommits, setAllCommits] = useState<CommitHistory[]>([])
   const [hasMore, setHasMore] = useState(true)
   const [selectedCommit, setSelectedCommit] = useState<CommitHistory | null>(
@@ -344,7 +413,7 @@ function History() {
 
   // Reset pagination when ref changes
   useEffect(() => {
-    setPage(0)
+    setCursor(undefined)
     setAllCommits([])
     setHasMore(true)
   }, [selectedRef])
@@ -356,19 +425,19 @@ function History() {
       projectName,
       "history",
       selectedRef,
-      "page",
-      page,
+      "cursor",
+      cursor,
     ],
     queryFn: async () => {
       const results = (await ProjectsService.getProjectHistory({
         ownerName: accountName,
         projectName: projectName,
         limit: PAGE_SIZE,
-        offset: page * PAGE_SIZE,
+        cursor,
         ref: selectedRef,
       })) as unknown as CommitHistory[]
       setAllCommits((prev) => {
-        if (page === 0) return results
+        if (cursor === undefined) return results
         const existing = new Set(prev.map((c) => c.hash))
         return [...prev, ...results.filter((c) => !existing.has(c.hash))]
       })
@@ -697,7 +766,9 @@ function History() {
                   size="sm"
                   variant="outline"
                   isLoading={isFetching}
-                  onClick={() => setPage((p) => p + 1)}
+                  onClick={() =>
+                    setCursor(allCommits[allCommits.length - 1]?.hash)
+                  }
                 >
                   Load more
                 </Button>